@@ -10,9 +10,11 @@ import sys
 import sqlite3
 import json
 import logging
+import asyncio
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Optional, Tuple
 import base64
+import hashlib
 import subprocess
 
 # Moscow timezone (UTC+3)
@@ -34,6 +36,7 @@ except ImportError:
     pass  # dotenv is optional
 
 from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -50,6 +53,9 @@ try:
     from vector_store import VectorStore
     from draft_queue import DraftQueue
     from v2ray_manager import V2RayManager
+    from v2ray_fleet import V2RayFleet, format_fleet_dashboard
+    from xray_traffic_stats import XrayTrafficCollector, format_bytes
+    from v2ray_jobs import V2RayJobRunner, install_xray_job, diagnose_server_job, JOB_DONE, JOB_CANCELLED
     from v2ray_commands import V2RayCommands
     from club_manager import ClubManager
     from club_commands import ClubCommands, WAITING_REPORT
@@ -58,12 +64,15 @@ try:
     from issue_manager import IssueManager
     from issue_commands import IssueCommands, ISSUE_SELECT_CLUB, ISSUE_ENTER_DESCRIPTION, ISSUE_EDIT_DESCRIPTION
     from content_generator import ContentGenerator
+    from content_queue import ContentQueue
     from content_commands import ContentCommands
     # from modules.finmon import register_finmon  # Временно отключено - модуль в разработке
     from modules.admins import register_admins
     # Улучшенные модули управления админами и сменами
     from modules.enhanced_admin_shift_integration import register_enhanced_admin_shift_management
     from modules.backup_commands import register_backup_commands
+    from modules.image_fingerprint import ImageFingerprintIndex, perceptual_hash
+    from modules.data_version import DataVersion
     # Accounting receipts and invoices
     from modules.accounting_receipts import (
         AccountingReceipts,
@@ -85,6 +94,8 @@ try:
     from modules.finmon_analytics import create_finance_analytics_handlers
     # Shift reminders system
     from modules.shift_reminders import setup_reminder_jobs
+    # Central notification dispatcher (rate limits, retries, delivery log)
+    from modules.notification_dispatcher import NotificationDispatcher, PRIORITY_HIGH, get_notifier
     # Duty shift manager
     from modules.duty_shift_manager import create_duty_shift_handlers, show_duty_shift_menu
     # Maintenance tasks
@@ -746,6 +757,15 @@ class ClubAssistantBot:
         
         # V2Ray Manager (только для владельца)
         self.v2ray_manager = V2RayManager(DB_PATH)
+        self.v2ray_fleet = V2RayFleet(self.v2ray_manager)
+        self.v2ray_traffic = XrayTrafficCollector(self.v2ray_manager, self.v2ray_manager.traffic_stats)
+        self.v2ray_jobs = V2RayJobRunner(
+            DB_PATH, per_host_limit=config.get('v2ray_max_installs_per_host', 1)
+        )
+        self.v2ray_jobs.register('install', "Установка Xray", install_xray_job(self.v2ray_manager),
+                                 self._render_install_result, host_limited=True)
+        self.v2ray_jobs.register('diagnose', "Диагностика", diagnose_server_job(self.v2ray_manager),
+                                 self._render_diagnose_result)
         self.v2ray_commands = V2RayCommands(self.v2ray_manager, self.admin_manager, owner_ids=owner_ids)
         
         # Store owner IDs from environment
@@ -841,6 +861,20 @@ class ClubAssistantBot:
             self.video_generator = None
             logger.info("⏸️ Video generation disabled")
         
+        # Отпечатки фото - кэш ответов Vision на повторные фото
+        self.image_index = ImageFingerprintIndex(DB_PATH)
+
+        # Версия данных для кеша WebApp: таблицу и триггеры ставит только бот
+        DataVersion(DB_PATH).install()
+
+        # Очередь генерации контента (воркеры, кэш по хэшу промпта)
+        self.content_queue = ContentQueue(
+            DB_PATH,
+            self.content_generator,
+            self.video_generator,
+            limits=config.get('content_generation', {}).get('concurrency')
+        )
+
         openai.api_key = config['openai_api_key']
         
         self.bot_username = None
@@ -1887,35 +1921,33 @@ class ClubAssistantBot:
             return
         
         prompt = ' '.join(context.args)
-        user_id = update.effective_user.id
-        
-        # Show processing message
-        await update.message.reply_text("🎨 Генерирую изображение... Это может занять ~30 секунд.")
-        
+        await self._submit_content(update, context, 'image', prompt)
+    
+    async def _submit_content(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                              content_type: str, prompt: str, params: dict = None):
+        """Поставить генерацию в очередь (результат придет отдельным сообщением)"""
         try:
-            response = openai.Image.create(
-                model="dall-e-3",
-                prompt=prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1
-            )
-            
-            image_url = response['data'][0]['url']
-            
-            # Log to database (non-blocking - don't fail if logging fails)
-            try:
-                self.content_generator.generate_image(prompt, user_id)
-            except Exception as log_err:
-                logger.warning(f"⚠️ Failed to log image generation to database: {log_err}")
-            
-            await update.message.reply_photo(
-                photo=image_url,
-                caption=f"🎨 {prompt}"
+            result = await self.content_queue.submit(
+                context.bot,
+                update.effective_user.id,
+                update.effective_chat.id,
+                content_type,
+                prompt,
+                params
             )
         except Exception as e:
-            logger.error(f"❌ Image generation error: {e}")
+            logger.error(f"❌ Content queue error: {e}")
             await update.message.reply_text(f"❌ Ошибка: {e}")
+            return
+        
+        if result['cached']:
+            return
+        
+        emoji = {'image': '🎨', 'video': '🎬'}.get(content_type, '✍️')
+        text = f"{emoji} Запрос #{result['id']} принят, пришлю результат сюда."
+        if result['position']:
+            text += f"\n⏳ В очереди перед вами: {result['position']}"
+        await update.message.reply_text(text)
     
     async def cmd_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Summarize messages - use with reply or in group"""
@@ -1959,39 +1991,8 @@ class ClubAssistantBot:
             return
         
         prompt = ' '.join(context.args)
-        user_id = update.effective_user.id
-        msg = await update.message.reply_text("🎬 Генерирую видео...")
-        
-        try:
-            result = self.video_generator.generate(prompt)
-            
-            if 'error' in result:
-                await msg.edit_text(f"❌ Ошибка: {result['error']}")
-                return
-            
-            video_url = result['video_url']
-            
-            # Log to database (non-blocking - don't fail if logging fails)
-            try:
-                self.content_generator.generate_video(
-                    prompt, 
-                    user_id, 
-                    video_url=video_url,
-                    duration=result.get('duration', 5),
-                    resolution=result.get('resolution', '1080p')
-                )
-            except Exception as log_err:
-                logger.warning(f"⚠️ Failed to log video generation to database: {log_err}")
-            
-            await update.message.reply_video(
-                video=video_url,
-                caption=f"🎬 {prompt}\n📊 {result['resolution']} • {result['duration']}s"
-            )
-            await msg.delete()
-            
-        except Exception as e:
-            logger.error(f"❌ Video generation error: {e}")
-            await msg.edit_text(f"❌ Ошибка: {e}")
+        await self._submit_content(update, context, 'video', prompt,
+                                   {'duration': 5, 'resolution': '1080p'})
     
     def _build_main_menu_keyboard(self, user_id: int) -> InlineKeyboardMarkup:
         """Построить клавиатуру главного меню"""
@@ -2592,12 +2593,16 @@ class ClubAssistantBot:
             ]
 
             # Send to target admin
-            sent_message = await context.bot.send_message(
-                chat_id=target_admin_id,
-                text=notification_text,
+            sent_message = await get_notifier(context.bot_data, context.bot).send(
+                target_admin_id,
+                notification_text,
+                priority=PRIORITY_HIGH,
+                category='swap_request',
                 reply_markup=InlineKeyboardMarkup(keyboard),
                 parse_mode='Markdown'
             )
+            if sent_message is None:
+                raise RuntimeError(f"не удалось доставить запрос админу {target_admin_id}")
 
             # Store swap request info for later
             if 'pending_swap_requests' not in context.bot_data:
@@ -2733,7 +2738,7 @@ class ClubAssistantBot:
                         logger.info(f"✅ Swap completed: {requester_name} <-> {responder_name} on {shift_date} {club} {shift_type}")
 
                         # Notify requester
-                        await context.bot.send_message(
+                        get_notifier(context.bot_data, context.bot).submit(
                             chat_id=requester_id,
                             text=f"✅ {responder_name} согласился на обмен!\n\n{result_text}",
                             parse_mode='Markdown'
@@ -2755,7 +2760,7 @@ class ClubAssistantBot:
                         )
 
                         # Notify requester about failure
-                        await context.bot.send_message(
+                        get_notifier(context.bot_data, context.bot).submit(
                             chat_id=requester_id,
                             text=f"❌ {responder_name} согласился, но не удалось обновить расписание.\n\n{error_text}"
                         )
@@ -2772,7 +2777,7 @@ class ClubAssistantBot:
                     )
 
                     # Notify requester about error
-                    await context.bot.send_message(
+                    get_notifier(context.bot_data, context.bot).submit(
                         chat_id=requester_id,
                         text=f"❌ Технический сбой при обмене сменой:\n\n{error_text}"
                     )
@@ -2790,7 +2795,7 @@ class ClubAssistantBot:
                 )
 
                 # Notify requester
-                await context.bot.send_message(
+                get_notifier(context.bot_data, context.bot).submit(
                     chat_id=requester_id,
                     text=f"❌ {responder_name} отклонил запрос на обмен сменой.\n\n"
                          f"📅 {shift_date.day} {month_name} ({weekday}) - {club_emoji} {club} {shift_emoji}"
@@ -3206,6 +3211,17 @@ class ClubAssistantBot:
             await self._show_v2_help_menu(query)
             return
         
+        # V2Ray - удаление пользователей с истёкшим доступом на всех серверах
+        if data in ("v2_cleanup_expired", "v2_cleanup_expired_confirm"):
+            if not self.v2ray_commands.is_owner(query.from_user.id):
+                await query.answer("❌ Доступ запрещён")
+                return
+            if data == "v2_cleanup_expired":
+                await self._confirm_v2_cleanup_expired(query)
+            else:
+                await self._v2_cleanup_expired(query)
+            return
+        
         # V2Ray - детали сервера
         if data.startswith("v2server_"):
             server_name = data.replace("v2server_", "")
@@ -3224,6 +3240,18 @@ class ClubAssistantBot:
             await self._diagnose_server(query, server_name)
             return
         
+        # V2Ray - отмена фоновой задачи
+        if data.startswith("v2jobcancel_"):
+            if not self.v2ray_commands.is_owner(query.from_user.id):
+                await query.answer("❌ Доступ запрещён")
+                return
+            job_id = int(data.replace("v2jobcancel_", ""))
+            if self.v2ray_jobs.cancel(job_id):
+                await query.answer("⛔ Отменяю...")
+            else:
+                await query.answer("Задача уже завершена")
+            return
+        
         # V2Ray - статистика сервера
         if data.startswith("v2stats_"):
             server_name = data.replace("v2stats_", "")
@@ -3362,16 +3390,16 @@ class ClubAssistantBot:
             return
     
     async def _show_v2_servers_menu(self, query):
-        """Меню управления серверами"""
+        """Меню управления серверами со сводкой по всем серверам"""
         servers = self.v2ray_manager.list_servers()
         
-        text = "📡 Управление серверами\n\n"
-        
         if servers:
-            text += "Ваши серверы:\n\n"
-            for srv in servers:
-                text += f"🖥️ {srv['name']} - {srv['host']}\n"
+            await query.edit_message_text(f"⏳ Опрашиваю серверы ({len(servers)})...")
+            # Все серверы опрашиваются параллельно, у каждого свой таймаут
+            statuses = await self.v2ray_fleet.gather_status()
+            text = format_fleet_dashboard(statuses)
         else:
+            text = "📡 Управление серверами\n\n"
             text += "Нет добавленных серверов\n\n"
             text += "Добавьте сервер командой:\n"
             text += "/v2add <имя> <host> <user> <pass> [sni]"
@@ -3382,10 +3410,48 @@ class ClubAssistantBot:
                 InlineKeyboardButton(f"⚙️ {srv['name']}", callback_data=f"v2server_{srv['name']}")
             ])
         
+        if servers:
+            keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data="v2_servers")])
+            keyboard.append([InlineKeyboardButton("🧹 Удалить истёкших", callback_data="v2_cleanup_expired")])
         keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="v2ray")])
         
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
     
+    async def _confirm_v2_cleanup_expired(self, query):
+        """Список пользователей с истёкшим доступом по серверам и подтверждение удаления"""
+        grouped = await asyncio.to_thread(self.v2ray_manager.group_expired_users)
+        keyboard = []
+        if not grouped:
+            text = "🧹 Пользователей с истёкшим доступом нет"
+        else:
+            total = sum(len(uuids) for uuids in grouped.values())
+            text = f"🧹 Истёкший доступ: {total} польз.\n\n"
+            for server_name, uuids in grouped.items():
+                text += f"🖥️ {server_name}: {len(uuids)}\n"
+            text += "\nНа каждом сервере - одна перезапись конфига. Удалить?"
+            keyboard.append([InlineKeyboardButton("✅ Удалить", callback_data="v2_cleanup_expired_confirm")])
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="v2_servers")])
+        
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    async def _v2_cleanup_expired(self, query):
+        """Удалить пользователей с истёкшим доступом на всех серверах параллельно"""
+        await query.edit_message_text("⏳ Удаляю пользователей с истёкшим доступом...")
+        summary = await self.v2ray_fleet.cleanup_expired()
+        
+        if not summary:
+            text = "🧹 Пользователей с истёкшим доступом нет"
+        else:
+            text = "🧹 Удаление истёкших пользователей\n\n"
+            for server_name, deleted in summary.items():
+                if deleted < 0:
+                    text += f"❌ {server_name}: ошибка или таймаут\n"
+                else:
+                    text += f"✅ {server_name}: удалено {deleted}\n"
+        
+        keyboard = [[InlineKeyboardButton("◀️ К серверам", callback_data="v2_servers")]]
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    
     async def _show_v2_users_menu(self, query):
         """Меню управления пользователями"""
         text = """👤 Управление пользователями
@@ -3505,8 +3571,33 @@ class ClubAssistantBot:
             logger.error(f"❌ Error showing server details: {e}", exc_info=True)
             await query.answer(f"❌ Ошибка: {str(e)}")
     
+    async def _submit_v2ray_job(self, query, kind: str, server_name: str):
+        """Поставить фоновую задачу V2Ray; прогресс выводится в это же сообщение"""
+        server_info = self.v2ray_manager.get_server_info(server_name)
+        if not server_info:
+            await query.edit_message_text(f"❌ Сервер {server_name} не найден в БД")
+            return
+        
+        active = self.v2ray_jobs.active_job(server_name, kind)
+        if active:
+            keyboard = [[
+                InlineKeyboardButton("⛔ Отменить", callback_data=f"v2jobcancel_{active['id']}"),
+                InlineKeyboardButton("◀️ К серверу", callback_data=f"v2server_{server_name}")
+            ]]
+            await query.edit_message_text(
+                f"⏳ На сервере {server_name} уже выполняется задача #{active['id']}",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        
+        job_id = await self.v2ray_jobs.submit(
+            kind, server_name, server_info['host'], query.get_bot(),
+            query.message.chat_id, query.message.message_id, query.from_user.id
+        )
+        logger.info(f"📋 V2Ray {kind} job #{job_id} submitted for {server_name}")
+    
     async def _install_xray_async(self, query, server_name: str):
-        """Асинхронная установка Xray на сервер"""
+        """Установка Xray на сервер (фоновая задача)"""
         try:
             if not self.v2ray_commands.is_owner(query.from_user.id):
                 await query.answer("❌ Доступ запрещён")
@@ -3515,55 +3606,29 @@ class ClubAssistantBot:
             logger.info(f"🔧 Installing Xray on server: {server_name}")
             await query.answer("⏳ Начинаю установку...")
             await query.edit_message_text(f"⏳ Подключаюсь к серверу {server_name}...")
+            await self._submit_v2ray_job(query, 'install', server_name)
             
-            server = self.v2ray_manager.get_server(server_name)
-            
-            if not server:
-                await query.edit_message_text(f"❌ Сервер {server_name} не найден")
-                return
-            
-            if not server.connect():
-                await query.edit_message_text("❌ Не удалось подключиться к серверу")
-                return
-            
-            await query.edit_message_text("📥 Устанавливаю Xray (2-3 минуты)...\nПожалуйста, подождите...")
-            
-            if not server.install_v2ray():
-                await query.edit_message_text("❌ Ошибка установки Xray")
-                server.disconnect()
-                return
-            
-            await query.edit_message_text("⚙️ Создаю REALITY конфигурацию...")
-            
-            # Получаем SNI из базы
-            server_keys = self.v2ray_manager.get_server_keys(server_name)
-            sni = server_keys.get('sni', 'rutube.ru')
-            
-            config = server.create_reality_config(port=443, sni=sni)
-            
-            if not config:
-                await query.edit_message_text("❌ Ошибка создания конфигурации")
-                server.disconnect()
-                return
-            
-            # Сохраняем ключи в базу
-            client_keys = config.get('_client_keys', {})
-            if client_keys:
-                self.v2ray_manager.save_server_keys(
-                    server_name,
-                    client_keys['public_key'],
-                    client_keys['short_id'],
-                    client_keys.get('private_key', '')
-                )
-            
-            if not server.deploy_config(config):
-                await query.edit_message_text("❌ Ошибка применения конфигурации")
-                server.disconnect()
-                return
-            
-            server.disconnect()
-            
-            text = f"""✅ Xray успешно установлен на {server_name}!
+        except Exception as e:
+            logger.error(f"❌ Error installing Xray: {e}", exc_info=True)
+            await query.edit_message_text(f"❌ Ошибка установки: {str(e)}")
+    
+    def _render_install_result(self, job: Dict):
+        """Итоговое сообщение задачи установки"""
+        server_name = job['server_name']
+        back = [InlineKeyboardButton("◀️ К серверу", callback_data=f"v2server_{server_name}")]
+        
+        if job['status'] == JOB_CANCELLED:
+            return f"⛔ Установка Xray на {server_name} отменена", InlineKeyboardMarkup([back])
+        
+        if job['status'] != JOB_DONE:
+            text = f"❌ {job['error'] or 'Ошибка установки'}"
+            tail = job.get('lines', [])[-8:]
+            if tail:
+                text += "\n\n" + "\n".join(tail)
+            return text, InlineKeyboardMarkup([back])
+        
+        sni = job['result'].get('sni', 'rutube.ru')
+        text = f"""✅ Xray успешно установлен на {server_name}!
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🔐 Настройки:
@@ -3576,101 +3641,55 @@ class ClubAssistantBot:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━
 Добавьте пользователей:
 /v2user {server_name} <user_id> [email]"""
-            
-            keyboard = [
-                [InlineKeyboardButton("📊 Статистика", callback_data=f"v2stats_{server_name}")],
-                [InlineKeyboardButton("◀️ К серверу", callback_data=f"v2server_{server_name}")]
-            ]
-            
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-            logger.info(f"✅ Xray installed successfully on {server_name}")
-            
-        except Exception as e:
-            logger.error(f"❌ Error installing Xray: {e}", exc_info=True)
-            await query.edit_message_text(f"❌ Ошибка установки: {str(e)}")
+        
+        keyboard = [
+            [InlineKeyboardButton("📊 Статистика", callback_data=f"v2stats_{server_name}")],
+            back
+        ]
+        return text, InlineKeyboardMarkup(keyboard)
     
     async def _diagnose_server(self, query, server_name: str):
-        """Диагностика сервера и исправление проблем"""
+        """Диагностика сервера и исправление проблем (фоновая задача)"""
         try:
             if not self.v2ray_commands.is_owner(query.from_user.id):
                 await query.answer("❌ Доступ запрещён")
                 return
             
             await query.edit_message_text(f"🔍 Диагностика сервера {server_name}...\n\nПроверяю конфигурацию...")
-            
-            # Получаем информацию о сервере
-            server_info = self.v2ray_manager.get_server_info(server_name)
-            
-            if not server_info:
-                await query.edit_message_text(f"❌ Сервер {server_name} не найден в БД")
-                return
-            
-            issues = []
-            fixes_applied = []
-            
-            # Проверка 1: Наличие public_key
-            if not server_info.get('public_key'):
-                issues.append("❌ Отсутствует Public Key")
-            else:
-                issues.append(f"✅ Public Key: {server_info['public_key'][:20]}...")
-            
-            # Проверка 2: Наличие short_id
-            if not server_info.get('short_id'):
-                issues.append("❌ Отсутствует Short ID")
-            else:
-                issues.append(f"✅ Short ID: {server_info['short_id']}")
-            
-            # Проверка 3: Xray запущен на сервере
-            logger.info(f"🔍 Checking if Xray is running on {server_name}...")
-            xray_status = self.v2ray_manager.check_xray_status(server_name)
-            
-            if xray_status:
-                issues.append("✅ Xray запущен")
-            else:
-                issues.append("❌ Xray не запущен или недоступен")
-            
-            # Проверка 4: Ключи на сервере
-            keys_on_server = self.v2ray_manager.get_keys_from_server(server_name)
-            
-            if keys_on_server:
-                issues.append("✅ Ключи найдены на сервере")
-                
-                # Если ключей нет в БД, но есть на сервере - сохраняем
-                if not server_info.get('public_key') and keys_on_server.get('public_key'):
-                    result = self.v2ray_manager.save_keys_to_db(
-                        server_name, 
-                        keys_on_server['public_key'],
-                        keys_on_server.get('private_key', ''),
-                        keys_on_server.get('short_id', '')
-                    )
-                    if result:
-                        fixes_applied.append("✅ Ключи сохранены в БД")
-                        issues.append(f"✅ Public Key: {keys_on_server['public_key'][:20]}...")
-                        issues.append(f"✅ Short ID: {keys_on_server.get('short_id', 'N/A')}")
-            else:
-                issues.append("❌ Ключи не найдены на сервере")
-            
-            # Формируем отчет
-            text = f"🔍 Диагностика {server_name}\n\n"
-            text += "━━━━━━━━━━━━━━━━━━━━━━\n"
-            text += "📋 Результаты проверки:\n"
-            text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-            text += "\n".join(issues)
-            
-            if fixes_applied:
-                text += "\n\n━━━━━━━━━━━━━━━━━━━━━━\n"
-                text += "🔧 Исправления:\n"
-                text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                text += "\n".join(fixes_applied)
-                text += "\n\n✅ Проблемы исправлены!"
-            
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=f"v2server_{server_name}")]]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+            await self._submit_v2ray_job(query, 'diagnose', server_name)
             
         except Exception as e:
             logger.error(f"❌ Diagnose error: {e}", exc_info=True)
             await query.edit_message_text(f"❌ Ошибка диагностики: {e}")
     
+    def _render_diagnose_result(self, job: Dict):
+        """Итоговое сообщение задачи диагностики"""
+        server_name = job['server_name']
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=f"v2server_{server_name}")]]
+        
+        if job['status'] == JOB_CANCELLED:
+            return f"⛔ Диагностика {server_name} отменена", InlineKeyboardMarkup(keyboard)
+        if job['status'] != JOB_DONE:
+            return f"❌ Ошибка диагностики: {job['error']}", InlineKeyboardMarkup(keyboard)
+        
+        result = job['result']
+        
+        # Формируем отчет
+        text = f"🔍 Диагностика {server_name}\n\n"
+        text += "━━━━━━━━━━━━━━━━━━━━━━\n"
+        text += "📋 Результаты проверки:\n"
+        text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+        text += "\n".join(result['issues'])
+        
+        if result['fixes_applied']:
+            text += "\n\n━━━━━━━━━━━━━━━━━━━━━━\n"
+            text += "🔧 Исправления:\n"
+            text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+            text += "\n".join(result['fixes_applied'])
+            text += "\n\n✅ Проблемы исправлены!"
+        
+        return text, InlineKeyboardMarkup(keyboard)
+    
     async def _show_v2_server_stats(self, query, server_name: str):
         """Показать статистику сервера"""
         try:
@@ -3682,22 +3701,15 @@ class ClubAssistantBot:
             await query.answer("⏳ Получаю статистику...")
             await query.edit_message_text("⏳ Подключаюсь к серверу...")
             
-            server = self.v2ray_manager.get_server(server_name)
+            # SSH-вызовы выполняются в потоке, чтобы не блокировать бота
+            stats = await asyncio.to_thread(self.v2ray_fleet.server_status, server_name)
             
-            if not server:
+            if stats['error'] == 'не найден в БД':
                 await query.edit_message_text(f"❌ Сервер {server_name} не найден")
                 return
             
-            if not server.connect():
-                await query.edit_message_text("❌ Не удалось подключиться")
-                return
-            
-            stats = server.get_stats()
-            
-            server.disconnect()
-            
-            if not stats:
-                await query.edit_message_text("❌ Ошибка получения статистики")
+            if not stats['ok']:
+                await query.edit_message_text(f"❌ Не удалось подключиться: {stats['error']}")
                 return
             
             status_emoji = "✅" if stats['running'] else "❌"
@@ -3711,9 +3723,10 @@ class ClubAssistantBot:
 {status_emoji} Статус: {status_text}
 📍 Host: {stats['host']}
 🔌 Port: {stats['port']}
-🔐 Protocol: {stats['protocol']}
-🌐 SNI: {stats['sni']}
-👥 Пользователей: {stats['users']}"""
+🔐 Protocol: {stats['protocol'] or 'vless'}
+🌐 SNI: {stats['sni'] or 'unknown'}
+👥 Пользователей: {stats['users']}
+⏱ Ответ: {stats['latency_ms']:.0f} мс"""
             
             keyboard = [
                 [InlineKeyboardButton("🔄 Обновить", callback_data=f"v2stats_{server_name}")],
@@ -3862,6 +3875,28 @@ class ClubAssistantBot:
                 else:
                     text += f"\n⚠️ Доступ истёк: {expires.strftime('%Y-%m-%d %H:%M')}\n"
             
+            # Трафик из локальных рядов (собираются фоновой задачей)
+            traffic_stats = self.v2ray_manager.traffic_stats
+            source = await asyncio.to_thread(traffic_stats.source_status, server_name)
+            if source is None:
+                text += "\n📊 Трафик: ещё не собирался с этого сервера\n"
+            elif not source['ok']:
+                checked = datetime.fromtimestamp(source['checked_at']).strftime('%d.%m %H:%M')
+                text += f"\n⚠️ Трафик недоступен ({checked}): {escape_markdown(source['error'][:200])}\n"
+            else:
+                usage = await asyncio.to_thread(traffic_stats.usage_periods, server_name, user['email'])
+                text += "\n📊 Трафик (↑ / ↓):\n"
+                for label, period in (('24 часа', '24h'), ('7 дней', '7d'), ('30 дней', '30d')):
+                    u = usage[period]
+                    text += f"   {label}: {format_bytes(u['uplink'])} / {format_bytes(u['downlink'])}\n"
+            
+            top = await asyncio.to_thread(traffic_stats.top_talkers, server_name, datetime.now().timestamp() - 7 * 86400)
+            if top:
+                text += f"\n🔝 Топ за 7 дней на {server_name}:\n"
+                for i, row in enumerate(top, 1):
+                    marker = " ◀️" if row['email'] == user['email'] else ""
+                    text += f"   {i}. {row['email']} - {format_bytes(row['total'])}{marker}\n"
+            
             text += f"━━━━━━━━━━━━━━━━━━━━━━"
             
             keyboard = []
@@ -4097,13 +4132,25 @@ class ClubAssistantBot:
 
         try:
             photo = update.message.photo[-1]
+            # Кэш ответов: тот же файл с тем же вопросом (похожее по pHash фото
+            # может отличаться содержимым - для него ответ запрашивается заново)
+            question_key = hashlib.sha256(' '.join(caption.lower().split()).encode('utf-8')).hexdigest()
+            match = self.image_index.find('vision', photo.file_unique_id, context_key=question_key)
+            
+            if match and match['result']:
+                self.image_index.touch(match['id'])
+                await update.message.reply_text(f"🤖 Vision:\n\n{match['result']}")
+                return
+            
             file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await file.download_as_bytearray()
+            photo_bytes = bytes(await file.download_as_bytearray())
+            phash = await asyncio.to_thread(perceptual_hash, photo_bytes)
             photo_b64 = base64.b64encode(photo_bytes).decode('utf-8')
-
+            
             # ВНИМАНИЕ: GPT-4o дорогой! (~$2.50 input + $10 output за 1M токенов)
             # Вызывается только когда бота упоминают с фото
-            response = openai.ChatCompletion.create(
+            response = await asyncio.to_thread(
+                openai.ChatCompletion.create,
                 model="gpt-4o",
                 messages=[{
                     "role": "user",
@@ -4116,6 +4163,9 @@ class ClubAssistantBot:
             )
             
             answer = response['choices'][0]['message']['content']
+            self.image_index.remember('vision', photo.file_unique_id, phash, answer,
+                                      update.effective_user.id, update.effective_chat.id,
+                                      context_key=question_key)
             await update.message.reply_text(f"🤖 Vision:\n\n{answer}")
             
         except Exception as e:
@@ -4715,6 +4765,9 @@ class ClubAssistantBot:
         application.bot_data['schedule_parser'] = schedule_parser  # Для использования в maintenance_manager
         logger.info("✅ Controller panel data stored in bot_data")
 
+        # Общий диспетчер уведомлений (воркеры стартуют при первой отправке)
+        application.bot_data['notifier'] = NotificationDispatcher(application.bot, DB_PATH)
+
         # Duty shift handlers
         try:
             duty_handlers = create_duty_shift_handlers()
@@ -4786,12 +4839,48 @@ class ClubAssistantBot:
             # Setup all reminder jobs
             setup_reminder_jobs(application)
             logger.info("✅ Shift reminder jobs scheduled")
-            logger.info("   Jobs: unopened shifts, inventory deadlines, cleaning rating deadlines, system health")
+            logger.info("   Jobs: shift deadline scheduler (unopened shifts, inventory, cleaning rating), system health")
         except Exception as e:
             logger.error(f"❌ Failed to setup reminder jobs: {e}")
             import traceback
             traceback.print_exc()
 
+        # Очередь генерации контента: продолжить задачи, прерванные перезапуском
+        try:
+            async def resume_content_queue(context: ContextTypes.DEFAULT_TYPE):
+                await self.content_queue.start(context.bot)
+            
+            application.job_queue.run_once(
+                resume_content_queue,
+                when=timedelta(seconds=5),
+                name='content_queue_resume'
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to schedule content queue resume: {e}")
+        
+        # V2Ray: сбор трафика пользователей из Xray StatsService
+        try:
+            async def collect_v2ray_traffic(context: ContextTypes.DEFAULT_TYPE):
+                await self.v2ray_traffic.collect_all()
+
+            application.job_queue.run_repeating(
+                collect_v2ray_traffic,
+                interval=timedelta(minutes=5),
+                first=timedelta(minutes=1),
+                name='v2ray_collect_traffic'
+            )
+            logger.info("✅ V2Ray traffic collector job scheduled")
+        except Exception as e:
+            logger.error(f"❌ Failed to setup V2Ray traffic job: {e}")
+
+        # Nightly revenue forecast (cached for owner panel and WebApp)
+        try:
+            from modules.revenue_forecast import setup_forecast_jobs
+            setup_forecast_jobs(application)
+            logger.info("✅ Revenue forecast job scheduled")
+        except Exception as e:
+            logger.error(f"❌ Failed to setup revenue forecast job: {e}")
+
         # Обработчик inline-кнопок (must be AFTER ConversationHandlers and module registrations)
         application.add_handler(CallbackQueryHandler(self.handle_callback))
         
@@ -4834,7 +4923,7 @@ class ClubAssistantBot:
         logger.info("   Content: /image, /video")
         logger.info("   FinMon: /shift, /balances, /movements, /finmon")
         logger.info("   Schedule: /schedule (add, week, today, remove, clear)")
-        logger.info("   Owner: /apply_migrations, /migration, /backup")
+        logger.info("   Owner: /apply_migrations, /migration, /backup, /export")
         logger.info("   Admin: /admins, /v2ray")
         logger.info("   Reply keyboard: 🔓 Открыть смену / 🔒 Закрыть смену, 💸 Списать с кассы, 💰 Взять зарплату (динамическая)")
         logger.info("   Salary system: /salary command enabled")
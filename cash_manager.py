@@ -3,8 +3,18 @@
 """
 Cash Manager - Финансовый мониторинг касс
 Управление 4 кассами: 2 официальные + 2 коробки
+
+Контрольные точки: при каждом движении обновляются дневные итоги кассы
+(cash_daily_balances: приход, расход, остаток на конец дня) и расходы по
+категориям (cash_daily_categories). Месячный отчёт и остаток на любую дату
+читаются из них, без сканирования cash_movements. reconcile_balances сверяет
+cash_balances и контрольные точки с журналом движений.
+
+Сверка из cron:
+    python cash_manager.py --db knowledge.db --reconcile [--fix]
 """
 
+import calendar
 import sqlite3
 from datetime import datetime
 from typing import List, Dict, Optional
@@ -51,6 +61,36 @@ class CashManager:
             )
         ''')
         
+        # Дневные контрольные точки: итоги дня и остаток на конец дня
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cash_daily_balances (
+                club TEXT NOT NULL,
+                cash_type TEXT NOT NULL,
+                day TEXT NOT NULL,
+                income REAL NOT NULL DEFAULT 0,
+                expense REAL NOT NULL DEFAULT 0,
+                movements INTEGER NOT NULL DEFAULT 0,
+                closing_balance REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (club, cash_type, day)
+            )
+        ''')
+        
+        # Дневные расходы по категориям (для месячного отчёта)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cash_daily_categories (
+                club TEXT NOT NULL,
+                day TEXT NOT NULL,
+                category TEXT NOT NULL,
+                expense REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (club, day, category)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cash_movements_club_time
+            ON cash_movements(club, cash_type, created_at)
+        ''')
+        
         # Инициализируем балансы для всех касс если их нет
         clubs = ['rio', 'michurinskaya']
         cash_types = ['official', 'box']
@@ -62,6 +102,14 @@ class CashManager:
                     VALUES (?, ?, 0)
                 ''', (club, cash_type))
         
+        # Первый запуск с контрольными точками - построить их по журналу
+        cursor.execute('SELECT 1 FROM cash_daily_balances LIMIT 1')
+        if not cursor.fetchone():
+            cursor.execute('SELECT 1 FROM cash_movements LIMIT 1')
+            if cursor.fetchone():
+                self._rebuild_checkpoints(cursor)
+                logger.info("✅ Cash checkpoints built from movement log")
+        
         conn.commit()
         conn.close()
         logger.info("✅ Cash Manager database initialized")
@@ -106,6 +154,31 @@ class CashManager:
                     WHERE club = ? AND cash_type = ?
                 ''', (abs(amount), club, cash_type))
             
+            # Контрольная точка дня - в той же транзакции
+            cursor.execute('SELECT date(created_at) FROM cash_movements WHERE id = ?',
+                           (cursor.lastrowid,))
+            day = cursor.fetchone()[0]
+            income = abs(amount) if operation == 'income' else 0.0
+            expense = 0.0 if operation == 'income' else abs(amount)
+            cursor.execute('''
+                INSERT INTO cash_daily_balances
+                (club, cash_type, day, income, expense, movements, closing_balance)
+                VALUES (?, ?, ?, ?, ?, 1, COALESCE(
+                    (SELECT balance FROM cash_balances WHERE club = ? AND cash_type = ?), 0))
+                ON CONFLICT(club, cash_type, day) DO UPDATE SET
+                    income = income + excluded.income,
+                    expense = expense + excluded.expense,
+                    movements = movements + 1,
+                    closing_balance = excluded.closing_balance
+            ''', (club, cash_type, day, income, expense, club, cash_type))
+            if expense and category:
+                cursor.execute('''
+                    INSERT INTO cash_daily_categories (club, day, category, expense)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(club, day, category) DO UPDATE SET
+                        expense = expense + excluded.expense
+                ''', (club, day, category, expense))
+            
             conn.commit()
             conn.close()
             
@@ -136,6 +209,60 @@ class CashManager:
             logger.error(f"❌ Error getting balance: {e}")
             return 0.0
     
+    def get_balance_at(self, club: str, cash_type: str, moment: str) -> float:
+        """
+        Остаток кассы на момент времени
+        
+        Args:
+            moment: 'YYYY-MM-DD' - на конец дня,
+                    'YYYY-MM-DD HH:MM:SS' - с учётом движений до этого момента
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            day = moment[:10]
+            if len(moment) <= 10:
+                balance = self._closing_balance(cursor, club, cash_type, day, inclusive=True)
+            else:
+                # Остаток на конец прошлого дня + движения за день до момента
+                balance = self._closing_balance(cursor, club, cash_type, day, inclusive=False)
+                cursor.execute('''
+                    SELECT COALESCE(SUM(CASE WHEN operation = 'income' THEN amount ELSE -amount END), 0)
+                    FROM cash_movements
+                    WHERE club = ? AND cash_type = ?
+                    AND created_at >= ? AND created_at <= ?
+                ''', (club, cash_type, day, moment))
+                balance += cursor.fetchone()[0]
+            
+            conn.close()
+            return balance
+        
+        except Exception as e:
+            logger.error(f"❌ Error getting balance at {moment}: {e}")
+            return 0.0
+    
+    def _closing_balance(self, cursor, club: str, cash_type: str, day: str,
+                         inclusive: bool) -> float:
+        """Остаток на конец дня day (inclusive) или на начало дня по контрольным точкам"""
+        cursor.execute(f'''
+            SELECT closing_balance FROM cash_daily_balances
+            WHERE club = ? AND cash_type = ? AND day {'<=' if inclusive else '<'} ?
+            ORDER BY day DESC LIMIT 1
+        ''', (club, cash_type, day))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        
+        # Раньше первой контрольной точки - остаток до первого движения
+        cursor.execute('''
+            SELECT closing_balance - income + expense FROM cash_daily_balances
+            WHERE club = ? AND cash_type = ?
+            ORDER BY day ASC LIMIT 1
+        ''', (club, cash_type))
+        row = cursor.fetchone()
+        return row[0] if row else 0.0
+    
     def get_all_balances(self) -> Dict:
         """Получить балансы всех касс"""
         try:
@@ -159,8 +286,12 @@ class CashManager:
             return {}
     
     def get_movements(self, club: str = None, cash_type: str = None, 
-                     limit: int = 50) -> List[Dict]:
-        """Получить историю движений"""
+                     limit: int = 50, before_id: int = None) -> List[Dict]:
+        """Получить историю движений
+        
+        Args:
+            before_id: Следующая страница - движения старше записи с этим id
+        """
         try:
             conn = sqlite3.connect(self.db_path)
             conn.row_factory = sqlite3.Row
@@ -177,7 +308,12 @@ class CashManager:
                 query += ' AND cash_type = ?'
                 params.append(cash_type)
             
-            query += ' ORDER BY created_at DESC LIMIT ?'
+            if before_id:
+                query += ''' AND (created_at, id) < (
+                    SELECT created_at, id FROM cash_movements WHERE id = ?)'''
+                params.append(before_id)
+            
+            query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
             params.append(limit)
             
             cursor.execute(query, params)
@@ -192,23 +328,21 @@ class CashManager:
             return []
     
     def get_monthly_summary(self, club: str, year: int, month: int) -> Dict:
-        """Получить итоги за месяц"""
+        """Получить итоги за месяц (по дневным контрольным точкам)"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            first_day = f"{year:04d}-{month:02d}-01"
+            last_day = f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+            
             # Получаем суммы по официальным и коробкам отдельно
             cursor.execute('''
-                SELECT 
-                    cash_type,
-                    operation,
-                    SUM(amount) as total
-                FROM cash_movements
-                WHERE club = ?
-                AND strftime('%Y', created_at) = ?
-                AND strftime('%m', created_at) = ?
-                GROUP BY cash_type, operation
-            ''', (club, str(year), str(month).zfill(2)))
+                SELECT cash_type, SUM(income), SUM(expense)
+                FROM cash_daily_balances
+                WHERE club = ? AND day BETWEEN ? AND ?
+                GROUP BY cash_type
+            ''', (club, first_day, last_day))
             
             summary = {
                 'official': {'income': 0, 'expense': 0, 'net': 0},
@@ -217,9 +351,11 @@ class CashManager:
             }
             
             for row in cursor.fetchall():
-                cash_type, operation, total = row
-                summary[cash_type][operation] = total
-                summary['total'][operation] += total
+                cash_type, income, expense = row
+                summary[cash_type]['income'] = income
+                summary[cash_type]['expense'] = expense
+                summary['total']['income'] += income
+                summary['total']['expense'] += expense
             
             # Вычисляем чистый доход
             for cash_type in ['official', 'box', 'total']:
@@ -227,17 +363,20 @@ class CashManager:
                     summary[cash_type]['income'] - summary[cash_type]['expense']
                 )
             
+            # Остаток на конец месяца
+            summary['total']['closing'] = 0
+            for cash_type in ['official', 'box']:
+                closing = self._closing_balance(cursor, club, cash_type, last_day, inclusive=True)
+                summary[cash_type]['closing'] = closing
+                summary['total']['closing'] += closing
+            
             # Получаем разбивку по категориям расходов
             cursor.execute('''
-                SELECT category, SUM(amount) as total
-                FROM cash_movements
-                WHERE club = ?
-                AND strftime('%Y', created_at) = ?
-                AND strftime('%m', created_at) = ?
-                AND operation = 'expense'
-                AND category != ''
+                SELECT category, SUM(expense) as total
+                FROM cash_daily_categories
+                WHERE club = ? AND day BETWEEN ? AND ?
                 GROUP BY category
-            ''', (club, str(year), str(month).zfill(2)))
+            ''', (club, first_day, last_day))
             
             summary['expenses_by_category'] = {}
             for row in cursor.fetchall():
@@ -246,11 +385,136 @@ class CashManager:
             
             conn.close()
             return summary
-            
+        
         except Exception as e:
             logger.error(f"❌ Error getting monthly summary: {e}")
             return {}
     
+    def _rebuild_checkpoints(self, cursor):
+        """Пересобрать контрольные точки по журналу движений
+        
+        Остатки на конец дня отсчитываются назад от текущего cash_balances:
+        начальный остаток кассы в журнал не попадает.
+        """
+        checkpoints, categories = self._checkpoints_from_log(cursor)
+        cursor.execute('DELETE FROM cash_daily_balances')
+        cursor.executemany('''
+            INSERT INTO cash_daily_balances
+            (club, cash_type, day, income, expense, movements, closing_balance)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [key + tuple(value) for key, value in checkpoints.items()])
+        cursor.execute('DELETE FROM cash_daily_categories')
+        cursor.executemany('''
+            INSERT INTO cash_daily_categories (club, day, category, expense)
+            VALUES (?, ?, ?, ?)
+        ''', [key + (expense,) for key, expense in categories.items()])
+    
+    def _checkpoints_from_log(self, cursor):
+        """Дневные итоги и расходы по категориям, посчитанные по cash_movements"""
+        cursor.execute('''
+            SELECT club, cash_type, date(created_at) AS day,
+                   SUM(CASE WHEN operation = 'income' THEN amount ELSE 0 END),
+                   SUM(CASE WHEN operation = 'income' THEN 0 ELSE amount END),
+                   COUNT(*)
+            FROM cash_movements
+            GROUP BY club, cash_type, day
+            ORDER BY club, cash_type, day DESC
+        ''')
+        days = cursor.fetchall()
+        
+        cursor.execute('SELECT club, cash_type, balance FROM cash_balances')
+        balances = {(club, cash_type): balance for club, cash_type, balance in cursor.fetchall()}
+        
+        checkpoints = {}
+        closing = {}
+        for club, cash_type, day, income, expense, count in days:
+            key = (club, cash_type)
+            if key not in closing:
+                # Кассы без строки в cash_balances - остаток по журналу
+                closing[key] = balances.get(key, sum(
+                    i - e for c, t, _, i, e, _ in days if (c, t) == key))
+            checkpoints[(club, cash_type, day)] = [income, expense, count, closing[key]]
+            closing[key] -= income - expense
+        
+        cursor.execute('''
+            SELECT club, date(created_at) AS day, category, SUM(amount)
+            FROM cash_movements
+            WHERE operation != 'income' AND category != ''
+            GROUP BY club, day, category
+        ''')
+        categories = {(club, day, category): total for club, day, category, total in cursor.fetchall()}
+        return checkpoints, categories
+    
+    def reconcile_balances(self, fix: bool = False) -> List[Dict]:
+        """
+        Сверить cash_balances и контрольные точки с журналом движений
+        
+        Args:
+            fix: Пересобрать контрольные точки по журналу. Расхождение
+                 cash_balances с журналом только сообщается - начальный
+                 остаток кассы журнал не знает.
+        
+        Returns:
+            [{'kind': 'balance' | 'checkpoint' | 'category', ...}]
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            issues = []
+            
+            cursor.execute('''
+                SELECT club, cash_type,
+                       SUM(CASE WHEN operation = 'income' THEN amount ELSE -amount END)
+                FROM cash_movements
+                GROUP BY club, cash_type
+            ''')
+            log_totals = {(club, cash_type): total for club, cash_type, total in cursor.fetchall()}
+            cursor.execute('SELECT club, cash_type, balance FROM cash_balances')
+            for club, cash_type, balance in cursor.fetchall():
+                actual = log_totals.get((club, cash_type), 0.0)
+                if abs(balance - actual) > 0.005:
+                    issues.append({'kind': 'balance', 'club': club, 'cash_type': cash_type,
+                                   'stored': balance, 'actual': actual})
+            
+            checkpoints, categories = self._checkpoints_from_log(cursor)
+            cursor.execute('''
+                SELECT club, cash_type, day, income, expense, movements, closing_balance
+                FROM cash_daily_balances
+            ''')
+            stored = {row[:3]: list(row[3:]) for row in cursor.fetchall()}
+            for key in set(checkpoints) | set(stored):
+                expected = checkpoints.get(key, [0.0, 0.0, 0, 0.0])
+                found = stored.get(key, [0.0, 0.0, 0, 0.0])
+                if expected[2] != found[2] or any(
+                        abs(a - b) > 0.005 for a, b in zip(expected[:2] + expected[3:],
+                                                           found[:2] + found[3:])):
+                    issues.append({'kind': 'checkpoint', 'club': key[0], 'cash_type': key[1],
+                                   'day': key[2], 'stored': found, 'actual': expected})
+            
+            cursor.execute('SELECT club, day, category, expense FROM cash_daily_categories')
+            stored = {row[:3]: row[3] for row in cursor.fetchall()}
+            for key in set(categories) | set(stored):
+                if abs(categories.get(key, 0.0) - stored.get(key, 0.0)) > 0.005:
+                    issues.append({'kind': 'category', 'club': key[0], 'day': key[1],
+                                   'category': key[2], 'stored': stored.get(key, 0.0),
+                                   'actual': categories.get(key, 0.0)})
+            
+            if fix and any(issue['kind'] != 'balance' for issue in issues):
+                self._rebuild_checkpoints(cursor)
+                conn.commit()
+            conn.close()
+            
+            if issues:
+                logger.warning(f"⚠️ Cash reconciliation: {len(issues)} issues"
+                               f"{' (checkpoints rebuilt)' if fix else ''}")
+            else:
+                logger.info("✅ Cash reconciliation: balances match movement log")
+            return issues
+        
+        except Exception as e:
+            logger.error(f"❌ Error reconciling cash balances: {e}")
+            return []
+    
     def format_balance_report(self) -> str:
         """Форматирование отчёта по балансам"""
         balances = self.get_all_balances()
@@ -359,6 +623,7 @@ class CashManager:
         text += f"   ➕ Приход: {summary['total']['income']:,.0f} ₽\n"
         text += f"   ➖ Расход: {summary['total']['expense']:,.0f} ₽\n"
         text += f"   💰 Чистый: {summary['total']['net']:,.0f} ₽\n"
+        text += f"   🏦 Остаток на конец: {summary['total']['closing']:,.0f} ₽\n"
         
         if summary.get('expenses_by_category'):
             text += "\n📊 РАСХОДЫ ПО КАТЕГОРИЯМ\n"
@@ -366,3 +631,18 @@ class CashManager:
                 text += f"   • {category}: {amount:,.0f} ₽\n"
         
         return text
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Сверка балансов касс с журналом движений')
+    parser.add_argument('--db', default='knowledge.db')
+    parser.add_argument('--reconcile', action='store_true')
+    parser.add_argument('--fix', action='store_true', help='пересобрать контрольные точки')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.reconcile:
+        for issue in CashManager(args.db).reconcile_balances(fix=args.fix):
+            print(issue)
@@ -5,6 +5,7 @@ Content Generation Manager
 Handles AI content generation (text, images, video)
 """
 
+import hashlib
 import logging
 import sqlite3
 from datetime import datetime
@@ -51,6 +52,27 @@ class ContentGenerator:
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )''')
             
+            # Queue/cache columns (for existing DBs)
+            cursor.execute("PRAGMA table_info(content_generations)")
+            columns = [row[1] for row in cursor.fetchall()]
+            for column, column_type in (
+                ('prompt_hash', 'TEXT'),
+                ('chat_id', 'INTEGER'),
+                ('params', 'TEXT'),
+                ('provider_task_id', 'TEXT'),
+                ('telegram_file_id', 'TEXT'),
+                ('cached_from', 'INTEGER'),
+                ('started_at', 'TIMESTAMP'),
+            ):
+                if column not in columns:
+                    logger.info(f"🔧 Adding {column} column to content_generations table")
+                    cursor.execute(f'ALTER TABLE content_generations ADD COLUMN {column} {column_type}')
+            
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_content_generations_cache
+                ON content_generations(content_type, prompt_hash, status)''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_content_generations_queue
+                ON content_generations(status, content_type)''')
+            
             # Initialize default GPT model if not exists
             cursor.execute('INSERT OR IGNORE INTO gpt_settings (id, active_model) VALUES (1, ?)', 
                          (self.gpt_model,))
@@ -63,6 +85,36 @@ class ContentGenerator:
     
 
     
+    @staticmethod
+    def prompt_hash(content_type: str, prompt: str, params: str = '') -> str:
+        """Cache key: type + normalized prompt + generation params"""
+        normalized = ' '.join(prompt.lower().split())
+        return hashlib.sha256(f"{content_type}|{params}|{normalized}".encode('utf-8')).hexdigest()
+    
+    def request_text(self, prompt: str, model: str) -> str:
+        """GPT call only (no DB logging) - used by the generation queue"""
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "Ты - творческий AI помощник. Создавай качественный контент по запросу пользователя."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=1000
+        )
+        return response['choices'][0]['message']['content'].strip()
+    
+    def request_image(self, prompt: str) -> str:
+        """DALL-E 3 call only (no DB logging); returns a temporary image URL"""
+        response = openai.Image.create(
+            model="dall-e-3",
+            prompt=prompt,
+            n=1,
+            size="1024x1024",
+            quality="standard"
+        )
+        return response['data'][0]['url']
+    
     def generate_text(self, prompt: str, user_id: int) -> Dict:
         """Generate text content using GPT"""
         try:
@@ -71,18 +123,8 @@ class ContentGenerator:
             
             generation_id = self._log_generation(user_id, prompt, 'text', active_model)
             
-            response = openai.ChatCompletion.create(
-                model=active_model,
-                messages=[
-                    {"role": "system", "content": "Ты - творческий AI помощник. Создавай качественный контент по запросу пользователя."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            content = response['choices'][0]['message']['content'].strip()
-            
+            content = self.request_text(prompt, active_model)
+
             self._update_generation(generation_id, 'completed', generated_content=content)
             
             return {
@@ -105,16 +147,8 @@ class ContentGenerator:
         try:
             generation_id = self._log_generation(user_id, prompt, 'image', 'dall-e-3')
             
-            response = openai.Image.create(
-                model="dall-e-3",
-                prompt=prompt,
-                n=1,
-                size="1024x1024",
-                quality="standard"
-            )
-            
-            image_url = response['data'][0]['url']
-            
+            image_url = self.request_image(prompt)
+
             self._update_generation(generation_id, 'completed', image_url=image_url)
             
             return {
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content Generation Queue
+Persistent job queue for text/image/video generation on top of content_generations.
+
+Handlers only enqueue a request and return; async workers (bounded per content
+type) call OpenAI in worker threads, poll video tasks without blocking the event
+loop, and push the result to the requesting chat. Repeated prompts are served
+from a prompt-hash cache (Telegram file_id when available, since OpenAI URLs expire).
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {'text': 4, 'image': 2, 'video': 1}
+CACHE_TTL_DAYS = 30
+URL_TTL_MINUTES = 50  # DALL-E / Sora result URLs live ~1 hour
+VIDEO_POLL_INTERVAL = 5.0
+VIDEO_TIMEOUT = 600
+
+TYPE_EMOJI = {'text': '✍️', 'image': '🎨', 'video': '🎬'}
+
+
+class ContentQueue:
+    """Queued, cached content generation with per-type worker limits"""
+
+    def __init__(self, db_path: str, content_generator, video_generator=None,
+                 limits: Optional[Dict[str, int]] = None,
+                 cache_ttl_days: int = CACHE_TTL_DAYS,
+                 poll_interval: float = VIDEO_POLL_INTERVAL,
+                 video_timeout: float = VIDEO_TIMEOUT):
+        self.db_path = db_path
+        self.content_generator = content_generator
+        self.video_generator = video_generator
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.cache_ttl_days = cache_ttl_days
+        self.poll_interval = poll_interval
+        self.video_timeout = video_timeout
+        self.bot = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # Same format as CURRENT_TIMESTAMP in started_at: claims older than this
+        # belong to a previous process
+        self._booted_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    # ===== PUBLIC API =====
+
+    async def start(self, bot) -> int:
+        """Resume work persisted before a restart. Returns number of resumed jobs"""
+        self.bot = bot
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # Interrupted API calls are retried; submitted video tasks keep polling.
+        # Only claims made before this process started are reset: jobs submitted
+        # and claimed since then are running here and must not run twice
+        cursor.execute('''
+            UPDATE content_generations SET status = 'pending', started_at = NULL
+            WHERE status = 'processing' AND provider_task_id IS NULL AND chat_id IS NOT NULL
+            AND (started_at IS NULL OR started_at < ?)
+        ''', (self._booted_at,))
+        cursor.execute('''
+            SELECT id FROM content_generations
+            WHERE status IN ('pending', 'processing') AND chat_id IS NOT NULL
+            ORDER BY id
+        ''')
+        job_ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        conn.close()
+
+        for job_id in job_ids:
+            self._spawn(job_id)
+        if job_ids:
+            logger.info(f"🔄 Content queue: resumed {len(job_ids)} job(s)")
+        return len(job_ids)
+
+    async def submit(self, bot, user_id: int, chat_id: int, content_type: str,
+                     prompt: str, params: Optional[Dict] = None) -> Dict:
+        """
+        Enqueue a generation request (or answer it from cache)
+
+        Returns:
+            dict with 'id', 'cached' (result already sent) and 'position' (jobs ahead)
+        """
+        self.bot = self.bot or bot
+        params_json = json.dumps(params or {}, sort_keys=True)
+        prompt_hash = self.content_generator.prompt_hash(content_type, prompt, params_json)
+
+        cached = self._find_cached(content_type, prompt_hash)
+        if cached:
+            job_id = self._insert(user_id, chat_id, content_type, prompt, params_json, prompt_hash,
+                                  status='completed', cached=cached)
+            logger.info(f"⚡ Content cache hit: #{job_id} <- #{cached['id']}")
+            await self._deliver(job_id, chat_id, content_type, prompt, params or {}, cached)
+            return {'id': job_id, 'cached': True, 'position': 0}
+
+        position = self.pending_count(content_type)
+        job_id = self._insert(user_id, chat_id, content_type, prompt, params_json, prompt_hash,
+                              status='pending')
+        self._spawn(job_id)
+        logger.info(f"📥 Content job #{job_id} queued ({content_type}, {position} ahead)")
+        return {'id': job_id, 'cached': False, 'position': position}
+
+    def pending_count(self, content_type: str) -> int:
+        """Jobs of this type waiting or running"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM content_generations
+            WHERE content_type = ? AND status IN ('pending', 'processing') AND chat_id IS NOT NULL
+        ''', (content_type,))
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+
+    async def stop(self):
+        """Cancel in-flight workers (jobs stay in the DB and resume on next start)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    # ===== CACHE =====
+
+    def _find_cached(self, content_type: str, prompt_hash: str) -> Optional[Dict]:
+        """Latest reusable result for the same prompt hash"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, generated_content, image_url, video_url, telegram_file_id
+            FROM content_generations
+            WHERE content_type = ? AND prompt_hash = ? AND status = 'completed'
+              AND completed_at >= datetime('now', ?)
+              AND (telegram_file_id IS NOT NULL
+                   OR generated_content IS NOT NULL
+                   OR (cached_from IS NULL AND completed_at >= datetime('now', ?)))
+            ORDER BY telegram_file_id IS NULL, id DESC
+            LIMIT 1
+        ''', (content_type, prompt_hash, f'-{self.cache_ttl_days} days', f'-{URL_TTL_MINUTES} minutes'))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    # ===== DB =====
+
+    def _insert(self, user_id, chat_id, content_type, prompt, params_json, prompt_hash,
+                status: str, cached: Optional[Dict] = None) -> int:
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        if cached:
+            cursor.execute('''
+                INSERT INTO content_generations
+                (user_id, chat_id, request_text, content_type, params, prompt_hash, model_used,
+                 status, generated_content, image_url, video_url, telegram_file_id,
+                 cached_from, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'cache', 'completed', ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (user_id, chat_id, prompt, content_type, params_json, prompt_hash,
+                  cached['generated_content'], cached['image_url'], cached['video_url'],
+                  cached['telegram_file_id'], cached['id']))
+        else:
+            cursor.execute('''
+                INSERT INTO content_generations
+                (user_id, chat_id, request_text, content_type, params, prompt_hash, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, chat_id, prompt, content_type, params_json, prompt_hash, status))
+        job_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return job_id
+
+    def _load(self, job_id: int) -> Optional[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM content_generations WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def _claim(self, job_id: int, model: str) -> bool:
+        """Atomically move pending -> processing (only one worker wins)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE content_generations
+            SET status = 'processing', model_used = ?, started_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+        ''', (model, job_id))
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+
+    def _set_task_id(self, job_id: int, task_id: str):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('UPDATE content_generations SET provider_task_id = ? WHERE id = ?',
+                     (task_id, job_id))
+        conn.commit()
+        conn.close()
+
+    def _set_file_id(self, job_id: int, file_id: str):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('UPDATE content_generations SET telegram_file_id = ? WHERE id = ?',
+                     (file_id, job_id))
+        conn.commit()
+        conn.close()
+
+    # ===== WORKERS =====
+
+    def _semaphore(self, content_type: str) -> asyncio.Semaphore:
+        if content_type not in self._semaphores:
+            self._semaphores[content_type] = asyncio.Semaphore(max(1, self.limits.get(content_type, 1)))
+        return self._semaphores[content_type]
+
+    def _spawn(self, job_id: int):
+        if job_id in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _t, j=job_id: self._tasks.pop(j, None))
+
+    async def _run(self, job_id: int):
+        job = self._load(job_id)
+        if not job:
+            return
+        content_type = job['content_type']
+        params = json.loads(job['params'] or '{}')
+
+        async with self._semaphore(content_type):
+            try:
+                if job['status'] == 'processing' and job['provider_task_id']:
+                    # Resumed video task: just keep polling
+                    result = await self._poll_video(job)
+                else:
+                    model = self._model_for(content_type)
+                    if not self._claim(job_id, model):
+                        return
+                    result = await self._generate(job_id, content_type, job['request_text'], model, params)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Content job #{job_id} error: {e}")
+                result = {'error': str(e)}
+
+        if 'error' in result:
+            self.content_generator._update_generation(job_id, 'failed', error_message=result['error'])
+            await self._notify_failure(job['chat_id'], content_type, result['error'])
+            return
+
+        self.content_generator._update_generation(
+            job_id, 'completed',
+            generated_content=result.get('generated_content'),
+            image_url=result.get('image_url'),
+            video_url=result.get('video_url'),
+        )
+        logger.info(f"✅ Content job #{job_id} completed")
+        await self._deliver(job_id, job['chat_id'], content_type, job['request_text'], params, result)
+
+    def _model_for(self, content_type: str) -> str:
+        if content_type == 'text':
+            return self.content_generator.get_active_model()
+        if content_type == 'image':
+            return 'dall-e-3'
+        return 'sora'
+
+    async def _generate(self, job_id: int, content_type: str, prompt: str, model: str,
+                        params: Dict) -> Dict:
+        if content_type == 'text':
+            content = await asyncio.to_thread(self.content_generator.request_text, prompt, model)
+            return {'generated_content': content}
+
+        if content_type == 'image':
+            image_url = await asyncio.to_thread(self.content_generator.request_image, prompt)
+            return {'image_url': image_url}
+
+        if content_type == 'video':
+            if not self.video_generator:
+                return {'error': 'Video generation is disabled'}
+            result = await asyncio.to_thread(
+                self.video_generator.start, prompt,
+                params.get('duration', 5), params.get('resolution', '1080p')
+            )
+            if 'error' in result:
+                return result
+            if 'video_url' in result:
+                return {'video_url': result['video_url']}
+            self._set_task_id(job_id, result['task_id'])
+            return await self._poll_video(self._load(job_id))
+
+        return {'error': f'Unknown content type: {content_type}'}
+
+    async def _poll_video(self, job: Dict) -> Dict:
+        """Poll a provider task with asyncio.sleep between checks (no blocked thread)"""
+        if not self.video_generator:
+            return {'error': 'Video generation is disabled'}
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.video_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            status = await asyncio.to_thread(self.video_generator.check, job['provider_task_id'])
+            if status['status'] == 'completed':
+                return {'video_url': status['video_url']}
+            if status['status'] == 'failed':
+                return {'error': f"Video generation failed: {status.get('error')}"}
+        return {'error': 'Video generation timeout'}
+
+    # ===== DELIVERY =====
+
+    async def _deliver(self, job_id: int, chat_id: int, content_type: str, prompt: str,
+                       params: Dict, result: Dict):
+        """Send the result to the requester and remember the Telegram file_id"""
+        bot = self.bot
+        try:
+            if content_type == 'text':
+                await bot.send_message(chat_id=chat_id, text=result['generated_content'][:4096])
+                return
+
+            if content_type == 'image':
+                message = await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=result.get('telegram_file_id') or result['image_url'],
+                    caption=f"🎨 {prompt}"[:1024]
+                )
+                file_id = message.photo[-1].file_id if message.photo else None
+            else:
+                caption = f"🎬 {prompt}"
+                if params:
+                    caption += f"\n📊 {params.get('resolution', '1080p')} • {params.get('duration', 5)}s"
+                message = await bot.send_video(
+                    chat_id=chat_id,
+                    video=result.get('telegram_file_id') or result['video_url'],
+                    caption=caption[:1024]
+                )
+                file_id = message.video.file_id if message.video else None
+
+            if file_id and file_id != result.get('telegram_file_id'):
+                self._set_file_id(job_id, file_id)
+        except Exception as e:
+            logger.error(f"❌ Failed to deliver content job #{job_id}: {e}")
+
+    async def _notify_failure(self, chat_id: int, content_type: str, error: str):
+        try:
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=f"❌ {TYPE_EMOJI.get(content_type, '📄')} Ошибка генерации: {error}"
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to send generation error: {e}")
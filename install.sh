@@ -68,7 +68,7 @@ if [ "$INSTALL_TYPE" == "2" ]; then
 else
     # Обычная установка
     echo -e "${YELLOW}[2/5]${NC} Установка пакетов..."
-    apt-get install -y python3 python3-pip python3-venv git > /dev/null 2>&1
+    apt-get install -y python3 python3-pip python3-venv git tesseract-ocr tesseract-ocr-rus > /dev/null 2>&1
     echo "✅ Пакеты установлены"
 fi
 
@@ -9,6 +9,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 import logging
 
+from modules.notification_dispatcher import PRIORITY_HIGH, get_notifier
+
 logger = logging.getLogger(__name__)
 
 # Состояния conversation handler
@@ -187,16 +189,30 @@ class IssueCommands:
             context.user_data.clear()
             return ConversationHandler.END
         
+        # Возможные дубли среди активных проблем клуба
+        duplicates = self.issue_manager.find_duplicates(description, club, exclude_id=issue_id)
+        duplicates_text = ""
+        if duplicates:
+            duplicates_text = "\n\n⚠️ Похоже на активные проблемы:\n"
+            for duplicate in duplicates[:3]:
+                short = duplicate['description']
+                if len(short) > 60:
+                    short = short[:57] + "..."
+                duplicates_text += f"• #{duplicate['id']}: {short}\n"
+            logger.info(f"⚠️ Issue #{issue_id} looks like {[d['id'] for d in duplicates]}")
+        
         # 2. Уведомляем владельца
-        notification_text = self.issue_manager.format_notification(issue_id)
+        notification_text = self.issue_manager.format_notification(issue_id) + duplicates_text.rstrip()
         
         try:
-            # Отправляем уведомление владельцу
-            await self.bot_app.bot.send_message(
-                chat_id=self.owner_id,
-                text=notification_text
+            # Уведомление владельцу уходит через общий диспетчер (лимиты, повторы)
+            get_notifier(self.bot_app.bot_data, self.bot_app.bot).submit(
+                self.owner_id, notification_text,
+                priority=PRIORITY_HIGH,
+                dedup_key=f"issue:{issue_id}",
+                category='issue'
             )
-            logger.info(f"✅ Owner notified about issue #{issue_id}")
+            logger.info(f"✅ Owner notification queued for issue #{issue_id}")
         except Exception as e:
             logger.error(f"❌ Failed to notify owner: {e}")
         
@@ -223,6 +239,7 @@ class IssueCommands:
         text += "• Записана в базу данных\n"
         text += "• Владелец уведомлён\n"
         text += "• Добавлена в базу знаний бота"
+        text += duplicates_text.rstrip()
         
         keyboard = [[InlineKeyboardButton("◀️ В меню проблем", callback_data="issue_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
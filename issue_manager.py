@@ -3,6 +3,11 @@
 """
 Issue Manager - Система отслеживания проблем клуба
 Запись проблем, уведомления, база знаний, управление
+
+Поиск похожих проблем: описание приводится к основам слов (стеммер Snowball)
+в колонку search_text, по ней строится индекс FTS5 club_issues_fts.
+"Не работает мышка" и "мышки не работают" дают общие основы и находятся
+через индекс, без сканирования таблицы.
 """
 
 import sqlite3
@@ -10,14 +15,20 @@ from datetime import datetime
 from typing import List, Dict, Optional
 import logging
 
+from modules.russian_stemmer import normalize_text, stem_words
+
 logger = logging.getLogger(__name__)
 
+# Доля общих основ (от более короткого описания), с которой проблема считается дублем
+DUPLICATE_THRESHOLD = 0.6
+
 
 class IssueManager:
     """Менеджер системы отслеживания проблем клуба"""
     
     def __init__(self, db_path: str = 'knowledge.db'):
         self.db_path = db_path
+        self.fts_available = False
         self._init_db()
     
     def _init_db(self):
@@ -40,6 +51,62 @@ class IssueManager:
             )
         ''')
         
+        # Нормализованный текст (основы слов) для поиска
+        cursor.execute("PRAGMA table_info(club_issues)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'search_text' not in columns:
+            cursor.execute("ALTER TABLE club_issues ADD COLUMN search_text TEXT")
+        
+        cursor.execute('SELECT id, description FROM club_issues WHERE search_text IS NULL')
+        missing = [(normalize_text(description), issue_id) for issue_id, description in cursor.fetchall()]
+        if missing:
+            cursor.executemany('UPDATE club_issues SET search_text = ? WHERE id = ?', missing)
+        
+        # Полнотекстовый индекс над search_text (внешнее содержимое - club_issues)
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='club_issues_fts'")
+            fts_exists = cursor.fetchone() is not None
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS club_issues_fts USING fts5(
+                    search_text, content='club_issues', content_rowid='id'
+                )
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS club_issues_fts_insert AFTER INSERT ON club_issues BEGIN
+                    INSERT INTO club_issues_fts(rowid, search_text) VALUES (new.id, new.search_text);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS club_issues_fts_delete AFTER DELETE ON club_issues BEGIN
+                    INSERT INTO club_issues_fts(club_issues_fts, rowid, search_text)
+                    SELECT 'delete', old.id, old.search_text WHERE old.search_text IS NOT NULL;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS club_issues_fts_update AFTER UPDATE OF search_text ON club_issues BEGIN
+                    INSERT INTO club_issues_fts(club_issues_fts, rowid, search_text)
+                    SELECT 'delete', old.id, old.search_text WHERE old.search_text IS NOT NULL;
+                    INSERT INTO club_issues_fts(rowid, search_text) VALUES (new.id, new.search_text);
+                END
+            ''')
+            if not fts_exists:
+                cursor.execute("INSERT INTO club_issues_fts(club_issues_fts) VALUES ('rebuild')")
+            
+            # Триггер на теневой таблице FTS5 (например, от журнала изменений) роняет
+            # процесс при первой же записи в индекс - такие триггеры снимаются
+            cursor.execute("""
+                SELECT name FROM sqlite_master
+                WHERE type = 'trigger' AND tbl_name IN (
+                    'club_issues_fts_data', 'club_issues_fts_idx', 'club_issues_fts_content',
+                    'club_issues_fts_docsize', 'club_issues_fts_config')
+            """)
+            for (trigger,) in cursor.fetchall():
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+                logger.warning(f"⚠️ Dropped trigger {trigger} on FTS shadow table")
+            self.fts_available = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"⚠️ FTS5 unavailable, similar issues search uses LIKE: {e}")
+        
         conn.commit()
         conn.close()
         logger.info("✅ Issue Manager database initialized")
@@ -63,9 +130,9 @@ class IssueManager:
             cursor = conn.cursor()
             
             cursor.execute('''
-                INSERT INTO club_issues (club, description, created_by, created_by_name)
-                VALUES (?, ?, ?, ?)
-            ''', (club, description, created_by, created_by_name))
+                INSERT INTO club_issues (club, description, created_by, created_by_name, search_text)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (club, description, created_by, created_by_name, normalize_text(description)))
             
             issue_id = cursor.lastrowid
             
@@ -142,9 +209,9 @@ class IssueManager:
             
             cursor.execute('''
                 UPDATE club_issues 
-                SET description = ?, updated_at = CURRENT_TIMESTAMP
+                SET description = ?, search_text = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
-            ''', (description, issue_id))
+            ''', (description, normalize_text(description), issue_id))
             
             conn.commit()
             conn.close()
@@ -336,47 +403,102 @@ class IssueManager:
         
         return text
     
-    def search_similar(self, description: str, club: str = None) -> List[Dict]:
+    def search_similar(self, description: str, club: str = None, status: str = None,
+                       limit: int = 10) -> List[Dict]:
         """
-        Простой поиск похожих проблем (по ключевым словам)
+        Поиск похожих проблем по основам слов (FTS5, самые релевантные первыми)
         Для более умного поиска используется векторная БД через KnowledgeBase
+        
+        Returns:
+            Проблемы с полем 'similarity' - доля общих основ от более короткого описания
         """
         try:
-            # Извлекаем ключевые слова из описания
-            keywords = [word.lower() for word in description.split() 
-                       if len(word) > 3]
+            stems = list(dict.fromkeys(stem_words(description)))
             
-            if not keywords:
+            if not stems:
                 return []
             
             conn = sqlite3.connect(self.db_path)
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Ищем проблемы содержащие хотя бы одно ключевое слово
-            query = 'SELECT * FROM club_issues WHERE '
-            conditions = []
-            params = []
-            
-            for keyword in keywords[:5]:  # Берём первые 5 ключевых слов
-                conditions.append('LOWER(description) LIKE ?')
-                params.append(f'%{keyword}%')
-            
-            query += '(' + ' OR '.join(conditions) + ')'
+            if self.fts_available:
+                # Проблемы, содержащие хотя бы одну основу
+                query = '''
+                    SELECT c.* FROM club_issues_fts f
+                    JOIN club_issues c ON c.id = f.rowid
+                    WHERE club_issues_fts MATCH ?
+                '''
+                params = [' OR '.join('"' + s.replace('"', '""') + '"' for s in stems)]
+            else:
+                query = 'SELECT * FROM club_issues c WHERE ('
+                query += ' OR '.join("(' ' || c.search_text || ' ') LIKE ?" for _ in stems) + ')'
+                params = [f'% {s} %' for s in stems]
             
             if club:
-                query += ' AND club = ?'
+                query += ' AND c.club = ?'
                 params.append(club)
             
-            query += ' ORDER BY created_at DESC LIMIT 10'
+            if status:
+                query += ' AND c.status = ?'
+                params.append(status)
+            
+            # Кандидаты - лучшие по bm25 (без FTS5 - самые свежие)
+            query += ' ORDER BY bm25(club_issues_fts)' if self.fts_available else ' ORDER BY c.created_at DESC'
+            query += ' LIMIT ?'
+            params.append(max(limit * 5, 50))
             
             cursor.execute(query, params)
             
-            issues = [dict(row) for row in cursor.fetchall()]
+            issues = []
+            query_stems = set(stems)
+            for row in cursor.fetchall():
+                issue = dict(row)
+                issue_stems = set((issue.get('search_text') or '').split())
+                common = len(query_stems & issue_stems)
+                issue['similarity'] = common / max(min(len(query_stems), len(issue_stems)), 1)
+                issues.append(issue)
             conn.close()
             
-            return issues
-            
+            issues.sort(key=lambda i: (i['similarity'], i['created_at']), reverse=True)
+            return issues[:limit]
+        
         except Exception as e:
             logger.error(f"❌ Error searching similar issues: {e}")
             return []
+    
+    def find_duplicates(self, description: str, club: str, exclude_id: int = None,
+                        threshold: float = DUPLICATE_THRESHOLD) -> List[Dict]:
+        """Активные проблемы клуба, похожие на описание настолько, что это вероятный дубль"""
+        return [issue for issue in self.search_similar(description, club=club, status='active')
+                if issue['id'] != exclude_id and issue['similarity'] >= threshold]
+
+
+if __name__ == '__main__':
+    # Проверка: поиск и запись проблем при установленных триггерах журнала изменений
+    #   python issue_manager.py
+    import os
+    import tempfile
+    
+    from modules.db_recovery import ChangeJournal
+    
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'issues.db')
+        manager = IssueManager(db_path)
+        journal = ChangeJournal(db_path, journal_path=os.path.join(tmp, 'journal', 'journal.db'))
+        journal.install_triggers()
+        IssueManager(db_path)
+        journal.ensure_triggers()
+        
+        first = manager.create_issue('rio', 'Не работает мышка на 5 ПК', 1, 'check')
+        second = manager.create_issue('rio', 'Мышки не работают', 1, 'check')
+        manager.update_issue(first, 'Не работает мышка и клавиатура на 5 ПК')
+        manager.delete_issue(second)
+        assert first and second, "create_issue failed"
+        assert [i['id'] for i in manager.find_duplicates('Мышка не работает', 'rio')] == [first]
+        
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO club_issues_fts(club_issues_fts) VALUES ('integrity-check')")
+        conn.close()
+    print("✅ IssueManager: create/update/delete with change journal triggers OK")
@@ -6,17 +6,25 @@ Owner-only commands for database backups and migration file distribution
 """
 
 import os
+import asyncio
 import logging
 import tarfile
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from telegram import Update, Document
 from telegram.ext import ContextTypes
 from .runtime_migrator import RuntimeMigrator
+from .history_export import HistoryExporter
+from .snapshot_store import SnapshotStore, SnapshotError
+from .db_recovery import ChangeJournal, PointInTimeRecovery
+from .data_version import DataVersion
 
 logger = logging.getLogger(__name__)
 
+# Moscow timezone (UTC+3) - /restore_at takes owner-facing local time
+MSK = timezone(timedelta(hours=3))
+
 
 class BackupCommands:
     """Commands for backup and migration management"""
@@ -40,6 +48,17 @@ class BackupCommands:
         
         # Initialize runtime migrator
         self.migrator = RuntimeMigrator(db_path, self.migrations_dir)
+
+        # Columnar history export (incremental by watermark)
+        self.exporter = HistoryExporter(db_path, os.path.join(self.backup_dir, 'exports'))
+
+        # Incremental consistent snapshots (online SQLite backup + chunk dedup)
+        self.snapshots = SnapshotStore(os.path.join(self.backup_dir, 'snapshots'), db_path)
+
+        # Change journal (triggers + shipping to a separate file) for point-in-time recovery
+        self.journal = ChangeJournal(db_path, os.path.join(self.backup_dir, 'journal', 'journal.db'))
+        self.journal.install_triggers()
+        self.recovery = PointInTimeRecovery(self.snapshots, self.journal)
     
     def is_owner(self, user_id: int) -> bool:
         """Check if user is owner"""
@@ -65,6 +84,9 @@ class BackupCommands:
             # Apply migrations
             success, messages = self.migrator.apply_all_migrations()
             
+            # New tables from migrations get their data version triggers
+            DataVersion(self.db_path).install()
+            
             # Format response
             if not messages:
                 response = "ℹ️ Нет доступных миграций"
@@ -129,6 +151,27 @@ class BackupCommands:
             logger.error(f"Error sending migration files: {e}")
             await update.message.reply_text(f"❌ Ошибка отправки файлов миграций: {e}")
     
+    def _snapshot_and_archive(self, label: str, archive_path: str) -> dict:
+        """
+        Take an incremental snapshot and build a tar.gz from it
+        (blocking: run via asyncio.to_thread)
+        """
+        manifest = self.snapshots.create(label=label)
+        self.snapshots.export_archive(manifest['id'], archive_path)
+        self.snapshots.apply_retention()
+        return manifest
+    
+    @staticmethod
+    def _snapshot_summary(manifest: dict) -> str:
+        """Short snapshot description for captions"""
+        return (
+            f"🆔 Снимок: {manifest['id']}\n"
+            f"📊 Данные: {manifest['total_size'] / (1024 * 1024):.2f} МБ, "
+            f"новых: {manifest['new_bytes'] / (1024 * 1024):.2f} МБ\n"
+            f"🩺 Целостность БД: {manifest['integrity']}\n"
+            f"⏱ {manifest['duration_sec']} с"
+        )
+    
     async def cmd_backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Create and send backup archive
@@ -148,26 +191,8 @@ class BackupCommands:
             
             await update.message.reply_text("🔄 Создаю резервную копию...")
             
-            # Create tar archive
-            with tarfile.open(archive_path, 'w:gz') as tar:
-                # Add SQLite database if exists
-                if os.path.exists(self.db_path):
-                    tar.add(self.db_path, arcname=os.path.basename(self.db_path))
-                
-                # Add JSON/CSV files from modules/finmon_simple if they exist
-                finmon_data_dir = './finmon_data'
-                if os.path.exists(finmon_data_dir):
-                    for root, dirs, files in os.walk(finmon_data_dir):
-                        for file in files:
-                            if file.endswith(('.json', '.csv')):
-                                file_path = os.path.join(root, file)
-                                arcname = os.path.relpath(file_path, '.')
-                                tar.add(file_path, arcname=arcname)
-                
-                # Add config.json if exists (without sensitive data we'll warn about this)
-                if os.path.exists('config.json'):
-                    # Note: In production, you might want to sanitize sensitive data
-                    tar.add('config.json', arcname='config.json')
+            # Snapshot (online backup API + integrity check) runs in a worker thread
+            manifest = await asyncio.to_thread(self._snapshot_and_archive, 'manual', archive_path)
             
             # Get archive size
             archive_size = os.path.getsize(archive_path)
@@ -180,17 +205,235 @@ class BackupCommands:
                 await update.message.reply_document(
                     document=f,
                     filename=archive_name,
-                    caption=f"💾 Резервная копия\n🕐 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n📊 Размер: {size_mb:.2f} МБ"
+                    caption=f"💾 Резервная копия\n🕐 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n{self._snapshot_summary(manifest)}"
                 )
             
-            # Clean up archive
-            os.remove(archive_path)
-            
             logger.info(f"✅ Backup sent to user {user_id}, size: {size_mb:.2f} MB")
             
+        except SnapshotError as e:
+            logger.error(f"Backup integrity error: {e}")
+            await update.message.reply_text(f"❌ Резервная копия не создана: {e}")
         except Exception as e:
             logger.error(f"Error creating backup: {e}")
             await update.message.reply_text(f"❌ Ошибка создания резервной копии: {e}")
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+    
+    async def cmd_backups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        List stored snapshots
+        Usage: /backups
+        """
+        user_id = update.effective_user.id
+        
+        if not self.is_owner(user_id):
+            await update.message.reply_text("❌ Эта команда доступна только владельцу бота")
+            return
+        
+        snapshots = await asyncio.to_thread(self.snapshots.list_snapshots)
+        if not snapshots:
+            await update.message.reply_text("ℹ️ Снимков пока нет. Создайте: /backup")
+            return
+        
+        storage_size = await asyncio.to_thread(self.snapshots.storage_size)
+        storage_mb = storage_size / (1024 * 1024)
+        lines = [f"💾 Снимки ({len(snapshots)}), хранилище: {storage_mb:.2f} МБ\n"]
+        for snap in snapshots[:20]:
+            lines.append(
+                f"• {snap['id']} ({snap['label']}) - "
+                f"{snap['total_size'] / (1024 * 1024):.1f} МБ, +{snap['new_bytes'] / (1024 * 1024):.2f} МБ"
+            )
+        lines.append("\nВосстановить: /restore <id>")
+        await update.message.reply_text("\n".join(lines))
+    
+    async def cmd_restore(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Restore database and data files from a snapshot
+        Usage: /restore <id> - verify snapshot and ask for confirmation
+               /restore <id> confirm - restore (a safety snapshot is taken first)
+        """
+        user_id = update.effective_user.id
+        
+        if not self.is_owner(user_id):
+            await update.message.reply_text("❌ Эта команда доступна только владельцу бота")
+            return
+        
+        if not context.args:
+            await update.message.reply_text("Использование: /restore <id> (список: /backups)")
+            return
+        
+        snapshot_id = context.args[0]
+        confirmed = len(context.args) > 1 and context.args[1].lower() == 'confirm'
+        
+        try:
+            await update.message.reply_text(f"🔍 Проверяю снимок {snapshot_id}...")
+            ok, problems = await asyncio.to_thread(self.snapshots.verify, snapshot_id)
+            if not ok:
+                await update.message.reply_text("❌ Снимок поврежден:\n" + "\n".join(problems[:10]))
+                return
+            
+            if not confirmed:
+                manifest = self.snapshots.load_manifest(snapshot_id)
+                files = "\n".join(f"• {name}" for name in manifest['files'])
+                await update.message.reply_text(
+                    f"✅ Снимок {snapshot_id} цел\n\n{files}\n\n"
+                    f"⚠️ Текущие данные будут заменены (перед этим снимется страховочная копия).\n"
+                    f"Подтвердите: /restore {snapshot_id} confirm"
+                )
+                return
+            
+            await update.message.reply_text("♻️ Восстанавливаю...")
+            result = await asyncio.to_thread(self.snapshots.restore, snapshot_id)
+            await update.message.reply_text(
+                f"✅ Восстановлено из {snapshot_id}:\n" +
+                "\n".join(f"• {name}" for name in result['restored']) +
+                f"\n\n🛟 Страховочный снимок: {result['safety_snapshot']}"
+            )
+            logger.info(f"✅ Snapshot {snapshot_id} restored by user {user_id}")
+            
+        except SnapshotError as e:
+            logger.error(f"Restore error: {e}")
+            await update.message.reply_text(f"❌ Восстановление не выполнено: {e}")
+        except Exception as e:
+            logger.error(f"Error restoring snapshot: {e}")
+            await update.message.reply_text(f"❌ Ошибка восстановления: {e}")
+    
+    async def cmd_restore_at(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Point-in-time recovery: nearest earlier snapshot + change journal replay
+        Usage: /restore_at 2025-11-02 14:30 - dry run (builds and verifies a copy)
+               /restore_at 2025-11-02 14:30 confirm - replace the live database
+        """
+        user_id = update.effective_user.id
+        
+        if not self.is_owner(user_id):
+            await update.message.reply_text("❌ Эта команда доступна только владельцу бота")
+            return
+        
+        args = context.args or []
+        confirmed = bool(args) and args[-1].lower() == 'confirm'
+        moment = ' '.join(args[:-1] if confirmed else args)
+        try:
+            target = datetime.strptime(moment, '%Y-%m-%d %H:%M').replace(tzinfo=MSK)
+        except ValueError:
+            await update.message.reply_text("Использование: /restore_at ГГГГ-ММ-ДД ЧЧ:ММ [confirm] (время МСК)")
+            return
+        target_ts = target.timestamp()
+        
+        try:
+            if not confirmed:
+                await update.message.reply_text(f"🔍 Собираю копию БД на {moment} МСК для проверки...")
+                dry_run_path = os.path.join(self.backup_dir, f'.pitr_check_{int(target_ts)}.db')
+                try:
+                    await asyncio.to_thread(self.journal.ship)
+                    report = await asyncio.to_thread(self.recovery.build, target_ts, dry_run_path)
+                finally:
+                    if os.path.exists(dry_run_path):
+                        os.remove(dry_run_path)
+                await update.message.reply_text(
+                    f"✅ Копия на {moment} МСК собрана и проверена\n\n"
+                    f"🆔 Снимок: {report['snapshot_id']}\n"
+                    f"📝 Изменений из журнала: {report['replayed']}\n"
+                    f"🔢 Строк сверено со снимком: {report['rows_verified']}\n"
+                    f"🩺 Целостность: {report['integrity']}\n"
+                    f"⏱ {report['duration_sec']} с\n\n"
+                    f"⚠️ Для замены живой БД: /restore_at {moment} confirm"
+                )
+                return
+            
+            await update.message.reply_text(f"♻️ Восстанавливаю БД на {moment} МСК...")
+            report = await asyncio.to_thread(self.recovery.restore_to, target_ts)
+            await update.message.reply_text(
+                f"✅ БД восстановлена на {moment} МСК\n\n"
+                f"🆔 Снимок: {report['snapshot_id']} + {report['replayed']} изменений\n"
+                f"🛟 Страховочный снимок: {report['safety_snapshot']}\n"
+                f"⏱ {report['duration_sec']} с"
+            )
+            logger.info(f"✅ PITR to {moment} by user {user_id}")
+            
+        except SnapshotError as e:
+            logger.error(f"PITR error: {e}")
+            await update.message.reply_text(f"❌ Восстановление не выполнено: {e}")
+        except Exception as e:
+            logger.error(f"Error in point-in-time restore: {e}")
+            await update.message.reply_text(f"❌ Ошибка восстановления: {e}")
+    
+    async def snapshot_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Scheduled job: local incremental snapshot + retention
+        Called by JobQueue daily
+        """
+        try:
+            await asyncio.to_thread(self.snapshots.create, 'daily')
+            await asyncio.to_thread(self.snapshots.apply_retention)
+            
+            # Journal entries older than the oldest kept snapshot can no longer be replayed
+            snapshots = await asyncio.to_thread(self.snapshots.list_snapshots)
+            if snapshots and snapshots[-1].get('created_ts'):
+                await asyncio.to_thread(self.journal.prune, snapshots[-1]['created_ts'])
+        except Exception as e:
+            logger.error(f"❌ Error in scheduled snapshot: {e}")
+    
+    async def ship_journal_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Scheduled job: move change journal out of the main DB
+        Called by JobQueue every minute
+        """
+        try:
+            await asyncio.to_thread(self.journal.ensure_triggers)
+            await asyncio.to_thread(self.journal.ship)
+        except Exception as e:
+            logger.error(f"❌ Error shipping change journal: {e}")
+    
+    async def cmd_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Export shift and cash history to a compressed columnar file (NPZ)
+        Usage: /export - only rows added since the previous export
+               /export full - all rows (resets the watermark chain)
+        """
+        user_id = update.effective_user.id
+        
+        if not self.is_owner(user_id):
+            await update.message.reply_text("❌ Эта команда доступна только владельцу бота")
+            return
+        
+        full = bool(context.args) and context.args[0].lower() == 'full'
+        
+        try:
+            await update.message.reply_text(
+                "🔄 Выгружаю историю (полная)..." if full else "🔄 Выгружаю новые записи с прошлой выгрузки..."
+            )
+            
+            # Export runs in a worker thread so the event loop stays responsive
+            manifest = await asyncio.to_thread(self.exporter.export, not full)
+            
+            if manifest is None:
+                await update.message.reply_text("ℹ️ Новых записей с прошлой выгрузки нет")
+                return
+            
+            size_mb = manifest['size_bytes'] / (1024 * 1024)
+            lines = [
+                f"• {table}: {info['rows']} строк"
+                for table, info in manifest['tables'].items()
+            ]
+            
+            with open(manifest['path'], 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=os.path.basename(manifest['path']),
+                    caption=(
+                        f"📤 Выгрузка истории ({'полная' if full else 'инкремент'})\n"
+                        f"🕐 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+                        f"📊 Размер: {size_mb:.2f} МБ\n\n" + "\n".join(lines)
+                    )
+                )
+            
+            logger.info(f"✅ History export sent to user {user_id}: {manifest['total_rows']} rows")
+            
+        except Exception as e:
+            logger.error(f"Error exporting history: {e}")
+            await update.message.reply_text(f"❌ Ошибка выгрузки истории: {e}")
     
     async def send_scheduled_migration(self, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -249,26 +492,8 @@ class BackupCommands:
             
             logger.info(f"📦 Creating weekly backup: {archive_name}")
             
-            # Create tar archive with important files
-            with tarfile.open(archive_path, 'w:gz') as tar:
-                # Add SQLite database
-                if os.path.exists(self.db_path):
-                    tar.add(self.db_path, arcname=os.path.basename(self.db_path))
-                    logger.info(f"  Added: {self.db_path}")
-                
-                # Add FinMon data files
-                finmon_files = ['finmon_balances.json', 'finmon_log.csv']
-                for file in finmon_files:
-                    if os.path.exists(file):
-                        tar.add(file, arcname=file)
-                        logger.info(f"  Added: {file}")
-                
-                # Add vector store if exists
-                vector_files = ['vector_index.faiss', 'vector_metadata.pkl']
-                for file in vector_files:
-                    if os.path.exists(file):
-                        tar.add(file, arcname=file)
-                        logger.info(f"  Added: {file}")
+            # Consistent snapshot of the DB and data files, built off the event loop
+            manifest = await asyncio.to_thread(self._snapshot_and_archive, 'weekly', archive_path)
             
             # Get archive size
             archive_size = os.path.getsize(archive_path)
@@ -286,6 +511,7 @@ class BackupCommands:
                                 f"💾 Еженедельный автобэкап\n"
                                 f"🕐 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
                                 f"📊 Размер: {size_mb:.2f} МБ\n\n"
+                                f"{self._snapshot_summary(manifest)}\n\n"
                                 f"Включено:\n"
                                 f"• База данных (knowledge.db)\n"
                                 f"• Финансовые данные (finmon_*.json/csv)\n"
@@ -350,6 +576,10 @@ def register_backup_commands(application, config: dict = None):
     application.add_handler(CommandHandler("apply_migrations", backup_commands.cmd_apply_migrations))
     application.add_handler(CommandHandler("migration", backup_commands.cmd_migration))
     application.add_handler(CommandHandler("backup", backup_commands.cmd_backup))
+    application.add_handler(CommandHandler("export", backup_commands.cmd_export))
+    application.add_handler(CommandHandler("backups", backup_commands.cmd_backups))
+    application.add_handler(CommandHandler("restore", backup_commands.cmd_restore))
+    application.add_handler(CommandHandler("restore_at", backup_commands.cmd_restore_at))
     
     # Schedule periodic migration file sending
     if application.job_queue:
@@ -371,6 +601,24 @@ def register_backup_commands(application, config: dict = None):
             name='weekly_backup'
         )
         logger.info(f"✅ Weekly backup enabled (every 7 days, starts in 1 hour)")
+        
+        # Daily local incremental snapshot (only changed chunks are stored)
+        application.job_queue.run_repeating(
+            backup_commands.snapshot_job,
+            interval=24 * 60 * 60,
+            first=15 * 60,
+            name='daily_snapshot'
+        )
+        logger.info("✅ Daily incremental snapshots enabled")
+        
+        # Change journal shipping (point-in-time recovery between snapshots)
+        application.job_queue.run_repeating(
+            backup_commands.ship_journal_job,
+            interval=60,
+            first=60,
+            name='change_journal_ship'
+        )
+        logger.info("✅ Change journal shipping enabled (every minute)")
     else:
         logger.warning("⚠️ JobQueue not available, scheduled backups disabled")
     
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Архив смен для панели контролёра
+
+Календарь архива (finmon_archive_calendar: день МСК -> число смен и выручка)
+и день смены в finmon_shifts.archive_day поддерживаются триггерами SQLite при
+закрытии, правке и удалении смены. Навигация год -> месяц -> день читает
+календарь, список смен дня - индекс (archive_day, closed_at) с keyset-
+пагинацией, отчёт по смене - один запрос с чек-листом.
+"""
+
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SHIFTS_PAGE_SIZE = 10
+
+# День смены по МСК - как в прежних запросах архива
+ARCHIVE_DAY_SQL = "DATE({}.closed_at, '+3 hours')"
+
+_installed = set()
+
+
+def ensure_archive_schema(db_path: str) -> bool:
+    """
+    Создать календарь архива, колонку archive_day, индекс и триггеры.
+    Идемпотентно; при первом создании календарь заполняется по истории.
+    False - если в finmon_shifts нет closed_at/total_revenue (старая схема).
+    """
+    if db_path in _installed:
+        return True
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("PRAGMA table_info(finmon_shifts)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if not {'closed_at', 'total_revenue'} <= columns:
+            conn.close()
+            return False
+
+        if 'archive_day' not in columns:
+            cursor.execute("ALTER TABLE finmon_shifts ADD COLUMN archive_day TEXT")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_finmon_shifts_archive_day
+            ON finmon_shifts(archive_day, closed_at)
+        """)
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='finmon_archive_calendar'")
+        calendar_exists = cursor.fetchone() is not None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS finmon_archive_calendar (
+                day TEXT PRIMARY KEY,
+                shifts INTEGER NOT NULL DEFAULT 0,
+                total_revenue REAL NOT NULL DEFAULT 0
+            )
+        """)
+
+        new_day = ARCHIVE_DAY_SQL.format('new')
+        old_day = ARCHIVE_DAY_SQL.format('old')
+        add_new = f"""
+            UPDATE finmon_shifts SET archive_day = {new_day} WHERE id = new.id;
+            INSERT INTO finmon_archive_calendar (day, shifts, total_revenue)
+            SELECT {new_day}, 1, COALESCE(new.total_revenue, 0) WHERE {new_day} IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET
+                shifts = shifts + 1,
+                total_revenue = total_revenue + excluded.total_revenue;
+        """
+        remove_old = f"""
+            UPDATE finmon_archive_calendar
+            SET shifts = shifts - 1, total_revenue = total_revenue - COALESCE(old.total_revenue, 0)
+            WHERE day = {old_day};
+            DELETE FROM finmon_archive_calendar WHERE day = {old_day} AND shifts <= 0;
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS finmon_archive_insert
+            AFTER INSERT ON finmon_shifts BEGIN {add_new} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS finmon_archive_update
+            AFTER UPDATE OF closed_at, total_revenue ON finmon_shifts BEGIN {remove_old} {add_new} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS finmon_archive_delete
+            AFTER DELETE ON finmon_shifts BEGIN {remove_old} END
+        """)
+
+        if not calendar_exists:
+            _rebuild(cursor)
+            logger.info("✅ Archive calendar built from finmon_shifts history")
+
+        conn.commit()
+        conn.close()
+        _installed.add(db_path)
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Failed to install archive calendar: {e}")
+        return False
+
+
+def _rebuild(cursor):
+    """Пересчитать archive_day и календарь по finmon_shifts"""
+    cursor.execute(f"UPDATE finmon_shifts SET archive_day = {ARCHIVE_DAY_SQL.format('finmon_shifts')}")
+    cursor.execute("DELETE FROM finmon_archive_calendar")
+    cursor.execute("""
+        INSERT INTO finmon_archive_calendar (day, shifts, total_revenue)
+        SELECT archive_day, COUNT(*), SUM(COALESCE(total_revenue, 0))
+        FROM finmon_shifts
+        WHERE archive_day IS NOT NULL
+        GROUP BY archive_day
+    """)
+
+
+def rebuild_archive_calendar(db_path: str) -> bool:
+    """Пересобрать календарь (после массовой правки смен в обход SQLite-триггеров)"""
+    if not ensure_archive_schema(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    _rebuild(conn.cursor())
+    conn.commit()
+    conn.close()
+    return True
+
+
+def get_archive_years(db_path: str) -> List[str]:
+    """Годы с закрытыми сменами (по убыванию)"""
+    ensure_archive_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT substr(day, 1, 4) AS year
+        FROM finmon_archive_calendar
+        ORDER BY year DESC
+    """)
+    years = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return years
+
+
+def get_archive_months(db_path: str, year: str) -> List[str]:
+    """Месяцы года с закрытыми сменами ('01'..'12', по убыванию)"""
+    ensure_archive_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT substr(day, 6, 2) AS month
+        FROM finmon_archive_calendar
+        WHERE day >= ? AND day < ?
+        ORDER BY month DESC
+    """, (f"{year}-01-01", f"{int(year) + 1:04d}-01-01"))
+    months = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return months
+
+
+def get_archive_days(db_path: str, year: str, month: str) -> List[str]:
+    """Дни месяца с закрытыми сменами ('01'..'31', по убыванию)"""
+    ensure_archive_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT substr(day, 9, 2)
+        FROM finmon_archive_calendar
+        WHERE day >= ? AND day < ?
+        ORDER BY day DESC
+    """, (f"{year}-{month}-01", f"{year}-{month}-32"))
+    days = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return days
+
+
+def get_archive_shifts(db_path: str, day: str, after_id: Optional[int] = None,
+                       limit: int = SHIFTS_PAGE_SIZE) -> Tuple[List[Dict], bool]:
+    """
+    Страница смен дня в порядке закрытия
+
+    Args:
+        day: 'YYYY-MM-DD' (МСК)
+        after_id: id последней смены предыдущей страницы
+
+    Returns:
+        (смены, есть ли следующая страница)
+    """
+    ensure_archive_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    query = """
+        SELECT f.id, f.club, f.shift_type, f.total_revenue,
+               f.closed_at, ad.full_name, f.admin_id
+        FROM finmon_shifts f
+        LEFT JOIN admins ad ON f.admin_id = ad.user_id
+        WHERE f.archive_day = ?
+    """
+    params = [day]
+    if after_id:
+        query += " AND (f.closed_at, f.id) > (SELECT closed_at, id FROM finmon_shifts WHERE id = ?)"
+        params.append(after_id)
+    query += " ORDER BY f.closed_at, f.id LIMIT ?"
+    params.append(limit + 1)
+
+    cursor.execute(query, params)
+    shifts = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return shifts[:limit], len(shifts) > limit
+
+
+def get_shift_report(db_path: str, shift_id: int) -> Optional[Dict]:
+    """
+    Смена с именем админа и чек-листом приёма - одним запросом
+
+    Чек-лист привязан к active_shifts; смена из finmon_shifts находится по
+    (admin_id, club, opened_at) - opened_at копируется при закрытии смены.
+
+    Returns:
+        Поля смены + 'full_name' + 'checklist': [{'status', 'notes', 'item_name'}]
+    """
+    ensure_archive_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute("""
+                SELECT f.*, ad.full_name,
+                       scr.id AS checklist_id, scr.status AS checklist_status,
+                       scr.notes AS checklist_notes, sci.item_name AS checklist_item
+                FROM finmon_shifts f
+                LEFT JOIN admins ad ON f.admin_id = ad.user_id
+                LEFT JOIN active_shifts s
+                    ON s.admin_id = f.admin_id AND s.club = f.club AND s.opened_at = f.opened_at
+                LEFT JOIN shift_checklist_responses scr ON scr.shift_id = s.id
+                LEFT JOIN shift_checklist_items sci ON scr.item_id = sci.id
+                WHERE f.id = ?
+                ORDER BY scr.id
+            """, (shift_id,))
+        except sqlite3.OperationalError:
+            # Нет таблиц смен/чек-листа - отчёт без чек-листа
+            cursor.execute("""
+                SELECT f.*, ad.full_name
+                FROM finmon_shifts f
+                LEFT JOIN admins ad ON f.admin_id = ad.user_id
+                WHERE f.id = ?
+            """, (shift_id,))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        return None
+
+    checklist_columns = ('checklist_id', 'checklist_status', 'checklist_notes', 'checklist_item')
+    shift = {key: rows[0][key] for key in rows[0].keys() if key not in checklist_columns}
+    shift['checklist'] = [
+        {'status': row['checklist_status'], 'notes': row['checklist_notes'],
+         'item_name': row['checklist_item']}
+        for row in rows
+        if 'checklist_id' in row.keys() and row['checklist_id'] is not None
+        and row['checklist_item'] is not None
+    ]
+    return shift
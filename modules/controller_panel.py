@@ -10,6 +10,10 @@ from datetime import datetime, timezone, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
 
+from modules.controller_archive import (
+    get_archive_days, get_archive_months, get_archive_shifts, get_archive_years, get_shift_report
+)
+
 logger = logging.getLogger(__name__)
 
 # Moscow timezone (UTC+3)
@@ -664,18 +668,8 @@ async def show_archive_years(update: Update, context: ContextTypes.DEFAULT_TYPE)
     db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Получаем все годы, в которых есть закрытые смены
-        cursor.execute("""
-            SELECT DISTINCT strftime('%Y', closed_at, '+3 hours') as year
-            FROM finmon_shifts
-            WHERE closed_at IS NOT NULL
-            ORDER BY year DESC
-        """)
-        years = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        # Годы с закрытыми сменами - из календаря архива
+        years = get_archive_years(db_path)
 
         text = "📂 <b>Архив отчётов</b>\n\n"
         text += "Выберите год:"
@@ -702,19 +696,8 @@ async def show_archive_months(update: Update, context: ContextTypes.DEFAULT_TYPE
     db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Получаем все месяцы в выбранном году
-        cursor.execute("""
-            SELECT DISTINCT strftime('%m', closed_at, '+3 hours') as month
-            FROM finmon_shifts
-            WHERE strftime('%Y', closed_at, '+3 hours') = ?
-            AND closed_at IS NOT NULL
-            ORDER BY month DESC
-        """, (year,))
-        months = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        # Месяцы выбранного года - из календаря архива
+        months = get_archive_months(db_path, year)
 
         month_names = {
             '01': 'Январь', '02': 'Февраль', '03': 'Март', '04': 'Апрель',
@@ -748,20 +731,8 @@ async def show_archive_days(update: Update, context: ContextTypes.DEFAULT_TYPE,
     db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Получаем все дни в выбранном месяце
-        cursor.execute("""
-            SELECT DISTINCT strftime('%d', closed_at, '+3 hours') as day
-            FROM finmon_shifts
-            WHERE strftime('%Y', closed_at, '+3 hours') = ?
-            AND strftime('%m', closed_at, '+3 hours') = ?
-            AND closed_at IS NOT NULL
-            ORDER BY day DESC
-        """, (year, month))
-        days = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        # Дни выбранного месяца - из календаря архива
+        days = get_archive_days(db_path, year, month)
 
         month_names = {
             '01': 'Январь', '02': 'Февраль', '03': 'Март', '04': 'Апрель',
@@ -786,30 +757,18 @@ async def show_archive_days(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await query.edit_message_text(f"❌ Ошибка: {e}", parse_mode='HTML')
 
 
-async def show_archive_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE, year: str, month: str, day: str):
-    """Показать выбор смены для просмотра отчёта"""
+async def show_archive_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE, year: str, month: str, day: str,
+                              after_id: int = None):
+    """Показать выбор смены для просмотра отчёта (страницами, после смены after_id)"""
     query = update.callback_query
     await query.answer()
 
     db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
 
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # Получаем все смены в выбранный день
+        # Смены выбранного дня - страница по индексу (archive_day, closed_at)
         date_str = f"{year}-{month}-{day}"
-        cursor.execute("""
-            SELECT f.id, f.club, f.shift_type, f.total_revenue,
-                   f.closed_at, ad.full_name, f.admin_id
-            FROM finmon_shifts f
-            LEFT JOIN admins ad ON f.admin_id = ad.user_id
-            WHERE DATE(f.closed_at, '+3 hours') = ?
-            ORDER BY f.closed_at
-        """, (date_str,))
-        shifts = cursor.fetchall()
-        conn.close()
+        shifts, has_more = get_archive_shifts(db_path, date_str, after_id=after_id)
 
         text = f"📂 <b>Архив отчётов - {day}.{month}.{year}</b>\n\n"
         text += "Выберите смену для просмотра:"
@@ -824,6 +783,14 @@ async def show_archive_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE
             button_text = f"{shift_emoji} {shift['club']} - {admin_name} ({revenue:,.0f}₽, {closed_time})"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=f"ctrl_shift_{shift['id']}")])
 
+        pages = []
+        if after_id:
+            pages.append(InlineKeyboardButton("⏮ В начало", callback_data=f"ctrl_day_{year}_{month}_{day}"))
+        if has_more:
+            pages.append(InlineKeyboardButton("Далее ▶️", callback_data=f"ctrl_day_{year}_{month}_{day}_{shifts[-1]['id']}"))
+        if pages:
+            keyboard.append(pages)
+
         keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data=f"ctrl_month_{year}_{month}")])
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -842,18 +809,8 @@ async def show_shift_report(update: Update, context: ContextTypes.DEFAULT_TYPE,
     db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
 
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # Получаем данные смены
-        cursor.execute("""
-            SELECT f.*, ad.full_name
-            FROM finmon_shifts f
-            LEFT JOIN admins ad ON f.admin_id = ad.user_id
-            WHERE f.id = ?
-        """, (shift_id,))
-        shift = cursor.fetchone()
+        # Смена, имя админа и чек-лист приёма - одним запросом
+        shift = get_shift_report(db_path, shift_id)
 
         if not shift:
             await query.edit_message_text("❌ Смена не найдена", parse_mode='HTML')
@@ -890,15 +847,7 @@ async def show_shift_report(update: Update, context: ContextTypes.DEFAULT_TYPE,
         if shift['notes']:
             text += f"📝 Примечания: {shift['notes']}\n\n"
 
-        # Получаем чек-лист смены с именами пунктов
-        cursor.execute("""
-            SELECT scr.status, scr.notes, sci.item_name
-            FROM shift_checklist_responses scr
-            JOIN shift_checklist_items sci ON scr.item_id = sci.id
-            WHERE scr.shift_id = ?
-            ORDER BY scr.id
-        """, (shift['active_shift_id'],))
-        checklist_items = cursor.fetchall()
+        checklist_items = shift['checklist']
 
         if checklist_items:
             text += f"✅ <b>Чек-лист приёма смены ({len(checklist_items)} пунктов):</b>\n"
@@ -910,10 +859,11 @@ async def show_shift_report(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 text += "\n"
             text += "\n"
 
-        conn.close()
-
-        # Кнопка назад
-        shift_date_parts = shift_date.strftime('%Y_%m_%d').split('_')
+        # Кнопка назад - к дню смены в архиве
+        if shift.get('archive_day'):
+            shift_date_parts = shift['archive_day'].split('-')
+        else:
+            shift_date_parts = shift_date.strftime('%Y_%m_%d').split('_')
         keyboard = [[InlineKeyboardButton("◀️ Назад к списку смен",
                                           callback_data=f"ctrl_day_{shift_date_parts[0]}_{shift_date_parts[1]}_{shift_date_parts[2]}")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1119,7 +1069,9 @@ async def handle_controller_callback(update: Update, context: ContextTypes.DEFAU
     if data.startswith("ctrl_day_"):
         parts = data.split("_")
         year, month, day = parts[2], parts[3], parts[4]
-        await show_archive_shifts(update, context, year, month, day)
+        # Формат: ctrl_day_{year}_{month}_{day}[_{after_id}]
+        after_id = int(parts[5]) if len(parts) > 5 else None
+        await show_archive_shifts(update, context, year, month, day, after_id)
         return
 
     if data.startswith("ctrl_shift_"):
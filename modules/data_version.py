@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Data Version - штамп версии данных SQLite для кешей
+
+Версия хранится в таблице data_versions (по строке на scope) и увеличивается
+триггерами SQLite при любой записи в отслеживаемые таблицы, поэтому разные
+процессы (бот, WebApp) видят одну и ту же версию без явной синхронизации.
+
+Таблицу и триггеры ставит только бот (install() при старте и после
+миграций); таблицы, созданные после install(), получают триггеры при
+следующем чтении версии в боте. WebApp читает версию через read-only
+подключение (read_only=True) и DDL не выполняет: пока версия неполная,
+current() возвращает None и ответы не кешируются.
+"""
+
+import logging
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, запись в которые меняет результаты аналитики
+VERSIONED_TABLES = (
+    'finmon_shifts',
+    'shift_expenses',
+    'shift_cash_withdrawals',
+    'active_shifts',
+    'admins',
+    'revenue_forecasts',
+)
+
+
+class DataVersion:
+    """Штамп версии данных, общий для бота и WebApp"""
+
+    def __init__(self, db_path: str, scope: str = 'finance',
+                 tables: Iterable[str] = VERSIONED_TABLES, read_only: bool = False):
+        self.db_path = db_path
+        self.scope = scope
+        self.tables = tuple(tables)
+        self.read_only = read_only
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        return sqlite3.connect(self.db_path)
+
+    def _unversioned_tables(self, cursor) -> List[str]:
+        """Отслеживаемые таблицы, которые уже есть в БД, но еще без триггеров версии"""
+        placeholders = ', '.join('?' for _ in self.tables)
+        cursor.execute(f"""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name IN ({placeholders})
+            AND 'trg_' || name || '_insert_' || ? || '_version' NOT IN (
+                SELECT name FROM sqlite_master WHERE type = 'trigger'
+            )
+        """, (*self.tables, self.scope))
+        return [row[0] for row in cursor.fetchall()]
+
+    def install(self) -> bool:
+        """
+        Создать таблицу data_versions и триггеры на существующих таблицах.
+        Идемпотентно: можно вызывать при каждом старте.
+        Если триггеры поставлены на новые таблицы, версия увеличивается:
+        записи в них до установки триггеров версию не меняли.
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    scope TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute(
+                "INSERT OR IGNORE INTO data_versions (scope, version) VALUES (?, 0)",
+                (self.scope,)
+            )
+
+            new_tables = self._unversioned_tables(cursor)
+            for table in new_tables:
+                for event in ('INSERT', 'UPDATE', 'DELETE'):
+                    cursor.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_{self.scope}_version
+                        AFTER {event} ON {table}
+                        BEGIN
+                            UPDATE data_versions
+                            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                            WHERE scope = '{self.scope}';
+                        END
+                    """)
+            if new_tables:
+                cursor.execute(
+                    "UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE scope = ?",
+                    (self.scope,)
+                )
+
+            conn.commit()
+            conn.close()
+            if new_tables:
+                logger.info(f"✅ DataVersion '{self.scope}': триггеры на {', '.join(new_tables)}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Не удалось установить триггеры версии данных: {e}")
+            return False
+
+    def _read_version(self) -> Tuple[Optional[int], bool]:
+        """(версия или None, все ли существующие отслеживаемые таблицы под триггерами)"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM data_versions WHERE scope = ?", (self.scope,))
+            row = cursor.fetchone()
+            if row is None:
+                return None, False
+            return row[0], not self._unversioned_tables(cursor)
+        finally:
+            conn.close()
+
+    def current(self) -> Optional[str]:
+        """
+        Текущая версия данных (строка для ключа кеша) или None, если версии
+        нет или она не покрывает все отслеживаемые таблицы - тогда кешировать
+        нельзя. В режиме записи заодно ставит триггеры на таблицы,
+        появившиеся после install(); в read-only только читает.
+        """
+        try:
+            version, complete = self._read_version()
+            if version is not None and not complete and not self.read_only and self.install():
+                version, complete = self._read_version()
+        except sqlite3.Error as e:
+            logger.debug(f"DataVersion '{self.scope}' недоступна: {e}")
+            return None
+        return f"v{version}" if version is not None and complete else None
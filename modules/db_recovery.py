@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DB Recovery - журнал изменений и восстановление БД на момент времени
+
+Журнал изменений:
+- на таблицы БД ставятся триггеры AFTER INSERT/UPDATE/DELETE, которые пишут
+  полный образ строки (json_object) в change_journal - так изменения
+  ловятся со всех путей записи, без правок в модулях;
+- раз в минуту журнал переносится ("отгружается") в отдельный файл
+  backups/journal/journal.db и удаляется из основной БД, поэтому он
+  переживает потерю основного файла.
+
+Восстановление (restore_to):
+1. Выбирается последний снимок SnapshotStore не позже целевого момента.
+2. БД снимка потоково собирается из чанков в новый файл (sha256 каждого
+   чанка и файла сверяются), число строк сверяется с манифестом снимка.
+3. Поверх накатываются записи журнала от начала снимка до целевого момента,
+   порциями через курсор. Записи - полные образы строк, поэтому повторный
+   накат уже попавших в снимок изменений безопасен (идемпотентен).
+4. PRAGMA integrity_check, затем новый файл переносится в живую БД через
+   backup API одной транзакцией: открытые подключения (в т.ч. WAL у WebApp)
+   видят либо старую, либо новую БД целиком.
+
+Ограничения: DDL (ALTER/CREATE TABLE) в журнал не попадает - после миграций
+нужен свежий снимок (/backup); таблицы WITHOUT ROWID, виртуальные (FTS) и
+их теневые таблицы (<fts>_data, _idx, ...) не журналируются - триггер на
+теневой таблице роняет процесс при записи в FTS5. Индексы FTS после наката
+пересобираются из своих таблиц-источников.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .snapshot_store import SnapshotStore, SnapshotError
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_TABLE = 'change_journal'
+TRIGGER_PREFIX = 'cj_'
+
+# Таблицы с высокой частотой служебных записей, которые не нужно восстанавливать
+JOURNAL_EXCLUDE = {
+    JOURNAL_TABLE,
+    'notification_log',
+    'export_watermarks',
+}
+
+# Суффиксы теневых таблиц виртуальных таблиц (FTS3/4/5, R*Tree) - для SQLite без PRAGMA table_list
+SHADOW_SUFFIXES = ('_data', '_idx', '_content', '_docsize', '_config',
+                   '_segments', '_segdir', '_stat', '_node', '_rowid', '_parent')
+
+SHIP_BATCH = 5000
+REPLAY_BATCH = 2000
+
+# Временная метка в секундах эпохи с долями (unixepoch('subsec') есть только в SQLite 3.42+)
+_NOW_TS = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+class ChangeJournal:
+    """Триггерный журнал изменений с отгрузкой в отдельный файл"""
+
+    def __init__(self, db_path: str = 'knowledge.db', journal_path: str = './backups/journal/journal.db',
+                 exclude: Optional[set] = None):
+        self.db_path = db_path
+        self.journal_path = journal_path
+        self.exclude = set(exclude or JOURNAL_EXCLUDE) | {JOURNAL_TABLE}
+        os.makedirs(os.path.dirname(journal_path) or '.', exist_ok=True)
+        self._ship_lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                tbl TEXT NOT NULL,
+                op TEXT NOT NULL,
+                row_id INTEGER,
+                old_row_id INTEGER,
+                data TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+        conn = sqlite3.connect(self.journal_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                tbl TEXT NOT NULL,
+                op TEXT NOT NULL,
+                row_id INTEGER,
+                old_row_id INTEGER,
+                data TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_changes_ts ON changes(ts)')
+        # Изменения "отмененной" ветки после восстановления на прошлый момент
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS abandoned_changes (
+                seq INTEGER, ts REAL, tbl TEXT, op TEXT, row_id INTEGER,
+                old_row_id INTEGER, data TEXT, abandoned_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS restores (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                restored_at REAL NOT NULL,
+                target_ts REAL NOT NULL,
+                snapshot_id TEXT,
+                replayed INTEGER
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    # ===== Триггеры =====
+
+    @staticmethod
+    def _shadow_tables(conn: sqlite3.Connection) -> set:
+        """Теневые таблицы виртуальных таблиц (FTS5: <name>_data, _idx, _content, _docsize, _config)"""
+        shadow = set()
+        try:
+            shadow = {row[1] for row in conn.execute("PRAGMA table_list") if row[2] == 'shadow'}
+        except sqlite3.OperationalError:
+            pass  # SQLite < 3.37
+        rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall()
+        virtual = [name for name, sql in rows if sql and sql.upper().startswith('CREATE VIRTUAL')]
+        for name, _ in rows:
+            if any(name == vtab + suffix for vtab in virtual for suffix in SHADOW_SUFFIXES):
+                shadow.add(name)
+        return shadow
+    
+    @staticmethod
+    def _journaled_tables(conn: sqlite3.Connection, exclude: set) -> Dict[str, List[str]]:
+        """Таблицы с rowid (обычные), которые можно журналировать: {table: [columns]}"""
+        tables = {}
+        shadow = ChangeJournal._shadow_tables(conn)
+        rows = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for name, sql in rows:
+            if name in exclude or name in shadow or not sql or sql.upper().startswith('CREATE VIRTUAL'):
+                continue
+            if 'WITHOUT ROWID' in sql.upper():
+                continue
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+            if columns:
+                tables[name] = columns
+        return tables
+
+    def install_triggers(self) -> int:
+        """
+        Поставить (пересоздать) триггеры журнала на все таблицы.
+        Пересоздание учитывает колонки, добавленные миграциями.
+
+        Returns:
+            Число журналируемых таблиц
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            tables = self._journaled_tables(conn, self.exclude)
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (TRIGGER_PREFIX + '%',)
+            )}
+            wanted = set()
+            conn.execute('BEGIN IMMEDIATE')
+            for table, columns in tables.items():
+                new_image = ', '.join(f"'{col}', NEW.\"{col}\"" for col in columns)
+                for op, when, body in (
+                    ('I', 'INSERT', f"NEW.rowid, NULL, json_object({new_image})"),
+                    ('U', 'UPDATE', f"NEW.rowid, OLD.rowid, json_object({new_image})"),
+                    ('D', 'DELETE', "NULL, OLD.rowid, NULL"),
+                ):
+                    trigger = f"{TRIGGER_PREFIX}{table}_{op.lower()}"
+                    wanted.add(trigger)
+                    conn.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+                    conn.execute(f'''
+                        CREATE TRIGGER "{trigger}" AFTER {when} ON "{table}"
+                        BEGIN
+                            INSERT INTO {JOURNAL_TABLE} (ts, tbl, op, row_id, old_row_id, data)
+                            VALUES ({_NOW_TS}, '{table}', '{op}', {body});
+                        END
+                    ''')
+            # Триггеры удаленных/исключенных таблиц
+            for trigger in existing - wanted:
+                conn.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return len(tables)
+
+    def ensure_triggers(self) -> int:
+        """
+        Доставить триггеры на таблицы, созданные после запуска (дешевая проверка),
+        и снять лишние - например, поставленные раньше на теневые таблицы FTS
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            tables = self._journaled_tables(conn, self.exclude)
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (TRIGGER_PREFIX + '%',)
+            )}
+        finally:
+            conn.close()
+        missing = [t for t in tables if f"{TRIGGER_PREFIX}{t}_i" not in existing]
+        wanted = {f"{TRIGGER_PREFIX}{t}_{op}" for t in tables for op in ('i', 'u', 'd')}
+        stale = existing - wanted
+        if missing or stale:
+            if missing:
+                logger.info(f"📝 Change journal: новые таблицы {missing}")
+            if stale:
+                logger.info(f"📝 Change journal: снимаются лишние триггеры {sorted(stale)}")
+            self.install_triggers()
+        return len(missing)
+
+    # ===== Отгрузка =====
+
+    def ship(self) -> int:
+        """Перенести записи журнала из основной БД в файл журнала"""
+        shipped = 0
+        with self._ship_lock:
+            src = sqlite3.connect(self.db_path, timeout=30)
+            dst = sqlite3.connect(self.journal_path, timeout=30)
+            try:
+                while True:
+                    rows = src.execute(f'''
+                        SELECT seq, ts, tbl, op, row_id, old_row_id, data FROM {JOURNAL_TABLE}
+                        ORDER BY seq LIMIT ?
+                    ''', (SHIP_BATCH,)).fetchall()
+                    if not rows:
+                        break
+                    # Сначала надежно пишем в файл журнала, потом удаляем из БД
+                    dst.executemany('INSERT OR IGNORE INTO changes VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                    dst.commit()
+                    src.execute(f'DELETE FROM {JOURNAL_TABLE} WHERE seq <= ?', (rows[-1][0],))
+                    src.commit()
+                    shipped += len(rows)
+            finally:
+                dst.close()
+                src.close()
+        if shipped:
+            logger.debug(f"📝 Change journal: отгружено {shipped} записей")
+        return shipped
+
+    def last_seq(self) -> int:
+        conn = sqlite3.connect(self.journal_path)
+        seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+        conn.close()
+        return seq
+
+    def coverage(self) -> Dict:
+        """Диапазон времени, покрытый журналом"""
+        conn = sqlite3.connect(self.journal_path)
+        first, last, count = conn.execute('SELECT MIN(ts), MAX(ts), COUNT(*) FROM changes').fetchone()
+        conn.close()
+        return {'first_ts': first, 'last_ts': last, 'count': count}
+
+    def prune(self, before_ts: float) -> int:
+        """Удалить записи журнала старше before_ts (покрытые самым старым снимком)"""
+        conn = sqlite3.connect(self.journal_path)
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM changes WHERE ts < ?', (before_ts,))
+        removed = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return removed
+
+
+class PointInTimeRecovery:
+    """Восстановление БД из снимка + журнала изменений"""
+
+    def __init__(self, snapshots: SnapshotStore, journal: ChangeJournal):
+        self.snapshots = snapshots
+        self.journal = journal
+        self.db_path = snapshots.db_path
+
+    def choose_snapshot(self, target_ts: float) -> Optional[Dict]:
+        """Последний снимок, начатый не позже target_ts"""
+        for snap in self.snapshots.list_snapshots():
+            created_ts = snap.get('created_ts')
+            if created_ts is None:
+                created_ts = datetime.fromisoformat(snap['created_at']).timestamp()
+            if created_ts <= target_ts:
+                snap['created_ts'] = created_ts
+                return snap
+        return None
+
+    def build(self, target_ts: float, output_path: str) -> Dict:
+        """
+        Собрать БД на момент target_ts в новый файл output_path (живая БД не трогается).
+
+        Returns:
+            Отчет: снимок, число накатанных изменений, сверка строк, integrity
+        """
+        started = time.monotonic()
+        snap = self.choose_snapshot(target_ts)
+        if snap is None:
+            raise SnapshotError("нет снимка раньше указанного момента")
+
+        db_name = next(name for name, info in snap['files'].items() if info['role'] == 'database')
+
+        # 1. Снимок -> новый файл потоково (чанк за чанком, с проверкой sha256)
+        self.snapshots.materialize(snap['id'], db_name, output_path)
+
+        # 2. Сверка числа строк с манифестом
+        expected = snap.get('table_counts') or {}
+        if expected:
+            actual = SnapshotStore.table_counts(output_path)
+            mismatched = {t: (n, actual.get(t)) for t, n in expected.items() if actual.get(t) != n}
+            if mismatched:
+                raise SnapshotError(f"число строк не совпадает со снимком: {mismatched}")
+
+        # 3. Накат журнала
+        replayed, skipped = self._replay(output_path, snap['created_ts'], target_ts)
+
+        # 4. Проверка целостности результата
+        integrity = SnapshotStore.check_integrity(output_path)
+        if integrity != 'ok':
+            raise SnapshotError(f"восстановленная БД не прошла проверку: {integrity}")
+
+        return {
+            'snapshot_id': snap['id'],
+            'snapshot_ts': snap['created_ts'],
+            'target_ts': target_ts,
+            'replayed': replayed,
+            'skipped': skipped,
+            'rows_verified': sum(expected.values()),
+            'table_counts': SnapshotStore.table_counts(output_path),
+            'integrity': integrity,
+            'duration_sec': round(time.monotonic() - started, 2),
+        }
+
+    def _replay(self, db_path: str, from_ts: float, to_ts: float):
+        """Накатить изменения журнала (from_ts, to_ts] на БД db_path порциями"""
+        journal = sqlite3.connect(f"file:{self.journal.journal_path}?mode=ro", uri=True)
+        target = sqlite3.connect(db_path)
+        replayed = 0
+        skipped: Dict[str, int] = {}
+        columns_cache: Dict[str, set] = {}
+        try:
+            # Триггеры журнала в собираемой копии не нужны - иначе накат сам себя журналирует
+            for (trigger,) in target.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (TRIGGER_PREFIX + '%',)
+            ).fetchall():
+                target.execute(f'DROP TRIGGER "{trigger}"')
+            
+            # Теневые таблицы FTS не накатываются (записи могли остаться в старом журнале):
+            # индекс пересобирается после наката
+            shadow = ChangeJournal._shadow_tables(target)
+            
+            cursor = journal.execute('''
+                SELECT tbl, op, row_id, old_row_id, data FROM changes
+                WHERE ts >= ? AND ts <= ? ORDER BY seq
+            ''', (from_ts, to_ts))
+            while True:
+                batch = cursor.fetchmany(REPLAY_BATCH)
+                if not batch:
+                    break
+                for tbl, op, row_id, old_row_id, data in batch:
+                    if tbl not in columns_cache:
+                        columns_cache[tbl] = {row[1] for row in target.execute(f'PRAGMA table_info("{tbl}")')}
+                    known = columns_cache[tbl]
+                    if not known or tbl in shadow:
+                        skipped[tbl] = skipped.get(tbl, 0) + 1
+                        continue
+                    if op == 'D' or (op == 'U' and old_row_id != row_id):
+                        target.execute(f'DELETE FROM "{tbl}" WHERE rowid = ?', (old_row_id,))
+                    if op in ('I', 'U'):
+                        image = {k: v for k, v in json.loads(data or '{}').items() if k in known}
+                        cols = ', '.join(f'"{c}"' for c in image)
+                        marks = ', '.join('?' for _ in image)
+                        target.execute(
+                            f'INSERT OR REPLACE INTO "{tbl}" (rowid, {cols}) VALUES (?, {marks})',
+                            (row_id, *image.values())
+                        )
+                    replayed += 1
+                target.commit()
+            
+            self._rebuild_fts(target)
+        finally:
+            target.close()
+            journal.close()
+        return replayed, skipped
+
+    @staticmethod
+    def _rebuild_fts(conn: sqlite3.Connection):
+        """Пересобрать индексы FTS5 из таблиц-источников (INSERT OR REPLACE наката не вызывает их триггеры удаления)"""
+        rows = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL%'"
+        ).fetchall()
+        for name, sql in rows:
+            if 'FTS5' not in sql.upper():
+                continue
+            try:
+                conn.execute(f'INSERT INTO "{name}"("{name}") VALUES (\'rebuild\')')
+                conn.commit()
+            except sqlite3.Error as e:
+                # Contentless-индекс пересобрать не из чего
+                logger.warning(f"⚠️ FTS {name} не пересобран: {e}")
+    
+    def restore_to(self, target_ts: float) -> Dict:
+        """
+        Восстановить живую БД на момент target_ts (блокирующий вызов).
+        Перед заменой снимается страховочный снимок текущего состояния.
+        """
+        self.journal.ship()
+        work_path = os.path.join(self.snapshots.root, f'.pitr_{int(target_ts)}.db')
+        try:
+            report = self.build(target_ts, work_path)
+
+            # Последовательность журнала не должна начинаться заново после восстановления,
+            # иначе новые seq совпадут с уже отгруженными
+            last_seq = self.journal.last_seq()
+            conn = sqlite3.connect(work_path)
+            conn.execute(f'DELETE FROM {JOURNAL_TABLE}')
+            updated = conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (last_seq, JOURNAL_TABLE))
+            if updated.rowcount == 0:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (JOURNAL_TABLE, last_seq))
+            conn.commit()
+            conn.close()
+
+            safety = self.snapshots.create(label=f'before_pitr_{int(target_ts)}')
+            report['safety_snapshot'] = safety['id']
+
+            # Атомарная замена: backup API пишет всю БД одной транзакцией
+            src = sqlite3.connect(work_path)
+            dst = sqlite3.connect(self.db_path, timeout=60)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+        finally:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+
+        self._archive_abandoned(target_ts, report)
+        self.journal.install_triggers()
+        logger.info(
+            f"♻️ PITR to {datetime.fromtimestamp(target_ts).isoformat()}: snapshot {report['snapshot_id']}, "
+            f"replayed {report['replayed']} changes in {report['duration_sec']} s"
+        )
+        return report
+
+    def _archive_abandoned(self, target_ts: float, report: Dict):
+        """Изменения после целевого момента уходят в abandoned_changes (другая ветка истории)"""
+        conn = sqlite3.connect(self.journal.journal_path)
+        now = time.time()
+        conn.execute('''
+            INSERT INTO abandoned_changes SELECT seq, ts, tbl, op, row_id, old_row_id, data, ?
+            FROM changes WHERE ts > ?
+        ''', (now, target_ts))
+        conn.execute('DELETE FROM changes WHERE ts > ?', (target_ts,))
+        conn.execute('''
+            INSERT INTO restores (restored_at, target_ts, snapshot_id, replayed) VALUES (?, ?, ?, ?)
+        ''', (now, target_ts, report['snapshot_id'], report['replayed']))
+        conn.commit()
+        conn.close()
+
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер восстановления БД на момент времени на синтетической базе
+
+Генерирует базу заданного размера (по умолчанию 1 ГБ: смены, движения
+кассы, проблемы клуба с индексом FTS5), ставит триггеры журнала, снимает
+снимок, делает серию изменений через журнал, запоминает эталон на целевой
+момент и еще одну серию изменений после него. Затем засекает
+PointInTimeRecovery.restore_to и сверяет восстановленную базу с эталоном:
+число строк, контрольные суммы таблиц, integrity_check, целостность FTS.
+
+Запуск:
+    python -m modules.db_recovery_bench --size-mb 1024 --changes 20000 --max-seconds 600
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from modules.db_recovery import ChangeJournal, PointInTimeRecovery
+from modules.snapshot_store import SnapshotStore
+
+CLUBS = ('rio', 'michurinskaya')
+BATCH_ROWS = 50000
+
+SCHEMA = """
+CREATE TABLE finmon_shifts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    club TEXT NOT NULL,
+    admin_id INTEGER,
+    shift_type TEXT,
+    opened_at TIMESTAMP,
+    closed_at TIMESTAMP,
+    total_revenue REAL,
+    cash REAL,
+    card REAL,
+    notes TEXT
+);
+CREATE INDEX idx_bench_shifts_closed ON finmon_shifts(closed_at);
+CREATE TABLE cash_movements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    club TEXT NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT,
+    description TEXT,
+    created_at TIMESTAMP
+);
+CREATE TABLE club_issues (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    club TEXT,
+    description TEXT,
+    search_text TEXT,
+    status TEXT DEFAULT 'active'
+);
+CREATE VIRTUAL TABLE club_issues_fts USING fts5(
+    search_text, content='club_issues', content_rowid='id'
+);
+CREATE TRIGGER club_issues_fts_insert AFTER INSERT ON club_issues BEGIN
+    INSERT INTO club_issues_fts(rowid, search_text) VALUES (new.id, new.search_text);
+END;
+CREATE TRIGGER club_issues_fts_delete AFTER DELETE ON club_issues BEGIN
+    INSERT INTO club_issues_fts(club_issues_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+END;
+CREATE TRIGGER club_issues_fts_update AFTER UPDATE ON club_issues BEGIN
+    INSERT INTO club_issues_fts(club_issues_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+    INSERT INTO club_issues_fts(rowid, search_text) VALUES (new.id, new.search_text);
+END;
+"""
+
+# Порция синтетических строк одним запросом (рекурсивный CTE вместо Python-цикла)
+FILL_SHIFTS = """
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows)
+INSERT INTO finmon_shifts (club, admin_id, shift_type, opened_at, closed_at,
+                           total_revenue, cash, card, notes)
+SELECT CASE i % 2 WHEN 0 THEN 'rio' ELSE 'michurinskaya' END,
+       1000 + abs(random()) % 40,
+       CASE i % 2 WHEN 0 THEN 'morning' ELSE 'evening' END,
+       datetime('2023-01-01', '+' || ((:base + i) / 2) || ' hours'),
+       datetime('2023-01-01', '+' || ((:base + i) / 2 + 12) || ' hours'),
+       abs(random()) % 200000 / 1.0, abs(random()) % 60000 / 1.0, abs(random()) % 140000 / 1.0,
+       'Смена прошла штатно, замечаний нет. ' || hex(randomblob(60))
+FROM n
+"""
+
+FILL_MOVEMENTS = """
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows)
+INSERT INTO cash_movements (club, amount, category, description, created_at)
+SELECT CASE i % 2 WHEN 0 THEN 'rio' ELSE 'michurinskaya' END,
+       (abs(random()) % 20000 - 10000) / 1.0,
+       CASE i % 4 WHEN 0 THEN 'salary' WHEN 1 THEN 'supplies' WHEN 2 THEN 'revenue' ELSE 'other' END,
+       'Движение по кассе ' || hex(randomblob(40)),
+       datetime('2023-01-01', '+' || ((:base + i) / 4) || ' minutes')
+FROM n
+"""
+
+WORDS = ('компьютер', 'монитор', 'клавиатура', 'не', 'работает', 'сломан', 'шум', 'кондиционер',
+         'сеть', 'пропадает', 'мышь', 'наушники', 'стул', 'протекает', 'свет', 'роутер')
+
+
+def generate(db_path: str, size_mb: int, seed: int) -> Dict[str, int]:
+    """Синтетическая база не меньше size_mb мегабайт"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    rnd = random.Random(seed)
+    issues = []
+    for _ in range(5000):
+        text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 10)))
+        issues.append((rnd.choice(CLUBS), text, text))
+    conn.executemany('INSERT INTO club_issues (club, description, search_text) VALUES (?, ?, ?)', issues)
+    conn.commit()
+
+    target = size_mb * 1048576
+    base = 0
+    while _db_size(conn) < target:
+        conn.execute(FILL_SHIFTS, {'rows': BATCH_ROWS, 'base': base})
+        conn.execute(FILL_MOVEMENTS, {'rows': BATCH_ROWS * 2, 'base': base * 2})
+        conn.commit()
+        base += BATCH_ROWS
+        if base % (BATCH_ROWS * 20) == 0:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return SnapshotStore.table_counts(db_path)
+
+
+def _db_size(conn: sqlite3.Connection) -> int:
+    """Размер базы с учетом страниц, еще лежащих в WAL"""
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+def apply_changes(db_path: str, count: int, seed: int):
+    """Смесь вставок, правок и удалений через обычные пути записи (ловятся триггерами журнала)"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path, timeout=30)
+    max_shift = conn.execute('SELECT MAX(id) FROM finmon_shifts').fetchone()[0]
+    max_movement = conn.execute('SELECT MAX(id) FROM cash_movements').fetchone()[0]
+    max_issue = conn.execute('SELECT MAX(id) FROM club_issues').fetchone()[0]
+    for n in range(count):
+        kind = rnd.random()
+        if kind < 0.35:
+            conn.execute('UPDATE finmon_shifts SET total_revenue = ?, notes = ? WHERE id = ?',
+                         (rnd.randint(0, 200000), f'исправлено #{n}', rnd.randint(1, max_shift)))
+        elif kind < 0.6:
+            conn.execute('INSERT INTO cash_movements (club, amount, category, description, created_at) '
+                         'VALUES (?, ?, ?, ?, datetime(\'now\'))',
+                         (rnd.choice(CLUBS), rnd.randint(-5000, 5000), 'other', f'движение #{n}'))
+        elif kind < 0.75:
+            conn.execute('DELETE FROM cash_movements WHERE id = ?', (rnd.randint(1, max_movement),))
+        elif kind < 0.9:
+            text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 10)))
+            conn.execute('UPDATE club_issues SET description = ?, search_text = ? WHERE id = ?',
+                         (text, text, rnd.randint(1, max_issue)))
+        else:
+            text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 10)))
+            conn.execute('INSERT INTO club_issues (club, description, search_text) VALUES (?, ?, ?)',
+                         (rnd.choice(CLUBS), text, text))
+        if n % 500 == 499:
+            conn.commit()
+    conn.commit()
+    conn.close()
+
+
+def fingerprint(db_path: str) -> Dict:
+    """Число строк и контрольные суммы по таблицам (для сверки восстановленной базы)"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return {
+            'finmon_shifts': conn.execute(
+                'SELECT COUNT(*), TOTAL(id), TOTAL(total_revenue), TOTAL(length(notes)) FROM finmon_shifts'
+            ).fetchone(),
+            'cash_movements': conn.execute(
+                'SELECT COUNT(*), TOTAL(id), TOTAL(amount), TOTAL(length(description)) FROM cash_movements'
+            ).fetchone(),
+            'club_issues': conn.execute(
+                'SELECT COUNT(*), TOTAL(id), TOTAL(length(search_text)) FROM club_issues'
+            ).fetchone(),
+            'fts_matches': conn.execute(
+                "SELECT COUNT(*) FROM club_issues_fts WHERE club_issues_fts MATCH 'монитор'"
+            ).fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def _timed(label: str, func, *args):
+    started = time.monotonic()
+    result = func(*args)
+    elapsed = time.monotonic() - started
+    print(f"{label:<28} {elapsed:8.1f} с")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер PITR на синтетической базе')
+    parser.add_argument('--size-mb', type=int, default=1024, help='размер синтетической базы, МБ')
+    parser.add_argument('--changes', type=int, default=20000, help='изменений между снимком и целевым моментом')
+    parser.add_argument('--after', type=int, default=5000, help='изменений после целевого момента (откатываются)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='каталог для базы и снимков (по умолчанию временный)')
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+    parser.add_argument('--max-seconds', type=float, help='порог времени восстановления (код выхода 1 при превышении)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pitr_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, 'knowledge.db')
+    try:
+        counts, _ = _timed('генерация базы', generate, db_path, args.size_mb, args.seed)
+        print(f"  {os.path.getsize(db_path) / 1048576:.0f} МБ, строк: {counts}")
+
+        journal = ChangeJournal(db_path, os.path.join(workdir, 'journal', 'journal.db'))
+        journal.install_triggers()
+        store = SnapshotStore(os.path.join(workdir, 'snapshots'), db_path, data_files=())
+        snap, _ = _timed('снимок', store.create, 'bench')
+        print(f"  сжато {snap['new_bytes'] / 1048576:.0f} МБ ({snap['codec']})")
+
+        _timed(f'{args.changes} изменений', apply_changes, db_path, args.changes, args.seed + 1)
+        journal.ship()
+        time.sleep(0.05)
+        target_ts = time.time()
+        expected = fingerprint(db_path)
+        time.sleep(0.05)
+        apply_changes(db_path, args.after, args.seed + 2)
+        journal.ship()
+        if fingerprint(db_path) == expected:
+            print('⚠️ изменения после целевого момента не изменили контрольные суммы')
+
+        pitr = PointInTimeRecovery(store, journal)
+        report, elapsed = _timed('restore_to', pitr.restore_to, target_ts)
+        print(f"  сборка {report['duration_sec']} с, накатано {report['replayed']}, "
+              f"пропущено {report['skipped']}, integrity {report['integrity']}")
+
+        actual = fingerprint(db_path)
+        ok = actual == expected
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("INSERT INTO club_issues_fts(club_issues_fts) VALUES ('integrity-check')")
+        except sqlite3.DatabaseError as e:
+            print(f"❌ FTS integrity-check: {e}")
+            ok = False
+        finally:
+            conn.close()
+
+        if not ok:
+            print(f"❌ база не совпала с эталоном:\n  ожидалось {expected}\n  получено  {actual}")
+        elif args.max_seconds is not None and elapsed > args.max_seconds:
+            print(f"❌ восстановление {elapsed:.1f} с дольше порога {args.max_seconds} с")
+            ok = False
+        else:
+            print('✅ восстановленная база совпала с эталоном')
+        return 0 if ok else 1
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+Персистентная очередь дедлайнов и событийный планировщик
+Автор: Club Assistant Bot
+
+Вместо периодического опроса таблиц каждые N минут дедлайны
+рассчитываются в момент события (открытие/закрытие смены) и
+сохраняются в таблицу shift_deadlines с индексом по due_at.
+Планировщик спит ровно до ближайшего дедлайна (или до появления
+более раннего), атомарно «забирает» наступившие записи и
+передает их обработчикам.
+
+Гарантии:
+- Переживает перезапуск: просроченные за время простоя дедлайны
+  срабатывают сразу после старта (catch-up), зависшие захваты
+  возвращаются в очередь по истечении аренды - при старте и затем
+  каждые RECOVER_INTERVAL_SECONDS (захват мог бросить другой процесс).
+- Каждая запись выдается ровно одному обработчику: захват - это
+  UPDATE ... WHERE status = 'pending' внутри BEGIN IMMEDIATE.
+  Запись помечается выполненной после успешной обработки.
+
+Время - unix timestamp (секунды, UTC). Часы и функция сна
+передаются в конструктор, что позволяет гонять планировщик на
+виртуальных часах.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_CLAIMED = 'claimed'
+STATUS_DONE = 'done'
+STATUS_CANCELLED = 'cancelled'
+STATUS_FAILED = 'failed'
+
+# Сколько держится захват до возврата в очередь (обработчик упал вместе с процессом)
+CLAIM_LEASE_SECONDS = 300
+
+# Повторы при ошибке обработчика
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 60
+
+# Максимальный сон планировщика (страховка от пропущенного пробуждения)
+MAX_SLEEP_SECONDS = 600
+
+# Как часто планировщик возвращает в очередь брошенные захваты
+RECOVER_INTERVAL_SECONDS = 60
+
+
+class DeadlineQueue:
+    """Хранилище дедлайнов в SQLite"""
+
+    def __init__(self, db_path: str = 'club_assistant.db', clock: Callable[[], float] = time.time):
+        self.db_path = db_path
+        self.clock = clock
+        self._listeners: List[Callable[[float], None]] = []
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shift_deadlines (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    shift_id INTEGER,
+                    club TEXT,
+                    due_at REAL NOT NULL,
+                    payload TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claim_token TEXT,
+                    claimed_at REAL,
+                    fired_at REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    UNIQUE (kind, shift_id)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_shift_deadlines_due
+                ON shift_deadlines(due_at) WHERE status = 'pending'
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_shift_deadlines_shift
+                ON shift_deadlines(shift_id, status)
+            """)
+        finally:
+            conn.close()
+
+    # ===== ПОДПИСКА НА НОВЫЕ ДЕДЛАЙНЫ =====
+
+    def add_listener(self, callback: Callable[[float], None]):
+        """callback(due_at) вызывается после добавления дедлайна (пробуждение планировщика)"""
+        self._listeners.append(callback)
+
+    def _notify(self, due_at: float):
+        for callback in list(self._listeners):
+            try:
+                callback(due_at)
+            except Exception as e:
+                logger.error(f"❌ Ошибка подписчика очереди дедлайнов: {e}")
+
+    # ===== ЗАПИСЬ =====
+
+    def schedule(self, kind: str, due_at: float, shift_id: Optional[int] = None,
+                 club: Optional[str] = None, payload: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Запланировать дедлайн. Повторное планирование того же (kind, shift_id)
+        игнорируется - дедлайн уникален.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO shift_deadlines (kind, shift_id, club, due_at, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (kind, shift_id, club, due_at,
+                  json.dumps(payload, ensure_ascii=False) if payload else None, self.clock()))
+            created = cursor.rowcount > 0
+        finally:
+            conn.close()
+
+        if created:
+            self._notify(due_at)
+        return created
+
+    def cancel(self, shift_id: Optional[int] = None, kinds: Optional[List[str]] = None,
+               club: Optional[str] = None) -> int:
+        """Отменить ожидающие дедлайны смены и/или клуба (опционально - только указанных типов)"""
+        where = ["status = 'pending'"]
+        params: List[Any] = []
+        if shift_id is not None:
+            where.append("shift_id = ?")
+            params.append(shift_id)
+        if club is not None:
+            where.append("club = ?")
+            params.append(club)
+        if kinds:
+            where.append(f"kind IN ({', '.join('?' for _ in kinds)})")
+            params.extend(kinds)
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE shift_deadlines SET status = 'cancelled' WHERE {' AND '.join(where)}",
+                params
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    # ===== ЗАХВАТ И ЗАВЕРШЕНИЕ =====
+
+    def next_due_at(self) -> Optional[float]:
+        """Время ближайшего ожидающего дедлайна"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT MIN(due_at) FROM shift_deadlines WHERE status = 'pending'"
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def claim_due(self, limit: int = 50) -> List[Dict]:
+        """Атомарно захватить наступившие дедлайны"""
+        now = self.clock()
+        token = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                UPDATE shift_deadlines
+                SET status = 'claimed', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM shift_deadlines
+                    WHERE status = 'pending' AND due_at <= ?
+                    ORDER BY due_at
+                    LIMIT ?
+                )
+            """, (token, now, now, limit))
+            rows = conn.execute("""
+                SELECT * FROM shift_deadlines WHERE claim_token = ? AND status = 'claimed'
+                ORDER BY due_at
+            """, (token,)).fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        result = []
+        for row in rows:
+            item = dict(row)
+            item['payload'] = json.loads(item['payload']) if item['payload'] else {}
+            result.append(item)
+        return result
+
+    def complete(self, deadline_id: int, claim_token: str) -> bool:
+        """Пометить захваченный дедлайн выполненным"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                UPDATE shift_deadlines SET status = 'done', fired_at = ?
+                WHERE id = ? AND claim_token = ? AND status = 'claimed'
+            """, (self.clock(), deadline_id, claim_token))
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def fail(self, deadline_id: int, claim_token: str, error: str) -> bool:
+        """Вернуть дедлайн в очередь с задержкой (или окончательно провалить после MAX_ATTEMPTS)"""
+        now = self.clock()
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                UPDATE shift_deadlines
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    due_at = ? + ? * attempts,
+                    claim_token = NULL,
+                    last_error = ?
+                WHERE id = ? AND claim_token = ? AND status = 'claimed'
+            """, (MAX_ATTEMPTS, now, RETRY_BACKOFF_SECONDS, error[:500], deadline_id, claim_token))
+            retried = cursor.rowcount > 0
+        finally:
+            conn.close()
+
+        if retried:
+            self._notify(now + RETRY_BACKOFF_SECONDS)
+        return retried
+
+    def recover_stale(self, lease_seconds: float = CLAIM_LEASE_SECONDS) -> int:
+        """Вернуть в очередь захваты, брошенные упавшим процессом"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                UPDATE shift_deadlines
+                SET status = 'pending', claim_token = NULL
+                WHERE status = 'claimed' AND claimed_at < ?
+            """, (self.clock() - lease_seconds,))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def get_pending(self, shift_id: Optional[int] = None) -> List[Dict]:
+        """Ожидающие дедлайны (для отладки и панели)"""
+        conn = self._connect()
+        try:
+            if shift_id is not None:
+                rows = conn.execute("""
+                    SELECT * FROM shift_deadlines WHERE status = 'pending' AND shift_id = ?
+                    ORDER BY due_at
+                """, (shift_id,)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM shift_deadlines WHERE status = 'pending' ORDER BY due_at"
+                ).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+
+_queues: Dict[str, DeadlineQueue] = {}
+
+
+def get_deadline_queue(db_path: str) -> DeadlineQueue:
+    """
+    Общий экземпляр очереди для БД: хуки открытия/закрытия смен и
+    планировщик должны видеть одни и те же подписки на пробуждение
+    """
+    queue = _queues.get(db_path)
+    if queue is None:
+        queue = DeadlineQueue(db_path)
+        _queues[db_path] = queue
+    return queue
+
+
+Handler = Callable[[Dict], Awaitable[None]]
+
+
+class DeadlineScheduler:
+    """Единый планировщик: спит до ближайшего дедлайна и вызывает обработчики по kind"""
+
+    def __init__(self, queue: DeadlineQueue, handlers: Dict[str, Handler],
+                 sleep: Optional[Callable[[float], Awaitable[None]]] = None,
+                 max_sleep: float = MAX_SLEEP_SECONDS,
+                 recover_interval: float = RECOVER_INTERVAL_SECONDS):
+        self.queue = queue
+        self.handlers = handlers
+        self.max_sleep = max_sleep
+        self.recover_interval = recover_interval
+        self._next_recover_at = 0.0
+        self._sleep = sleep
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped = False
+        queue.add_listener(self._on_new_deadline)
+
+    def _on_new_deadline(self, due_at: float):
+        """Разбудить планировщик, если новый дедлайн может быть раньше текущего сна"""
+        if self._wakeup is None or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run_once(self) -> int:
+        """Обработать все наступившие дедлайны; вернуть число обработанных"""
+        processed = 0
+        while True:
+            batch = self.queue.claim_due()
+            if not batch:
+                return processed
+            for item in batch:
+                await self._dispatch(item)
+                processed += 1
+
+    async def _dispatch(self, item: Dict):
+        handler = self.handlers.get(item['kind'])
+        if handler is None:
+            logger.warning(f"⚠️ Нет обработчика для дедлайна {item['kind']}, #{item['id']} снят с очереди")
+            self.queue.complete(item['id'], item['claim_token'])
+            return
+        try:
+            await handler(item)
+            self.queue.complete(item['id'], item['claim_token'])
+        except Exception as e:
+            self.queue.fail(item['id'], item['claim_token'], str(e))
+            if item['attempts'] >= MAX_ATTEMPTS:
+                logger.error(f"❌ Дедлайн #{item['id']} ({item['kind']}) не выполнен после "
+                             f"{item['attempts']} попыток, отказ: {e}")
+            else:
+                logger.warning(f"⚠️ Дедлайн #{item['id']} ({item['kind']}) не выполнен (попытка "
+                               f"{item['attempts']}), повтор через {RETRY_BACKOFF_SECONDS * item['attempts']:.0f} с: {e}")
+
+    def recover_stale(self) -> int:
+        """Вернуть в очередь брошенные захваты, если подошло время проверки"""
+        now = self.queue.clock()
+        if now < self._next_recover_at:
+            return 0
+        self._next_recover_at = now + self.recover_interval
+        recovered = self.queue.recover_stale()
+        if recovered:
+            logger.info(f"⏰ Возвращено в очередь брошенных захватов дедлайнов: {recovered}")
+        return recovered
+
+    def seconds_until_next(self) -> float:
+        now = self.queue.clock()
+        # Проснуться не позже следующей проверки брошенных захватов
+        limit = min(self.max_sleep, max(0.0, self._next_recover_at - now))
+        next_due = self.queue.next_due_at()
+        if next_due is None:
+            return limit
+        return max(0.0, min(limit, next_due - now))
+
+    async def _wait(self, timeout: float):
+        if self._sleep is not None:
+            await self._sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """Основной цикл (запускается как фоновая задача)"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+        self._next_recover_at = 0.0
+
+        logger.info("⏰ Планировщик дедлайнов запущен")
+        while not self._stopped:
+            try:
+                self.recover_stale()
+                # Catch-up: все, что наступило (в т.ч. за время простоя), обрабатывается сразу
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка планировщика дедлайнов: {e}")
+
+            self._wakeup.clear()
+            delay = self.seconds_until_next()
+            if delay > 0:
+                await self._wait(delay)
+
+    def stop(self):
+        self._stopped = True
+        if self._wakeup is not None:
+            self._on_new_deadline(0)
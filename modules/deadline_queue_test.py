@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверки очереди дедлайнов и планировщика на виртуальных часах
+
+Часы и сон планировщика подменяются: сон мгновенно переводит часы вперед,
+поэтому часы работы планировщика проходят за миллисекунды, а момент
+срабатывания проверяется точно.
+
+Запуск:
+    python -m modules.deadline_queue_test
+    python -m pytest modules/deadline_queue_test.py
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+from modules import deadline_queue
+from modules.deadline_queue import (CLAIM_LEASE_SECONDS, MAX_ATTEMPTS, RETRY_BACKOFF_SECONDS,
+                                    DeadlineQueue, DeadlineScheduler)
+
+START = 1_750_000_000.0
+
+
+class VirtualClock:
+    """Часы, которые двигает только сон планировщика"""
+
+    def __init__(self, now: float = START):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def _db_path() -> str:
+    return os.path.join(tempfile.mkdtemp(prefix='deadlines_'), 'test.db')
+
+
+def _run_until(scheduler: DeadlineScheduler, clock: VirtualClock, until: float):
+    """Крутить планировщик, пока виртуальные часы не дойдут до until"""
+    async def sleep(seconds: float):
+        await clock.sleep(seconds)
+        if clock.now >= until:
+            scheduler.stop()
+
+    scheduler._sleep = sleep
+    asyncio.run(asyncio.wait_for(scheduler.run(), timeout=10))
+
+
+def _recorder(fired: list, clock: VirtualClock):
+    async def handler(item):
+        fired.append((item['kind'], item['shift_id'], clock.now))
+    return handler
+
+
+def test_fires_exactly_at_due_time():
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    fired = []
+    scheduler = DeadlineScheduler(queue, {'a': _recorder(fired, clock), 'b': _recorder(fired, clock)})
+    queue.schedule('a', START + 1800, shift_id=1)
+    queue.schedule('b', START + 7200, shift_id=1)
+
+    _run_until(scheduler, clock, START + 3 * 3600)
+
+    assert fired == [('a', 1, START + 1800), ('b', 1, START + 7200)]
+    assert queue.get_pending() == []
+
+
+def test_schedule_is_unique_per_shift():
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    assert queue.schedule('a', START + 60, shift_id=1)
+    assert not queue.schedule('a', START + 120, shift_id=1)
+    assert [item['due_at'] for item in queue.get_pending()] == [START + 60]
+
+
+def test_cancelled_deadline_does_not_fire():
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    fired = []
+    scheduler = DeadlineScheduler(queue, {'a': _recorder(fired, clock)})
+    queue.schedule('a', START + 600, shift_id=1, club='rio')
+    queue.schedule('a', START + 600, shift_id=2, club='sever')
+    assert queue.cancel(shift_id=1) == 1
+
+    _run_until(scheduler, clock, START + 3600)
+
+    assert fired == [('a', 2, START + 600)]
+
+
+def test_catch_up_after_downtime():
+    """Дедлайны, наступившие пока бот лежал, срабатывают сразу после старта"""
+    clock = VirtualClock()
+    path = _db_path()
+    DeadlineQueue(path, clock=clock).schedule('a', START + 60, shift_id=1)
+
+    clock.now = START + 5 * 3600
+    queue = DeadlineQueue(path, clock=clock)
+    fired = []
+    scheduler = DeadlineScheduler(queue, {'a': _recorder(fired, clock)})
+    _run_until(scheduler, clock, START + 6 * 3600)
+
+    assert fired == [('a', 1, START + 5 * 3600)]
+
+
+def test_claim_is_exactly_once():
+    clock = VirtualClock()
+    path = _db_path()
+    first, second = DeadlineQueue(path, clock=clock), DeadlineQueue(path, clock=clock)
+    for shift_id in range(20):
+        first.schedule('a', START - shift_id, shift_id=shift_id)
+
+    claimed = first.claim_due(limit=7) + second.claim_due() + first.claim_due()
+
+    ids = [item['id'] for item in claimed]
+    assert len(ids) == 20 and len(set(ids)) == 20
+    assert second.claim_due() == []
+
+
+def test_failed_handler_is_retried_with_backoff():
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    calls = []
+
+    async def flaky(item):
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise RuntimeError('telegram недоступен')
+
+    scheduler = DeadlineScheduler(queue, {'a': flaky})
+    queue.schedule('a', START + 10, shift_id=1)
+    _run_until(scheduler, clock, START + 3600)
+
+    # Повтор через RETRY_BACKOFF_SECONDS * номер попытки
+    assert calls == [START + 10, START + 10 + RETRY_BACKOFF_SECONDS, START + 10 + 3 * RETRY_BACKOFF_SECONDS]
+    conn = sqlite3.connect(queue.db_path)
+    assert conn.execute('SELECT status, attempts FROM shift_deadlines').fetchone() == ('done', 3)
+    conn.close()
+
+
+def test_gives_up_after_max_attempts():
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    calls = []
+
+    async def broken(item):
+        calls.append(clock.now)
+        raise RuntimeError('boom')
+
+    scheduler = DeadlineScheduler(queue, {'a': broken})
+    queue.schedule('a', START, shift_id=1)
+    _run_until(scheduler, clock, START + 24 * 3600)
+
+    assert len(calls) == MAX_ATTEMPTS
+    conn = sqlite3.connect(queue.db_path)
+    assert conn.execute('SELECT status FROM shift_deadlines').fetchone() == ('failed',)
+    conn.close()
+
+
+def test_stale_claim_recovered_while_running():
+    """Захват, брошенный другим процессом, возвращается в очередь без перезапуска планировщика"""
+    clock = VirtualClock()
+    path = _db_path()
+    queue = DeadlineQueue(path, clock=clock)
+    fired = []
+    scheduler = DeadlineScheduler(queue, {'a': _recorder(fired, clock)}, recover_interval=60)
+    queue.schedule('a', START + 3600, shift_id=1)
+
+    async def crash_worker_then_run():
+        # Другой процесс захватит дедлайн в момент наступления и упадет
+        async def sleep(seconds: float):
+            await clock.sleep(seconds)
+            if clock.now >= START + 3600 and not getattr(sleep, 'stolen', False):
+                sleep.stolen = True
+                assert len(DeadlineQueue(path, clock=clock).claim_due()) == 1
+            if clock.now >= START + 4 * 3600:
+                scheduler.stop()
+        scheduler._sleep = sleep
+        await scheduler.run()
+
+    asyncio.run(asyncio.wait_for(crash_worker_then_run(), timeout=10))
+
+    assert len(fired) == 1
+    fired_at = fired[0][2]
+    assert START + 3600 + CLAIM_LEASE_SECONDS <= fired_at <= START + 3600 + CLAIM_LEASE_SECONDS + 60
+
+
+def test_sleeps_until_next_deadline():
+    """Без дедлайнов планировщик спит не дольше проверки захватов, с дедлайном - ровно до него"""
+    clock = VirtualClock()
+    queue = DeadlineQueue(_db_path(), clock=clock)
+    scheduler = DeadlineScheduler(queue, {'a': _recorder([], clock)}, recover_interval=60)
+    queue.schedule('a', START + 25, shift_id=1)
+    _run_until(scheduler, clock, START + 200)
+
+    assert clock.sleeps[0] == 25
+    assert max(clock.sleeps) <= 60
+
+
+def test_backfill_reads_naive_opened_at_as_utc():
+    """opened_at пишет CURRENT_TIMESTAMP SQLite: время без зоны в UTC"""
+    from modules import shift_reminders
+
+    clock = VirtualClock()
+    path = _db_path()
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE active_shifts (
+            id INTEGER PRIMARY KEY, admin_id INTEGER, club TEXT, status TEXT,
+            opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Такое же значение, какое CURRENT_TIMESTAMP дал бы за 10 минут до START
+    conn.execute("INSERT INTO active_shifts (id, admin_id, club, status, opened_at) "
+                 "VALUES (7, 100, 'rio', 'open', datetime(?, 'unixepoch'))", (START - 600,))
+    conn.commit()
+    conn.close()
+
+    deadline_queue._queues[path] = DeadlineQueue(path, clock=clock)
+    try:
+        assert shift_reminders.backfill_open_shift_deadlines(path, now=START) == 1
+        pending = {item['kind']: item['due_at'] for item in deadline_queue._queues[path].get_pending()}
+    finally:
+        deadline_queue._queues.pop(path, None)
+
+    for kind, offset in shift_reminders.OPEN_SHIFT_DEADLINES:
+        assert pending[kind] == START - 600 + offset.total_seconds()
+
+
+def main() -> int:
+    tests = [(name, func) for name, func in sorted(globals().items())
+             if name.startswith('test_') and callable(func)]
+    failed = 0
+    for name, func in tests:
+        try:
+            func()
+            print(f"✅ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {name}: {type(e).__name__}: {e}")
+    print(f"{len(tests) - failed}/{len(tests)} passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,8 +17,31 @@ from typing import Dict, List, Tuple, Optional
 from collections import defaultdict
 import json
 
+from modules.salary_engine import get_salary_engine
+
 logger = logging.getLogger(__name__)
 
+# Сколько секунд начисления из Google Sheets считаются актуальными
+SHEETS_SALARY_TTL = 300
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Критические значения t-распределения (двусторонний 95%) для df = 1..30
+_T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+]
+
+
+def _t_critical_95(df: int) -> float:
+    """Критическое значение t для 95% доверительного интервала"""
+    if df < 1:
+        return 0.0
+    if df <= len(_T_CRITICAL_95):
+        return _T_CRITICAL_95[df - 1]
+    return 1.96
+
 
 class FinanceAnalytics:
     """Модуль финансовой аналитики"""
@@ -26,6 +49,7 @@ class FinanceAnalytics:
     def __init__(self, db_path: str = "club_assistant.db", sheets_parser=None):
         self.db_path = db_path
         self.sheets_parser = sheets_parser
+        self.salary_engine = get_salary_engine(db_path)
         logger.info("✅ FinanceAnalytics инициализирован")
 
     def _get_db(self):
@@ -319,6 +343,17 @@ class FinanceAnalytics:
             return None
 
     def calculate_net_salaries(self) -> Dict[int, Dict]:
+        """
+        Чистые зарплаты за текущий месяц (см. _calculate_net_salaries).
+        
+        Кэшируются в SalaryEngine до записи в таблицы зарплат; начисления
+        из Sheets меняются вне БД, поэтому не дольше SHEETS_SALARY_TTL.
+        """
+        start_of_month = datetime.now().replace(day=1).strftime("%Y-%m-%d")
+        return self.salary_engine.cached(('net_salaries', start_of_month),
+                                         self._calculate_net_salaries, ttl=SHEETS_SALARY_TTL)
+    
+    def _calculate_net_salaries(self) -> Dict[int, Dict]:
         """
         Рассчитать чистые зарплаты с учетом выплат из кассы
 
@@ -394,28 +429,28 @@ class FinanceAnalytics:
 
         Показывает:
         - В какие дни недели каждый админ работает лучше
-        - Средняя выручка по дням недели
-        - Корреляция дня недели и эффективности
+        - Среднюю, медианную выручку, стандартное отклонение и 95% ДИ
+        - Те же показатели в разрезе клубов (админ × день недели × клуб)
+
+        День недели считается в SQL (strftime('%w')), статистика по группам -
+        одним векторизованным проходом NumPy по колонкам выручки.
 
         Возвращает:
         {
             admin_id: {
-                'name': 'Имя',
                 'by_weekday': {
-                    'Monday': {'shifts': 5, 'avg_revenue': 50000},
-                    'Tuesday': {'shifts': 3, 'avg_revenue': 45000},
+                    'Monday': {'shifts': 5, 'total_revenue': 250000, 'avg_revenue': 50000,
+                               'median_revenue': 48000, 'std_revenue': 7000,
+                               'ci_low': 41300, 'ci_high': 58700},
                     ...
                 },
+                'by_club': {'Рио': {'Monday': {...}, ...}},
                 'best_day': 'Friday',
                 'worst_day': 'Monday'
             }
         }
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Параметры фильтрации
-        where_clauses = ["status = 'closed'"]
+        where_clauses = ["closed_at IS NOT NULL", "opened_at IS NOT NULL"]
         params = []
 
         if start_date:
@@ -430,79 +465,134 @@ class FinanceAnalytics:
             where_clauses.append("club = ?")
             params.append(club)
 
-        where_sql = " AND ".join(where_clauses)
-
-        # Получить все закрытые смены с датами
+        # strftime('%w'): 0 = воскресенье; приводим к 0 = понедельник
         query = f"""
         SELECT
-            id as shift_id,
             admin_id,
-            club,
-            opened_at,
-            closed_at
+            COALESCE(club, 'Неизвестно'),
+            (CAST(strftime('%w', opened_at) AS INTEGER) + 6) % 7 as weekday,
+            COALESCE(total_revenue, 0)
         FROM finmon_shifts
-        WHERE closed_at IS NOT NULL AND {where_sql}
+        WHERE {" AND ".join(where_clauses)}
         """
 
-        cursor.execute(query, params)
-        shifts = cursor.fetchall()
-
-        # Группировать по администраторам и дням недели
-        admin_performance = defaultdict(lambda: defaultdict(list))
-
-        weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
 
-        for shift in shifts:
-            shift_id, admin_id, club_name, opened_at, closed_at = shift
+        rows = [row for row in rows if row[0] is not None and row[2] is not None]
+        if not rows:
+            logger.info("📊 Нет смен для анализа эффективности")
+            return {}
 
-            # Определить день недели (0 = Monday, 6 = Sunday)
-            opened_dt = datetime.fromisoformat(opened_at)
-            weekday = weekdays[opened_dt.weekday()]
+        import numpy as np
 
-            # TODO: Получить выручку смены (когда будет реализована)
-            # Сейчас используем заглушку
-            revenue = 0
+        admin_col, club_col, weekday_col, revenue_col = zip(*rows)
+        admins = np.asarray(admin_col, dtype=np.int64)
+        weekdays_idx = np.asarray(weekday_col, dtype=np.int64)
+        revenues = np.asarray(revenue_col, dtype=np.float64)
+        club_names, club_codes = np.unique(np.asarray(club_col, dtype=object), return_inverse=True)
+        admin_ids, admin_codes = np.unique(admins, return_inverse=True)
 
-            admin_performance[admin_id][weekday].append(revenue)
+        # Группы: админ × день недели и админ × клуб × день недели
+        by_admin = self._grouped_revenue_stats(admin_codes * 7 + weekdays_idx, revenues)
+        by_admin_club = self._grouped_revenue_stats(
+            (admin_codes * len(club_names) + club_codes) * 7 + weekdays_idx, revenues
+        )
 
-        # Рассчитать статистику
         result = {}
+        for admin_pos, admin_id in enumerate(admin_ids.tolist()):
+            by_weekday = {
+                day: by_admin.get(admin_pos * 7 + day_pos, self._empty_weekday_stats())
+                for day_pos, day in enumerate(WEEKDAYS)
+            }
 
-        for admin_id, weekday_data in admin_performance.items():
-            by_weekday = {}
+            by_club = {}
+            for club_pos, club_name in enumerate(club_names.tolist()):
+                base = (admin_pos * len(club_names) + club_pos) * 7
+                club_days = {
+                    day: by_admin_club[base + day_pos]
+                    for day_pos, day in enumerate(WEEKDAYS)
+                    if base + day_pos in by_admin_club
+                }
+                if club_days:
+                    by_club[club_name] = club_days
 
-            for weekday in weekdays:
-                revenues = weekday_data.get(weekday, [])
-                if revenues:
-                    by_weekday[weekday] = {
-                        'shifts': len(revenues),
-                        'total_revenue': sum(revenues),
-                        'avg_revenue': sum(revenues) / len(revenues)
-                    }
-                else:
-                    by_weekday[weekday] = {
-                        'shifts': 0,
-                        'total_revenue': 0,
-                        'avg_revenue': 0
-                    }
-
-            # Найти лучший и худший день
             avg_revenues = {day: data['avg_revenue'] for day, data in by_weekday.items() if data['shifts'] > 0}
 
-            best_day = max(avg_revenues, key=avg_revenues.get) if avg_revenues else None
-            worst_day = min(avg_revenues, key=avg_revenues.get) if avg_revenues else None
-
             result[admin_id] = {
                 'by_weekday': by_weekday,
-                'best_day': best_day,
-                'worst_day': worst_day
+                'by_club': by_club,
+                'best_day': max(avg_revenues, key=avg_revenues.get) if avg_revenues else None,
+                'worst_day': min(avg_revenues, key=avg_revenues.get) if avg_revenues else None
             }
 
-        conn.close()
-
-        logger.info(f"📊 Проанализирована эффективность {len(result)} администраторов")
+        logger.info(f"📊 Проанализирована эффективность {len(result)} администраторов ({len(rows)} смен)")
         return result
 
+    @staticmethod
+    def _empty_weekday_stats() -> Dict:
+        return {
+            'shifts': 0,
+            'total_revenue': 0,
+            'avg_revenue': 0,
+            'median_revenue': 0,
+            'std_revenue': 0,
+            'ci_low': 0,
+            'ci_high': 0
+        }
+
+    @staticmethod
+    def _grouped_revenue_stats(group_keys, values) -> Dict[int, Dict]:
+        """
+        Статистика выручки по группам за один проход NumPy
+
+        Args:
+            group_keys: массив целочисленных ключей групп (по одному на смену)
+            values: массив выручки смен
+
+        Returns:
+            {ключ группы: {'shifts', 'total_revenue', 'avg_revenue', 'median_revenue',
+                           'std_revenue', 'ci_low', 'ci_high'}}
+        """
+        import numpy as np
+
+        keys, inverse = np.unique(group_keys, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=values)
+        means = sums / counts
+
+        # Выборочное стандартное отклонение (ddof=1)
+        deviations = values - means[inverse]
+        sq_sums = np.bincount(inverse, weights=deviations * deviations)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stds = np.where(counts > 1, np.sqrt(sq_sums / (counts - 1)), 0.0)
+
+        # Медиана: сортировка по (группа, значение) и выбор центральных элементов
+        order = np.lexsort((values, inverse))
+        sorted_values = values[order]
+        starts = np.cumsum(counts) - counts
+        medians = (sorted_values[starts + (counts - 1) // 2] + sorted_values[starts + counts // 2]) / 2
+
+        # 95% доверительный интервал для среднего (t-распределение)
+        t_crit = np.array([_t_critical_95(int(n) - 1) for n in counts])
+        margins = np.where(counts > 1, t_crit * stds / np.sqrt(counts), 0.0)
+
+        stats = {}
+        for i, key in enumerate(keys.tolist()):
+            stats[key] = {
+                'shifts': int(counts[i]),
+                'total_revenue': float(sums[i]),
+                'avg_revenue': float(means[i]),
+                'median_revenue': float(medians[i]),
+                'std_revenue': float(stds[i]),
+                'ci_low': float(means[i] - margins[i]),
+                'ci_high': float(means[i] + margins[i])
+            }
+        return stats
+
     # =====================================================
     # ФОРМАТИРОВАНИЕ ОТЧЕТОВ
     # =====================================================
@@ -6,20 +6,56 @@
 - Сохранения данных в finmon_shifts
 - Получения предыдущей смены
 - Загрузки z-отчетов
-- OCR через OpenAI Vision
+- OCR z-отчетов (локально OpenCV + Tesseract, OpenAI Vision - при низкой уверенности)
 - Уведомлений контролеру
 """
 
+import asyncio
 import logging
 import sqlite3
 import json
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import base64
 import requests
 
+from modules.controller_archive import ensure_archive_schema
+from modules.image_fingerprint import ImageFingerprintIndex, perceptual_hash
+from modules.z_report_ocr import ZReportOCR
+
 logger = logging.getLogger(__name__)
 
+# Слот отчета -> (название, введенная сумма, флаг отключенной кассы)
+Z_REPORT_SLOTS = [
+    ('z_cash', 'Наличные', 'fact_cash', 'cash_disabled'),
+    ('z_card', 'Карта', 'fact_card', 'card_disabled'),
+    ('z_qr', 'QR', 'qr', 'qr_disabled'),
+    ('z_card2', 'Карта 2', 'card2', 'card2_disabled'),
+]
+
+
+def _parse_amount(value) -> float:
+    return float(str(value).replace(' ', '').replace(',', '.').replace('₽', '').strip())
+
+
+def _same_totals(first: Optional[Dict[str, Any]], second: Optional[Dict[str, Any]]) -> bool:
+    """Итог распознан в обоих отчетах и совпадает, как и суммы наличными/картой, если есть в обоих"""
+    if not isinstance(first, dict) or not isinstance(second, dict):
+        return False
+    if first.get('total') is None or second.get('total') is None:
+        return False
+    for key in ('total', 'cash', 'card'):
+        a, b = first.get(key), second.get(key)
+        if a is None or b is None:
+            continue
+        try:
+            if abs(_parse_amount(a) - _parse_amount(b)) > 0.005:
+                return False
+        except (TypeError, ValueError):
+            # Нечисловая сумма в кэше или распознавании - не дубликат, идем обычным путем
+            return False
+    return True
+
 
 class FinMonShiftImprovements:
     """Улучшения для финмониторинга смен"""
@@ -28,6 +64,10 @@ class FinMonShiftImprovements:
         self.db_path = db_path
         self.openai_api_key = openai_api_key
         self.controller_id = controller_id
+        self.z_ocr = ZReportOCR(fallback=self._vision_ocr)
+        self.fingerprints = ImageFingerprintIndex(db_path)
+        # Календарь архива контролёра обновляется триггерами при закрытии смены
+        ensure_archive_schema(db_path)
 
     def get_previous_shift_cash(self, club: str, shift_type: str) -> Optional[float]:
         """
@@ -190,22 +230,69 @@ class FinMonShiftImprovements:
             logger.error(f"❌ Error saving shift to DB: {e}")
             return None
 
-    async def process_z_report_ocr(self, photo_file, bot) -> Optional[Dict[str, Any]]:
+    async def process_z_report_ocr(self, photo_file, bot, user_id: Optional[int] = None,
+                                   ref: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
-        Обработать z-отчет через OpenAI Vision API
+        Обработать z-отчет: локальный OCR, OpenAI Vision - только при низкой уверенности.
+        Результат берется из кэша только для того же файла Telegram (file_unique_id).
+        Похожее по pHash фото распознается заново: разные чеки одного шаблона,
+        снятые в одинаковых условиях, бывают ближе порога - дубликатом такое фото
+        считается, только если совпали и итоги.
 
         Args:
             photo_file: Telegram photo file object
             bot: Telegram bot instance
+            user_id: Кто загрузил фото
+            ref: Идентификатор смены - совпадение с фото другой смены помечается как дубликат
 
         Returns:
-            Словарь с распознанными данными или None
+            Словарь с распознанными данными (+ confidence, source, duplicate_of) или None
         """
         try:
-            # Скачать фото
-            file = await bot.get_file(photo_file.file_id)
-            file_bytes = await file.download_as_bytearray()
+            # Тот же файл Telegram - без скачивания и распознавания
+            match = self.fingerprints.find('z_report', photo_file.file_unique_id)
+            if match and match['result']:
+                self.fingerprints.touch(match['id'])
+                ocr_data = dict(match['result'], source='cache')
+                logger.info(f"♻️ Z-report OCR from cache #{match['id']} (same file)")
+            else:
+                file = await bot.get_file(photo_file.file_id)
+                file_bytes = bytes(await file.download_as_bytearray())
+                phash = await asyncio.to_thread(perceptual_hash, file_bytes)
+                ocr_data = await self.z_ocr.recognize(file_bytes)
+
+                # Похожие фото - кандидаты в дубликаты, подтверждаются итогами
+                match = None
+                if phash:
+                    confirmed = [similar for similar in self.fingerprints.find_similar('z_report', phash)
+                                 if _same_totals(similar['result'], ocr_data)]
+                    other_shift = [similar for similar in confirmed if similar['ref'] != ref]
+                    match = (other_shift or confirmed or [None])[0]
+                self.fingerprints.remember('z_report', photo_file.file_unique_id, phash, ocr_data,
+                                           user_id=user_id, ref=ref)
+
+            if match and match['ref'] != ref:
+                logger.warning(f"🚨 Duplicate Z-report photo: matches #{match['id']} ({match['ref']})")
+                ocr_data = dict(ocr_data or {}, duplicate_of={
+                    'id': match['id'],
+                    'ref': match['ref'],
+                    'user_id': match['user_id'],
+                    'created_at': match['created_at'],
+                    'distance': match['distance'],
+                })
+            return ocr_data
 
+        except Exception as e:
+            logger.error(f"❌ Error processing OCR: {e}")
+            return None
+
+    async def _vision_ocr(self, file_bytes: bytes) -> Optional[Dict[str, Any]]:
+        """Распознать z-отчет через OpenAI Vision (HTTP-запрос в отдельном потоке)"""
+        return await asyncio.to_thread(self._vision_ocr_sync, file_bytes)
+
+    def _vision_ocr_sync(self, file_bytes: bytes) -> Optional[Dict[str, Any]]:
+        """Запрос к OpenAI Vision API"""
+        try:
             # Конвертировать в base64
             base64_image = base64.b64encode(file_bytes).decode('utf-8')
 
@@ -279,6 +366,59 @@ class FinMonShiftImprovements:
             logger.error(f"❌ Error processing OCR: {e}")
             return None
 
+    @staticmethod
+    def compare_ocr_totals(shift_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Сверить распознанные итоги всех отчетов с введенными суммами за один проход
+
+        Returns:
+            Список по загруженным отчетам: {'slot', 'label', 'entered', 'recognized',
+            'difference', 'percentage', 'match', 'duplicate_of'}; recognized = None,
+            если отчет не распознан
+        """
+        checks = []
+        for slot, label, entered_key, disabled_key in Z_REPORT_SLOTS:
+            if shift_data.get(disabled_key):
+                continue
+            raw = shift_data.get(f'{slot}_ocr')
+            if not raw and not shift_data.get(f'{slot}_photo'):
+                continue
+
+            try:
+                ocr = json.loads(raw) if raw else {}
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.error(f"Failed to parse {slot} OCR JSON: {e}")
+                ocr = {}
+
+            entered = shift_data.get(entered_key) or 0
+            check = {
+                'slot': slot,
+                'label': label,
+                'entered': entered,
+                'recognized': None,
+                'difference': None,
+                'percentage': None,
+                'match': None,
+                'duplicate_of': ocr.get('duplicate_of') if isinstance(ocr, dict) else None,
+            }
+            ocr_total = ocr.get('total') if isinstance(ocr, dict) else None
+            if ocr_total is not None:
+                try:
+                    recognized = _parse_amount(ocr_total)
+                except (ValueError, TypeError) as e:
+                    logger.error(f"Failed to parse {slot} OCR total: {ocr_total}, error: {e}")
+                else:
+                    difference = abs(recognized - entered)
+                    base = max(entered, recognized)
+                    check.update(
+                        recognized=recognized,
+                        difference=difference,
+                        percentage=(difference / base) * 100 if base > 0 else 0,
+                        match=difference <= 0.01,
+                    )
+            checks.append(check)
+        return checks
+
     async def send_shift_notification_to_controller(
         self,
         bot,
@@ -345,57 +485,26 @@ class FinMonShiftImprovements:
 
             # Analyze OCR data and compare with entered values
             ocr_warnings = []
+            duplicates = []
+            for check in self.compare_ocr_totals(shift_data):
+                if check['match'] is False:
+                    ocr_warnings.append(
+                        f"⚠️ *{check['label']}:* Расхождение!\n"
+                        f"  - OCR распознал: {check['recognized']:,.0f} ₽\n"
+                        f"  - Введено вручную: {check['entered']:,.0f} ₽\n"
+                        f"  - Разница: {check['difference']:,.0f} ₽ ({check['percentage']:.1f}%)"
+                    )
+                duplicate = check['duplicate_of']
+                if duplicate:
+                    duplicates.append(
+                        f"  • {check['label']}: фото уже загружалось {duplicate.get('created_at', '?')[:16]}"
+                        f" ({duplicate.get('ref') or 'другая смена'})"
+                    )
 
-            # Check cash OCR
-            if shift_data.get('z_cash_ocr') and not shift_data.get('cash_disabled'):
-                try:
-                    cash_ocr = json.loads(shift_data.get('z_cash_ocr'))
-                    ocr_total = cash_ocr.get('total')
-                    entered_cash = shift_data.get('fact_cash', 0)
-
-                    if ocr_total is not None:
-                        # Try to parse OCR total (could be string or number)
-                        try:
-                            ocr_total_value = float(str(ocr_total).replace(' ', '').replace(',', '.').replace('₽', '').strip())
-                            difference = abs(ocr_total_value - entered_cash)
-
-                            if difference > 0.01:  # Allow small floating point differences
-                                percentage = (difference / max(entered_cash, ocr_total_value)) * 100 if max(entered_cash, ocr_total_value) > 0 else 0
-                                ocr_warnings.append(
-                                    f"⚠️ *Наличные:* Расхождение!\n"
-                                    f"  - OCR распознал: {ocr_total_value:,.0f} ₽\n"
-                                    f"  - Введено вручную: {entered_cash:,.0f} ₽\n"
-                                    f"  - Разница: {difference:,.0f} ₽ ({percentage:.1f}%)"
-                                )
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"Failed to parse cash OCR total: {ocr_total}, error: {e}")
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.error(f"Failed to parse cash OCR JSON: {e}")
-
-            # Check card OCR
-            if shift_data.get('z_card_ocr') and not shift_data.get('card_disabled'):
-                try:
-                    card_ocr = json.loads(shift_data.get('z_card_ocr'))
-                    ocr_total = card_ocr.get('total')
-                    entered_card = shift_data.get('fact_card', 0)
-
-                    if ocr_total is not None:
-                        try:
-                            ocr_total_value = float(str(ocr_total).replace(' ', '').replace(',', '.').replace('₽', '').strip())
-                            difference = abs(ocr_total_value - entered_card)
-
-                            if difference > 0.01:
-                                percentage = (difference / max(entered_card, ocr_total_value)) * 100 if max(entered_card, ocr_total_value) > 0 else 0
-                                ocr_warnings.append(
-                                    f"⚠️ *Карта:* Расхождение!\n"
-                                    f"  - OCR распознал: {ocr_total_value:,.0f} ₽\n"
-                                    f"  - Введено вручную: {entered_card:,.0f} ₽\n"
-                                    f"  - Разница: {difference:,.0f} ₽ ({percentage:.1f}%)"
-                                )
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"Failed to parse card OCR total: {ocr_total}, error: {e}")
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.error(f"Failed to parse card OCR JSON: {e}")
+            # Повторно использованные фото отчетов
+            if duplicates:
+                msg += "\n\n🚨 *Повторный чек!*\n"
+                msg += "\n".join(duplicates)
 
             # Add OCR status to message
             if ocr_warnings:
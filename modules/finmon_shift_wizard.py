@@ -5,6 +5,7 @@ FinMon Shift Wizard - Button-based shift submission
 Handles /shift command with step-by-step wizard
 """
 
+import asyncio
 import logging
 import json
 from datetime import datetime, date, timedelta
@@ -27,6 +28,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import BadRequest
 
+from modules.notification_dispatcher import PRIORITY_HIGH, get_notifier
+
 # Try to import analytics module
 try:
     from modules.finmon_analytics import FinMonAnalytics
@@ -59,6 +62,9 @@ SHIFT_CLOSE_TIMES = {
 EARLY_OFFSET_HOURS = 1  # Allow early close 1 hour before
 GRACE_MINUTES = 60      # Grace period after close time
 
+# Сколько сводка ждет фоновые OCR отчетов (локальный OCR + Vision-фоллбек)
+Z_OCR_JOIN_TIMEOUT = 30
+
 
 def now_msk() -> datetime:
     """Get current time in Moscow timezone"""
@@ -1075,6 +1081,74 @@ class ShiftWizard:
         await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
         return UPLOAD_Z_CARD
 
+    async def _process_z_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               photo, slot: str):
+        """Запустить OCR фото отчета в фоне - мастер сразу идет к следующему шагу"""
+        if not self.improvements:
+            return
+
+        # Смена + слот: то же фото в другом слоте или другой смене - дубликат
+        shift_data = context.user_data['shift_data']
+        if shift_data.get('active_shift_id'):
+            ref = f"shift:{shift_data['active_shift_id']}:{slot}"
+        else:
+            ref = f"{shift_data.get('club')}|{shift_data.get('shift_type')}|{now_msk().strftime('%Y-%m-%d')}:{slot}"
+
+        tasks = context.user_data.setdefault('z_ocr_tasks', {})
+        if slot in tasks:
+            tasks[slot].cancel()
+        tasks[slot] = asyncio.create_task(self.improvements.process_z_report_ocr(
+            photo, context.bot, user_id=update.effective_user.id, ref=ref
+        ))
+        logger.info(f"🔄 OCR {slot} started in background")
+
+    async def _collect_z_ocr(self, context: ContextTypes.DEFAULT_TYPE,
+                             timeout: float = Z_OCR_JOIN_TIMEOUT):
+        """Дождаться фоновых OCR (не дольше timeout) и сохранить результаты в shift_data"""
+        tasks = context.user_data.get('z_ocr_tasks')
+        if not tasks:
+            return
+
+        await asyncio.wait(tasks.values(), timeout=timeout)
+
+        shift_data = context.user_data['shift_data']
+        for slot, task in list(tasks.items()):
+            if not task.done():
+                logger.warning(f"⏱ OCR {slot} not finished in {timeout}s")
+                continue
+            del tasks[slot]
+            if task.cancelled():
+                continue
+            ocr_result = task.result()
+            if ocr_result:
+                shift_data[f'{slot}_ocr'] = json.dumps(ocr_result, ensure_ascii=False)
+                logger.info(f"✅ OCR {slot}: {ocr_result}")
+
+    def _cancel_z_ocr(self, context: ContextTypes.DEFAULT_TYPE):
+        """Отменить незавершенные фоновые OCR"""
+        for task in context.user_data.pop('z_ocr_tasks', {}).values():
+            task.cancel()
+
+    def _format_ocr_check(self, shift_data: Dict) -> str:
+        """Блок сверки распознанных отчетов с введенными суммами"""
+        checks = self.improvements.compare_ocr_totals(shift_data) if self.improvements else []
+        if not checks:
+            return ""
+
+        msg = "\n🧾 Сверка с отчетами:\n"
+        for check in checks:
+            if check['recognized'] is None:
+                msg += f"  • {check['label']}: ❔ не распознано\n"
+            elif check['match']:
+                msg += f"  • {check['label']}: ✅ {check['recognized']:,.0f} ₽\n"
+            else:
+                msg += (f"  • {check['label']}: ⚠️ в отчете {check['recognized']:,.0f} ₽, "
+                        f"введено {check['entered']:,.0f} ₽ (разница {check['difference']:,.0f} ₽)\n")
+            duplicate = check['duplicate_of']
+            if duplicate:
+                msg += f"    🚨 фото уже загружалось {(duplicate.get('created_at') or '')[:16]}\n"
+        return msg
+
     async def upload_z_cash(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle z-report photo upload for cash register"""
         if not update.message.photo:
@@ -1085,18 +1159,10 @@ class ShiftWizard:
         photo = update.message.photo[-1]
         context.user_data['shift_data']['z_cash_photo'] = photo.file_id
 
-        # Process OCR if improvements module available
-        ocr_result = None
-        if self.improvements:
-            await update.message.reply_text("⏳ Обрабатываю чек через OCR...")
-            ocr_result = await self.improvements.process_z_report_ocr(photo, context.bot)
-            if ocr_result:
-                context.user_data['shift_data']['z_cash_ocr'] = json.dumps(ocr_result, ensure_ascii=False)
-                logger.info(f"✅ OCR для наличных: {ocr_result}")
+        # OCR идет в фоне, результат сверяется на сводке
+        await self._process_z_photo(update, context, photo, 'z_cash')
 
         msg = "✅ Итоговый отчет загружен\n\n"
-        if ocr_result and 'total' in ocr_result:
-            msg += f"📊 Распознано: {ocr_result.get('total', 'N/A')} ₽\n\n"
 
         msg += "📸 Загрузите СВЕРКУ ИТОГОВ\n\n"
         msg += "Отправьте фото чека или нажмите 'Пропустить'"
@@ -1126,19 +1192,9 @@ class ShiftWizard:
         photo = update.message.photo[-1]
         context.user_data['shift_data']['z_card_photo'] = photo.file_id
 
-        ocr_result = None
-        if self.improvements:
-            await update.message.reply_text("⏳ Обрабатываю чек через OCR...")
-            ocr_result = await self.improvements.process_z_report_ocr(photo, context.bot)
-            if ocr_result:
-                context.user_data['shift_data']['z_card_ocr'] = json.dumps(ocr_result, ensure_ascii=False)
-                logger.info(f"✅ OCR для карты: {ocr_result}")
-
-        msg = "✅ X-отчет карты загружен\n\n"
-        if ocr_result and 'total' in ocr_result:
-            msg += f"📊 Распознано: {ocr_result.get('total', 'N/A')} ₽\n\n"
+        await self._process_z_photo(update, context, photo, 'z_card')
 
-        await update.message.reply_text(msg)
+        await update.message.reply_text("✅ X-отчет карты загружен")
 
         # Пропускаем QR и карту 2, сразу к сейфу
         # Передаём message напрямую - у него есть reply_text
@@ -1169,17 +1225,9 @@ class ShiftWizard:
         photo = update.message.photo[-1]
         context.user_data['shift_data']['z_qr_photo'] = photo.file_id
 
-        ocr_result = None
-        if self.improvements:
-            await update.message.reply_text("⏳ Обрабатываю чек через OCR...")
-            ocr_result = await self.improvements.process_z_report_ocr(photo, context.bot)
-            if ocr_result:
-                context.user_data['shift_data']['z_qr_ocr'] = json.dumps(ocr_result, ensure_ascii=False)
-                logger.info(f"✅ OCR для QR: {ocr_result}")
+        await self._process_z_photo(update, context, photo, 'z_qr')
 
         msg = "✅ X-отчет QR загружен\n\n"
-        if ocr_result and 'total' in ocr_result:
-            msg += f"📊 Распознано: {ocr_result.get('total', 'N/A')} ₽\n\n"
 
         msg += "📸 Загрузите X-отчет (касса 2)\n\n"
         msg += "Отправьте фото чека или нажмите 'Пропустить'"
@@ -1208,19 +1256,9 @@ class ShiftWizard:
         photo = update.message.photo[-1]
         context.user_data['shift_data']['z_card2_photo'] = photo.file_id
 
-        ocr_result = None
-        if self.improvements:
-            await update.message.reply_text("⏳ Обрабатываю чек через OCR...")
-            ocr_result = await self.improvements.process_z_report_ocr(photo, context.bot)
-            if ocr_result:
-                context.user_data['shift_data']['z_card2_ocr'] = json.dumps(ocr_result, ensure_ascii=False)
-                logger.info(f"✅ OCR для карты 2: {ocr_result}")
+        await self._process_z_photo(update, context, photo, 'z_card2')
 
-        msg = "✅ X-отчет карты 2 загружен\n\n"
-        if ocr_result and 'total' in ocr_result:
-            msg += f"📊 Распознано: {ocr_result.get('total', 'N/A')} ₽\n\n"
-
-        await update.message.reply_text(msg)
+        await update.message.reply_text("✅ X-отчет карты 2 загружен")
 
         # Continue to safe input
         return await self._continue_to_safe(update.message, context)
@@ -1419,11 +1457,13 @@ class ShiftWizard:
                 f"⚠️ Требуется проверка!"
             )
 
-            await context.bot.send_message(
-                chat_id=self.controller_id,
-                text=notification
+            get_notifier(context.bot_data, context.bot).submit(
+                self.controller_id, notification,
+                priority=PRIORITY_HIGH,
+                dedup_key=f"cash_discrepancy:{user.id}:{club}:{shift_time}:{actual:.0f}",
+                category='cash_discrepancy'
             )
-            logger.info(f"📨 Sent cash discrepancy notification to controller: {discrepancy_type} {discrepancy:,.0f} ₽")
+            logger.info(f"📨 Queued cash discrepancy notification to controller: {discrepancy_type} {discrepancy:,.0f} ₽")
         except Exception as e:
             logger.error(f"❌ Failed to send controller notification: {e}")
 
@@ -1482,6 +1522,9 @@ class ShiftWizard:
         data = context.user_data['shift_data']
         expenses = context.user_data.get('expenses', [])
         
+        # Фоновые OCR отчетов - к этому моменту обычно уже готовы
+        await self._collect_z_ocr(context)
+        
         prev_official = context.user_data.get('prev_official', 0)
         prev_box = context.user_data.get('prev_box', 0)
         
@@ -1503,6 +1546,7 @@ class ShiftWizard:
         msg += f"  • Карта факт: {data['fact_card']:,.0f} ₽\n"
         msg += f"  • QR: {data['qr']:,.0f} ₽\n"
         msg += f"  • Коробка: {data['card2']:,.0f} ₽\n"
+        msg += self._format_ocr_check(data)
         
         if expenses:
             msg += f"\n💸 Расходы (списано):\n"
@@ -1546,6 +1590,10 @@ class ShiftWizard:
         shift_time = context.user_data.get('shift_time')
         expenses = context.user_data.get('expenses', [])
         
+        # OCR, не успевшие к сводке
+        await self._collect_z_ocr(context, timeout=5)
+        self._cancel_z_ocr(context)
+        
         # Add club and expenses to data
         data['club'] = club
         data['expenses'] = expenses
@@ -1700,6 +1748,9 @@ class ShiftWizard:
         shift_time = context.user_data.get('shift_time')
         shift_label = "☀️ Утро (дневная смена)" if shift_time == "morning" else "🌙 Вечер (ночная смена)"
 
+        # Фото отчетов загружаются заново
+        self._cancel_z_ocr(context)
+        
         # Save important values that should not be cleared
         prev_official = context.user_data.get('prev_official', 0)
         prev_box = context.user_data.get('prev_box', 0)
@@ -1757,6 +1808,7 @@ class ShiftWizard:
         await query.edit_message_text("❌ Сдача смены отменена")
         
         # Clear context
+        self._cancel_z_ocr(context)
         context.user_data.clear()
         
         return ConversationHandler.END
@@ -1764,6 +1816,7 @@ class ShiftWizard:
     async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel via /cancel command"""
         await update.message.reply_text("❌ Сдача смены отменена")
+        self._cancel_z_ocr(context)
         context.user_data.clear()
         return ConversationHandler.END
     
@@ -1961,21 +2014,19 @@ class ShiftWizard:
             
             # Notify owner
             if self.owner_ids:
-                for owner_id in self.owner_ids:
-                    try:
-                        club = context.user_data.get('expense_club')
-                        user = query.from_user
-                        notify_msg = f"💸 Списание в смене #{shift_id}\n\n"
-                        notify_msg += f"🏢 {club} | {source_label}\n"
-                        notify_msg += f"💰 {amount:,.0f} ₽\n"
-                        notify_msg += f"📝 {reason}\n\n"
-                        notify_msg += f"👤 {user.full_name or 'Неизвестно'}"
-                        if user.username:
-                            notify_msg += f" (@{user.username})"
-                        
-                        await context.bot.send_message(chat_id=owner_id, text=notify_msg)
-                    except:
-                        pass
+                club = context.user_data.get('expense_club')
+                user = query.from_user
+                notify_msg = f"💸 Списание в смене #{shift_id}\n\n"
+                notify_msg += f"🏢 {club} | {source_label}\n"
+                notify_msg += f"💰 {amount:,.0f} ₽\n"
+                notify_msg += f"📝 {reason}\n\n"
+                notify_msg += f"👤 {user.full_name or 'Неизвестно'}"
+                if user.username:
+                    notify_msg += f" (@{user.username})"
+                
+                get_notifier(context.bot_data, context.bot).fan_out(
+                    self.owner_ids, notify_msg, category='shift_expense'
+                )
         else:
             await query.edit_message_text("❌ Не удалось сохранить списание. Попробуйте позже.")
         
@@ -2845,19 +2896,19 @@ class ShiftWizard:
 
                 # Notify all owners about the revert
                 if self.owner_ids:
-                    for owner_id in self.owner_ids:
-                        try:
-                            cash_source_label = "🔐 Основная касса" if withdrawal_info.get('cash_source') == 'main' else "📦 Бокс"
-                            notify_msg = f"🔄 Возврат снятия зарплаты\n\n"
-                            notify_msg += f"🆔 Снятие #{withdrawal_id}\n"
-                            notify_msg += f"🏢 {withdrawal_info['club']}\n"
-                            notify_msg += f"💼 Касса: {cash_source_label}\n"
-                            notify_msg += f"💰 {withdrawal_info['amount']:,.0f} ₽ возвращено в кассу\n\n"
-                            notify_msg += f"👤 Возврат выполнен: {controller_name}"
-
-                            await context.bot.send_message(chat_id=owner_id, text=notify_msg)
-                        except Exception as e:
-                            logger.error(f"Failed to send revert notification: {e}")
+                    cash_source_label = "🔐 Основная касса" if withdrawal_info.get('cash_source') == 'main' else "📦 Бокс"
+                    notify_msg = f"🔄 Возврат снятия зарплаты\n\n"
+                    notify_msg += f"🆔 Снятие #{withdrawal_id}\n"
+                    notify_msg += f"🏢 {withdrawal_info['club']}\n"
+                    notify_msg += f"💼 Касса: {cash_source_label}\n"
+                    notify_msg += f"💰 {withdrawal_info['amount']:,.0f} ₽ возвращено в кассу\n\n"
+                    notify_msg += f"👤 Возврат выполнен: {controller_name}"
+
+                    get_notifier(context.bot_data, context.bot).fan_out(
+                        self.owner_ids, notify_msg,
+                        dedup_key=f"withdrawal_revert:{withdrawal_id}",
+                        category='withdrawal_revert'
+                    )
 
                 await query.answer("✅ Деньги возвращены в кассу", show_alert=True)
             else:
@@ -3,22 +3,57 @@
 """
 FinMon Simple - Financial Monitoring without Database
 Uses JSON for balances and CSV for transaction logs
+
+Balances are replaced atomically (temp file + fsync + rename) and every
+read-modify-write runs under an exclusive file lock, so concurrent shift
+closes cannot clobber each other. The CSV log is append-only; a sidecar
+index keeps byte offsets of the latest rows per club and per shift type,
+so recent movements and the previous shift are read with a seek instead
+of a full scan.
 """
 
 import json
 import csv
+import io
 import os
 import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime, date
 from typing import Dict, Optional, Tuple, List
 import logging
 
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 # File paths
 BALANCES_FILE = "finmon_balances.json"
 LOG_FILE = "finmon_log.csv"
 
+LOG_FIELDS = [
+    'timestamp', 'club', 'shift_date', 'shift_time',
+    'admin_tg_id', 'admin_username', 'duty_name',
+    'safe_cash_end', 'box_cash_end',
+    'delta_official', 'delta_box',
+    'fact_cash', 'fact_card', 'qr', 'card2',
+    'expenses_total', 'expenses_details',
+    'identity_confirmed', 'confirmation_timestamp'
+]
+
+# Offsets of the latest rows kept in the index per club (and for all clubs)
+INDEX_DEPTH = 100
+INDEX_VERSION = 1
+
+# Serializes lock holders inside this process (flock is per open file,
+# so a nested acquire must not open the lock file again)
+_process_lock = threading.RLock()
+_lock_depth = 0
+
 # Club mapping
 CHAT_TO_CLUB = {
     5329834944: "Рио",
@@ -31,8 +66,54 @@ class FinMonSimple:
     def __init__(self, balances_file: str = BALANCES_FILE, log_file: str = LOG_FILE):
         self.balances_file = balances_file
         self.log_file = log_file
+        self.lock_file = balances_file + '.lock'
+        self.index_file = os.path.splitext(log_file)[0] + '.idx.json'
+        self._index = None
         self._init_storage()
     
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock on balances and log (threads and other processes), reentrant"""
+        global _lock_depth
+        with _process_lock:
+            if not FCNTL_AVAILABLE or _lock_depth:
+                _lock_depth += 1
+                try:
+                    yield
+                finally:
+                    _lock_depth -= 1
+                return
+            with open(self.lock_file, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                _lock_depth += 1
+                try:
+                    yield
+                finally:
+                    _lock_depth -= 1
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _write_json_atomic(self, path: str, payload) -> None:
+        """Write JSON to a temp file, fsync it and rename over the target"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+    
     def _init_storage(self):
         """Initialize JSON and CSV files if they don't exist"""
         # Initialize balances file
@@ -41,20 +122,15 @@ class FinMonSimple:
                 "Рио": {"official": 0, "box": 0},
                 "Север": {"official": 0, "box": 0}
             }
-            with open(self.balances_file, 'w', encoding='utf-8') as f:
-                json.dump(initial_balances, f, ensure_ascii=False, indent=2)
+            with self._locked():
+                if not os.path.exists(self.balances_file):
+                    self._write_json_atomic(self.balances_file, initial_balances)
             logger.info(f"✅ Created {self.balances_file}")
         
         # Initialize CSV log file
         if not os.path.exists(self.log_file):
             with open(self.log_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=[
-                    'timestamp', 'club', 'shift_date', 'shift_time',
-                    'admin_tg_id', 'admin_username', 'duty_name',
-                    'safe_cash_end', 'box_cash_end',
-                    'delta_official', 'delta_box',
-                    'fact_cash', 'fact_card', 'qr', 'card2'
-                ])
+                writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
                 writer.writeheader()
             logger.info(f"✅ Created {self.log_file}")
     
@@ -68,10 +144,10 @@ class FinMonSimple:
             return {"Рио": {"official": 0, "box": 0}, "Север": {"official": 0, "box": 0}}
     
     def save_balances(self, balances: Dict[str, Dict[str, float]]):
-        """Save balances to JSON file"""
+        """Save balances to JSON file (atomic replace under the storage lock)"""
         try:
-            with open(self.balances_file, 'w', encoding='utf-8') as f:
-                json.dump(balances, f, ensure_ascii=False, indent=2)
+            with self._locked():
+                self._write_json_atomic(self.balances_file, balances)
             logger.info(f"✅ Balances saved")
         except Exception as e:
             logger.error(f"❌ Error saving balances: {e}")
@@ -214,51 +290,34 @@ class FinMonSimple:
         expenses_total = sum(exp['amount'] for exp in expenses)
         expenses_details = json.dumps(expenses, ensure_ascii=False) if expenses else ""
         
-        # Load current balances
-        balances = self.get_balances()
+        # Balances and log are updated under one lock: a concurrent close
+        # for another club must not overwrite this one with stale balances
+        with self._locked():
+            balances = self.get_balances()
         
-        if club not in balances:
-            logger.error(f"❌ Unknown club: {club}")
-            return False
+            if club not in balances:
+                logger.error(f"❌ Unknown club: {club}")
+                return False
         
-        # Calculate deltas
-        old_official = balances[club]['official']
-        old_box = balances[club]['box']
+            # Calculate deltas
+            old_official = balances[club]['official']
+            old_box = balances[club]['box']
         
-        new_official = data['safe_cash_end']
-        new_box = data['box_cash_end']
+            new_official = data['safe_cash_end']
+            new_box = data['box_cash_end']
         
-        delta_official = new_official - old_official
-        delta_box = new_box - old_box
+            delta_official = new_official - old_official
+            delta_box = new_box - old_box
         
-        # Update balances
-        balances[club]['official'] = new_official
-        balances[club]['box'] = new_box
+            # Update balances
+            balances[club]['official'] = new_official
+            balances[club]['box'] = new_box
         
-        self.save_balances(balances)
+            self.save_balances(balances)
         
-        # Append to CSV log
-        try:
-            # Check if we need to add headers (file doesn't exist or is empty)
-            file_exists = os.path.exists(self.log_file)
-            fieldnames = [
-                'timestamp', 'club', 'shift_date', 'shift_time',
-                'admin_tg_id', 'admin_username', 'duty_name',
-                'safe_cash_end', 'box_cash_end',
-                'delta_official', 'delta_box',
-                'fact_cash', 'fact_card', 'qr', 'card2',
-                'expenses_total', 'expenses_details',
-                'identity_confirmed', 'confirmation_timestamp'
-            ]
-            
-            with open(self.log_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                
-                # Write header if file is new or empty
-                if not file_exists or os.path.getsize(self.log_file) == 0:
-                    writer.writeheader()
-                
-                writer.writerow({
+            # Append to CSV log
+            try:
+                offset = self._append_log_row({
                     'timestamp': datetime.now().isoformat(),
                     'club': club,
                     'shift_date': shift_date.isoformat(),
@@ -279,11 +338,11 @@ class FinMonSimple:
                     'identity_confirmed': 1 if identity_confirmed else 0,
                     'confirmation_timestamp': confirmation_timestamp
                 })
-            logger.info(f"✅ Shift logged for {club} with {len(expenses)} expenses")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Error logging shift: {e}")
-            return False
+                logger.info(f"✅ Shift logged for {club} with {len(expenses)} expenses (offset {offset})")
+                return True
+            except Exception as e:
+                logger.error(f"❌ Error logging shift: {e}")
+                return False
     
     def get_club_balances(self, club: str) -> Optional[Dict[str, float]]:
         """Get balances for a specific club"""
@@ -294,6 +353,109 @@ class FinMonSimple:
         """Get all balances"""
         return self.get_balances()
     
+    # ===== Log index =====
+    
+    def _empty_index(self) -> Dict:
+        return {'version': INDEX_VERSION, 'size': 0, 'fields': None,
+                'all': [], 'clubs': {}, 'counts': {}, 'last_by_type': {}}
+    
+    def _index_row(self, index: Dict, offset: int, club: str, shift_time: str):
+        """Register a log row at byte offset in the index"""
+        index['all'] = (index['all'] + [offset])[-INDEX_DEPTH:]
+        index['clubs'][club] = (index['clubs'].get(club, []) + [offset])[-INDEX_DEPTH:]
+        index['counts'][club] = index['counts'].get(club, 0) + 1
+        index['counts']['*'] = index['counts'].get('*', 0) + 1
+        index['last_by_type'].setdefault(club, {})[shift_time] = offset
+    
+    def _scan_log(self, index: Dict) -> Dict:
+        """Index log rows appended after index['size'] (whole file for a new index)"""
+        with open(self.log_file, 'rb') as f:
+            if index['size'] == 0:
+                header = f.readline()
+                index['fields'] = next(csv.reader([header.decode('utf-8-sig')]), None)
+                index['size'] = f.tell()
+            else:
+                f.seek(index['size'])
+            fields = index['fields'] or LOG_FIELDS
+            club_pos, time_pos = fields.index('club'), fields.index('shift_time')
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # EOF or a row that is still being written
+                values = next(csv.reader([line.decode('utf-8')]), None)
+                if values and values != fields and len(values) > max(club_pos, time_pos):
+                    self._index_row(index, offset, values[club_pos], values[time_pos])
+                index['size'] = f.tell()
+        return index
+    
+    def _load_index(self) -> Dict:
+        """
+        Index of the log, caught up with the file.
+        
+        The log is append-only: if it grew, only the tail is scanned;
+        if it shrank or was replaced, the index is rebuilt.
+        """
+        size = os.path.getsize(self.log_file) if os.path.exists(self.log_file) else 0
+        index = self._index
+        if index is None and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') != INDEX_VERSION:
+                    index = None
+            except Exception as e:
+                logger.warning(f"⚠️ Rebuilding log index: {e}")
+                index = None
+        if index is not None and index['size'] == size:
+            self._index = index
+            return index
+        
+        with self._locked():
+            if index is None or index['size'] > size:
+                index = self._empty_index()
+            if size:
+                index = self._scan_log(index)
+            self._save_index(index)
+        return index
+    
+    def _save_index(self, index: Dict):
+        self._index = index
+        try:
+            self._write_json_atomic(self.index_file, index)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save log index: {e}")
+    
+    def _append_log_row(self, row: Dict) -> int:
+        """Append a row to the CSV log and the index; returns its byte offset"""
+        with self._locked():
+            index = self._load_index()
+            with open(self.log_file, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
+                # Write header if file is new or empty
+                if f.tell() == 0:
+                    writer.writeheader()
+                    index = self._empty_index()
+                    index['fields'] = LOG_FIELDS
+                offset = f.tell()
+                writer.writerow(row)
+                f.flush()
+                os.fsync(f.fileno())
+                index['size'] = f.tell()
+            self._index_row(index, offset, row['club'], row['shift_time'])
+            self._save_index(index)
+            return offset
+    
+    def _read_rows(self, offsets: List[int], fields: List[str]) -> List[Dict]:
+        """Read log rows at the given byte offsets"""
+        rows = []
+        with open(self.log_file, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                line = f.readline().decode('utf-8')
+                rows.append(next(csv.DictReader(io.StringIO(line), fieldnames=fields)))
+        return rows
+    
     def get_recent_movements(self, club: str = None, limit: int = 10) -> List[Dict]:
         """
         Get recent movements from CSV log
@@ -306,6 +468,14 @@ class FinMonSimple:
             List of movement dictionaries
         """
         try:
+            index = self._load_index()
+            offsets = index['clubs'].get(club, []) if club else index['all']
+            total = index['counts'].get(club if club else '*', 0)
+            if limit <= len(offsets) or len(offsets) == total:
+                # Most recent first
+                return self._read_rows(offsets[::-1][:limit], index['fields'] or LOG_FIELDS)
+            
+            # Deeper than the index: full scan
             with open(self.log_file, 'r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
                 rows = list(reader)
@@ -333,19 +503,18 @@ class FinMonSimple:
             Dict with revenue data or None
         """
         try:
-            movements = self.get_recent_movements(club, limit=20)
-
-            # Find most recent shift of same type
-            for mov in movements:
-                if mov.get('shift_time') == shift_type:
-                    return {
-                        'fact_cash': float(mov.get('fact_cash', 0)),
-                        'fact_card': float(mov.get('fact_card', 0)),
-                        'qr': float(mov.get('qr', 0)),
-                        'card2': float(mov.get('card2', 0))
-                    }
+            index = self._load_index()
+            offset = index['last_by_type'].get(club, {}).get(shift_type)
+            if offset is None:
+                return None
 
-            return None
+            mov = self._read_rows([offset], index['fields'] or LOG_FIELDS)[0]
+            return {
+                'fact_cash': float(mov.get('fact_cash', 0)),
+                'fact_card': float(mov.get('fact_card', 0)),
+                'qr': float(mov.get('qr', 0)),
+                'card2': float(mov.get('card2', 0))
+            }
         except Exception as e:
             logger.error(f"❌ Error getting previous shift revenue: {e}")
             return None
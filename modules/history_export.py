@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+History Export - потоковая колоночная выгрузка истории смен и кассы
+
+Таблицы читаются порциями по rowid (keyset) через read-only подключение,
+каждая порция сразу пишется в сжатый NPZ-архив (zip + .npy колонки),
+поэтому выгрузка не держит блокировку БД и не грузит таблицу в память.
+
+Поддерживается инкрементальная выгрузка: для каждой таблицы хранится
+водяной знак (последний выгруженный rowid) в таблице export_watermarks.
+Инкремент содержит только новые строки; изменения уже выгруженных строк
+попадают только в полную выгрузку.
+
+Чтение результата:
+    data = np.load('history_....npz')
+    data['finmon_shifts.00000.total_revenue']
+    manifest = json.loads(bytes(data['__manifest__']))
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import zipfile
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TABLES = (
+    'finmon_shifts',
+    'shift_expenses',
+    'shift_cash_withdrawals',
+    'cash_movements',
+    'admin_products',
+)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class HistoryExporter:
+    """Потоковый экспорт таблиц в сжатый колоночный NPZ"""
+
+    def __init__(self, db_path: str = 'knowledge.db', export_dir: str = './backups/exports',
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.db_path = db_path
+        self.export_dir = export_dir
+        self.chunk_size = chunk_size
+        os.makedirs(self.export_dir, exist_ok=True)
+        self._init_db()
+
+    def _init_db(self):
+        """Таблица водяных знаков инкрементальной выгрузки"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS export_watermarks (
+                table_name TEXT PRIMARY KEY,
+                last_rowid INTEGER NOT NULL DEFAULT 0,
+                rows_exported INTEGER NOT NULL DEFAULT 0,
+                export_file TEXT,
+                exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _connect_readonly(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=10)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def get_watermarks(self) -> Dict[str, int]:
+        """Последний выгруженный rowid по таблицам"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT table_name, last_rowid FROM export_watermarks").fetchall()
+        conn.close()
+        return {name: rowid for name, rowid in rows}
+
+    def reset_watermarks(self):
+        """Сбросить водяные знаки (следующая выгрузка будет полной)"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM export_watermarks")
+        conn.commit()
+        conn.close()
+
+    def _save_watermarks(self, manifest: Dict, export_file: str):
+        conn = sqlite3.connect(self.db_path)
+        for table, info in manifest['tables'].items():
+            if info['rows'] == 0:
+                continue
+            conn.execute("""
+                INSERT INTO export_watermarks (table_name, last_rowid, rows_exported, export_file, exported_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(table_name) DO UPDATE SET
+                    last_rowid = excluded.last_rowid,
+                    rows_exported = export_watermarks.rows_exported + excluded.rows_exported,
+                    export_file = excluded.export_file,
+                    exported_at = CURRENT_TIMESTAMP
+            """, (table, info['last_rowid'], info['rows'], os.path.basename(export_file)))
+        conn.commit()
+        conn.close()
+
+    def export(self, incremental: bool = True, tables: Sequence[str] = EXPORT_TABLES) -> Optional[Dict]:
+        """
+        Выгрузить таблицы в NPZ
+
+        Args:
+            incremental: только строки после водяного знака
+            tables: список таблиц
+
+        Returns:
+            Манифест выгрузки (с путем к файлу в 'path') или None, если новых строк нет
+        """
+        import numpy as np
+
+        watermarks = self.get_watermarks() if incremental else {}
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        kind = 'incr' if incremental else 'full'
+        path = os.path.join(self.export_dir, f'history_{kind}_{timestamp}.npz')
+        tmp_path = path + '.tmp'
+
+        manifest = {
+            'created_at': datetime.now().isoformat(),
+            'incremental': incremental,
+            'chunk_size': self.chunk_size,
+            'tables': {}
+        }
+
+        conn = self._connect_readonly()
+        try:
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )}
+
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                for table in tables:
+                    if table not in existing:
+                        logger.info(f"  ⏭ {table}: таблица не найдена")
+                        continue
+                    manifest['tables'][table] = self._export_table(
+                        conn, zf, np, table, watermarks.get(table, 0)
+                    )
+
+                total_rows = sum(info['rows'] for info in manifest['tables'].values())
+                manifest['total_rows'] = total_rows
+                with zf.open('__manifest__.npy', 'w') as f:
+                    np.lib.format.write_array(
+                        f, np.frombuffer(json.dumps(manifest, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+                    )
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            conn.close()
+
+        if incremental and manifest['total_rows'] == 0:
+            os.remove(tmp_path)
+            logger.info("ℹ️ Нет новых строк для инкрементальной выгрузки")
+            return None
+
+        os.replace(tmp_path, path)
+        self._save_watermarks(manifest, path)
+
+        manifest['path'] = path
+        manifest['size_bytes'] = os.path.getsize(path)
+        logger.info(f"✅ Выгрузка истории: {path} ({manifest['total_rows']} строк, "
+                    f"{manifest['size_bytes'] / 1024:.1f} КБ)")
+        return manifest
+
+    def _export_table(self, conn: sqlite3.Connection, zf: zipfile.ZipFile, np,
+                      table: str, after_rowid: int) -> Dict:
+        """Выгрузить одну таблицу порциями по rowid"""
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        select_cols = ', '.join(f'"{c}"' for c in columns)
+
+        info = {'columns': columns, 'rows': 0, 'chunks': 0,
+                'first_rowid': None, 'last_rowid': after_rowid}
+        last_rowid = after_rowid
+
+        while True:
+            # Каждая порция - отдельный короткий запрос, блокировки чтения не копятся
+            rows = conn.execute(
+                f"SELECT rowid, {select_cols} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, self.chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+
+            prefix = f"{table}.{info['chunks']:05d}"
+            column_values = list(zip(*rows))
+            self._write_column(zf, np, f"{prefix}._rowid_", column_values[0])
+            for name, values in zip(columns, column_values[1:]):
+                self._write_column(zf, np, f"{prefix}.{name}", values)
+
+            if info['first_rowid'] is None:
+                info['first_rowid'] = rows[0][0]
+            last_rowid = rows[-1][0]
+            info['rows'] += len(rows)
+            info['chunks'] += 1
+
+            if len(rows) < self.chunk_size:
+                break
+
+        info['last_rowid'] = last_rowid
+        logger.info(f"  📤 {table}: {info['rows']} строк, {info['chunks']} порций")
+        return info
+
+    @staticmethod
+    def _write_column(zf: zipfile.ZipFile, np, name: str, values: Sequence):
+        with zf.open(f'{name}.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, _to_array(np, values), allow_pickle=False)
+
+    def list_exports(self) -> List[Dict]:
+        """Список файлов выгрузок (новые первыми)"""
+        result = []
+        for name in sorted(os.listdir(self.export_dir), reverse=True):
+            if name.startswith('history_') and name.endswith('.npz'):
+                path = os.path.join(self.export_dir, name)
+                result.append({'name': name, 'path': path, 'size_bytes': os.path.getsize(path)})
+        return result
+
+
+def _to_array(np, values: Sequence):
+    """
+    Колонка SQLite -> типизированный массив NumPy без pickle:
+    целые без NULL -> int64, числа -> float64 (NULL = NaN), иначе строки UTF-8.
+    """
+    non_null = [v for v in values if v is not None]
+    if non_null and all(isinstance(v, int) for v in non_null) and len(non_null) == len(values):
+        return np.asarray(values, dtype=np.int64)
+    if non_null and all(isinstance(v, (int, float)) for v in non_null):
+        return np.asarray([np.nan if v is None else v for v in values], dtype=np.float64)
+    if all(isinstance(v, bytes) for v in non_null) and non_null:
+        return np.asarray([v.hex() if v is not None else '' for v in values], dtype=np.str_)
+    return np.asarray(['' if v is None else str(v) for v in values], dtype=np.str_)
+
+
+def load_export(path: str) -> Dict[str, Dict]:
+    """
+    Прочитать NPZ-выгрузку обратно: {table: {column: склеенный массив}}
+    """
+    import numpy as np
+
+    data = np.load(path, allow_pickle=False)
+    manifest = json.loads(bytes(data['__manifest__']).decode('utf-8'))
+
+    result = {}
+    for table, info in manifest['tables'].items():
+        table_data = {}
+        for column in ['_rowid_'] + info['columns']:
+            parts = [data[f"{table}.{i:05d}.{column}"] for i in range(info['chunks'])]
+            if parts:
+                # Числовые порции склеиваются с повышением типа, строки с числами - как строки
+                if any(p.dtype.kind == 'U' for p in parts):
+                    parts = [p.astype(np.str_) for p in parts]
+                table_data[column] = np.concatenate(parts)
+        result[table] = table_data
+    return result
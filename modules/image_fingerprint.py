@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отпечатки изображений (perceptual hash + Telegram file_unique_id)
+
+Повторно присланное фото (тот же файл или пересжатая/пересохраненная копия)
+находится по file_unique_id или по pHash с расстоянием Хэмминга <= max_distance.
+Сохраненный результат OCR/Vision переиспользуется только для того же файла
+(exact): разные чеки одного шаблона, снятые в одинаковых условиях, расходятся
+всего на 12-18 бит. Совпадение по pHash - лишь кандидат в повторный чек,
+вызывающий код подтверждает его содержимым (итогами).
+"""
+
+import io
+import json
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy as np
+    from modules.z_report_ocr import crop_receipt
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# 256-битный хэш: пересжатая/уменьшенная копия чека - до ~12 бит, но разные
+# чеки одного шаблона при одинаковой съемке - от ~12 бит: только кандидат
+DEFAULT_MAX_DISTANCE = 14
+DEFAULT_WINDOW_DAYS = 180
+HASH_SIZE = 16
+
+
+def hamming(a: str, b: str) -> int:
+    """Расстояние Хэмминга между hex-хэшами"""
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def _bits_to_hex(bits) -> str:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def perceptual_hash(image_bytes: bytes) -> Optional[str]:
+    """
+    256-битный pHash (hex) обрезанного по ленте чека: DCT 64x64,
+    знак низких частот 16x16 относительно медианы. Общий pHash 8x8 для
+    чеков не годится - все они "белая лента на столе" и почти совпадают.
+    Без OpenCV - dHash 16x16 через Pillow. None, если фото не декодируется.
+    """
+    if CV2_AVAILABLE:
+        gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return None
+        gray = crop_receipt(gray)
+        size = HASH_SIZE * 4
+        small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+        return _bits_to_hex(low > np.median(low[1:]))
+
+    if PIL_AVAILABLE:
+        try:
+            image = Image.open(io.BytesIO(image_bytes)).convert('L').resize((HASH_SIZE + 1, HASH_SIZE))
+        except Exception:
+            return None
+        pixels = list(image.getdata())
+        width = HASH_SIZE + 1
+        return _bits_to_hex(pixels[row * width + col] > pixels[row * width + col + 1]
+                            for row in range(HASH_SIZE) for col in range(HASH_SIZE))
+    return None
+
+
+class ImageFingerprintIndex:
+    """Индекс отпечатков загруженных фото с кэшем результатов распознавания"""
+
+    def __init__(self, db_path: str, max_distance: int = DEFAULT_MAX_DISTANCE,
+                 window_days: int = DEFAULT_WINDOW_DAYS):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self.window_days = window_days
+        self._init_db()
+
+    def _init_db(self):
+        """Создать таблицу отпечатков"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS image_fingerprints (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    phash TEXT,
+                    context_key TEXT NOT NULL DEFAULT '',
+                    result TEXT,
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    ref TEXT,
+                    seen_count INTEGER DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_image_fingerprints_file
+                ON image_fingerprints(kind, file_unique_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_image_fingerprints_recent
+                ON image_fingerprints(kind, created_at)
+            ''')
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Failed to init image_fingerprints: {e}")
+
+    def find(self, kind: str, file_unique_id: Optional[str] = None, phash: Optional[str] = None,
+             context_key: str = '') -> Optional[Dict[str, Any]]:
+        """
+        Найти ранее загруженное фото: сначала точно по file_unique_id,
+        затем ближайшее по pHash (в пределах окна window_days).
+
+        Returns:
+            {'id', 'result', 'ref', 'user_id', 'created_at', 'distance', 'exact'} или None
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            if file_unique_id:
+                cursor.execute('''
+                    SELECT * FROM image_fingerprints
+                    WHERE kind = ? AND file_unique_id = ? AND context_key = ?
+                    ORDER BY id LIMIT 1
+                ''', (kind, file_unique_id, context_key))
+                row = cursor.fetchone()
+                if row:
+                    return self._match(row, 0, exact=True)
+
+            if phash is None:
+                return None
+        finally:
+            conn.close()
+
+        similar = self.find_similar(kind, phash, context_key, limit=1)
+        return similar[0] if similar else None
+
+    def find_similar(self, kind: str, phash: str, context_key: str = '',
+                     limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Фото с pHash в пределах max_distance (окно window_days), ближайшие первыми.
+        Это кандидаты: разные чеки одного шаблона тоже бывают в пределах порога.
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            since = (datetime.now() - timedelta(days=self.window_days)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute('''
+                SELECT id, phash FROM image_fingerprints
+                WHERE kind = ? AND context_key = ? AND created_at >= ? AND phash IS NOT NULL
+            ''', (kind, context_key, since))
+            near = []
+            for row_id, row_hash in cursor.fetchall():
+                distance = hamming(phash, row_hash)
+                if distance <= self.max_distance:
+                    near.append((distance, row_id))
+            near.sort()
+
+            matches = []
+            for distance, row_id in near[:limit]:
+                cursor.execute('SELECT * FROM image_fingerprints WHERE id = ?', (row_id,))
+                matches.append(self._match(cursor.fetchone(), distance, exact=False))
+            return matches
+        finally:
+            conn.close()
+
+    def _match(self, row, distance: int, exact: bool) -> Dict[str, Any]:
+        result = row['result']
+        try:
+            result = json.loads(result) if result else None
+        except (TypeError, ValueError):
+            pass
+        return {
+            'id': row['id'],
+            'result': result,
+            'ref': row['ref'],
+            'user_id': row['user_id'],
+            'created_at': row['created_at'],
+            'distance': distance,
+            'exact': exact,
+        }
+
+    def remember(self, kind: str, file_unique_id: Optional[str], phash: Optional[str],
+                 result: Any, user_id: Optional[int] = None, chat_id: Optional[int] = None,
+                 ref: Optional[str] = None, context_key: str = '') -> int:
+        """Сохранить отпечаток и результат распознавания"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO image_fingerprints
+            (kind, file_unique_id, phash, context_key, result, user_id, chat_id, ref, created_at, last_seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (kind, file_unique_id, phash, context_key,
+              json.dumps(result, ensure_ascii=False) if result is not None else None,
+              user_id, chat_id, ref,
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        fingerprint_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return fingerprint_id
+
+    def touch(self, fingerprint_id: int):
+        """Отметить повторную загрузку"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            UPDATE image_fingerprints
+            SET seen_count = seen_count + 1, last_seen_at = ?
+            WHERE id = ?
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), fingerprint_id))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Notification Dispatcher - центральная рассылка уведомлений бота
+
+Все служебные уведомления (напоминания смен, расхождения кассы, проблемы,
+запросы на обмен сменами) проходят через одну очередь с приоритетами:
+- токен-бакеты под лимиты Telegram: общий (~30 сообщений/сек) и по чатам
+  (1/сек в личку, 20/мин в группы);
+- параллельная отправка в разные чаты несколькими воркерами; сообщение в
+  "занятый" чат откладывается, не блокируя остальные;
+- повтор при RetryAfter (429) и сетевых ошибках, ошибки одного получателя
+  не прерывают рассылку остальным; TimedOut не повторяется - запрос мог
+  дойти до Telegram, и повтор дал бы дубль (статус unconfirmed);
+- дедупликация по ключу (одно и то же уведомление не уходит дважды);
+- deliver() ждет результата и бросает DeliveryError при недоставке, чтобы
+  вызывающий (например, очередь дедлайнов) мог повторить;
+- журнал доставки в таблице notification_log пишется пачками в отдельном
+  потоке, не блокируя event loop.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше - важнее)
+PRIORITY_CRITICAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 3
+
+# Лимиты Telegram Bot API
+GLOBAL_RATE = 30.0              # сообщений в секунду на бота
+PRIVATE_CHAT_RATE = 1.0         # сообщений в секунду в один личный чат
+GROUP_CHAT_RATE = 20.0 / 60.0   # сообщений в секунду в одну группу
+
+DEFAULT_WORKERS = 8
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 2.0
+DEDUP_TTL_SECONDS = 3600
+
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_DEDUPLICATED = 'deduplicated'
+STATUS_UNCONFIRMED = 'unconfirmed'
+
+# Сколько deliver() ждет доставки (лимиты Telegram и повторы)
+DELIVER_TIMEOUT_SECONDS = 120
+
+
+class DeliveryError(Exception):
+    """Уведомление не доставлено части получателей"""
+
+
+class TokenBucket:
+    """Классический токен-бакет: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до появления токена (0 - можно отправлять сейчас)"""
+        now = self.clock()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill(self.clock())
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Пауза после RetryAfter: токены обнуляются до конца окна"""
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+        self.tokens = 0
+
+
+class NotificationDispatcher:
+    """Очередь уведомлений с ограничением скорости и журналом доставки"""
+
+    def __init__(self, bot, db_path: str = 'club_assistant.db', workers: int = DEFAULT_WORKERS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.bot = bot
+        self.db_path = db_path
+        self.workers = workers
+        self.clock = clock
+
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE, clock)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._dedup: Dict[str, float] = {}
+
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopped = False
+
+        self._log_rows: List[Tuple] = []
+        self._log_task: Optional[asyncio.Task] = None
+
+        self._init_db()
+
+    def _init_db(self):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    category TEXT,
+                    dedup_key TEXT,
+                    priority INTEGER,
+                    status TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    message_id INTEGER,
+                    error TEXT,
+                    queued_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_notification_log_created
+                ON notification_log(created_at)
+            """)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Failed to init notification_log: {e}")
+
+    # ===== ПОСТАНОВКА В ОЧЕРЕДЬ =====
+
+    def submit(self, chat_id, text: str, priority: int = PRIORITY_NORMAL,
+               dedup_key: Optional[str] = None, dedup_ttl: float = DEDUP_TTL_SECONDS,
+               category: Optional[str] = None, **kwargs) -> Optional[asyncio.Future]:
+        """
+        Поставить сообщение в очередь. kwargs передаются в bot.send_message
+        (parse_mode, reply_markup, ...).
+
+        Returns:
+            Future с отправленным Message (None при неудаче)
+            или None, если chat_id пуст либо уведомление - дубликат
+        """
+        item = self._enqueue(chat_id, text, priority, dedup_key, dedup_ttl, category, kwargs)
+        return item['future'] if item else None
+
+    def _enqueue(self, chat_id, text: str, priority: int, dedup_key: Optional[str],
+                 dedup_ttl: float, category: Optional[str], kwargs: Dict) -> Optional[Dict]:
+        if not chat_id:
+            return None
+
+        if dedup_key:
+            key = f"{dedup_key}:{chat_id}"
+            now = self.clock()
+            expires = self._dedup.get(key)
+            if expires is not None and expires > now:
+                logger.info(f"📭 Duplicate notification skipped: {key}")
+                self._log(chat_id, category, dedup_key, priority, STATUS_DEDUPLICATED, 0)
+                return None
+            self._dedup[key] = now + dedup_ttl
+            if len(self._dedup) > 1000:
+                self._dedup = {k: v for k, v in self._dedup.items() if v > now}
+
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        item = {
+            'chat_id': chat_id,
+            'text': text,
+            'kwargs': kwargs,
+            'priority': priority,
+            'dedup_key': dedup_key,
+            'category': category,
+            'attempts': 0,
+            'queued_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'future': future,
+            'status': None,
+        }
+        self._push(item, ready_at=0.0)
+        return item
+
+    def fan_out(self, chat_ids: Iterable, text: str, **kwargs) -> List[asyncio.Future]:
+        """Одно сообщение нескольким получателям (пустые и повторные chat_id пропускаются)"""
+        futures = []
+        seen = set()
+        for chat_id in chat_ids:
+            if not chat_id or chat_id in seen:
+                continue
+            seen.add(chat_id)
+            future = self.submit(chat_id, text, **kwargs)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    async def deliver(self, chat_ids: Iterable, text: str, priority: int = PRIORITY_NORMAL,
+                      dedup_key: Optional[str] = None, category: Optional[str] = None,
+                      timeout: float = DELIVER_TIMEOUT_SECONDS, **kwargs) -> List:
+        """
+        Разослать и дождаться результата.
+        Получатели, которым уведомление уже ушло (дубликат по dedup_key),
+        пропускаются - повторный вызов досылает только недоставленным.
+        Неподтвержденная отправка (TimedOut) ошибкой не считается: сообщение
+        могло дойти, повтор дал бы дубль.
+
+        Returns:
+            Отправленные Message
+
+        Raises:
+            DeliveryError, если кому-то доставить не удалось или не дождались за timeout
+        """
+        items = []
+        seen = set()
+        for chat_id in chat_ids:
+            if not chat_id or chat_id in seen:
+                continue
+            seen.add(chat_id)
+            item = self._enqueue(chat_id, text, priority, dedup_key, DEDUP_TTL_SECONDS, category, kwargs)
+            if item is not None:
+                items.append(item)
+        if not items:
+            return []
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(asyncio.shield(item['future']) for item in items)), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise DeliveryError(f"не дождались доставки за {timeout:.0f} с")
+
+        failed = [item['chat_id'] for item in items if item['status'] == STATUS_FAILED]
+        if failed:
+            raise DeliveryError(f"не доставлено {len(failed)} из {len(items)}: {failed}")
+        return [item['future'].result() for item in items if item['status'] == STATUS_SENT]
+
+    async def send(self, chat_id, text: str, **kwargs):
+        """Отправить через очередь и дождаться результата (Message или None)"""
+        future = self.submit(chat_id, text, **kwargs)
+        if future is None:
+            return None
+        return await future
+
+    # ===== ВОРКЕРЫ =====
+
+    def _ensure_started(self):
+        if self._tasks and not self._stopped:
+            return
+        self._stopped = False
+        self._cond = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"📬 Notification dispatcher started ({self.workers} workers)")
+
+    def _push(self, item: Dict, ready_at: float):
+        item['ready_at'] = ready_at
+        if 'seq' not in item:
+            item['seq'] = next(self._seq)
+        heapq.heappush(self._heap, (item['priority'], item['seq'], item))
+        asyncio.get_running_loop().create_task(self._wake())
+
+    async def _wake(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные chat_id - группы и каналы, у них лимит строже
+            rate = GROUP_CHAT_RATE if isinstance(chat_id, int) and chat_id < 0 else PRIVATE_CHAT_RATE
+            bucket = TokenBucket(rate, 1.0, self.clock)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self) -> Tuple[Optional[Dict], Optional[float]]:
+        """
+        Взять самое приоритетное сообщение, которое можно отправить сейчас.
+        Сообщения в чаты с исчерпанным лимитом (и отложенные повторы) остаются
+        в очереди, поэтому один "шумный" чат не задерживает остальные.
+
+        Returns:
+            (сообщение, None) или (None, сколько ждать до ближайшего; None - очередь пуста)
+        """
+        now = self.clock()
+        deferred = []
+        wait = None
+        selected = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            item = entry[2]
+            delay = max(item['ready_at'] - now, self._chat_bucket(item['chat_id']).delay())
+            if delay <= 0:
+                selected = item
+                break
+            deferred.append(entry)
+            wait = delay if wait is None else min(wait, delay)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return selected, (None if selected else wait)
+
+    async def _worker(self, index: int):
+        while not self._stopped:
+            async with self._cond:
+                item, wait = self._next_ready()
+                while item is None:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    item, wait = self._next_ready()
+                # Токен чата занимаем сразу, чтобы другой воркер не отправил туда же
+                self._chat_bucket(item['chat_id']).consume()
+
+            global_delay = self.global_bucket.delay()
+            while global_delay > 0:
+                await asyncio.sleep(global_delay)
+                global_delay = self.global_bucket.delay()
+            self.global_bucket.consume()
+
+            await self._deliver(item)
+
+    async def _deliver(self, item: Dict):
+        item['attempts'] += 1
+        chat_id = item['chat_id']
+        try:
+            message = await self.bot.send_message(chat_id=chat_id, text=item['text'], **item['kwargs'])
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"⏳ Flood control for {chat_id}: retry in {retry_after:.0f}s")
+            # 429 может означать как лимит чата, так и общий - притормаживаем оба
+            self._chat_bucket(chat_id).block(retry_after)
+            self.global_bucket.block(min(retry_after, 1.0))
+            # Отсрочку обеспечивает блокировка чата; сообщение сохраняет место в очереди чата
+            item['attempts'] -= 1
+            self._retry(item, 0, str(e))
+            return
+        except (BadRequest, Forbidden) as e:
+            # Чат недоступен или сообщение некорректно - повтор не поможет
+            self._finish(item, None, str(e))
+            return
+        except TimedOut as e:
+            # Запрос мог дойти до Telegram: повтор рискует дублем
+            self._finish(item, None, str(e), unconfirmed=True)
+            return
+        except NetworkError as e:
+            self._retry(item, RETRY_BACKOFF_SECONDS * item['attempts'], str(e))
+            return
+        except Exception as e:
+            self._finish(item, None, str(e))
+            return
+        self._finish(item, message, None)
+
+    def _retry(self, item: Dict, delay: float, error: str):
+        if item['attempts'] >= MAX_ATTEMPTS:
+            self._finish(item, None, error)
+            return
+        self._push(item, ready_at=self.clock() + delay if delay else 0.0)
+
+    def _finish(self, item: Dict, message, error: Optional[str], unconfirmed: bool = False):
+        if unconfirmed:
+            # Ключ дедупликации остается: повторная постановка не продублирует сообщение
+            logger.warning(f"⚠️ Notification to {item['chat_id']} unconfirmed: {error}")
+            item['status'] = STATUS_UNCONFIRMED
+        elif error:
+            logger.error(f"❌ Notification to {item['chat_id']} failed: {error}")
+            if item['dedup_key']:
+                # Недоставленное уведомление можно отправить повторно
+                self._dedup.pop(f"{item['dedup_key']}:{item['chat_id']}", None)
+            item['status'] = STATUS_FAILED
+        else:
+            item['status'] = STATUS_SENT
+        self._log(
+            item['chat_id'], item['category'], item['dedup_key'], item['priority'],
+            item['status'], item['attempts'],
+            getattr(message, 'message_id', None), error, item['queued_at']
+        )
+        if not item['future'].done():
+            item['future'].set_result(message)
+
+    def _log(self, chat_id, category, dedup_key, priority, status, attempts,
+             message_id=None, error=None, queued_at=None):
+        """Добавить запись в журнал доставки (пишется фоновой задачей через поток)"""
+        self._log_rows.append((chat_id, category, dedup_key, priority, status, attempts, message_id,
+                               error[:500] if error else None, queued_at))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_log(self._take_log_rows())
+            return
+        if self._log_task is None or self._log_task.done():
+            self._log_task = loop.create_task(self._flush_log())
+
+    def _take_log_rows(self) -> List[Tuple]:
+        rows, self._log_rows = self._log_rows, []
+        return rows
+
+    async def _flush_log(self):
+        while self._log_rows:
+            await asyncio.to_thread(self._write_log, self._take_log_rows())
+
+    def _write_log(self, rows: List[Tuple]):
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.executemany("""
+                INSERT INTO notification_log
+                (chat_id, category, dedup_key, priority, status, attempts, message_id, error, queued_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Failed to write notification log: {e}")
+
+    async def stop(self):
+        """Остановить воркеры (неотправленные сообщения остаются в памяти)"""
+        self._stopped = True
+        if self._cond is not None:
+            await self._wake()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._log_task is not None:
+            await self._log_task
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+
+def get_notifier(bot_data: Dict, bot=None) -> Optional[NotificationDispatcher]:
+    """
+    Общий диспетчер из bot_data (создается при первом обращении, если передан bot)
+    """
+    notifier = bot_data.get('notifier')
+    if notifier is None and bot is not None:
+        notifier = NotificationDispatcher(bot, bot_data.get('db_path', 'club_assistant.db'))
+        bot_data['notifier'] = notifier
+    return notifier
@@ -111,8 +111,9 @@ async def show_owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🔄 Обновить", callback_data="owner_panel")],
         [
             InlineKeyboardButton("📊 Финансы", callback_data="owner_finance"),
-            InlineKeyboardButton("🧹 Отзывы", callback_data="reviews_all")
+            InlineKeyboardButton("🔮 Прогноз", callback_data="owner_forecast")
         ],
+        [InlineKeyboardButton("🧹 Отзывы", callback_data="reviews_all")],
         [
             InlineKeyboardButton("⭐️ Рейтинги уборки", callback_data="owner_cleaning_ratings"),
             InlineKeyboardButton("📦 Инвентарь", callback_data="owner_inventory")
@@ -231,6 +232,30 @@ async def show_owner_finance(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
 
 
+async def show_owner_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать прогноз выручки и остатков сейфа (из кеша прогнозов)"""
+    query = update.callback_query
+    await query.answer()
+
+    db_path = context.bot_data.get('db_path', '/opt/club_assistant/club_assistant.db')
+
+    try:
+        from modules.revenue_forecast import RevenueForecaster
+
+        text = RevenueForecaster(db_path).format_forecast()
+
+    except Exception as e:
+        logger.error(f"Error in show_owner_forecast: {e}")
+        text = f"🔮 <b>Прогноз выручки</b>\n\n❌ Ошибка: {e}"
+
+    keyboard = [
+        [InlineKeyboardButton("◀️ Назад", callback_data="owner_panel")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
+
+
 async def show_owner_cleaning_ratings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать рейтинги уборки админов"""
     query = update.callback_query
@@ -415,6 +440,8 @@ async def handle_owner_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await show_owner_panel(update, context)
     elif data == "owner_finance":
         await show_owner_finance(update, context)
+    elif data == "owner_forecast":
+        await show_owner_forecast(update, context)
     elif data == "owner_cleaning_ratings":
         await show_owner_cleaning_ratings(update, context)
     elif data == "owner_inventory":
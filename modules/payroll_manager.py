@@ -10,6 +10,8 @@ from datetime import datetime, date, timedelta
 from typing import Optional, Dict, List, Tuple
 from decimal import Decimal, ROUND_HALF_UP
 
+from modules.salary_engine import compute_period, get_salary_engine
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +20,7 @@ class PayrollManager:
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self.engine = get_salary_engine(db_path)
     
     def _get_conn(self) -> sqlite3.Connection:
         """Get database connection"""
@@ -284,7 +287,14 @@ class PayrollManager:
     # ===== Period Calculations =====
     
     def calculate_period_salary(self, admin_id: int, start_date: date, end_date: date) -> Dict:
-        """Calculate salary for a period (advance or salary)"""
+        """Calculate salary for a period (advance or salary), cached until the data changes"""
+        return self.engine.cached(
+            ('payroll', admin_id, start_date.isoformat(), end_date.isoformat()),
+            lambda: self._calculate_period_salary(admin_id, start_date, end_date)
+        )
+    
+    def _calculate_period_salary(self, admin_id: int, start_date: date, end_date: date) -> Dict:
+        """Calculate salary for a period from raw rows"""
         try:
             # Get admin employment type
             employment_type = self.get_admin_employment_type(admin_id)
@@ -307,20 +317,12 @@ class PayrollManager:
                 AND closed_at IS NOT NULL
                 AND DATE(closed_at) >= ? 
                 AND DATE(closed_at) <= ?
-                ORDER BY closed_at
+                ORDER BY closed_at, id
             ''', (admin_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
             
             shifts = cursor.fetchall()
             conn.close()
             
-            # Calculate totals
-            total_shifts = len(shifts)
-            total_gross = total_shifts * config['rate_per_shift']
-            total_tax = (total_gross * config['tax_percentage']) / 100
-            total_net = total_gross - total_tax
-            total_taken = sum(shift[5] or 0 for shift in shifts)
-            remaining = total_net - total_taken
-            
             # Get payments in period
             payments = self.get_admin_payments(admin_id, start_date, end_date)
             
@@ -329,14 +331,7 @@ class PayrollManager:
                 'employment_type': employment_type,
                 'period_start': start_date,
                 'period_end': end_date,
-                'rate_per_shift': config['rate_per_shift'],
-                'tax_percentage': config['tax_percentage'],
-                'total_shifts': total_shifts,
-                'total_gross': total_gross,
-                'total_tax': total_tax,
-                'total_net': total_net,
-                'total_taken_from_cash': total_taken,
-                'remaining_salary': remaining,
+                **self._period_totals([shift[5] for shift in shifts], config),
                 'shifts': [
                     {
                         'shift_id': shift[0],
@@ -353,6 +348,21 @@ class PayrollManager:
             logger.error(f"Error calculating period salary: {e}")
             return {'error': str(e)}
     
+    def _period_totals(self, taken: List[Optional[float]], config: Dict) -> Dict:
+        """Period totals from salary_taken of its shifts (in closed_at order)"""
+        amounts = compute_period(len(taken), config['rate_per_shift'], config['tax_percentage'],
+                                 sum(amount or 0 for amount in taken))
+        return {
+            'rate_per_shift': config['rate_per_shift'],
+            'tax_percentage': config['tax_percentage'],
+            'total_shifts': amounts['total_shifts'],
+            'total_gross': amounts['gross'],
+            'total_tax': amounts['tax'],
+            'total_net': amounts['net'],
+            'total_taken_from_cash': amounts['cash_taken'],
+            'remaining_salary': amounts['due']
+        }
+    
     def calculate_advance(self, admin_id: int, year: int, month: int) -> Dict:
         """Calculate advance for 1-15 of month"""
         start_date = date(year, month, 1)
@@ -372,8 +382,27 @@ class PayrollManager:
     # ===== Summary Statistics =====
     
     def get_payroll_summary(self, year: int, month: int) -> Dict:
-        """Get payroll summary for all admins in month"""
+        """Get payroll summary for all admins in month, cached until the data changes"""
+        return self.engine.cached(('payroll_summary', year, month),
+                                  lambda: self._get_payroll_summary(year, month))
+    
+    def _get_payroll_summary(self, year: int, month: int) -> Dict:
+        """
+        Payroll summary for all admins in month from raw rows
+        
+        Set-based: one query per source for the whole month (admins, salary
+        configs, closed shifts), split into advance (1-15) and salary (16-end)
+        in a single pass. Totals are computed by _period_totals exactly as in
+        calculate_advance / calculate_salary.
+        """
         try:
+            month_start = date(year, month, 1)
+            advance_end = date(year, month, 15)
+            if month == 12:
+                month_end = date(year + 1, 1, 1) - timedelta(days=1)
+            else:
+                month_end = date(year, month + 1, 1) - timedelta(days=1)
+            
             conn = self._get_conn()
             cursor = conn.cursor()
             
@@ -384,8 +413,32 @@ class PayrollManager:
                 WHERE is_active = 1
                 ORDER BY full_name
             ''')
-            
             admins = cursor.fetchall()
+            
+            cursor.execute('''
+                SELECT employment_type, rate_per_shift, tax_percentage
+                FROM salary_config
+            ''')
+            configs = {
+                row[0]: {'rate_per_shift': row[1], 'tax_percentage': row[2]}
+                for row in cursor.fetchall()
+            }
+            
+            # All closed shifts of the month, bucketed by admin and half-month
+            cursor.execute('''
+                SELECT admin_id, DATE(closed_at), salary_taken
+                FROM active_shifts 
+                WHERE closed_at IS NOT NULL
+                AND DATE(closed_at) >= ? 
+                AND DATE(closed_at) <= ?
+                ORDER BY closed_at, id
+            ''', (month_start.strftime('%Y-%m-%d'), month_end.strftime('%Y-%m-%d')))
+            
+            advance_day = advance_end.strftime('%Y-%m-%d')
+            taken_by_half: Dict[int, Tuple[List, List]] = {}
+            for admin_id, closed_day, salary_taken in cursor.fetchall():
+                halves = taken_by_half.setdefault(admin_id, ([], []))
+                halves[0 if closed_day <= advance_day else 1].append(salary_taken)
             conn.close()
             
             summary = {
@@ -407,40 +460,44 @@ class PayrollManager:
                 full_name = admin[2]
                 employment_type = admin[3] or 'self_employed'
                 
-                # Calculate advance (1-15)
-                advance = self.calculate_advance(admin_id, year, month)
-                salary = self.calculate_salary(admin_id, year, month)
+                # Same skip rules as calculate_period_salary
+                config = configs.get(admin[3]) if admin[3] else None
+                if not config:
+                    continue
+                
+                advance_taken, salary_taken = taken_by_half.get(admin_id, ([], []))
+                advance = self._period_totals(advance_taken, config)
+                salary = self._period_totals(salary_taken, config)
+                
+                total_gross = advance['total_gross'] + salary['total_gross']
+                total_tax = advance['total_tax'] + salary['total_tax']
+                total_net = advance['total_net'] + salary['total_net']
+                total_taken = advance['total_taken_from_cash'] + salary['total_taken_from_cash']
+                remaining = advance['remaining_salary'] + salary['remaining_salary']
+                
+                admin_summary = {
+                    'admin_id': admin_id,
+                    'username': username,
+                    'full_name': full_name,
+                    'employment_type': employment_type,
+                    'advance_shifts': advance['total_shifts'],
+                    'salary_shifts': salary['total_shifts'],
+                    'total_shifts': advance['total_shifts'] + salary['total_shifts'],
+                    'gross_salary': total_gross,
+                    'tax_amount': total_tax,
+                    'net_salary': total_net,
+                    'taken_from_cash': total_taken,
+                    'remaining': remaining
+                }
+                
+                summary['admins'].append(admin_summary)
                 
-                if 'error' not in advance and 'error' not in salary:
-                    total_gross = advance['total_gross'] + salary['total_gross']
-                    total_tax = advance['total_tax'] + salary['total_tax']
-                    total_net = advance['total_net'] + salary['total_net']
-                    total_taken = advance['total_taken_from_cash'] + salary['total_taken_from_cash']
-                    remaining = advance['remaining_salary'] + salary['remaining_salary']
-                    
-                    admin_summary = {
-                        'admin_id': admin_id,
-                        'username': username,
-                        'full_name': full_name,
-                        'employment_type': employment_type,
-                        'advance_shifts': advance['total_shifts'],
-                        'salary_shifts': salary['total_shifts'],
-                        'total_shifts': advance['total_shifts'] + salary['total_shifts'],
-                        'gross_salary': total_gross,
-                        'tax_amount': total_tax,
-                        'net_salary': total_net,
-                        'taken_from_cash': total_taken,
-                        'remaining': remaining
-                    }
-                    
-                    summary['admins'].append(admin_summary)
-                    
-                    # Add to totals
-                    summary['totals']['total_gross'] += total_gross
-                    summary['totals']['total_tax'] += total_tax
-                    summary['totals']['total_net'] += total_net
-                    summary['totals']['total_taken'] += total_taken
-                    summary['totals']['total_remaining'] += remaining
+                # Add to totals
+                summary['totals']['total_gross'] += total_gross
+                summary['totals']['total_tax'] += total_tax
+                summary['totals']['total_net'] += total_net
+                summary['totals']['total_taken'] += total_taken
+                summary['totals']['total_remaining'] += remaining
             
             return summary
         except Exception as e:
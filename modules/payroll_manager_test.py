@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Property test: set-based payroll summary equals the per-admin path
+
+Builds randomized databases (admins with every kind of employment type,
+missing salary configs, shifts on half-month boundaries, date-only and
+NULL closed_at, fractional cash withdrawals) and checks that
+PayrollManager.get_payroll_summary returns exactly what the original
+per-admin loop over calculate_advance / calculate_salary produced.
+
+Run:
+    python -m modules.payroll_manager_test --cases 300 --seed 45
+    python -m pytest modules/payroll_manager_test.py
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+from typing import Dict
+
+from modules.payroll_manager import PayrollManager
+
+MONTHS = ((2025, 2), (2025, 11), (2025, 12), (2026, 1))
+EMPLOYMENT_TYPES = ('self_employed', 'staff', 'contractor', 'ghost')
+TOTAL_KEYS = ('total_gross', 'total_tax', 'total_net', 'total_taken', 'total_remaining')
+
+SCHEMA = """
+CREATE TABLE admins (
+    user_id INTEGER, username TEXT, full_name TEXT, employment_type TEXT,
+    is_active INTEGER, updated_at TEXT
+);
+CREATE TABLE salary_config (
+    id INTEGER PRIMARY KEY, employment_type TEXT UNIQUE, rate_per_shift REAL,
+    tax_percentage REAL, updated_at TEXT
+);
+CREATE TABLE active_shifts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, admin_id INTEGER, club TEXT, shift_type TEXT,
+    opened_at TEXT, closed_at TEXT, salary_taken REAL
+);
+CREATE TABLE salary_payments (
+    id INTEGER PRIMARY KEY, admin_id INTEGER, shift_id INTEGER, amount REAL,
+    payment_type TEXT, payment_date DATE, notes TEXT, created_at TEXT
+);
+CREATE INDEX idx_active_shifts_closed ON active_shifts(closed_at);
+"""
+
+
+def per_admin_summary(manager: PayrollManager, year: int, month: int) -> Dict:
+    """Reference: the original summary, one calculate_advance + calculate_salary per admin"""
+    conn = sqlite3.connect(manager.db_path)
+    admins = conn.execute('''
+        SELECT user_id, username, full_name, employment_type
+        FROM admins WHERE is_active = 1 ORDER BY full_name
+    ''').fetchall()
+    conn.close()
+
+    summary = {'year': year, 'month': month, 'admins': [], 'totals': dict.fromkeys(TOTAL_KEYS, 0)}
+    for admin_id, username, full_name, employment_type in admins:
+        advance = manager.calculate_advance(admin_id, year, month)
+        salary = manager.calculate_salary(admin_id, year, month)
+        if 'error' in advance or 'error' in salary:
+            continue
+        gross = advance['total_gross'] + salary['total_gross']
+        tax = advance['total_tax'] + salary['total_tax']
+        net = advance['total_net'] + salary['total_net']
+        taken = advance['total_taken_from_cash'] + salary['total_taken_from_cash']
+        remaining = advance['remaining_salary'] + salary['remaining_salary']
+        summary['admins'].append({
+            'admin_id': admin_id,
+            'username': username,
+            'full_name': full_name,
+            'employment_type': employment_type or 'self_employed',
+            'advance_shifts': advance['total_shifts'],
+            'salary_shifts': salary['total_shifts'],
+            'total_shifts': advance['total_shifts'] + salary['total_shifts'],
+            'gross_salary': gross,
+            'tax_amount': tax,
+            'net_salary': net,
+            'taken_from_cash': taken,
+            'remaining': remaining,
+        })
+        for key, value in zip(TOTAL_KEYS, (gross, tax, net, taken, remaining)):
+            summary['totals'][key] += value
+    return summary
+
+
+def make_database(path: str, rnd: random.Random, admins: int, shifts: int):
+    """Random payroll data, biased towards the edge cases of the half-month split"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    for employment_type in EMPLOYMENT_TYPES[:3]:
+        if rnd.random() < 0.9:
+            conn.execute(
+                'INSERT INTO salary_config (employment_type, rate_per_shift, tax_percentage) VALUES (?, ?, ?)',
+                (employment_type, rnd.choice([2000.0, 1800.5, 2213.37, 1999]), rnd.choice([6.0, 43.0, 13.3, 0, 15]))
+            )
+    for i in range(admins):
+        conn.execute('INSERT INTO admins VALUES (?, ?, ?, ?, ?, NULL)', (
+            100 + i, f'u{i}', rnd.choice(['Ann', 'Bob', None, f'N{i}']),
+            rnd.choice(EMPLOYMENT_TYPES + (None, '')), rnd.choice([1, 1, 1, 0])
+        ))
+    for _ in range(shifts):
+        year, month = rnd.choice(MONTHS)
+        day = rnd.randint(1, 28 if month == 2 else 31 if month in (12, 1) else 30)
+        closed_at = rnd.choice([
+            f"{year}-{month:02d}-{day:02d} {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00",
+            f"{year}-{month:02d}-{day:02d}",
+            None,
+            f"{year}-{month:02d}-15 23:59:59",
+            f"{year}-{month:02d}-16 00:00:00",
+        ])
+        conn.execute(
+            'INSERT INTO active_shifts (admin_id, club, shift_type, closed_at, salary_taken) VALUES (?, ?, ?, ?, ?)',
+            (100 + rnd.randrange(admins + 2), 'rio', 'morning', closed_at,
+             rnd.choice([None, 0, 500, 333.33, 0.1, 1000.7, 250]))
+        )
+    conn.commit()
+    conn.close()
+
+
+def check_equivalence(cases: int, seed: int):
+    """Raise AssertionError on the first database where the two paths differ"""
+    rnd = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix='payroll_')
+    try:
+        for case in range(cases):
+            path = os.path.join(workdir, f'case_{case}.db')
+            make_database(path, rnd, rnd.randint(0, 12), rnd.randint(0, 200))
+            manager = PayrollManager(path)
+            for year, month in MONTHS:
+                batched = manager.get_payroll_summary(year, month)
+                reference = per_admin_summary(manager, year, month)
+                assert batched == reference, (
+                    f"seed {seed}, case {case}, {year}-{month:02d}:\n"
+                    f"  set-based: {batched}\n  per-admin: {reference}"
+                )
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_summary_matches_per_admin_path():
+    check_equivalence(cases=100, seed=45)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Payroll summary property test')
+    parser.add_argument('--cases', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=45)
+    args = parser.parse_args()
+    try:
+        check_equivalence(args.cases, args.seed)
+    except AssertionError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ {args.cases} random databases x {len(MONTHS)} months: identical")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
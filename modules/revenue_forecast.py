@@ -0,0 +1,405 @@
+"""
+Модуль прогнозирования выручки и остатков кассы
+Автор: Club Assistant Bot
+
+Модель: для каждой пары (клуб, тип смены) - взвешенная ridge-регрессия
+выручки смены на признаки дня недели, праздников/предпраздничных дней и
+линейного тренда. Свежие смены весят больше (экспоненциальное затухание).
+Обучение - один SQL-запрос и замкнутое решение NumPy на группу, поэтому
+на многолетней истории укладывается в доли секунды.
+
+Прогноз на 30 дней вперед пересчитывается по расписанию (ночью) и
+кешируется в таблице revenue_forecasts; панель владельца и WebApp
+читают готовый прогноз.
+"""
+
+import logging
+import sqlite3
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Moscow timezone (UTC+3)
+MSK = timezone(timedelta(hours=3))
+
+# День смены по МСК (opened_at хранится в UTC) - как в архиве и отчетах
+SHIFT_DAY_SQL = "DATE(opened_at, '+3 hours')"
+
+FORECAST_HORIZON_DAYS = 30
+
+# Период полураспада веса смены (дни): недавние смены влияют сильнее
+HALF_LIFE_DAYS = 120
+
+# Регуляризация ridge
+RIDGE_ALPHA = 1.0
+
+# Окно для оценки среднего суточного расхода наличных (дни)
+CASH_OUTFLOW_WINDOW_DAYS = 60
+
+# Нерабочие праздничные дни РФ (месяц, день)
+RU_HOLIDAYS = {
+    (1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8),
+    (2, 23), (3, 8), (5, 1), (5, 9), (6, 12), (11, 4), (12, 31),
+}
+
+# Признаки: 7 дней недели + праздник + предпраздничный день + тренд
+N_FEATURES = 10
+
+
+def is_holiday(day: date) -> bool:
+    return (day.month, day.day) in RU_HOLIDAYS
+
+
+def _day_features(days: List[date], origin: date):
+    """Матрица признаков для списка дат (NumPy)"""
+    import numpy as np
+
+    X = np.zeros((len(days), N_FEATURES), dtype=np.float64)
+    for i, day in enumerate(days):
+        X[i, day.weekday()] = 1.0
+        X[i, 7] = 1.0 if is_holiday(day) else 0.0
+        X[i, 8] = 1.0 if is_holiday(day + timedelta(days=1)) and not is_holiday(day) else 0.0
+        X[i, 9] = (day - origin).days / 365.0
+    return X
+
+
+def _fit_ridge(X, y, weights, alpha: float = RIDGE_ALPHA):
+    """
+    Взвешенная ridge-регрессия в замкнутой форме.
+    Дни недели образуют полный one-hot базис, поэтому отдельный свободный член не нужен.
+    """
+    import numpy as np
+
+    # Уровни дней недели почти не штрафуем (это базовая выручка, а не эффект)
+    penalty = np.full(X.shape[1], alpha)
+    penalty[:7] = alpha * 1e-3
+
+    Xw = X * weights[:, None]
+    A = X.T @ Xw + np.diag(penalty)
+    b = Xw.T @ y
+    coef = np.linalg.solve(A, b)
+    residuals = y - X @ coef
+    dof = max(1.0, weights.sum() - X.shape[1])
+    sigma = float(np.sqrt((weights * residuals ** 2).sum() / dof))
+    return coef, sigma
+
+
+class RevenueForecaster:
+    """Обучение сезонной модели и кеш прогнозов"""
+
+    def __init__(self, db_path: str = 'club_assistant.db'):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        """Таблица кеша прогнозов"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS revenue_forecasts (
+                    club TEXT NOT NULL,
+                    forecast_date DATE NOT NULL,
+                    revenue REAL NOT NULL,
+                    revenue_low REAL NOT NULL,
+                    revenue_high REAL NOT NULL,
+                    cash_revenue REAL NOT NULL,
+                    cash_balance REAL,
+                    is_holiday INTEGER DEFAULT 0,
+                    generated_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (club, forecast_date)
+                )
+            """)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Error creating revenue_forecasts table: {e}")
+
+    # ===== ОБУЧЕНИЕ =====
+
+    def _load_history(self) -> List[Tuple]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(f"""
+                SELECT
+                    club,
+                    shift_type,
+                    {SHIFT_DAY_SQL} as shift_date,
+                    COALESCE(total_revenue, 0),
+                    COALESCE(cash_revenue, 0)
+                FROM finmon_shifts
+                WHERE closed_at IS NOT NULL
+                AND opened_at IS NOT NULL
+                AND club IS NOT NULL
+                ORDER BY opened_at
+            """).fetchall()
+        finally:
+            conn.close()
+
+    def _load_cash_state(self, club: str) -> Tuple[Optional[float], float]:
+        """
+        Последний остаток сейфа и средний суточный отток наличных по клубу
+
+        Отток = наличная выручка за окно - прирост сейфа за окно (инкассации, расходы, выплаты).
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cutoff = (datetime.now(MSK).date() - timedelta(days=CASH_OUTFLOW_WINDOW_DAYS)).isoformat()
+            rows = conn.execute(f"""
+                SELECT {SHIFT_DAY_SQL}, COALESCE(cash_revenue, 0), safe_cash_end
+                FROM finmon_shifts
+                WHERE club = ? AND closed_at IS NOT NULL AND {SHIFT_DAY_SQL} >= ?
+                ORDER BY closed_at
+            """, (club, cutoff)).fetchall()
+            if not rows:
+                last = conn.execute("""
+                    SELECT safe_cash_end FROM finmon_shifts
+                    WHERE club = ? AND closed_at IS NOT NULL
+                    ORDER BY closed_at DESC LIMIT 1
+                """, (club,)).fetchone()
+                return (last[0] if last else None), 0.0
+        finally:
+            conn.close()
+
+        last_balance = rows[-1][2]
+        if len(rows) < 2 or rows[0][2] is None or last_balance is None:
+            return last_balance, 0.0
+
+        first_day = date.fromisoformat(rows[0][0])
+        last_day = date.fromisoformat(rows[-1][0])
+        days = max(1, (last_day - first_day).days + 1)
+        # Выручка первой смены уже учтена в ее safe_cash_end
+        cash_in = sum(row[1] for row in rows[1:])
+        outflow = (cash_in - (last_balance - rows[0][2])) / days
+        return last_balance, max(0.0, outflow)
+
+    def train(self, today: Optional[date] = None) -> Dict:
+        """
+        Обучить модели и пересчитать прогноз на FORECAST_HORIZON_DAYS дней
+
+        Returns:
+            {'clubs': N, 'shifts': N, 'groups': N, 'train_ms': float}
+        """
+        import numpy as np
+
+        started = time.perf_counter()
+        today = today or datetime.now(MSK).date()
+        rows = [row for row in self._load_history() if row[2]]
+        if not rows:
+            logger.info("🔮 Нет истории смен для прогноза")
+            return {'clubs': 0, 'shifts': 0, 'groups': 0, 'train_ms': 0.0}
+
+        clubs, shift_types, dates, revenues, cash = zip(*rows)
+        day_list = [date.fromisoformat(d) for d in dates]
+        origin = min(day_list)
+
+        X_all = _day_features(day_list, origin)
+        y_total = np.asarray(revenues, dtype=np.float64)
+        y_cash = np.asarray(cash, dtype=np.float64)
+        age_days = np.asarray([(today - d).days for d in day_list], dtype=np.float64)
+        weights = np.power(0.5, np.clip(age_days, 0, None) / HALF_LIFE_DAYS)
+
+        groups: Dict[Tuple[str, str], np.ndarray] = {}
+        keys = np.asarray([f"{c}\x00{t}" for c, t in zip(clubs, shift_types)], dtype=object)
+        for key in set(keys.tolist()):
+            club, shift_type = key.split('\x00')
+            groups[(club, shift_type)] = np.flatnonzero(keys == key)
+
+        horizon = [today + timedelta(days=i) for i in range(1, FORECAST_HORIZON_DAYS + 1)]
+        X_future = _day_features(horizon, origin)
+
+        club_revenue: Dict[str, np.ndarray] = {}
+        club_cash: Dict[str, np.ndarray] = {}
+        club_var: Dict[str, np.ndarray] = {}
+
+        for (club, shift_type), idx in groups.items():
+            if len(idx) < 3:
+                continue
+            coef_total, sigma_total = _fit_ridge(X_all[idx], y_total[idx], weights[idx])
+            coef_cash, _ = _fit_ridge(X_all[idx], y_cash[idx], weights[idx])
+
+            pred_total = np.clip(X_future @ coef_total, 0, None)
+            pred_cash = np.clip(X_future @ coef_cash, 0, None)
+
+            club_revenue[club] = club_revenue.get(club, 0) + pred_total
+            club_cash[club] = club_cash.get(club, 0) + pred_cash
+            club_var[club] = club_var.get(club, 0) + sigma_total ** 2
+
+        generated_at = datetime.now(MSK).isoformat()
+        records = []
+        for club, revenue in club_revenue.items():
+            margin = 1.96 * np.sqrt(club_var[club])
+            start_balance, outflow = self._load_cash_state(club)
+            cash_balance = None
+            if start_balance is not None:
+                cash_balance = start_balance + np.cumsum(club_cash[club] - outflow)
+
+            for i, day in enumerate(horizon):
+                records.append((
+                    club,
+                    day.isoformat(),
+                    float(revenue[i]),
+                    float(max(0.0, revenue[i] - margin)),
+                    float(revenue[i] + margin),
+                    float(club_cash[club][i]),
+                    float(cash_balance[i]) if cash_balance is not None else None,
+                    1 if is_holiday(day) else 0,
+                    generated_at
+                ))
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("DELETE FROM revenue_forecasts")
+            conn.executemany("""
+                INSERT INTO revenue_forecasts (
+                    club, forecast_date, revenue, revenue_low, revenue_high,
+                    cash_revenue, cash_balance, is_holiday, generated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, records)
+            conn.commit()
+        finally:
+            conn.close()
+
+        stats = {
+            'clubs': len(club_revenue),
+            'shifts': len(rows),
+            'groups': len(groups),
+            'train_ms': (time.perf_counter() - started) * 1000
+        }
+        logger.info(f"🔮 Прогноз пересчитан: {stats['clubs']} клубов, {stats['shifts']} смен, "
+                    f"{stats['train_ms']:.0f} мс")
+        return stats
+
+    # ===== ЧТЕНИЕ КЕША =====
+
+    def get_forecast(self, days: int = 7, club: Optional[str] = None,
+                     today: Optional[date] = None) -> Dict[str, Dict]:
+        """
+        Прочитать кешированный прогноз (дни с сегодняшнего по МСК: если ночной
+        пересчет не прошел, прошедшие дни старого прогноза не показываются)
+
+        Returns:
+            {club: {'days': [{date, revenue, revenue_low, revenue_high, cash_balance, is_holiday}],
+                    'total': float, 'total_low': float, 'total_high': float,
+                    'cash_balance_end': float|None, 'generated_at': str}}
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            today = today or datetime.now(MSK).date()
+            where = "WHERE forecast_date >= ?"
+            params: list = [today.isoformat()]
+            if club:
+                where += " AND club = ?"
+                params.append(club)
+            rows = conn.execute(f"""
+                SELECT * FROM revenue_forecasts {where}
+                ORDER BY club, forecast_date
+            """, params).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        finally:
+            conn.close()
+
+        result: Dict[str, Dict] = {}
+        for row in rows:
+            data = result.setdefault(row['club'], {
+                'days': [], 'total': 0.0, 'total_low': 0.0, 'total_high': 0.0,
+                'cash_balance_end': None, 'generated_at': row['generated_at']
+            })
+            if len(data['days']) >= days:
+                continue
+            data['days'].append({
+                'date': row['forecast_date'],
+                'revenue': row['revenue'],
+                'revenue_low': row['revenue_low'],
+                'revenue_high': row['revenue_high'],
+                'cash_balance': row['cash_balance'],
+                'is_holiday': bool(row['is_holiday'])
+            })
+            data['total'] += row['revenue']
+            # Ошибки дней независимы: дисперсии складываются
+            data['_margin_sq'] = data.get('_margin_sq', 0.0) + (row['revenue_high'] - row['revenue']) ** 2
+            data['cash_balance_end'] = row['cash_balance']
+
+        for data in result.values():
+            margin = data.pop('_margin_sq', 0.0) ** 0.5
+            data['total_low'] = max(0.0, data['total'] - margin)
+            data['total_high'] = data['total'] + margin
+        return result
+
+    def format_forecast(self) -> str:
+        """Текст прогноза для панели владельца (HTML)"""
+        week = self.get_forecast(days=7)
+        month = self.get_forecast(days=FORECAST_HORIZON_DAYS)
+
+        if not week:
+            return "🔮 <b>Прогноз выручки</b>\n\n<i>Прогноз еще не рассчитан</i>"
+
+        text = "🔮 <b>Прогноз выручки</b>\n"
+        generated = next(iter(week.values()))['generated_at']
+        try:
+            generated = datetime.fromisoformat(generated).strftime('%d.%m %H:%M')
+        except ValueError:
+            pass
+        text += f"<i>Рассчитан: {generated}</i>\n"
+
+        weekday_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+        for club, data in sorted(week.items()):
+            text += f"\n🏢 <b>{club.upper()}</b>\n"
+            text += f"  • 7 дней: {data['total']:,.0f} ₽ "
+            text += f"({data['total_low']:,.0f}–{data['total_high']:,.0f})\n"
+            if club in month:
+                text += f"  • 30 дней: {month[club]['total']:,.0f} ₽\n"
+            if data['cash_balance_end'] is not None:
+                text += f"  • Сейф через 7 дней: ~{data['cash_balance_end']:,.0f} ₽\n"
+            if club in month and month[club]['cash_balance_end'] is not None:
+                text += f"  • Сейф через 30 дней: ~{month[club]['cash_balance_end']:,.0f} ₽\n"
+
+            text += "  По дням:\n"
+            for day in data['days']:
+                day_date = date.fromisoformat(day['date'])
+                holiday = " 🎉" if day['is_holiday'] else ""
+                text += f"    {weekday_names[day_date.weekday()]} {day_date.strftime('%d.%m')}: "
+                text += f"{day['revenue']:,.0f} ₽{holiday}\n"
+
+        return text
+
+
+# ===== JOB QUEUE =====
+
+async def refresh_revenue_forecast(context):
+    """Ночной пересчет прогноза (в отдельном потоке, чтобы не блокировать бота)"""
+    import asyncio
+
+    try:
+        db_path = context.bot_data.get('db_path', 'club_assistant.db')
+        forecaster = RevenueForecaster(db_path)
+        await asyncio.to_thread(forecaster.train)
+    except Exception as e:
+        logger.error(f"Error refreshing revenue forecast: {e}")
+
+
+def setup_forecast_jobs(application):
+    """
+    Запланировать пересчет прогноза: каждую ночь в 04:00 МСК и через минуту после старта
+    """
+    from datetime import time as dt_time
+
+    job_queue = application.job_queue
+
+    job_queue.run_daily(
+        refresh_revenue_forecast,
+        time=dt_time(hour=4, minute=0, tzinfo=MSK),
+        name='refresh_revenue_forecast'
+    )
+    job_queue.run_once(
+        refresh_revenue_forecast,
+        when=timedelta(minutes=1),
+        name='refresh_revenue_forecast_startup'
+    )
+
+    logger.info("Revenue forecast job scheduled (daily 04:00 MSK)")
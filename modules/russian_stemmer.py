@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Стеммер Snowball для русского языка (алгоритм Портера)
+
+Приводит словоформы к общей основе: "проблемы", "проблему", "проблемой" ->
+"проблем". Используется для полнотекстового поиска (FTS5) по описаниям
+проблем клуба: в индекс пишется нормализованный текст из основ.
+"""
+
+import re
+from typing import List
+
+VOWELS = set('аеиоуыэюя')
+
+PERFECTIVE_GERUND_1 = ('в', 'вши', 'вшись')
+PERFECTIVE_GERUND_2 = ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+REFLEXIVE = ('ся', 'сь')
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым',
+             'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+VERB_1 = ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны',
+          'ть', 'ешь', 'нно')
+VERB_2 = ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл',
+          'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить',
+          'ыть', 'ишь', 'ую', 'ю')
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей',
+        'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы',
+        'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я')
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+# Служебные слова - в индекс не попадают
+STOPWORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она',
+    'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее',
+    'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда',
+    'даже', 'ну', 'ли', 'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас',
+    'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничего', 'ей', 'может',
+    'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была',
+    'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж',
+    'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой', 'совсем', 'ним', 'здесь',
+    'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'были', 'куда', 'зачем', 'всех',
+    'можно', 'при', 'об', 'это', 'эта', 'эти', 'очень', 'снова', 'опять',
+}
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _regions(word: str):
+    """Начала областей RV и R2"""
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(rv: str, group_1=(), group_2=()) -> str:
+    """
+    Удалить самое длинное окончание из групп. Окончания первой группы
+    удаляются только после 'а' или 'я' (сама буква остается).
+    Возвращает None, если окончание не найдено.
+    """
+    best, first_group = '', False
+    for ending in group_1:
+        if len(ending) > len(best) and rv.endswith(ending):
+            best, first_group = ending, True
+    for ending in group_2:
+        if len(ending) > len(best) and rv.endswith(ending):
+            best, first_group = ending, False
+    if not best:
+        return None
+    stem = rv[:-len(best)]
+    if first_group and not (stem.endswith('а') or stem.endswith('я')):
+        return None
+    return stem
+
+
+def stem(word: str) -> str:
+    """Основа слова (ожидается слово в нижнем регистре, 'ё' заменяется на 'е')"""
+    word = word.replace('ё', 'е')
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратность + прилагательное/глагол/существительное
+    result = _strip(rv, PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2)
+    if result is None:
+        reflexive = _strip(rv, (), REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        result = _strip(rv, (), ADJECTIVE)
+        if result is not None:
+            participle = _strip(result, PARTICIPLE_1, PARTICIPLE_2)
+            if participle is not None:
+                result = participle
+        else:
+            result = _strip(rv, VERB_1, VERB_2)
+            if result is None:
+                result = _strip(rv, (), NOUN)
+    if result is not None:
+        rv = result
+
+    # Шаг 2: конечная 'и'
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательное окончание в R2
+    r2 = max(r2_start - rv_start, 0)
+    derivational = _strip(rv[r2:], (), DERIVATIONAL)
+    if derivational is not None:
+        rv = rv[:r2] + derivational
+
+    # Шаг 4: превосходная степень, двойная 'н', мягкий знак
+    superlative = _strip(rv, (), SUPERLATIVE)
+    if superlative is not None:
+        rv = superlative
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif superlative is None and rv.endswith('ь'):
+        rv = rv[:-1]
+
+    return prefix + rv
+
+
+def stem_words(text: str) -> List[str]:
+    """Основы значимых слов текста (без служебных слов и однобуквенных)"""
+    words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if len(word) > 1 and word not in STOPWORDS]
+
+
+def normalize_text(text: str) -> str:
+    """Нормализованный текст для полнотекстового индекса: основы через пробел"""
+    return ' '.join(stem_words(text))
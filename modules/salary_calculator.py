@@ -10,6 +10,8 @@ from datetime import datetime, date, timedelta
 from typing import Optional, Dict, List, Tuple
 from calendar import monthrange
 
+from modules.salary_engine import compute_period, get_salary_engine
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,6 +28,7 @@ class SalaryCalculator:
     def __init__(self, db_path: str, shift_manager=None):
         self.db_path = db_path
         self.shift_manager = shift_manager
+        self.engine = get_salary_engine(db_path)
     
     def _get_conn(self) -> sqlite3.Connection:
         """Get database connection"""
@@ -235,42 +238,12 @@ class SalaryCalculator:
             }
         """
         try:
-            # Get admin settings
-            settings = self.get_admin_salary_settings(admin_id)
-            
-            # Get worked shifts
-            shifts = self.get_worked_shifts(admin_id, period_start, period_end)
-            
-            # Get cash withdrawals
-            cash_taken = self.get_cash_withdrawals(admin_id, period_start, period_end)
-            
-            # Calculate amounts
-            total_shifts = len(shifts)
-            salary_per_shift = settings['salary_per_shift']
-            gross_amount = total_shifts * salary_per_shift
-            tax_rate = settings['tax_rate']
-            tax_amount = gross_amount * (tax_rate / 100)
-            net_amount = gross_amount - tax_amount
-            amount_due = net_amount - cash_taken
-            
-            result = {
-                'shifts': shifts,
-                'total_shifts': total_shifts,
-                'gross_amount': gross_amount,
-                'tax_rate': tax_rate,
-                'tax_amount': tax_amount,
-                'net_amount': net_amount,
-                'cash_taken': cash_taken,
-                'amount_due': amount_due,
-                'employment_type': settings['employment_type'],
-                'salary_per_shift': salary_per_shift,
-                'period_start': period_start,
-                'period_end': period_end
-            }
-            
-            logger.info(f"Salary calculation for admin {admin_id}: {total_shifts} shifts, {gross_amount} gross, {amount_due} due")
-            return result
-            
+            # Cached until shifts, withdrawals, payments or settings change
+            return self.engine.cached(
+                ('calculator', admin_id, str(period_start), str(period_end)),
+                lambda: self._calculate_salary(admin_id, period_start, period_end)
+            )
+        
         except Exception as e:
             logger.error(f"Failed to calculate salary: {e}")
             return {
@@ -288,6 +261,40 @@ class SalaryCalculator:
                 'period_end': period_end
             }
     
+    def _calculate_salary(self, admin_id: int, period_start: date, period_end: date) -> Dict:
+        """Calculate salary for period from raw rows (see calculate_salary)"""
+        # Get admin settings
+        settings = self.get_admin_salary_settings(admin_id)
+        
+        # Get worked shifts
+        shifts = self.get_worked_shifts(admin_id, period_start, period_end)
+        
+        # Get cash withdrawals
+        cash_taken = self.get_cash_withdrawals(admin_id, period_start, period_end)
+        
+        # Calculate amounts
+        salary_per_shift = settings['salary_per_shift']
+        tax_rate = settings['tax_rate']
+        amounts = compute_period(len(shifts), salary_per_shift, tax_rate, cash_taken)
+        
+        result = {
+            'shifts': shifts,
+            'total_shifts': amounts['total_shifts'],
+            'gross_amount': amounts['gross'],
+            'tax_rate': tax_rate,
+            'tax_amount': amounts['tax'],
+            'net_amount': amounts['net'],
+            'cash_taken': cash_taken,
+            'amount_due': amounts['due'],
+            'employment_type': settings['employment_type'],
+            'salary_per_shift': salary_per_shift,
+            'period_start': period_start,
+            'period_end': period_end
+        }
+        
+        logger.info(f"Salary calculation for admin {admin_id}: {result['total_shifts']} shifts, {result['gross_amount']} gross, {result['amount_due']} due")
+        return result
+    
     def record_payment(self, admin_id: int, payment_type: str, period_start: date, 
                       period_end: date, calculation: Dict) -> int:
         """
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Salary Engine - единый расчет зарплаты за период с кэшем результатов
+
+Арифметика периода (начислено -> налог -> к выплате -> остаток после взятого
+из кассы) находится в одном месте, compute_period; SalaryCalculator и
+PayrollManager считают через нее.
+
+Результаты расчетов кэшируются по ключу (расчет, админ, период, версия данных).
+Версию увеличивают триггеры SQLite (DataVersion, scope 'salary') на сменах,
+снятиях из кассы, выплатах и настройках зарплаты - любая запись, из бота или
+WebApp, делает старые результаты недостижимыми.
+"""
+
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from modules.data_version import DataVersion
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, запись в которые меняет результат расчета зарплаты
+SALARY_TABLES = (
+    'active_shifts',
+    'shift_cash_withdrawals',
+    'salary_payments',
+    'admins',
+    'salary_config',
+)
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def compute_period(total_shifts: int, rate_per_shift: float, tax_rate: float,
+                   cash_taken: float = 0.0) -> Dict[str, float]:
+    """
+    Итоги периода: начислено, налог, к выплате и остаток после взятого из кассы
+
+    Налог считается как (gross * tax_rate) / 100 - для целых ставок и
+    процентов результат точный (2000 * 6 / 100 = 120.0).
+    """
+    gross = total_shifts * rate_per_shift
+    tax = (gross * tax_rate) / 100
+    net = gross - tax
+    return {
+        'total_shifts': total_shifts,
+        'gross': gross,
+        'tax': tax,
+        'net': net,
+        'cash_taken': cash_taken,
+        'due': net - cash_taken,
+    }
+
+
+class SalaryEngine:
+    """Кэш результатов расчета зарплаты за период с инвалидацией по версии данных"""
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.data_version = DataVersion(db_path, scope='salary', tables=SALARY_TABLES)
+        self.data_version.install()
+        self._entries: 'OrderedDict[Tuple, Dict]' = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key: Tuple, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Результат compute() для ключа при текущей версии данных.
+
+        Args:
+            key: (расчет, админ, начало, конец, ...) - без версии
+            compute: Расчет при промахе; результат с 'error' не кэшируется
+            ttl: Срок жизни в секундах - для данных не из БД (Google Sheets)
+
+        Returns:
+            Копия результата (вызывающий код может ее менять)
+        """
+        version = self.data_version.current()
+        if version is None:
+            # Версия данных недоступна - считать без кэша
+            return compute()
+        with self._lock:
+            if version != self._version:
+                # Любая запись в таблицы зарплат - старые результаты больше не нужны
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None and (ttl is None or time.monotonic() - entry['created'] <= ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry['value'])
+            self.misses += 1
+
+        value = compute()
+        if isinstance(value, dict) and value.get('error'):
+            return value
+
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = {'value': copy.deepcopy(value), 'created': time.monotonic()}
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        """Сбросить кэш (например, после правки данных в обход SQLite)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'version': self._version}
+
+
+_engines: Dict[str, SalaryEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_salary_engine(db_path: str) -> SalaryEngine:
+    """Общий движок для БД - все калькуляторы одной БД делят кэш"""
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            engine = SalaryEngine(db_path)
+            _engines[db_path] = engine
+        return engine
@@ -86,6 +86,14 @@ class ShiftManager:
             conn.close()
 
             logger.info(f"✅ Opened shift {shift_id}: admin={admin_id}, club={club}, type={shift_type}, date={shift_date_str}")
+
+            # Дедлайны чек-листов (рейтинг уборки, инвентарь) - событийно, без опроса
+            try:
+                from modules.shift_reminders import schedule_shift_opened_deadlines
+                schedule_shift_opened_deadlines(self.db_path, shift_id, club, admin_id)
+            except Exception as deadline_error:
+                logger.warning(f"⚠️ Failed to schedule deadlines for shift {shift_id}: {deadline_error}")
+
             return shift_id
 
         except Exception as e:
@@ -106,6 +114,9 @@ class ShiftManager:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            cursor.execute("SELECT club FROM active_shifts WHERE id = ?", (shift_id,))
+            club_row = cursor.fetchone()
+            
             cursor.execute('''
                 UPDATE active_shifts 
                 SET status = 'closed'
@@ -118,6 +129,14 @@ class ShiftManager:
             
             if rows_affected > 0:
                 logger.info(f"✅ Closed shift {shift_id}")
+                
+                # Отменить дедлайны смены и поставить контроль открытия следующей
+                try:
+                    from modules.shift_reminders import schedule_shift_closed_deadlines
+                    schedule_shift_closed_deadlines(self.db_path, shift_id, club_row[0] if club_row else None)
+                except Exception as deadline_error:
+                    logger.warning(f"⚠️ Failed to update deadlines for shift {shift_id}: {deadline_error}")
+                
                 return True
             else:
                 logger.warning(f"⚠️ Shift {shift_id} not found or already closed")
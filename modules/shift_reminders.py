@@ -1,6 +1,7 @@
 """
 Модуль системы напоминаний для чек-листов смены
-Использует JobQueue для периодических проверок
+Дедлайны смен обслуживает событийный планировщик (modules/deadline_queue.py),
+JobQueue используется для его запуска и периодической проверки здоровья системы
 """
 
 import sqlite3
@@ -9,6 +10,8 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, List
 from telegram.ext import ContextTypes
 
+from modules.notification_dispatcher import PRIORITY_CRITICAL, PRIORITY_HIGH, get_notifier
+
 logger = logging.getLogger(__name__)
 
 # Moscow timezone (UTC+3)
@@ -116,289 +119,292 @@ class ShiftReminderManager:
             return False
 
 
-# ===== JOB QUEUE FUNCTIONS =====
+# ===== ДЕДЛАЙНЫ СМЕН =====
+#
+# Дедлайны рассчитываются при открытии/закрытии смены (ShiftManager) и
+# хранятся в очереди shift_deadlines; единый планировщик (DeadlineScheduler)
+# спит до ближайшего и вызывает обработчик соответствующего типа.
+# Обработчик повторно проверяет условие (смена еще открыта, чек-лист не
+# заполнен и т.п.), поэтому устаревшие дедлайны просто ничего не отправляют.
 
-async def check_unopened_shifts(context: ContextTypes.DEFAULT_TYPE):
-    """
-    Проверка смен, которые не открыты через 30 минут после закрытия предыдущей
-    Запускается каждые 5 минут
-    """
-    try:
-        db_path = context.bot_data.get('db_path', 'club_assistant.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+DEADLINE_CLEANING_RATING = 'cleaning_rating'
+DEADLINE_INVENTORY_CLUB = 'inventory_2h'
+DEADLINE_INVENTORY_ADMIN = 'inventory_3h'
+DEADLINE_INVENTORY_OVERDUE = 'inventory_overdue'
+DEADLINE_SHIFT_NOT_OPENED = 'shift_not_opened'
 
-        # Находим смены, которые закрыты более 30 минут назад
-        cutoff_time = datetime.now(MSK) - timedelta(minutes=30)
+# Смещения дедлайнов от открытия смены
+OPEN_SHIFT_DEADLINES = (
+    (DEADLINE_CLEANING_RATING, timedelta(minutes=30)),
+    (DEADLINE_INVENTORY_CLUB, timedelta(hours=2)),
+    (DEADLINE_INVENTORY_ADMIN, timedelta(hours=3)),
+    (DEADLINE_INVENTORY_OVERDUE, timedelta(hours=4)),
+)
 
-        cursor.execute("""
-            SELECT s.*, a.full_name as admin_name
-            FROM active_shifts s
-            LEFT JOIN admins a ON s.admin_id = a.user_id
-            WHERE s.status = 'closed'
-            AND s.closed_at <= ?
-            AND s.club IN ('rio', 'sever')
-        """, (cutoff_time,))
+# Смещение дедлайна "смена не открыта" от закрытия предыдущей
+SHIFT_NOT_OPENED_DELAY = timedelta(minutes=30)
 
-        closed_shifts = cursor.fetchall()
+# Клубы, для которых контролируется открытие следующей смены
+MONITORED_CLUBS = ('rio', 'sever')
 
-        for shift in closed_shifts:
-            club = shift['club']
-            shift_id = shift['id']
-            end_time = datetime.fromisoformat(shift['closed_at'])
+# При старте догоняем только недавно открытые смены (старые "зависшие" не тревожим)
+BACKFILL_WINDOW = timedelta(hours=24)
 
-            # Проверяем, есть ли новая открытая смена после этой
-            cursor.execute("""
-                SELECT id FROM active_shifts
-                WHERE club = ? AND opened_at > ? AND status = 'open'
-            """, (club, end_time))
-
-            new_shift = cursor.fetchone()
-
-            if not new_shift:
-                # Проверяем, не отправляли ли уже это напоминание
-                cursor.execute("""
-                    SELECT id FROM shift_reminders
-                    WHERE shift_id = ? AND reminder_type = ? AND is_resolved = 0
-                """, (shift_id, REMINDER_SHIFT_NOT_OPENED))
-
-                existing_reminder = cursor.fetchone()
 
-                if not existing_reminder:
-                    # Отправляем напоминание в чат клуба
-                    club_accounts = context.bot_data.get('club_accounts', {})
-                    club_chat_id = club_accounts.get(club)
+def schedule_shift_opened_deadlines(db_path: str, shift_id: int, club: str, admin_id: int,
+                                    opened_at: Optional[float] = None):
+    """Запланировать дедлайны чек-листов для открытой смены"""
+    from modules.deadline_queue import get_deadline_queue
 
-                    if club_chat_id:
-                        text = f"⚠️ *Внимание!*\n\n"
-                        text += f"Прошло более 30 минут после закрытия смены.\n"
-                        text += f"Пожалуйста, откройте новую смену через /start"
+    queue = get_deadline_queue(db_path)
+    opened_at = opened_at if opened_at is not None else queue.clock()
 
-                        await context.bot.send_message(
-                            chat_id=club_chat_id,
-                            text=text,
-                            parse_mode='Markdown'
-                        )
+    # Новая смена в клубе - напоминание "смена не открыта" больше не нужно
+    queue.cancel(club=club, kinds=[DEADLINE_SHIFT_NOT_OPENED])
 
-                    # Отправляем уведомление владельцу и Глазу
-                    owner_id = context.bot_data.get('owner_id')
-                    controller_id = context.bot_data.get('controller_id')
+    payload = {'admin_id': admin_id, 'opened_at': opened_at}
+    for kind, offset in OPEN_SHIFT_DEADLINES:
+        queue.schedule(kind, opened_at + offset.total_seconds(), shift_id=shift_id, club=club, payload=payload)
 
-                    alert_text = f"⚠️ *Смена не открыта - {club.upper()}*\n\n"
-                    alert_text += f"Закрыта: {end_time.strftime('%H:%M')}\n"
-                    alert_text += f"Прошло: более 30 минут\n"
-                    alert_text += f"Последний админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}"
 
-                    if owner_id:
-                        await context.bot.send_message(owner_id, alert_text, parse_mode='Markdown')
+def schedule_shift_closed_deadlines(db_path: str, shift_id: int, club: str,
+                                    closed_at: Optional[float] = None):
+    """Отменить дедлайны закрытой смены и запланировать контроль открытия следующей"""
+    from modules.deadline_queue import get_deadline_queue
 
-                    if controller_id:
-                        await context.bot.send_message(controller_id, alert_text, parse_mode='Markdown')
+    queue = get_deadline_queue(db_path)
+    closed_at = closed_at if closed_at is not None else queue.clock()
 
-                    # Создаем запись о напоминании
-                    reminder_manager = ShiftReminderManager(db_path)
-                    reminder_manager.create_reminder(shift_id, REMINDER_SHIFT_NOT_OPENED)
+    queue.cancel(shift_id=shift_id)
+    if club in MONITORED_CLUBS:
+        queue.schedule(
+            DEADLINE_SHIFT_NOT_OPENED,
+            closed_at + SHIFT_NOT_OPENED_DELAY.total_seconds(),
+            shift_id=shift_id,
+            club=club,
+            payload={'closed_at': closed_at}
+        )
 
-                    logger.info(f"Sent unopened shift reminder for {club}")
 
-        conn.close()
-
-    except Exception as e:
-        logger.error(f"Error checking unopened shifts: {e}")
-        import traceback
-        traceback.print_exc()
-
-
-async def check_inventory_deadlines(context: ContextTypes.DEFAULT_TYPE):
+def backfill_open_shift_deadlines(db_path: str, now: Optional[float] = None) -> int:
     """
-    Проверка дедлайнов инвентаря (4 часа после открытия смены)
-    Напоминания: через 3 часа (за 1ч до дедлайна), через 2 часа (на рабочий аккаунт), после 4 часов (владельцу)
-    Запускается каждые 5 минут
+    Запланировать дедлайны для открытых смен, у которых их еще нет
+    (смены, открытые до включения очереди дедлайнов). Идемпотентно.
     """
+    now = now if now is not None else datetime.now(timezone.utc).timestamp()
+    cutoff = now - BACKFILL_WINDOW.total_seconds()
+
     try:
-        db_path = context.bot_data.get('db_path', 'club_assistant.db')
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-
-        now = datetime.now(MSK)
-
-        # Находим активные смены без заполненного инвентаря
         cursor.execute("""
-            SELECT s.*, a.full_name as admin_name, a.user_id as admin_user_id
+            SELECT s.id, s.club, s.admin_id, s.opened_at
             FROM active_shifts s
-            LEFT JOIN admins a ON s.admin_id = a.user_id
-            LEFT JOIN shift_inventory_checklist ic ON s.id = ic.shift_id
             WHERE s.status = 'open'
-            AND ic.id IS NULL
+            AND NOT EXISTS (SELECT 1 FROM shift_deadlines d WHERE d.shift_id = s.id)
         """)
+        shifts = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить открытые смены для дедлайнов: {e}")
+        return 0
 
-        active_shifts = cursor.fetchall()
-
-        for shift in active_shifts:
-            shift_id = shift['id']
-            club = shift['club']
-            admin_id = shift['admin_user_id']
-            start_time = datetime.fromisoformat(shift['opened_at']).replace(tzinfo=MSK)
-
-            time_elapsed = (now - start_time).total_seconds() / 3600  # в часах
-
-            # Напоминание через 3 часа (за 1 час до дедлайна) - второе напоминание
-            if 3.0 <= time_elapsed < 3.1:
-                # Проверяем, сколько раз уже отправляли напоминания
-                cursor.execute("""
-                    SELECT COUNT(*) FROM shift_reminders
-                    WHERE shift_id = ? AND reminder_type = ?
-                """, (shift_id, REMINDER_INVENTORY))
-
-                reminder_count = cursor.fetchone()[0]
-
-                if reminder_count == 1:
-                    text = f"⏰ *Напоминание об инвентаре*\n\n"
-                    text += f"Осталось 1 час до дедлайна заполнения чек-листа инвентаря.\n"
-                    text += f"Пожалуйста, заполните его в ближайшее время."
-
-                    if admin_id:
-                        await context.bot.send_message(admin_id, text, parse_mode='Markdown')
-
-                    reminder_manager = ShiftReminderManager(db_path)
-                    reminder_manager.create_reminder(shift_id, REMINDER_INVENTORY)
-                    logger.info(f"Sent 3-hour inventory reminder for shift {shift_id}")
-
-            # Напоминание через 2 часа (на рабочий аккаунт клуба) - первое напоминание
-            elif 2.0 <= time_elapsed < 2.1:
-                # Проверяем, сколько раз уже отправляли напоминания
-                cursor.execute("""
-                    SELECT COUNT(*) FROM shift_reminders
-                    WHERE shift_id = ? AND reminder_type = ?
-                """, (shift_id, REMINDER_INVENTORY))
-
-                reminder_count = cursor.fetchone()[0]
-
-                if reminder_count == 0:
-                    club_accounts = context.bot_data.get('club_accounts', {})
-                    club_chat_id = club_accounts.get(club)
+    scheduled = 0
+    for shift in shifts:
+        try:
+            # opened_at заполняет CURRENT_TIMESTAMP SQLite - время без зоны в UTC
+            opened = datetime.fromisoformat(shift['opened_at'])
+            if opened.tzinfo is None:
+                opened = opened.replace(tzinfo=timezone.utc)
+            opened_ts = opened.timestamp()
+        except (TypeError, ValueError):
+            continue
+        if opened_ts < cutoff:
+            continue
+        schedule_shift_opened_deadlines(db_path, shift['id'], shift['club'], shift['admin_id'], opened_ts)
+        scheduled += 1
+
+    if scheduled:
+        logger.info(f"⏰ Дедлайны запланированы для открытых смен: {scheduled}")
+    return scheduled
+
+
+def _load_shift(db_path: str, shift_id: int) -> Optional[Dict]:
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.*, a.full_name as admin_name, a.user_id as admin_user_id
+            FROM active_shifts s
+            LEFT JOIN admins a ON s.admin_id = a.user_id
+            WHERE s.id = ?
+        """, (shift_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
 
-                    text = f"⏰ *Напоминание об инвентаре*\n\n"
-                    text += f"Осталось 2 часа до дедлайна.\n"
-                    text += f"Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}"
 
-                    if club_chat_id:
-                        await context.bot.send_message(club_chat_id, text, parse_mode='Markdown')
+def make_deadline_handlers(application) -> Dict:
+    """Обработчики дедлайнов по типу (замыкаются на bot и bot_data приложения)"""
+    bot_data = application.bot_data
+
+    def db_path() -> str:
+        return bot_data.get('db_path', 'club_assistant.db')
+
+    async def notify(chat_ids: List, text: str, item: Dict, audience: str):
+        """
+        Рассылка через общий диспетчер с ожиданием доставки: при неудаче
+        DeliveryError уходит в планировщик, и дедлайн повторяется (уже
+        получившим сообщение повтор не отправляется - dedup_key дедлайна).
+        audience ('admin', 'club', 'management') входит в dedup_key: разные
+        сообщения одного дедлайна одному человеку (админ он же владелец)
+        не считаются дубликатами.
+        """
+        await get_notifier(bot_data, application.bot).deliver(
+            chat_ids, text,
+            parse_mode='Markdown',
+            priority=PRIORITY_HIGH,
+            dedup_key=f"deadline:{item['id']}:{audience}",
+            category=item['kind']
+        )
+
+    async def on_cleaning_rating(item: Dict):
+        shift = _load_shift(db_path(), item['shift_id'])
+        if not shift or shift['status'] != 'open':
+            return
+
+        conn = sqlite3.connect(db_path())
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 1 FROM shift_cleaning_rating
+            WHERE shift_id = ? AND rated_at IS NOT NULL
+        """, (shift['id'],))
+        rated = cursor.fetchone() is not None
+        conn.close()
+        if rated:
+            return
+
+        text = f"⚠️ *Напоминание о рейтинге уборки*\n\n"
+        text += f"Прошло более 30 минут с начала смены.\n"
+        text += f"Пожалуйста, оцените качество уборки предыдущего админа."
+        await notify([shift['admin_user_id']], text, item, 'admin')
+
+        alert_text = f"⚠️ *Не заполнен рейтинг уборки*\n\n"
+        alert_text += f"🏢 Клуб: {shift['club'].upper()}\n"
+        alert_text += f"👤 Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}\n"
+        alert_text += f"⏰ Прошло: более 30 минут"
+        await notify([bot_data.get('owner_id'), bot_data.get('controller_id')], alert_text, item, 'management')
+
+        ShiftReminderManager(db_path()).create_reminder(shift['id'], REMINDER_CLEANING_RATING)
+        logger.info(f"Sent cleaning rating reminder for shift {shift['id']}")
+
+    def inventory_pending(shift_id: int) -> Optional[Dict]:
+        shift = _load_shift(db_path(), shift_id)
+        if not shift or shift['status'] != 'open':
+            return None
+        conn = sqlite3.connect(db_path())
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM shift_inventory_checklist WHERE shift_id = ?", (shift_id,))
+        done = cursor.fetchone() is not None
+        conn.close()
+        return None if done else shift
 
-                    reminder_manager = ShiftReminderManager(db_path)
-                    reminder_manager.create_reminder(shift_id, REMINDER_INVENTORY)
-                    logger.info(f"Sent 2-hour inventory reminder for shift {shift_id}")
+    async def on_inventory_club(item: Dict):
+        shift = inventory_pending(item['shift_id'])
+        if not shift:
+            return
 
-            # Уведомление владельцу после 4 часов (просрочено) - третье напоминание
-            elif time_elapsed >= 4.0:
-                # Проверяем, сколько раз уже отправляли напоминания
-                cursor.execute("""
-                    SELECT COUNT(*) FROM shift_reminders
-                    WHERE shift_id = ? AND reminder_type = ?
-                """, (shift_id, REMINDER_INVENTORY))
+        text = f"⏰ *Напоминание об инвентаре*\n\n"
+        text += f"Осталось 2 часа до дедлайна.\n"
+        text += f"Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}"
+        club_chat_id = bot_data.get('club_accounts', {}).get(shift['club'])
+        await notify([club_chat_id], text, item, 'club')
 
-                reminder_count = cursor.fetchone()[0]
+        ShiftReminderManager(db_path()).create_reminder(shift['id'], REMINDER_INVENTORY)
+        logger.info(f"Sent 2-hour inventory reminder for shift {shift['id']}")
 
-                if reminder_count == 2:
-                    owner_id = context.bot_data.get('owner_id')
-                    controller_id = context.bot_data.get('controller_id')
+    async def on_inventory_admin(item: Dict):
+        shift = inventory_pending(item['shift_id'])
+        if not shift:
+            return
 
-                    alert_text = f"❌ *Просрочен чек-лист инвентаря*\n\n"
-                    alert_text += f"🏢 Клуб: {club.upper()}\n"
-                    alert_text += f"👤 Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}\n"
-                    alert_text += f"⏰ Прошло: {int(time_elapsed)} часов\n"
-                    alert_text += f"📅 Начало смены: {start_time.strftime('%H:%M')}"
+        text = f"⏰ *Напоминание об инвентаре*\n\n"
+        text += f"Осталось 1 час до дедлайна заполнения чек-листа инвентаря.\n"
+        text += f"Пожалуйста, заполните его в ближайшее время."
+        await notify([shift['admin_user_id']], text, item, 'admin')
 
-                    if owner_id:
-                        await context.bot.send_message(owner_id, alert_text, parse_mode='Markdown')
+        ShiftReminderManager(db_path()).create_reminder(shift['id'], REMINDER_INVENTORY)
+        logger.info(f"Sent 3-hour inventory reminder for shift {shift['id']}")
 
-                    if controller_id:
-                        await context.bot.send_message(controller_id, alert_text, parse_mode='Markdown')
+    async def on_inventory_overdue(item: Dict):
+        shift = inventory_pending(item['shift_id'])
+        if not shift:
+            return
 
-                    reminder_manager = ShiftReminderManager(db_path)
-                    reminder_manager.create_reminder(shift_id, REMINDER_INVENTORY)
-                    logger.info(f"Sent overdue inventory alert for shift {shift_id}")
+        opened_at = datetime.fromtimestamp(item['payload'].get('opened_at', item['due_at']), MSK)
+        hours = (datetime.now(MSK) - opened_at).total_seconds() / 3600
 
-        conn.close()
+        alert_text = f"❌ *Просрочен чек-лист инвентаря*\n\n"
+        alert_text += f"🏢 Клуб: {shift['club'].upper()}\n"
+        alert_text += f"👤 Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}\n"
+        alert_text += f"⏰ Прошло: {int(hours)} часов\n"
+        alert_text += f"📅 Начало смены: {opened_at.strftime('%H:%M')}"
+        await notify([bot_data.get('owner_id'), bot_data.get('controller_id')], alert_text, item, 'management')
 
-    except Exception as e:
-        logger.error(f"Error checking inventory deadlines: {e}")
+        ShiftReminderManager(db_path()).create_reminder(shift['id'], REMINDER_INVENTORY)
+        logger.info(f"Sent overdue inventory alert for shift {shift['id']}")
 
+    async def on_shift_not_opened(item: Dict):
+        club = item['club']
 
-async def check_cleaning_rating_deadline(context: ContextTypes.DEFAULT_TYPE):
-    """
-    Проверка дедлайна рейтинга уборки (30 минут после открытия смены)
-    Запускается каждые 5 минут
-    """
-    try:
-        db_path = context.bot_data.get('db_path', 'club_assistant.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        conn = sqlite3.connect(db_path())
         cursor = conn.cursor()
-
-        now = datetime.now(MSK)
-        cutoff_time = now - timedelta(minutes=30)
-
-        # Находим смены, открытые более 30 минут назад без заполненного рейтинга уборки
         cursor.execute("""
-            SELECT s.*, a.full_name as admin_name, a.user_id as admin_user_id
-            FROM active_shifts s
-            LEFT JOIN admins a ON s.admin_id = a.user_id
-            LEFT JOIN shift_cleaning_rating scr ON s.id = scr.shift_id
-            WHERE s.opened_at <= ? AND s.status = 'open'
-            AND (scr.id IS NULL OR scr.rated_at IS NULL)
-        """, (cutoff_time,))
-
-        overdue_shifts = cursor.fetchall()
-
-        for shift in overdue_shifts:
-            shift_id = shift['id']
-            club = shift['club']
-            admin_id = shift['admin_user_id']
-
-            # Проверяем, не отправляли ли уже напоминание для этой смены
-            cursor.execute("""
-                SELECT id FROM shift_reminders
-                WHERE shift_id = ? AND reminder_type = ?
-            """, (shift_id, REMINDER_CLEANING_RATING))
-
-            if not cursor.fetchone():
-                # Отправляем напоминание админу
-                text = f"⚠️ *Напоминание о рейтинге уборки*\n\n"
-                text += f"Прошло более 30 минут с начала смены.\n"
-                text += f"Пожалуйста, оцените качество уборки предыдущего админа."
+            SELECT 1 FROM active_shifts
+            WHERE club = ? AND status = 'open' AND id > ?
+        """, (club, item['shift_id']))
+        reopened = cursor.fetchone() is not None
+        conn.close()
+        if reopened:
+            return
 
-                if admin_id:
-                    await context.bot.send_message(admin_id, text, parse_mode='Markdown')
+        shift = _load_shift(db_path(), item['shift_id'])
+        closed_at = datetime.fromtimestamp(item['payload'].get('closed_at', item['due_at']), MSK)
 
-                # Уведомляем владельца и Глаза
-                owner_id = context.bot_data.get('owner_id')
-                controller_id = context.bot_data.get('controller_id')
+        text = f"⚠️ *Внимание!*\n\n"
+        text += f"Прошло более 30 минут после закрытия смены.\n"
+        text += f"Пожалуйста, откройте новую смену через /start"
+        await notify([bot_data.get('club_accounts', {}).get(club)], text, item, 'club')
 
-                alert_text = f"⚠️ *Не заполнен рейтинг уборки*\n\n"
-                alert_text += f"🏢 Клуб: {club.upper()}\n"
-                alert_text += f"👤 Админ: {shift['admin_name'] if shift['admin_name'] else 'Неизвестно'}\n"
-                alert_text += f"⏰ Прошло: более 30 минут"
+        alert_text = f"⚠️ *Смена не открыта - {club.upper()}*\n\n"
+        alert_text += f"Закрыта: {closed_at.strftime('%H:%M')}\n"
+        alert_text += f"Прошло: более 30 минут\n"
+        alert_text += f"Последний админ: {shift['admin_name'] if shift and shift['admin_name'] else 'Неизвестно'}"
+        await notify([bot_data.get('owner_id'), bot_data.get('controller_id')], alert_text, item, 'management')
 
-                if owner_id:
-                    await context.bot.send_message(owner_id, alert_text, parse_mode='Markdown')
+        ShiftReminderManager(db_path()).create_reminder(item['shift_id'], REMINDER_SHIFT_NOT_OPENED)
+        logger.info(f"Sent unopened shift reminder for {club}")
 
-                if controller_id:
-                    await context.bot.send_message(controller_id, alert_text, parse_mode='Markdown')
+    return {
+        DEADLINE_CLEANING_RATING: on_cleaning_rating,
+        DEADLINE_INVENTORY_CLUB: on_inventory_club,
+        DEADLINE_INVENTORY_ADMIN: on_inventory_admin,
+        DEADLINE_INVENTORY_OVERDUE: on_inventory_overdue,
+        DEADLINE_SHIFT_NOT_OPENED: on_shift_not_opened,
+    }
 
-                # Создаем запись о напоминании
-                reminder_manager = ShiftReminderManager(db_path)
-                reminder_manager.create_reminder(shift_id, REMINDER_CLEANING_RATING)
 
-                logger.info(f"Sent cleaning rating reminder for shift {shift_id}")
+async def _start_deadline_scheduler(context: ContextTypes.DEFAULT_TYPE):
+    """Запустить планировщик дедлайнов фоновой задачей внутри event loop бота"""
+    scheduler = context.bot_data.get('deadline_scheduler')
+    if scheduler:
+        context.application.create_task(scheduler.run())
 
-        conn.close()
-
-    except Exception as e:
-        logger.error(f"Error checking cleaning rating deadline: {e}")
 
+# ===== JOB QUEUE FUNCTIONS =====
 
 async def check_system_health(context: ContextTypes.DEFAULT_TYPE):
     """
@@ -434,7 +440,14 @@ async def check_system_health(context: ContextTypes.DEFAULT_TYPE):
             text += f"• Диск: {disk.percent}% ({disk.used / (1024**3):.1f}GB / {disk.total / (1024**3):.1f}GB)"
 
             if owner_id:
-                await context.bot.send_message(owner_id, text, parse_mode='Markdown')
+                # Пока показатели критичны, повторяем алерт не чаще раза в час
+                get_notifier(context.bot_data, context.bot).submit(
+                    owner_id, text,
+                    parse_mode='Markdown',
+                    priority=PRIORITY_CRITICAL,
+                    dedup_key='system_health',
+                    category='system_health'
+                )
                 logger.warning(f"System health alert sent: CPU={cpu_percent}%, RAM={memory.percent}%, Disk={disk.percent}%")
 
     except Exception as e:
@@ -443,36 +456,26 @@ async def check_system_health(context: ContextTypes.DEFAULT_TYPE):
 
 def setup_reminder_jobs(application):
     """
-    Настроить все периодические задачи JobQueue
+    Настроить планировщик дедлайнов смен и периодическую проверку здоровья системы
     Вызывается при запуске бота
     """
+    from modules.deadline_queue import DeadlineScheduler, get_deadline_queue
+
     job_queue = application.job_queue
+    db_path = application.bot_data.get('db_path', 'club_assistant.db')
 
-    # Проверка нераскрытых смен - каждые 5 минут
-    job_queue.run_repeating(
-        check_unopened_shifts,
-        interval=timedelta(minutes=5),
-        first=timedelta(seconds=10),
-        name='check_unopened_shifts'
-    )
+    # Дедлайны смен: одна очередь + один планировщик вместо опроса каждые 5 минут
+    queue = get_deadline_queue(db_path)
+    backfill_open_shift_deadlines(db_path)
+    application.bot_data['deadline_scheduler'] = DeadlineScheduler(queue, make_deadline_handlers(application))
 
-    # Проверка дедлайнов инвентаря - каждые 5 минут
-    job_queue.run_repeating(
-        check_inventory_deadlines,
-        interval=timedelta(minutes=5),
-        first=timedelta(seconds=20),
-        name='check_inventory_deadlines'
-    )
-
-    # Проверка дедлайна рейтинга уборки - каждые 5 минут
-    job_queue.run_repeating(
-        check_cleaning_rating_deadline,
-        interval=timedelta(minutes=5),
-        first=timedelta(seconds=30),
-        name='check_cleaning_rating_deadline'
+    job_queue.run_once(
+        _start_deadline_scheduler,
+        when=timedelta(seconds=5),
+        name='start_deadline_scheduler'
     )
 
-    # Проверка здоровья системы - каждые 5 минут
+    # Проверка здоровья системы - каждые 5 минут (метрика, а не дедлайн)
     job_queue.run_repeating(
         check_system_health,
         interval=timedelta(minutes=5),
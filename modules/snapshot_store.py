@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Snapshot Store - инкрементальные согласованные снимки БД и файлов данных
+
+- Копия БД снимается онлайн через sqlite3 backup API порциями страниц:
+  бот продолжает писать, а копия получается согласованной (без "рваных"
+  страниц, как при копировании живого файла).
+- Копия проверяется PRAGMA integrity_check до того, как попасть в хранилище.
+- Файлы режутся на чанки, выровненные по страницам SQLite (64 КБ = 16
+  страниц по 4 КБ). SQLite меняет страницы на месте и backup API копирует
+  их по тем же номерам, поэтому неизмененные области дают те же чанки.
+- Чанки адресуются по sha256 и сжимаются (zstd, если установлен, иначе
+  gzip); новый снимок дописывает только чанки, которых еще нет.
+- Манифест снимка - JSON со списком чанков каждого файла; пишется
+  последним и атомарно, поэтому прерванный снимок просто не виден.
+- Хранение: последние KEEP_LAST снимков + по одному на день/неделю/месяц
+  (RETENTION), неиспользуемые чанки удаляются сборщиком мусора.
+
+Структура каталога:
+    snapshots/chunks/ab/abcdef...{.zst|.gz}
+    snapshots/manifests/20251102_030000.json
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+CHUNK_SIZE = 64 * 1024
+BACKUP_PAGES_PER_STEP = 256
+KEEP_LAST = 5
+RETENTION = {'daily': 7, 'weekly': 4, 'monthly': 6}
+
+# Файлы данных помимо БД (пути относительно рабочего каталога бота)
+DATA_FILES = (
+    'finmon_balances.json',
+    'finmon_log.csv',
+    'vector_index.faiss',
+    'vector_metadata.pkl',
+    'config.json',
+)
+DATA_DIRS = (('finmon_data', ('.json', '.csv')),)
+
+# Не восстанавливаются автоматически (секреты/настройки текущей установки)
+RESTORE_SKIP = {'config.json'}
+
+
+class SnapshotError(Exception):
+    """Ошибка создания/проверки/восстановления снимка"""
+
+
+class SnapshotStore:
+    """Хранилище снимков с дедупликацией чанков"""
+
+    def __init__(self, root: str, db_path: str = 'knowledge.db',
+                 data_files: Iterable[str] = DATA_FILES, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.db_path = db_path
+        self.data_files = tuple(data_files)
+        self.chunk_size = chunk_size
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.manifests_dir = os.path.join(root, 'manifests')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        # Снимок, восстановление и сборка мусора не должны пересекаться
+        self._lock = threading.Lock()
+
+    # ===== Чанки =====
+
+    def _chunk_base(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _find_chunk(self, digest: str) -> Optional[str]:
+        base = self._chunk_base(digest)
+        for suffix in ('.zst', '.gz'):
+            if os.path.exists(base + suffix):
+                return base + suffix
+        return None
+
+    def _put_chunk(self, digest: str, data: bytes) -> int:
+        """Сохранить чанк, если его еще нет; возвращает записанный объем"""
+        if self._find_chunk(digest):
+            return 0
+        if ZSTD_AVAILABLE:
+            payload, suffix = zstandard.ZstdCompressor(level=10).compress(data), '.zst'
+        else:
+            payload, suffix = gzip.compress(data, compresslevel=6), '.gz'
+        path = self._chunk_base(digest) + suffix
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        return len(payload)
+
+    def read_chunk(self, digest: str) -> bytes:
+        path = self._find_chunk(digest)
+        if path is None:
+            raise SnapshotError(f"чанк {digest[:12]} отсутствует")
+        with open(path, 'rb') as f:
+            payload = f.read()
+        if path.endswith('.zst'):
+            if not ZSTD_AVAILABLE:
+                raise SnapshotError("для чтения снимка нужен пакет zstandard")
+            data = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            data = gzip.decompress(payload)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise SnapshotError(f"чанк {digest[:12]} поврежден")
+        return data
+
+    def _store_file(self, path: str) -> Dict:
+        """Разрезать файл на чанки и дописать новые"""
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = new_chunks = new_bytes = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                written = self._put_chunk(digest, data)
+                if written:
+                    new_chunks += 1
+                    new_bytes += written
+                file_hash.update(data)
+                chunks.append(digest)
+                size += len(data)
+        return {'size': size, 'sha256': file_hash.hexdigest(), 'chunks': chunks,
+                'new_chunks': new_chunks, 'new_bytes': new_bytes}
+
+    # ===== Согласованная копия БД =====
+
+    def _consistent_copy(self, target_path: str):
+        """Онлайн-копия БД через backup API (порциями, без долгой блокировки писателей)"""
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        src = sqlite3.connect(self.db_path, timeout=30)
+        dst = sqlite3.connect(target_path)
+        try:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP)
+        finally:
+            dst.close()
+            src.close()
+
+    @staticmethod
+    def check_integrity(path: str) -> str:
+        """PRAGMA integrity_check: 'ok' или первая найденная ошибка"""
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = conn.execute('PRAGMA integrity_check').fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 'нет ответа'
+
+    @staticmethod
+    def table_counts(path: str) -> Dict[str, int]:
+        """Число строк в каждой таблице (для сверки после восстановления)"""
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                "AND sql NOT LIKE 'CREATE VIRTUAL%' ORDER BY name"
+            )]
+            return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+        finally:
+            conn.close()
+
+    def _data_paths(self) -> List[str]:
+        paths = [p for p in self.data_files if os.path.isfile(p)]
+        for directory, extensions in DATA_DIRS:
+            if os.path.isdir(directory):
+                for dirpath, dirnames, filenames in os.walk(directory):
+                    for filename in sorted(filenames):
+                        if filename.endswith(extensions):
+                            paths.append(os.path.relpath(os.path.join(dirpath, filename), '.'))
+        return paths
+
+    # ===== Снимки =====
+
+    def create(self, label: str = 'manual') -> Dict:
+        """
+        Снять снимок БД и файлов данных (блокирующий вызов, запускать в потоке).
+
+        Returns:
+            Манифест снимка (id, файлы, объем новых данных, проверка целостности)
+
+        Raises:
+            SnapshotError, если копия БД не прошла integrity_check
+        """
+        with self._lock:
+            started = datetime.now()
+            started_ts = time.time()
+            snapshot_id = started.strftime('%Y%m%d_%H%M%S')
+            while os.path.exists(self._manifest_path(snapshot_id)):
+                snapshot_id += '_1'
+
+            tmp_db = os.path.join(self.root, f'.{snapshot_id}.db')
+            try:
+                self._consistent_copy(tmp_db)
+                integrity = self.check_integrity(tmp_db)
+                if integrity != 'ok':
+                    raise SnapshotError(f"копия БД не прошла проверку: {integrity}")
+                table_counts = self.table_counts(tmp_db)
+
+                files = {os.path.basename(self.db_path): dict(self._store_file(tmp_db), role='database')}
+            finally:
+                if os.path.exists(tmp_db):
+                    os.remove(tmp_db)
+
+            for path in self._data_paths():
+                try:
+                    files[path] = dict(self._store_file(path), role='data')
+                except OSError as e:
+                    logger.warning(f"⚠️ Snapshot: пропускаю {path}: {e}")
+
+            manifest = {
+                'id': snapshot_id,
+                'label': label,
+                'created_at': started.isoformat(),
+                'created_ts': started_ts,
+                'duration_sec': round((datetime.now() - started).total_seconds(), 2),
+                'integrity': integrity,
+                'table_counts': table_counts,
+                'codec': 'zstd' if ZSTD_AVAILABLE else 'gzip',
+                'chunk_size': self.chunk_size,
+                'total_size': sum(f['size'] for f in files.values()),
+                'new_chunks': sum(f['new_chunks'] for f in files.values()),
+                'new_bytes': sum(f['new_bytes'] for f in files.values()),
+                'files': files,
+            }
+            self._write_manifest(manifest)
+
+        logger.info(
+            f"💾 Snapshot {snapshot_id}: {len(files)} файлов, "
+            f"{manifest['total_size'] / 1048576:.1f} МБ, новых {manifest['new_bytes'] / 1048576:.2f} МБ "
+            f"({manifest['new_chunks']} чанков) за {manifest['duration_sec']} с"
+        )
+        return manifest
+
+    def _manifest_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.manifests_dir, f'{snapshot_id}.json')
+
+    def _write_manifest(self, manifest: Dict):
+        path = self._manifest_path(manifest['id'])
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def load_manifest(self, snapshot_id: str) -> Optional[Dict]:
+        path = self._manifest_path(snapshot_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_snapshots(self) -> List[Dict]:
+        """Снимки от новых к старым (без списков чанков)"""
+        snapshots = []
+        for filename in sorted(os.listdir(self.manifests_dir), reverse=True):
+            if not filename.endswith('.json'):
+                continue
+            manifest = self.load_manifest(filename[:-5])
+            if manifest:
+                manifest['files'] = {name: {k: v for k, v in info.items() if k != 'chunks'}
+                                     for name, info in manifest['files'].items()}
+                snapshots.append(manifest)
+        return snapshots
+
+    def latest_id(self) -> Optional[str]:
+        ids = sorted(f[:-5] for f in os.listdir(self.manifests_dir) if f.endswith('.json'))
+        return ids[-1] if ids else None
+
+    def verify(self, snapshot_id: str) -> Tuple[bool, List[str]]:
+        """Проверить наличие и контрольные суммы всех чанков снимка"""
+        manifest = self.load_manifest(snapshot_id)
+        if manifest is None:
+            return False, [f"снимок {snapshot_id} не найден"]
+        problems = []
+        for name, info in manifest['files'].items():
+            file_hash = hashlib.sha256()
+            try:
+                for digest in info['chunks']:
+                    file_hash.update(self.read_chunk(digest))
+            except SnapshotError as e:
+                problems.append(f"{name}: {e}")
+                continue
+            if file_hash.hexdigest() != info['sha256']:
+                problems.append(f"{name}: контрольная сумма файла не совпадает")
+        return not problems, problems
+
+    def materialize(self, snapshot_id: str, name: str, target_path: str) -> str:
+        """Собрать файл снимка из чанков в target_path (с проверкой sha256)"""
+        manifest = self.load_manifest(snapshot_id)
+        if manifest is None or name not in manifest['files']:
+            raise SnapshotError(f"{name} нет в снимке {snapshot_id}")
+        info = manifest['files'][name]
+
+        file_hash = hashlib.sha256()
+        tmp = target_path + '.restore-tmp'
+        with open(tmp, 'wb') as f:
+            for digest in info['chunks']:
+                data = self.read_chunk(digest)
+                file_hash.update(data)
+                f.write(data)
+        if file_hash.hexdigest() != info['sha256']:
+            os.remove(tmp)
+            raise SnapshotError(f"{name}: контрольная сумма не совпадает")
+        os.replace(tmp, target_path)
+        return target_path
+
+    def export_archive(self, snapshot_id: str, archive_path: str) -> str:
+        """Собрать tar.gz из снимка (для отправки владельцу вне сервера)"""
+        manifest = self.load_manifest(snapshot_id)
+        if manifest is None:
+            raise SnapshotError(f"снимок {snapshot_id} не найден")
+        staging = os.path.join(self.root, f'.export_{snapshot_id}')
+        os.makedirs(staging, exist_ok=True)
+        try:
+            with tarfile.open(archive_path, 'w:gz') as tar:
+                for index, name in enumerate(manifest['files']):
+                    part = os.path.join(staging, str(index))
+                    self.materialize(snapshot_id, name, part)
+                    tar.add(part, arcname=name)
+                    os.remove(part)
+        finally:
+            for leftover in os.listdir(staging):
+                os.remove(os.path.join(staging, leftover))
+            os.rmdir(staging)
+        return archive_path
+
+    def restore(self, snapshot_id: str) -> Dict:
+        """
+        Восстановить БД и файлы данных из снимка (блокирующий вызов).
+
+        Перед восстановлением снимается страховочный снимок текущего
+        состояния. БД восстанавливается через backup API в живой файл -
+        открытые подключения бота видят новое содержимое без перезапуска.
+
+        Returns:
+            {'restored': [...], 'safety_snapshot': id}
+        """
+        manifest = self.load_manifest(snapshot_id)
+        if manifest is None:
+            raise SnapshotError(f"снимок {snapshot_id} не найден")
+
+        safety = self.create(label=f'before_restore_{snapshot_id}')
+
+        with self._lock:
+            restored = []
+            for name, info in manifest['files'].items():
+                if info['role'] == 'database':
+                    tmp_db = os.path.join(self.root, f'.restore_{snapshot_id}.db')
+                    try:
+                        self.materialize(snapshot_id, name, tmp_db)
+                        integrity = self.check_integrity(tmp_db)
+                        if integrity != 'ok':
+                            raise SnapshotError(f"БД из снимка не прошла проверку: {integrity}")
+                        src = sqlite3.connect(tmp_db)
+                        dst = sqlite3.connect(self.db_path, timeout=30)
+                        try:
+                            src.backup(dst)
+                        finally:
+                            dst.close()
+                            src.close()
+                    finally:
+                        if os.path.exists(tmp_db):
+                            os.remove(tmp_db)
+                    restored.append(name)
+                elif name not in RESTORE_SKIP:
+                    directory = os.path.dirname(name)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self.materialize(snapshot_id, name, name)
+                    restored.append(name)
+
+        logger.info(f"♻️ Restored snapshot {snapshot_id}: {restored} (safety snapshot {safety['id']})")
+        return {'restored': restored, 'safety_snapshot': safety['id']}
+
+    # ===== Хранение =====
+
+    def apply_retention(self, keep_last: int = KEEP_LAST, retention: Dict[str, int] = None) -> List[str]:
+        """Удалить снимки вне политики хранения и неиспользуемые чанки"""
+        retention = retention or RETENTION
+        with self._lock:
+            ids = sorted((f[:-5] for f in os.listdir(self.manifests_dir) if f.endswith('.json')), reverse=True)
+            keep = set(ids[:keep_last])
+
+            periods = {
+                'daily': lambda d: d.strftime('%Y-%m-%d'),
+                'weekly': lambda d: '%d-W%02d' % d.isocalendar()[:2],
+                'monthly': lambda d: d.strftime('%Y-%m'),
+            }
+            for policy, count in retention.items():
+                seen = []
+                for snapshot_id in ids:
+                    period = periods[policy](datetime.strptime(snapshot_id[:15], '%Y%m%d_%H%M%S'))
+                    if period in seen:
+                        continue
+                    if len(seen) >= count:
+                        break
+                    seen.append(period)
+                    keep.add(snapshot_id)
+
+            removed = [snapshot_id for snapshot_id in ids if snapshot_id not in keep]
+            for snapshot_id in removed:
+                os.remove(self._manifest_path(snapshot_id))
+            freed = self._collect_garbage()
+
+        if removed:
+            logger.info(f"🧹 Snapshots removed: {len(removed)}, freed {freed / 1048576:.2f} МБ")
+        return removed
+
+    def _collect_garbage(self) -> int:
+        """Удалить чанки, на которые не ссылается ни один манифест (под self._lock)"""
+        referenced = set()
+        for filename in os.listdir(self.manifests_dir):
+            if filename.endswith('.json'):
+                with open(os.path.join(self.manifests_dir, filename), 'r', encoding='utf-8') as f:
+                    for info in json.load(f)['files'].values():
+                        referenced.update(info['chunks'])
+
+        freed = 0
+        for dirpath, dirnames, filenames in os.walk(self.chunks_dir):
+            for filename in filenames:
+                digest = filename.split('.')[0]
+                if digest not in referenced:
+                    path = os.path.join(dirpath, filename)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+    def storage_size(self) -> int:
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.chunks_dir):
+            total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+        return total
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальное распознавание Z-отчетов (OpenCV + Tesseract)
+
+Фото чека выравнивается, обрезается по контуру ленты и бинаризуется,
+затем распознается Tesseract'ом (rus+eng, белый список цифр и кириллицы).
+Суммы извлекаются по ключевым словам строки и по правилам раскладки
+(итог = наличные + безнал, итог - максимальная сумма). Для каждого поля
+считается уверенность; к OpenAI Vision обращаемся только если уверенность
+в итоговой сумме ниже порога.
+
+Распознавание идет в пуле процессов - event loop бота не блокируется.
+"""
+
+import asyncio
+import difflib
+import logging
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy as np
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+    logger.warning("⚠️ opencv-python not available - local Z-report OCR disabled")
+
+try:
+    import pytesseract
+    TESSERACT_AVAILABLE = True
+except ImportError:
+    TESSERACT_AVAILABLE = False
+    logger.warning("⚠️ pytesseract not available - local Z-report OCR disabled")
+
+DEFAULT_THRESHOLD = 0.75
+DEFAULT_WORKERS = 2
+OCR_TIMEOUT_SECONDS = 20
+TARGET_WIDTH = 1200
+SUM_CHECK_CONFIDENCE = 0.95  # итог сошелся с наличные + безнал
+
+CHAR_WHITELIST = (
+    'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,:=№#*-/ '
+)
+
+# Ключевые слова строк Z-отчета (в верхнем регистре, кириллица)
+FIELD_KEYWORDS = {
+    'total': ('ИТОГ', 'ИТОГО', 'ВЫРУЧКА', 'ПРИХОД'),
+    'cash': ('НАЛИЧНЫМИ', 'НАЛИЧНЫЕ', 'НАЛ'),
+    'card': ('БЕЗНАЛИЧНЫМИ', 'ЭЛЕКТРОННЫМИ', 'БЕЗНАЛ', 'КАРТОЙ', 'КАРТА'),
+}
+REGISTER_KEYWORDS = ('ККТ', 'КАССА', 'РН', 'ЗН')
+AMOUNT_FIELDS = ('total', 'cash', 'card')
+
+# Латинские буквы, которые OCR путает с кириллицей
+HOMOGLYPHS = str.maketrans('ABCEHKMOPTXY', 'АВСЕНКМОРТХУ')
+
+AMOUNT_RE = re.compile(r'=?\s*(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)[.,](\d{2})(?!\d)')
+DATE_RE = re.compile(r'(?<!\d)(\d{2})[.,/](\d{2})[.,/](\d{2,4})(?!\d)')
+TIME_RE = re.compile(r'(?<!\d)([01]\d|2[0-3]):([0-5]\d)(?!\d)')
+REGISTER_RE = re.compile(r'(\d{4,20})')
+
+_LANG = None
+
+
+# ===== ПРЕДОБРАБОТКА =====
+
+def _estimate_skew(binary) -> float:
+    """Угол наклона строк по профилю проекции (максимум дисперсии сумм строк)"""
+    small = cv2.resize(binary, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+    h, w = small.shape
+    center = (w / 2, h / 2)
+
+    def score(angle):
+        m = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rotated = cv2.warpAffine(small, m, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+        return float(np.var(rotated.sum(axis=1)))
+
+    best = max(np.arange(-10, 10.5, 1.0), key=score)
+    return float(max(np.arange(best - 1, best + 1.01, 0.25), key=score))
+
+
+def crop_receipt(gray):
+    """Обрезать по светлой ленте чека, если она занимает заметную часть кадра"""
+    blurred = cv2.GaussianBlur(gray, (9, 9), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((25, 25), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return gray
+
+    contour = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(contour)
+    if area < 0.15 * gray.size or area > 0.95 * gray.size:
+        return gray
+
+    x, y, w, h = cv2.boundingRect(contour)
+    return gray[y:y + h, x:x + w]
+
+
+def preprocess(image_bytes: bytes):
+    """Декодировать, обрезать, выровнять и бинаризовать фото чека"""
+    data = np.frombuffer(image_bytes, dtype=np.uint8)
+    gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("Не удалось декодировать изображение")
+
+    gray = crop_receipt(gray)
+
+    h, w = gray.shape
+    scale = TARGET_WIDTH / float(w)
+    if scale > 1.1 or scale < 0.6:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale,
+                          interpolation=cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA)
+
+    gray = cv2.medianBlur(gray, 3)
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 31, 15)
+
+    angle = _estimate_skew(255 - binary)
+    if abs(angle) >= 0.25:
+        h, w = binary.shape
+        m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        binary = cv2.warpAffine(binary, m, (w, h), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+    return binary
+
+
+# ===== TESSERACT =====
+
+def _language() -> str:
+    global _LANG
+    if _LANG is None:
+        try:
+            available = set(pytesseract.get_languages(config=''))
+        except Exception:
+            available = set()
+        if 'rus' in available:
+            _LANG = 'rus+eng' if 'eng' in available else 'rus'
+        else:
+            logger.warning("⚠️ Tesseract 'rus' traineddata not found - using 'eng'")
+            _LANG = 'eng'
+    return _LANG
+
+
+def ocr_lines(binary) -> List[Dict]:
+    """Строки текста с уверенностью слов: [{'text', 'words': [(text, conf)], 'top'}]"""
+    config = f'--oem 1 --psm 6 -c preserve_interword_spaces=1 -c tessedit_char_whitelist="{CHAR_WHITELIST}"'
+    data = pytesseract.image_to_data(binary, lang=_language(), config=config,
+                                     output_type=pytesseract.Output.DICT)
+    lines: Dict[Tuple[int, int, int], Dict] = {}
+    for i, word in enumerate(data['text']):
+        word = (word or '').strip()
+        if not word:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        line = lines.setdefault(key, {'words': [], 'top': data['top'][i]})
+        line['words'].append((word, max(0.0, float(data['conf'][i])) / 100.0))
+
+    result = []
+    for line in sorted(lines.values(), key=lambda l: l['top']):
+        line['text'] = ' '.join(w for w, _ in line['words'])
+        result.append(line)
+    return result
+
+
+# ===== РАЗБОР ПОЛЕЙ =====
+
+def _normalize(text: str) -> str:
+    return text.upper().translate(HOMOGLYPHS).replace('Ё', 'Е')
+
+
+def _label_score(text: str, keywords) -> float:
+    """Насколько слова строки похожи на ключевое слово (0..1)"""
+    best = 0.0
+    for token in re.findall(r'[А-ЯA-Z]{2,}', _normalize(text)):
+        for keyword in keywords:
+            if token == keyword or (len(keyword) >= 5 and token.startswith(keyword)):
+                return 1.0
+            best = max(best, difflib.SequenceMatcher(None, token, keyword).ratio())
+    return best if best >= 0.6 else 0.0
+
+
+def _amounts(line: Dict) -> List[Tuple[float, float]]:
+    """Суммы строки с уверенностью OCR (минимум по словам суммы): [(value, conf)]"""
+    spans, position = [], 0
+    for word, conf in line['words']:
+        spans.append((position, position + len(word), conf))
+        position += len(word) + 1
+
+    found = []
+    for match in AMOUNT_RE.finditer(line['text']):
+        value = float(re.sub(r'\D', '', match.group(1)) + '.' + match.group(2))
+        confs = [conf for start, end, conf in spans if start < match.end() and end > match.start(1)]
+        found.append((value, min(confs) if confs else 0.5))
+    return found
+
+
+def parse_fields(lines: List[Dict]) -> Dict:
+    """
+    Извлечь поля Z-отчета из строк OCR.
+
+    Returns:
+        {'total', 'cash', 'card', 'date', 'time', 'register_number',
+         'confidence': {поле: 0..1}}
+    """
+    fields: Dict = {}
+    confidence: Dict[str, float] = {}
+    amounts: List[Dict] = []
+    consumed = set()
+
+    for index, line in enumerate(lines):
+        line_amounts = _amounts(line) if index not in consumed else []
+
+        # Строка относится к полю с самой похожей подписью ("БЕЗНАЛИЧНЫМИ" - не наличные)
+        scores = {field: _label_score(line['text'], FIELD_KEYWORDS[field]) for field in AMOUNT_FIELDS}
+        label = max(scores, key=scores.get)
+        if not scores[label]:
+            label = None
+        elif not line_amounts and index + 1 < len(lines):
+            # Подпись без суммы - сумма на следующей строке (узкая лента)
+            line_amounts = _amounts(lines[index + 1])
+            consumed.add(index + 1)
+
+        for value, conf in line_amounts:
+            amounts.append({'value': value, 'conf': conf, 'line': index,
+                            'label': label, 'label_score': scores[label] if label else 0.0})
+
+        if 'date' not in fields:
+            match = DATE_RE.search(line['text'])
+            if match:
+                day, month, year = match.groups()
+                if 1 <= int(day) <= 31 and 1 <= int(month) <= 12:
+                    fields['date'] = f"{day}.{month}.{year if len(year) == 4 else '20' + year}"
+                    confidence['date'] = min(c for _, c in line['words'])
+        if 'time' not in fields:
+            match = TIME_RE.search(line['text'])
+            if match:
+                fields['time'] = f"{match.group(1)}:{match.group(2)}"
+                confidence['time'] = min(c for _, c in line['words'])
+        if 'register_number' not in fields and _label_score(line['text'], REGISTER_KEYWORDS) == 1.0:
+            match = REGISTER_RE.search(line['text'])
+            if match:
+                fields['register_number'] = match.group(1)
+                confidence['register_number'] = min(c for _, c in line['words'])
+
+    _resolve_amounts(fields, confidence, amounts)
+
+    fields['confidence'] = {k: round(v, 3) for k, v in confidence.items()}
+    return fields
+
+
+def _find_sum_triple(amounts: List[Dict]) -> Optional[Tuple[Dict, Dict, Dict]]:
+    """Найти части и итог (a + b = c) с наилучшим совпадением подписей"""
+    best, best_score = None, 0
+    for k, total in enumerate(amounts):
+        for i, a in enumerate(amounts):
+            for j in range(i + 1, len(amounts)):
+                b = amounts[j]
+                if k in (i, j) or a['line'] == b['line'] or abs(a['value'] + b['value'] - total['value']) >= 0.01:
+                    continue
+                score = (total['label'] == 'total') + sum(p['label'] in ('cash', 'card') for p in (a, b))
+                score -= sum(p['label'] == 'total' for p in (a, b))
+                if best is None or score > best_score or (score == best_score and total['value'] > best[2]['value']):
+                    best, best_score = (a, b, total), score
+    return best
+
+
+def _resolve_amounts(fields: Dict, confidence: Dict, amounts: List[Dict]):
+    """
+    Итог, наличные и безнал: по подписям и по правилу итог = наличные + безнал.
+
+    Три независимо распознанные суммы случайно не сложатся, поэтому найденная
+    тройка подтверждает итог даже при плохо прочитанных подписях.
+    """
+    triple = _find_sum_triple(amounts)
+    if triple:
+        first, second, total = triple
+        ocr_conf = max(min(a['conf'] for a in triple), SUM_CHECK_CONFIDENCE)
+        fields['total'] = total['value']
+        confidence['total'] = ocr_conf
+
+        if first['label'] == 'card' or second['label'] == 'cash':
+            first, second = second, first
+        labeled = first['label'] == 'cash' or second['label'] == 'card'
+        for field, part in (('cash', first), ('card', second)):
+            fields[field] = part['value']
+            confidence[field] = ocr_conf if labeled else ocr_conf * 0.5
+        return
+
+    # Без тройки - только подписанные суммы
+    for field in AMOUNT_FIELDS:
+        candidates = [a for a in amounts if a['label'] == field]
+        if candidates:
+            best = max(candidates, key=lambda a: a['conf'] * a['label_score'])
+            fields[field] = best['value']
+            confidence[field] = best['conf'] * best['label_score']
+
+    if 'total' in fields:
+        if 'cash' in fields and 'card' in fields:
+            # Разбивка не сходится с итогом
+            for field in AMOUNT_FIELDS:
+                confidence[field] *= 0.5
+    elif amounts:
+        # Итог - наибольшая сумма чека
+        best = max(amounts, key=lambda a: a['value'])
+        fields['total'] = best['value']
+        confidence['total'] = best['conf'] * 0.5
+
+
+def recognize_z_report(image_bytes: bytes) -> Dict:
+    """Полный локальный конвейер (выполняется в процессе пула)"""
+    binary = preprocess(image_bytes)
+    return parse_fields(ocr_lines(binary))
+
+
+# ===== АСИНХРОННЫЙ ДВИЖОК =====
+
+class ZReportOCR:
+    """Распознавание Z-отчетов: локально в пуле процессов, Vision - только при низкой уверенности"""
+
+    def __init__(self, fallback: Optional[Callable[[bytes], Awaitable[Optional[Dict]]]] = None,
+                 threshold: float = DEFAULT_THRESHOLD, workers: int = DEFAULT_WORKERS,
+                 timeout: float = OCR_TIMEOUT_SECONDS):
+        self.fallback = fallback
+        self.threshold = threshold
+        self.workers = workers
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def local_available(self) -> bool:
+        return CV2_AVAILABLE and TESSERACT_AVAILABLE
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: бот многопоточный, fork из него небезопасен
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    async def recognize_local(self, image_bytes: bytes) -> Optional[Dict]:
+        if not self.local_available:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._get_pool(), recognize_z_report, bytes(image_bytes)),
+                timeout=self.timeout
+            )
+        except BrokenProcessPool:
+            logger.error("❌ OCR process pool crashed - recreating")
+            self._pool = None
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Local OCR timeout ({self.timeout}s)")
+        except Exception as e:
+            logger.error(f"❌ Local OCR error: {e}")
+        return None
+
+    def is_confident(self, result: Optional[Dict]) -> bool:
+        if not result or 'total' not in result:
+            return False
+        return result.get('confidence', {}).get('total', 0.0) >= self.threshold
+
+    async def recognize(self, image_bytes: bytes) -> Optional[Dict]:
+        """
+        Распознать Z-отчет.
+
+        Returns:
+            Словарь полей с 'confidence' и 'source' ('local' | 'vision') или None
+        """
+        local = await self.recognize_local(image_bytes)
+        if self.is_confident(local):
+            local['source'] = 'local'
+            logger.info(f"✅ Local OCR: total={local['total']} conf={local['confidence']}")
+            return local
+
+        if local:
+            logger.info(f"⚠️ Low local OCR confidence {local.get('confidence')} - escalating to Vision")
+        if self.fallback:
+            vision = await self.fallback(image_bytes)
+            if vision:
+                vision['source'] = 'vision'
+                return vision
+
+        if local and 'total' in local:
+            local['source'] = 'local'
+            return local
+        return None
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк локального OCR Z-отчетов на синтетических чеках
+
+Генерирует детерминированный набор чеков (по seed): разные суммы, шрифт,
+наклон, размытие, шум, фон и JPEG-сжатие. Меряет точность полей и задержку
+recognize_z_report, а также долю чеков, которые ушли бы в Vision API.
+
+Запуск:
+    python -m modules.z_report_ocr_bench --font /path/DejaVuSansMono.ttf --count 40
+"""
+
+import argparse
+import io
+import random
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from modules.z_report_ocr import DEFAULT_THRESHOLD, recognize_z_report
+
+CARD_LABELS = ('БЕЗНАЛИЧНЫМИ', 'ЭЛЕКТРОННЫМИ')
+TOTAL_LABELS = ('ИТОГ', 'ВЫРУЧКА')
+
+
+def _money(value: float) -> str:
+    whole, frac = f"{value:.2f}".split('.')
+    groups = []
+    while whole:
+        groups.insert(0, whole[-3:])
+        whole = whole[:-3]
+    return '=' + ' '.join(groups) + '.' + frac
+
+
+def make_receipt(seed: int, font_path: str) -> Tuple[bytes, Dict]:
+    """Синтетический Z-отчет: (JPEG, ожидаемые поля)"""
+    rnd = random.Random(seed)
+    cash = round(rnd.uniform(0, 60000), 2) if rnd.random() > 0.1 else 0.0
+    card = round(rnd.uniform(1000, 120000), 2)
+    total = round(cash + card, 2)
+    day, month = rnd.randint(1, 28), rnd.randint(1, 12)
+    hour, minute = rnd.randint(0, 23), rnd.randint(0, 59)
+    register = str(rnd.randint(10 ** 9, 10 ** 10 - 1))
+    expected = {
+        'total': total, 'cash': cash, 'card': card,
+        'date': f"{day:02d}.{month:02d}.2025", 'time': f"{hour:02d}:{minute:02d}",
+        'register_number': register,
+    }
+
+    width = 32
+    rows = [
+        'ООО "КОМПЬЮТЕРНЫЙ КЛУБ"'.center(width),
+        'ОТЧЕТ О ЗАКРЫТИИ СМЕНЫ'.center(width),
+        f"СМЕНА № {rnd.randint(1, 400)}",
+        f"РН ККТ {register}",
+        f"{day:02d}.{month:02d}.25 {hour:02d}:{minute:02d}",
+        '-' * width,
+        'ЧЕКОВ ПРИХОДА'.ljust(width - 4) + f"{rnd.randint(5, 300):>4}",
+    ]
+    for label, value in (('НАЛИЧНЫМИ', cash), (rnd.choice(CARD_LABELS), card),
+                         (rnd.choice(TOTAL_LABELS), total)):
+        amount = _money(value)
+        rows.append(label + ' ' * max(1, width - len(label) - len(amount)) + amount)
+    rows += ['-' * width, 'ФН 9960440300' + str(rnd.randint(100000, 999999)), 'СПАСИБО'.center(width)]
+
+    font_size = rnd.randint(22, 30)
+    font = ImageFont.truetype(font_path, font_size)
+    line_height = int(font_size * 1.45)
+    paper_w = int(font_size * 0.62 * width) + 60
+    paper_h = line_height * len(rows) + 80
+    paper = Image.new('L', (paper_w, paper_h), rnd.randint(225, 250))
+    draw = ImageDraw.Draw(paper)
+    ink = rnd.randint(0, 70)
+    for i, row in enumerate(rows):
+        draw.text((30, 40 + i * line_height), row, font=font, fill=ink)
+
+    # Фото: лента на темном фоне, наклон, размытие, шум, неравномерный свет
+    background = Image.new('L', (paper_w + 300, paper_h + 300), rnd.randint(40, 110))
+    background.paste(paper, (150 + rnd.randint(-40, 40), 150 + rnd.randint(-40, 40)))
+    image = np.array(background.rotate(rnd.uniform(-6, 6), resample=Image.BICUBIC,
+                                       fillcolor=rnd.randint(40, 110)), dtype=np.float32)
+    h, w = image.shape
+    image *= np.linspace(rnd.uniform(0.75, 1.0), rnd.uniform(0.9, 1.1), w)[None, :]
+    image += np.random.default_rng(seed).normal(0, rnd.uniform(2, 8), image.shape)
+    image = cv2.GaussianBlur(np.clip(image, 0, 255).astype(np.uint8), (3, 3), rnd.uniform(0.3, 1.0))
+
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format='JPEG', quality=rnd.randint(60, 90))
+    return buf.getvalue(), expected
+
+
+def run(count: int, font_path: str, threshold: float = DEFAULT_THRESHOLD) -> Dict:
+    fields = ('total', 'cash', 'card', 'date', 'time', 'register_number')
+    correct = {f: 0 for f in fields}
+    latencies: List[float] = []
+    confident = confident_correct = 0
+
+    for seed in range(count):
+        data, expected = make_receipt(seed, font_path)
+        started = time.perf_counter()
+        result = recognize_z_report(data)
+        latencies.append(time.perf_counter() - started)
+
+        for field in fields:
+            if str(result.get(field)) == str(expected[field]) or result.get(field) == expected[field]:
+                correct[field] += 1
+        if result.get('confidence', {}).get('total', 0.0) >= threshold:
+            confident += 1
+            confident_correct += result.get('total') == expected['total']
+
+    latencies.sort()
+    return {
+        'count': count,
+        'accuracy': {f: round(correct[f] / count, 3) for f in fields},
+        'local_rate': round(confident / count, 3),
+        'local_precision': round(confident_correct / confident, 3) if confident else None,
+        'latency_p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'latency_p95_ms': round(latencies[int(0.95 * (count - 1))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--font', required=True, help='TTF шрифт с кириллицей (моноширинный)')
+    parser.add_argument('--count', type=int, default=40)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--save', help='сохранить первые чеки в каталог (для просмотра)')
+    args = parser.parse_args()
+
+    if args.save:
+        import os
+        os.makedirs(args.save, exist_ok=True)
+        for seed in range(min(args.count, 5)):
+            with open(os.path.join(args.save, f"receipt_{seed}.jpg"), 'wb') as f:
+                f.write(make_receipt(seed, args.font)[0])
+
+    report = run(args.count, args.font, args.threshold)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,11 @@
 """
 Product Manager - Система учёта товара для админов
 Запись товара на админов, отчёты, управление товарами
+
+Долги: admin_products - история взятого товара (записи добавляются,
+погашение помечает их settled), admin_debt_balances - текущий долг каждого
+админа. Баланс меняется в той же транзакции, что и история, поэтому экраны
+долгов читают только балансы; check_debt_balances сверяет их с историей.
 """
 
 import sqlite3
@@ -59,6 +64,29 @@ class ProductManager:
             ''')
             logger.info("✅ Admin_products table created/verified")
             
+            # Колонки оплаты (используются settle_admin_debt / submit_payment_proof)
+            cursor.execute("PRAGMA table_info(admin_products)")
+            columns = {row[1] for row in cursor.fetchall()}
+            if 'paid_at' not in columns:
+                cursor.execute("ALTER TABLE admin_products ADD COLUMN paid_at TIMESTAMP")
+            if 'payment_proof_photo' not in columns:
+                cursor.execute("ALTER TABLE admin_products ADD COLUMN payment_proof_photo TEXT")
+            
+            # Текущие долги админов (поддерживаются вместе с admin_products)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS admin_debt_balances (
+                    admin_id INTEGER PRIMARY KEY,
+                    admin_name TEXT,
+                    balance REAL NOT NULL DEFAULT 0,
+                    open_items INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_admin_products_open
+                ON admin_products(admin_id, settled)
+            ''')
+            
             conn.commit()
             
             # Verify tables exist
@@ -75,6 +103,9 @@ class ProductManager:
                 logger.error("❌ Admin_products table was not created!")
             
             conn.close()
+            
+            # Балансы из истории: первый запуск и записи в обход менеджера
+            self.check_debt_balances(fix=True)
             logger.info("✅ Product Manager database initialized successfully")
         except Exception as e:
             logger.error(f"❌ Error initializing Product Manager database: {e}")
@@ -227,7 +258,17 @@ class ProductManager:
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (admin_id, admin_name, product_id, product['name'], 
                   quantity, product['cost_price'], total_debt))
-            
+            cursor.execute('''
+                INSERT INTO admin_debt_balances (admin_id, admin_name, balance, open_items, updated_at)
+                VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT(admin_id) DO UPDATE SET
+                    admin_name = excluded.admin_name,
+                    balance = balance + excluded.balance,
+                    open_items = open_items + 1,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (admin_id, admin_name, total_debt))
+            
+            # История и баланс - одной транзакцией
             conn.commit()
             conn.close()
             
@@ -245,15 +286,15 @@ class ProductManager:
             cursor = conn.cursor()
             
             cursor.execute('''
-                SELECT SUM(total_debt) FROM admin_products
-                WHERE admin_id = ? AND settled = FALSE
+                SELECT balance FROM admin_debt_balances
+                WHERE admin_id = ?
             ''', (admin_id,))
             
             row = cursor.fetchone()
             conn.close()
             
-            return row[0] if row[0] else 0.0
-            
+            return row[0] if row and row[0] else 0.0
+        
         except Exception as e:
             logger.error(f"❌ Error getting admin debt: {e}")
             return 0.0
@@ -400,11 +441,11 @@ class ProductManager:
             # Определяем порядок сортировки
             order_clause = 'total DESC' if sort_by == 'debt' else 'admin_name ASC'
             
+            # Текущие балансы - без агрегации по истории
             cursor.execute(f'''
-                SELECT admin_id, admin_name, SUM(total_debt) as total
-                FROM admin_products
-                WHERE settled = FALSE
-                GROUP BY admin_id
+                SELECT admin_id, admin_name, balance as total
+                FROM admin_debt_balances
+                WHERE open_items > 0
                 ORDER BY {order_clause}
             ''')
             
@@ -568,6 +609,7 @@ class ProductManager:
                 SET settled = TRUE
                 WHERE admin_id = ? AND settled = FALSE
             ''', (admin_id,))
+            self._zero_balances(cursor, admin_id)
             
             conn.commit()
             conn.close()
@@ -592,6 +634,7 @@ class ProductManager:
             ''')
             
             affected = cursor.rowcount
+            self._zero_balances(cursor)
             conn.commit()
             conn.close()
             
@@ -602,6 +645,80 @@ class ProductManager:
             logger.error(f"❌ Error clearing all debts: {e}")
             return False
     
+    def _zero_balances(self, cursor, admin_id: Optional[int] = None):
+        """Обнулить баланс (в транзакции погашения)"""
+        if admin_id is None:
+            cursor.execute('''
+                UPDATE admin_debt_balances
+                SET balance = 0, open_items = 0, updated_at = CURRENT_TIMESTAMP
+            ''')
+        else:
+            cursor.execute('''
+                UPDATE admin_debt_balances
+                SET balance = 0, open_items = 0, updated_at = CURRENT_TIMESTAMP
+                WHERE admin_id = ?
+            ''', (admin_id,))
+    
+    def check_debt_balances(self, fix: bool = False) -> List[Dict]:
+        """Сверить балансы с историей admin_products
+        
+        Args:
+            fix: Переписать расходящиеся балансы значениями из истории
+        
+        Returns:
+            Расхождения: [{'admin_id', 'stored', 'actual', 'stored_items', 'actual_items'}]
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT admin_id, MAX(admin_name), SUM(total_debt), COUNT(*)
+                FROM admin_products
+                WHERE settled = 0
+                GROUP BY admin_id
+            ''')
+            actual = {row[0]: row[1:] for row in cursor.fetchall()}
+            
+            cursor.execute('SELECT admin_id, balance, open_items FROM admin_debt_balances')
+            stored = {row[0]: row[1:] for row in cursor.fetchall()}
+            
+            mismatches = []
+            for admin_id in set(actual) | set(stored):
+                admin_name, actual_total, actual_items = actual.get(admin_id, (None, 0.0, 0))
+                stored_total, stored_items = stored.get(admin_id, (0.0, 0))
+                if abs((stored_total or 0) - (actual_total or 0)) > 0.005 or stored_items != actual_items:
+                    mismatches.append({
+                        'admin_id': admin_id,
+                        'stored': stored_total,
+                        'actual': actual_total,
+                        'stored_items': stored_items,
+                        'actual_items': actual_items
+                    })
+                    if fix:
+                        cursor.execute('''
+                            INSERT INTO admin_debt_balances (admin_id, admin_name, balance, open_items, updated_at)
+                            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                            ON CONFLICT(admin_id) DO UPDATE SET
+                                admin_name = COALESCE(excluded.admin_name, admin_name),
+                                balance = excluded.balance,
+                                open_items = excluded.open_items,
+                                updated_at = CURRENT_TIMESTAMP
+                        ''', (admin_id, admin_name, actual_total or 0.0, actual_items))
+            
+            if fix and mismatches:
+                conn.commit()
+            conn.close()
+            
+            if mismatches:
+                logger.warning(f"⚠️ Debt balances differ from history for {len(mismatches)} admins"
+                               f"{' (fixed)' if fix else ''}")
+            return mismatches
+        
+        except Exception as e:
+            logger.error(f"❌ Error checking debt balances: {e}")
+            return []
+    
     def format_products_list(self) -> str:
         """Форматирование списка товаров"""
         products = self.list_products()
@@ -856,15 +973,10 @@ class ProductManager:
             cursor = conn.cursor()
             
             cursor.execute('''
-                SELECT 
-                    admin_id,
-                    admin_name,
-                    SUM(total_debt) as total_debt
-                FROM admin_products
-                WHERE settled = 0
-                GROUP BY admin_id, admin_name
-                HAVING SUM(total_debt) > 0
-                ORDER BY total_debt DESC
+                SELECT admin_id, admin_name, balance AS total_debt
+                FROM admin_debt_balances
+                WHERE balance > 0
+                ORDER BY balance DESC
             ''')
             
             debts = []
@@ -951,9 +1063,10 @@ class ProductManager:
                 SET settled = 1, paid_at = ?
                 WHERE admin_id = ? AND settled = 0
             ''', (datetime.now().isoformat(), admin_id))
+            affected = cursor.rowcount
+            self._zero_balances(cursor, admin_id)
             
             conn.commit()
-            affected = cursor.rowcount
             conn.close()
             
             logger.info(f"✅ Settled debt for admin {admin_id}, {affected} items marked as paid")
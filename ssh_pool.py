@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH Pool - пул авторизованных SSH-соединений к V2Ray серверам
+
+Полное SSH-рукопожатие с парольной авторизацией занимает секунды, поэтому
+соединение на хост открывается один раз и переиспользуется всеми
+операциями (paramiko мультиплексирует каналы поверх одного транспорта):
+- keepalive на транспорте, чтобы NAT/фаервол не рвали простаивающее соединение;
+- проверка живости перед выдачей (send_ignore), мертвые соединения
+  пересоздаются прозрачно;
+- простаивающие дольше idle_timeout соединения закрываются; соединение,
+  на котором выполняется команда (счетчик in_use), не закрывается никогда.
+"""
+
+import codecs
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 30
+IDLE_TIMEOUT_SECONDS = 300
+HEALTH_CHECK_SECONDS = 30
+CONNECT_TIMEOUT_SECONDS = 10
+
+
+class SSHConnectionPool:
+    """Пул SSH-клиентов по ключу (host, port, username)"""
+
+    def __init__(self, keepalive: int = KEEPALIVE_SECONDS, idle_timeout: int = IDLE_TIMEOUT_SECONDS,
+                 health_check_interval: int = HEALTH_CHECK_SECONDS,
+                 connect_timeout: int = CONNECT_TIMEOUT_SECONDS):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+
+        self._entries: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self.connects = 0
+        self.reuses = 0
+
+    @staticmethod
+    def _key(host: str, port: int, username: str) -> Tuple:
+        return (host, int(port or 22), username)
+
+    def _key_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[key] = lock
+            return lock
+
+    def get_client(self, host: str, port: int, username: str, password: str) -> paramiko.SSHClient:
+        """
+        Авторизованный SSH-клиент из пула (или новый).
+        Клиент не нужно закрывать - он остается в пуле.
+
+        Raises:
+            paramiko.SSHException / OSError при невозможности подключиться
+        """
+        self.evict_idle()
+        key = self._key(host, port, username)
+
+        # Блокировка по хосту: параллельные запросы к одному серверу не плодят рукопожатия
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['password'] == password and self._is_healthy(entry):
+                    entry['last_used'] = time.monotonic()
+                    self.reuses += 1
+                    return entry['client']
+                self._close_entry(key)
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                hostname=host,
+                port=int(port or 22),
+                username=username,
+                password=password,
+                timeout=self.connect_timeout,
+                banner_timeout=self.connect_timeout,
+                auth_timeout=self.connect_timeout,
+                look_for_keys=False,
+                allow_agent=False
+            )
+            transport = client.get_transport()
+            if transport is not None and self.keepalive:
+                transport.set_keepalive(self.keepalive)
+
+            now = time.monotonic()
+            with self._lock:
+                self._entries[key] = {
+                    'client': client,
+                    'password': password,
+                    'created': now,
+                    'last_used': now,
+                    'last_check': now,
+                    'in_use': 0,
+                }
+            self.connects += 1
+            logger.info(f"🔌 SSH pool: новое соединение к {host}:{port}")
+            return client
+
+    def client_for(self, server: Dict) -> paramiko.SSHClient:
+        """Клиент для словаря сервера из V2RayManager.get_server_info"""
+        return self.get_client(server['host'], server.get('port', 22), server['username'], server['password'])
+
+    @contextmanager
+    def _in_use(self, server: Dict) -> Iterator[paramiko.SSHClient]:
+        """
+        Клиент из пула, помеченный занятым на время блока:
+        evict_idle не закроет транспорт посреди выполнения команды
+        """
+        client = self.client_for(server)
+        key = self._key(server['host'], server.get('port', 22), server['username'])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['client'] is client:
+                entry['in_use'] += 1
+            else:
+                entry = None
+        try:
+            yield client
+        finally:
+            if entry is not None:
+                with self._lock:
+                    entry['in_use'] -= 1
+                    entry['last_used'] = time.monotonic()
+
+    def _touch(self, server: Dict):
+        """Отметить использование соединения (долгие команды обновляют на каждом чтении)"""
+        entry = self._entries.get(self._key(server['host'], server.get('port', 22), server['username']))
+        if entry is not None:
+            entry['last_used'] = time.monotonic()
+
+    def _is_healthy(self, entry: Dict) -> bool:
+        transport = entry['client'].get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        now = time.monotonic()
+        if now - entry['last_check'] >= self.health_check_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+            entry['last_check'] = now
+        return True
+
+    def exec(self, server: Dict, command: str, timeout: int = 30) -> Tuple[int, str, str]:
+        """
+        Выполнить команду на сервере через пул.
+        Если соединение умерло между проверкой и запуском канала - один повтор на новом.
+        """
+        for attempt in (1, 2):
+            try:
+                with self._in_use(server) as client:
+                    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                    out, err = self._read_both(stdout.channel, timeout)
+                    exit_code = stdout.channel.recv_exit_status()
+                    return exit_code, out, err
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                self.invalidate(server['host'], server.get('port', 22), server['username'])
+                if attempt == 2:
+                    raise
+                logger.warning(f"⚠️ SSH pool: соединение к {server['host']} потеряно ({e}), переподключаюсь")
+
+    @staticmethod
+    def _read_both(channel: paramiko.Channel, timeout: int) -> Tuple[str, str]:
+        """
+        Прочитать stdout и stderr одновременно до завершения команды.
+        Последовательное чтение (stdout до EOF, затем stderr) зависает, когда
+        команда заполняет окно канала выводом в stderr.
+
+        Raises:
+            TimeoutError, если вывода нет дольше timeout секунд
+        """
+        out, err = bytearray(), bytearray()
+        deadline = time.monotonic() + timeout
+        while True:
+            received = False
+            if channel.recv_ready():
+                out += channel.recv(32768)
+                received = True
+            if channel.recv_stderr_ready():
+                err += channel.recv_stderr(32768)
+                received = True
+            if received:
+                deadline = time.monotonic() + timeout
+                continue
+            if channel.exit_status_ready() or channel.closed:
+                # Остаток, пришедший вместе со статусом выхода
+                while channel.recv_ready():
+                    out += channel.recv(32768)
+                while channel.recv_stderr_ready():
+                    err += channel.recv_stderr(32768)
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"нет вывода команды дольше {timeout} с")
+            time.sleep(0.01)
+        return out.decode('utf-8', errors='replace'), err.decode('utf-8', errors='replace')
+
+    def exec_stream(self, server: Dict, command: str, on_line: Callable[[str], None],
+                    cancel_event: Optional[threading.Event] = None, timeout: int = 600) -> int:
+        """
+        Выполнить долгую команду, передавая вывод (stdout+stderr) построчно в on_line.
+        При установке cancel_event канал закрывается, команда на сервере получает SIGHUP.
+
+        Returns:
+            Код выхода (-1 при отмене)
+
+        Raises:
+            TimeoutError, если команда не завершилась за timeout секунд
+        """
+        with self._in_use(server) as client:
+            return self._run_stream(client, server, command, on_line, cancel_event, timeout)
+
+    def _run_stream(self, client: paramiko.SSHClient, server: Dict, command: str,
+                    on_line: Callable[[str], None], cancel_event: Optional[threading.Event],
+                    timeout: int) -> int:
+        channel = client.get_transport().open_session()
+        try:
+            channel.set_combine_stderr(True)
+            channel.get_pty()
+            channel.exec_command(command)
+            deadline = time.monotonic() + timeout
+            # Инкрементальный декодер: многобайтовый символ может разорваться между пакетами
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            buffer = ''
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return -1
+                if channel.recv_ready():
+                    buffer += decoder.decode(channel.recv(4096))
+                    self._touch(server)
+                    *lines, buffer = buffer.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+                    for line in lines:
+                        on_line(line)
+                    continue
+                if channel.exit_status_ready():
+                    if buffer:
+                        on_line(buffer)
+                    return channel.recv_exit_status()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"команда не завершилась за {timeout} с")
+                time.sleep(0.1)
+        finally:
+            channel.close()
+
+    def invalidate(self, host: str, port: int, username: str):
+        """Закрыть и забыть соединение (например, после ошибки канала)"""
+        self._close_entry(self._key(host, port, username))
+
+    def _close_entry(self, key: Tuple):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            try:
+                entry['client'].close()
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        """Закрыть соединения, простаивающие дольше idle_timeout (кроме занятых командой)"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if not entry.get('in_use') and now - entry['last_used'] > self.idle_timeout]
+        for key in stale:
+            logger.info(f"🔌 SSH pool: закрываю простаивающее соединение к {key[0]}")
+            self._close_entry(key)
+
+    def close_all(self):
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self._close_entry(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'connections': len(self._entries), 'connects': self.connects, 'reuses': self.reuses}
+
+
+_pool: Optional[SSHConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_ssh_pool() -> SSHConnectionPool:
+    """Общий пул процесса"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SSHConnectionPool()
+        return _pool
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+V2Ray Fleet - параллельные операции над всеми V2Ray серверами
+
+Блокирующие SSH-вызовы V2RayManager выполняются в потоках, все серверы
+опрашиваются одновременно, у каждого хоста свой таймаут: недоступный
+сервер не задерживает сводку по остальным.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+HOST_TIMEOUT_SECONDS = 15
+CLEANUP_TIMEOUT_SECONDS = 60
+
+
+class V2RayFleet:
+    """Исполнитель операций над парком серверов"""
+
+    def __init__(self, manager, host_timeout: float = HOST_TIMEOUT_SECONDS):
+        self.manager = manager
+        self.host_timeout = host_timeout
+
+    def server_status(self, server_name: str) -> Dict:
+        """Состояние одного сервера (блокирующий вызов, выполняется в потоке)"""
+        started = time.perf_counter()
+        status = {'name': server_name, 'ok': False, 'running': False, 'users': 0,
+                  'protocol': None, 'sni': None, 'port': None, 'latency_ms': None, 'error': None}
+
+        server = self.manager.get_server_info(server_name)
+        if not server:
+            status['error'] = 'не найден в БД'
+            return status
+        status['host'] = server['host']
+
+        try:
+            exit_code, out, err = self.manager.ssh_pool.exec(server, 'systemctl is-active xray', timeout=10)
+            status['running'] = out.strip() == 'active'
+
+            config_path, config = self.manager._read_config(server_name, server)
+            if config:
+                inbound = config['inbounds'][0]
+                status['users'] = len(inbound.get('settings', {}).get('clients', []))
+                status['port'] = inbound.get('port', 443)
+                status['protocol'] = inbound.get('protocol', 'vless')
+                server_names = inbound.get('streamSettings', {}).get('realitySettings', {}).get('serverNames') or []
+                status['sni'] = server_names[0] if server_names else None
+            status['ok'] = True
+        except Exception as e:
+            status['error'] = str(e) or type(e).__name__
+
+        status['latency_ms'] = (time.perf_counter() - started) * 1000
+        return status
+
+    async def _run(self, func, *args, timeout: float):
+        return await asyncio.wait_for(asyncio.to_thread(func, *args), timeout=timeout)
+
+    async def gather_status(self) -> List[Dict]:
+        """Опросить все активные серверы параллельно"""
+        servers = self.manager.list_servers()
+        results = await asyncio.gather(
+            *[self._run(self.server_status, srv['name'], timeout=self.host_timeout) for srv in servers],
+            return_exceptions=True
+        )
+
+        statuses = []
+        for srv, result in zip(servers, results):
+            if isinstance(result, BaseException):
+                error = 'таймаут' if isinstance(result, asyncio.TimeoutError) else str(result)
+                logger.warning(f"⚠️ Fleet status {srv['name']}: {error}")
+                result = {'name': srv['name'], 'host': srv['host'], 'ok': False, 'running': False,
+                          'users': 0, 'sni': None, 'port': None, 'latency_ms': None, 'error': error}
+            statuses.append(result)
+        return statuses
+
+    async def cleanup_expired(self) -> Dict[str, int]:
+        """
+        Удалить истёкших пользователей на всех серверах параллельно:
+        на каждом сервере - одна перезапись конфига и один перезапуск Xray
+
+        Returns:
+            {server_name: число удаленных} (-1 - таймаут/ошибка сервера)
+        """
+        grouped = await asyncio.to_thread(self.manager.group_expired_users)
+        if not grouped:
+            return {}
+
+        names = list(grouped.keys())
+        results = await asyncio.gather(
+            *[self._run(self.manager.cleanup_server_expired, name, grouped[name], timeout=CLEANUP_TIMEOUT_SECONDS)
+              for name in names],
+            return_exceptions=True
+        )
+
+        summary = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.error(f"❌ Fleet cleanup {name} failed: {result}")
+                summary[name] = -1
+            else:
+                summary[name] = result
+        logger.info(f"✅ Fleet cleanup: {summary}")
+        return summary
+
+
+def format_fleet_dashboard(statuses: List[Dict]) -> str:
+    """Сводка по парку серверов для меню бота"""
+    if not statuses:
+        return "📡 Управление серверами\n\nНет добавленных серверов\n"
+
+    online = sum(1 for s in statuses if s['ok'] and s['running'])
+    total_users = sum(s['users'] for s in statuses if s['ok'])
+
+    text = "📡 Управление серверами\n\n"
+    text += f"🟢 Работают: {online}/{len(statuses)}  👥 Пользователей: {total_users}\n\n"
+
+    for s in statuses:
+        if not s['ok']:
+            text += f"⚫ {s['name']} - {s.get('host', '?')}\n   ❌ {s['error']}\n"
+            continue
+        emoji = "🟢" if s['running'] else "🔴"
+        text += f"{emoji} {s['name']} - {s['host']}\n"
+        text += f"   👥 {s['users']}"
+        if s['sni']:
+            text += f" · 🌐 {s['sni']}"
+        text += f" · ⏱ {s['latency_ms']:.0f} мс\n"
+    return text
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+V2Ray Jobs - фоновые задачи над серверами (установка Xray, диагностика)
+
+Долгие SSH-сессии выполняются в отдельном пуле потоков, обработчик
+Telegram только ставит задачу и сразу освобождается. Ход выполнения
+(шаг + хвост вывода установщика) выводится в одно сообщение, которое
+редактируется не чаще раза в edit_interval секунд. Задачи пишутся в БД
+(v2ray_jobs), их можно отменить; число одновременных установок на один
+хост ограничено.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_INTERRUPTED = 'interrupted'
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+DEFAULT_WORKERS = 4
+DEFAULT_PER_HOST_LIMIT = 1
+EDIT_INTERVAL_SECONDS = 3.0
+PROGRESS_LINES = 12
+LOG_TAIL_LINES = 50
+MAX_LINE_LENGTH = 160
+
+STATUS_EMOJI = {
+    JOB_QUEUED: '⏳', JOB_RUNNING: '🔄', JOB_DONE: '✅',
+    JOB_FAILED: '❌', JOB_CANCELLED: '⛔', JOB_INTERRUPTED: '⚠️',
+}
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class JobContext:
+    """Состояние задачи, доступное из рабочего потока"""
+
+    def __init__(self, job_id: int, server_name: str):
+        self.job_id = job_id
+        self.server_name = server_name
+        self.cancel_event = threading.Event()
+        # Будит задачу, ожидающую слот хоста (cancel_event - для рабочего потока)
+        self.cancel_requested = asyncio.Event()
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=LOG_TAIL_LINES)
+        self._step = ''
+        self.version = 0
+
+    def step(self, text: str):
+        """Текущий шаг (заголовок прогресса)"""
+        with self._lock:
+            self._step = text
+            self._lines.append(f"» {text}")
+            self.version += 1
+
+    def log(self, line: str):
+        """Строка вывода (потокобезопасно)"""
+        line = line.rstrip()
+        if not line:
+            return
+        with self._lock:
+            self._lines.append(line[:MAX_LINE_LENGTH])
+            self.version += 1
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def snapshot(self):
+        with self._lock:
+            return self.version, self._step, list(self._lines)
+
+
+class V2RayJobRunner:
+    """Очередь фоновых задач V2Ray с прогрессом в Telegram"""
+
+    def __init__(self, db_path: str = 'knowledge.db', workers: int = DEFAULT_WORKERS,
+                 per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                 edit_interval: float = EDIT_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.edit_interval = edit_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='v2ray-job')
+        self._kinds: Dict[str, Dict] = {}
+        self._contexts: Dict[int, JobContext] = {}
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._tasks = set()
+        self._init_db()
+        self.recover_interrupted()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS v2ray_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                server_name TEXT NOT NULL,
+                host TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                created_by INTEGER,
+                chat_id INTEGER,
+                message_id INTEGER,
+                step TEXT,
+                log TEXT,
+                result TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_v2ray_jobs_active
+            ON v2ray_jobs(server_name) WHERE status IN ('queued', 'running')
+        ''')
+        conn.commit()
+        conn.close()
+
+    def recover_interrupted(self) -> int:
+        """Задачи, оставшиеся активными после перезапуска бота, помечаются прерванными"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE v2ray_jobs SET status = ?, finished_at = ?, error = 'бот перезапущен'
+            WHERE status IN ('queued', 'running')
+        ''', (JOB_INTERRUPTED, datetime.now().isoformat()))
+        count = cursor.rowcount
+        conn.commit()
+        conn.close()
+        if count:
+            logger.warning(f"⚠️ V2Ray jobs: {count} задач прервано перезапуском")
+        return count
+
+    def register(self, kind: str, title: str, func: Callable[[JobContext, str], Dict],
+                 render: Callable[[Dict], tuple], host_limited: bool = False):
+        """
+        Зарегистрировать тип задачи.
+
+        Args:
+            kind: код задачи ('install', 'diagnose')
+            title: заголовок для сообщения прогресса
+            func: блокирующая функция (ctx, server_name) -> dict результата
+            render: (job) -> (text, reply_markup) итогового сообщения
+            host_limited: учитывать в лимите одновременных задач на хост
+        """
+        self._kinds[kind] = {'title': title, 'func': func, 'render': render, 'host_limited': host_limited}
+
+    def _update(self, job_id: int, **fields):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        cursor.execute(f'UPDATE v2ray_jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+        conn.close()
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM v2ray_jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def active_job(self, server_name: str, kind: Optional[str] = None) -> Optional[Dict]:
+        """Активная задача на сервере (чтобы не запускать вторую установку по двойному нажатию)"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        query = "SELECT * FROM v2ray_jobs WHERE server_name = ? AND status IN ('queued', 'running')"
+        params = [server_name]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        cursor.execute(query + ' ORDER BY id LIMIT 1', params)
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def recent_jobs(self, server_name: str, limit: int = 5) -> List[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, kind, status, error, created_at, finished_at FROM v2ray_jobs
+            WHERE server_name = ? ORDER BY id DESC LIMIT ?
+        ''', (server_name, limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    async def submit(self, kind: str, server_name: str, host: str, bot, chat_id: int,
+                     message_id: int, created_by: int) -> int:
+        """Поставить задачу в очередь; возвращает id сразу, не дожидаясь выполнения"""
+        if kind not in self._kinds:
+            raise ValueError(f"Неизвестный тип задачи: {kind}")
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO v2ray_jobs (kind, server_name, host, status, created_by, chat_id, message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (kind, server_name, host, JOB_QUEUED, created_by, chat_id, message_id))
+        job_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        ctx = JobContext(job_id, server_name)
+        self._contexts[job_id] = ctx
+        task = asyncio.create_task(self._run(job_id, kind, host, ctx, bot, chat_id, message_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info(f"📋 V2Ray job #{job_id} ({kind}) поставлена: {server_name}")
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """Запросить отмену задачи; False, если задача уже завершена"""
+        ctx = self._contexts.get(job_id)
+        if ctx is None:
+            return False
+        ctx.cancel_event.set()
+        ctx.cancel_requested.set()
+        logger.info(f"⛔ V2Ray job #{job_id}: запрошена отмена")
+        return True
+
+    def _host_slot(self, host: str) -> asyncio.Semaphore:
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = asyncio.Semaphore(self.per_host_limit)
+            self._host_slots[host] = slot
+        return slot
+
+    async def _acquire_slot(self, slot: asyncio.Semaphore, ctx: JobContext):
+        """Занять слот хоста; отмененная задача уходит из очереди, не дожидаясь слота"""
+        ctx.check_cancelled()
+        acquire = asyncio.ensure_future(slot.acquire())
+        cancelled = asyncio.ensure_future(ctx.cancel_requested.wait())
+        try:
+            await asyncio.wait({acquire, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            cancelled.cancel()
+            self._drop_slot(slot, acquire)
+            raise
+        cancelled.cancel()
+
+        # Отмена могла прийти одновременно с освобождением слота
+        if ctx.cancel_event.is_set():
+            self._drop_slot(slot, acquire)
+            raise JobCancelled()
+
+    @staticmethod
+    def _drop_slot(slot: asyncio.Semaphore, acquire: asyncio.Future):
+        """Вернуть слот, если он уже занят, иначе снять ожидание"""
+        if acquire.done() and not acquire.cancelled() and acquire.exception() is None:
+            slot.release()
+        else:
+            acquire.cancel()
+
+    @staticmethod
+    def _cancel_markup(job_id: int) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Отменить", callback_data=f"v2jobcancel_{job_id}")]])
+
+    def _progress_text(self, job_id: int, title: str, server_name: str, status: str, ctx: JobContext) -> str:
+        version, step, lines = ctx.snapshot()
+        text = f"{STATUS_EMOJI[status]} {title}: {server_name} (задача #{job_id})\n"
+        if status == JOB_QUEUED:
+            text += "\nОжидает: на сервере уже выполняется другая установка..."
+            return text
+        if step:
+            text += f"\n{step}\n"
+        if lines:
+            text += "\n" + "\n".join(lines[-PROGRESS_LINES:])
+        return text[:4000]
+
+    async def _edit(self, bot, chat_id: int, message_id: int, text: str, reply_markup=None) -> float:
+        """Отредактировать сообщение прогресса; возвращает паузу до следующей правки"""
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        except RetryAfter as e:
+            return float(e.retry_after)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"⚠️ V2Ray job progress: {e}")
+        except TelegramError as e:
+            logger.warning(f"⚠️ V2Ray job progress: {e}")
+        return self.edit_interval
+
+    async def _run(self, job_id: int, kind: str, host: str, ctx: JobContext, bot, chat_id: int, message_id: int):
+        spec = self._kinds[kind]
+        title = spec['title']
+        loop = asyncio.get_running_loop()
+        slot = self._host_slot(host) if spec['host_limited'] else None
+        status, result, error = JOB_FAILED, None, None
+
+        try:
+            if slot is not None:
+                ctx.check_cancelled()
+                if slot.locked():
+                    await self._edit(bot, chat_id, message_id,
+                                     self._progress_text(job_id, title, ctx.server_name, JOB_QUEUED, ctx),
+                                     self._cancel_markup(job_id))
+                await self._acquire_slot(slot, ctx)
+            try:
+                ctx.check_cancelled()
+                self._update(job_id, status=JOB_RUNNING, started_at=datetime.now().isoformat())
+
+                future = loop.run_in_executor(self._executor, spec['func'], ctx, ctx.server_name)
+                shown_version = -1
+                pause = 0.0
+                while not future.done():
+                    done, _ = await asyncio.wait({future}, timeout=pause or self.edit_interval)
+                    if done:
+                        break
+                    version, step, lines = ctx.snapshot()
+                    if version != shown_version:
+                        shown_version = version
+                        pause = await self._edit(bot, chat_id, message_id,
+                                                 self._progress_text(job_id, title, ctx.server_name, JOB_RUNNING, ctx),
+                                                 self._cancel_markup(job_id))
+                        self._update(job_id, step=step, log='\n'.join(lines))
+                    else:
+                        pause = self.edit_interval
+
+                result = future.result()
+                if ctx.cancel_event.is_set():
+                    status = JOB_CANCELLED
+                else:
+                    status = JOB_DONE if result.get('ok') else JOB_FAILED
+                    error = result.get('error')
+            finally:
+                if slot is not None:
+                    slot.release()
+        except JobCancelled:
+            status = JOB_CANCELLED
+        except Exception as e:
+            logger.error(f"❌ V2Ray job #{job_id} ({kind}) failed: {e}", exc_info=True)
+            error = str(e) or type(e).__name__
+        finally:
+            self._contexts.pop(job_id, None)
+
+        version, step, lines = ctx.snapshot()
+        self._update(job_id, status=status, step=step, log='\n'.join(lines),
+                     result=json.dumps(result, ensure_ascii=False) if result is not None else None,
+                     error=error, finished_at=datetime.now().isoformat())
+        logger.info(f"{STATUS_EMOJI[status]} V2Ray job #{job_id} ({kind}) {ctx.server_name}: {status}")
+
+        job = self.get_job(job_id)
+        job['lines'] = lines
+        try:
+            text, markup = spec['render'](job)
+        except Exception as e:
+            logger.error(f"❌ V2Ray job #{job_id} render failed: {e}", exc_info=True)
+            text, markup = f"{STATUS_EMOJI[status]} {title}: {ctx.server_name} - {status}", None
+        await self._edit(bot, chat_id, message_id, text, markup)
+
+    def shutdown(self):
+        for ctx in list(self._contexts.values()):
+            ctx.cancel_event.set()
+            ctx.cancel_requested.set()
+        self._executor.shutdown(wait=False)
+
+
+def install_xray_job(manager) -> Callable[[JobContext, str], Dict]:
+    """Задача установки Xray + REALITY конфигурации"""
+
+    def run(ctx: JobContext, server_name: str) -> Dict:
+        ctx.step(f"⏳ Подключаюсь к серверу {server_name}...")
+        server = manager.get_server(server_name)
+        if not server:
+            return {'ok': False, 'error': f"Сервер {server_name} не найден"}
+        if not server.connect():
+            return {'ok': False, 'error': "Не удалось подключиться к серверу"}
+
+        try:
+            ctx.check_cancelled()
+            ctx.step("📥 Устанавливаю Xray (2-3 минуты)...")
+            if not server.install_v2ray(on_output=ctx.log, cancel_event=ctx.cancel_event):
+                ctx.check_cancelled()
+                return {'ok': False, 'error': "Ошибка установки Xray"}
+
+            ctx.check_cancelled()
+            ctx.step("⚙️ Создаю REALITY конфигурацию...")
+            server_keys = manager.get_server_keys(server_name)
+            sni = server_keys.get('sni', 'rutube.ru')
+            config = server.create_reality_config(port=443, sni=sni)
+            if not config:
+                return {'ok': False, 'error': "Ошибка создания конфигурации"}
+
+            client_keys = config.get('_client_keys', {})
+            if client_keys:
+                manager.save_server_keys(
+                    server_name,
+                    client_keys['public_key'],
+                    client_keys['short_id'],
+                    client_keys.get('private_key', '')
+                )
+
+            ctx.check_cancelled()
+            ctx.step("🚀 Применяю конфигурацию...")
+            if not server.deploy_config(config):
+                return {'ok': False, 'error': "Ошибка применения конфигурации"}
+
+            return {'ok': True, 'sni': sni}
+        finally:
+            server.disconnect()
+
+    return run
+
+
+def diagnose_server_job(manager) -> Callable[[JobContext, str], Dict]:
+    """Задача диагностики сервера (проверки и автоисправление ключей)"""
+
+    def run(ctx: JobContext, server_name: str) -> Dict:
+        ctx.step("Проверяю конфигурацию...")
+        server_info = manager.get_server_info(server_name)
+        if not server_info:
+            return {'ok': False, 'error': f"Сервер {server_name} не найден в БД"}
+
+        issues = []
+        fixes_applied = []
+
+        # Проверка 1: Наличие public_key
+        if not server_info.get('public_key'):
+            issues.append("❌ Отсутствует Public Key")
+        else:
+            issues.append(f"✅ Public Key: {server_info['public_key'][:20]}...")
+
+        # Проверка 2: Наличие short_id
+        if not server_info.get('short_id'):
+            issues.append("❌ Отсутствует Short ID")
+        else:
+            issues.append(f"✅ Short ID: {server_info['short_id']}")
+
+        # Проверка 3: Xray запущен на сервере
+        ctx.check_cancelled()
+        ctx.step("Проверяю, запущен ли Xray...")
+        if manager.check_xray_status(server_name):
+            issues.append("✅ Xray запущен")
+        else:
+            issues.append("❌ Xray не запущен или недоступен")
+
+        # Проверка 4: Ключи на сервере
+        ctx.check_cancelled()
+        ctx.step("Ищу ключи на сервере...")
+        keys_on_server = manager.get_keys_from_server(server_name)
+        if keys_on_server:
+            issues.append("✅ Ключи найдены на сервере")
+
+            # Если ключей нет в БД, но есть на сервере - сохраняем
+            if not server_info.get('public_key') and keys_on_server.get('public_key'):
+                saved = manager.save_keys_to_db(
+                    server_name,
+                    keys_on_server['public_key'],
+                    keys_on_server.get('private_key', ''),
+                    keys_on_server.get('short_id', '')
+                )
+                if saved:
+                    fixes_applied.append("✅ Ключи сохранены в БД")
+                    issues.append(f"✅ Public Key: {keys_on_server['public_key'][:20]}...")
+                    issues.append(f"✅ Short ID: {keys_on_server.get('short_id', 'N/A')}")
+        else:
+            issues.append("❌ Ключи не найдены на сервере")
+
+        return {'ok': True, 'issues': issues, 'fixes_applied': fixes_applied}
+
+    return run
@@ -13,7 +13,13 @@ import base64
 import subprocess
 import logging
 import urllib.parse
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from ssh_pool import get_ssh_pool
+from xray_config_store import XrayConfigStore, XrayConfigSync
+from xray_traffic_stats import XrayTrafficStats, enable_stats_api
+
+XRAY_CONFIG_PATH = '/usr/local/etc/xray/config.json'
 
 logger = logging.getLogger(__name__)
 
@@ -27,19 +33,18 @@ class V2RayServer:
         self.password = password
         self.port = port
         self.ssh_client = None
+        # Заполняются V2RayManager.get_server: имя и локальная копия конфига
+        self.name = None
+        self.config_sync = None
+    
+    @property
+    def server_info(self) -> Dict:
+        return {'host': self.host, 'port': self.port, 'username': self.username, 'password': self.password}
     
     def connect(self) -> bool:
-        """Подключение к серверу по SSH"""
+        """Подключение к серверу по SSH (соединение берется из общего пула)"""
         try:
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh_client.connect(
-                hostname=self.host,
-                port=self.port,
-                username=self.username,
-                password=self.password,
-                timeout=10
-            )
+            self.ssh_client = get_ssh_pool().client_for(self.server_info)
             logger.info(f"✅ Подключен к {self.host}")
             return True
         except Exception as e:
@@ -47,25 +52,60 @@ class V2RayServer:
             return False
     
     def disconnect(self):
-        """Отключение от сервера"""
-        if self.ssh_client:
-            self.ssh_client.close()
-            logger.info(f"🔌 Отключен от {self.host}")
+        """Отключение от сервера (соединение остается в пуле для следующих операций)"""
+        self.ssh_client = None
     
     def _exec_command(self, command: str, timeout: int = 30) -> tuple:
         """Выполнение команды на сервере"""
         try:
-            stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
-            exit_code = stdout.channel.recv_exit_status()
-            out = stdout.read().decode('utf-8')
-            err = stderr.read().decode('utf-8')
-            return exit_code, out, err
+            return get_ssh_pool().exec(self.server_info, command, timeout=timeout)
         except Exception as e:
             logger.error(f"❌ Ошибка выполнения команды: {e}")
             return 1, "", str(e)
     
-    def install_v2ray(self, force: bool = False) -> bool:
-        """Установка Xray на сервер"""
+    def _load_config(self, max_age: Optional[float] = None) -> Dict:
+        """Текущий config.json (из локальной копии, если сервер известен менеджеру)"""
+        if self.config_sync and self.name:
+            path, config = self.config_sync.get(self.name, self.server_info, max_age=max_age)
+            if config is None:
+                raise RuntimeError(f"config.json не найден на {self.host}")
+            return config
+        
+        sftp = self.ssh_client.open_sftp()
+        try:
+            with sftp.file(XRAY_CONFIG_PATH, 'r') as f:
+                return json.load(f)
+        finally:
+            sftp.close()
+    
+    def _save_config(self, config: Dict, added_clients: Optional[List[Dict]] = None,
+                     removed_emails: Optional[List[str]] = None) -> bool:
+        """Развернуть config.json: атомарно, с проверкой и без перезапуска, если возможно"""
+        if self.config_sync and self.name:
+            local = self.config_sync.store.latest(self.name)
+            path = local['config_path'] if local else XRAY_CONFIG_PATH
+            return self.config_sync.deploy(self.name, self.server_info, path, config,
+                                           added_clients=added_clients, removed_emails=removed_emails)
+        
+        enable_stats_api(config)
+        sftp = self.ssh_client.open_sftp()
+        try:
+            with sftp.file(XRAY_CONFIG_PATH, 'w') as f:
+                json.dump(config, f, indent=2)
+        finally:
+            sftp.close()
+        exit_code, out, err = self._exec_command('systemctl restart xray')
+        return exit_code == 0
+    
+    def install_v2ray(self, force: bool = False, on_output=None, cancel_event=None) -> bool:
+        """
+        Установка Xray на сервер
+        
+        Args:
+            force: переустановить, даже если Xray уже есть
+            on_output: колбэк для построчного вывода установщика (для прогресса)
+            cancel_event: threading.Event для отмены установки
+        """
         try:
             # Проверка существующей установки
             if not force:
@@ -114,7 +154,17 @@ fi
             self._exec_command('chmod +x /tmp/install_xray.sh')
             
             # Запускаем установку
-            exit_code, out, err = self._exec_command('bash /tmp/install_xray.sh', timeout=180)
+            if on_output is not None:
+                err = 'см. вывод установщика'
+                exit_code = get_ssh_pool().exec_stream(
+                    self.server_info, 'bash /tmp/install_xray.sh', on_output,
+                    cancel_event=cancel_event, timeout=600
+                )
+                if exit_code == -1:
+                    logger.warning("⚠️ Установка Xray отменена")
+                    return False
+            else:
+                exit_code, out, err = self._exec_command('bash /tmp/install_xray.sh', timeout=180)
             
             if exit_code == 0:
                 logger.info("✅ Xray установлен успешно")
@@ -237,6 +287,9 @@ fi
                 ]
             }
             
+            # Статистика трафика по пользователям и API для изменений без перезапуска
+            enable_stats_api(config)
+            
             # Сохраняем ключи для клиента (они понадобятся для генерации ссылок)
             config['_client_keys'] = {
                 'public_key': keys['public_key'],
@@ -261,12 +314,19 @@ fi
             if '_client_keys' in config_to_save:
                 del config_to_save['_client_keys']
             
-            config_json = json.dumps(config_to_save, indent=2)
-            
             # Загружаем конфигурацию на сервер
+            if self.config_sync and self.name:
+                self._exec_command('mkdir -p /usr/local/etc/xray')
+                if not self.config_sync.deploy(self.name, self.server_info, XRAY_CONFIG_PATH, config_to_save):
+                    logger.error("❌ Конфигурация не прошла проверку или не установлена")
+                    return False
+            else:
+                sftp = self.ssh_client.open_sftp()
+                with sftp.file(XRAY_CONFIG_PATH, 'w') as f:
+                    f.write(json.dumps(config_to_save, indent=2))
+                sftp.close()
+            
             sftp = self.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'w') as f:
-                f.write(config_json)
             
             # Сохраняем ключи в отдельный файл keys.json
             if client_keys:
@@ -284,8 +344,10 @@ fi
             
             sftp.close()
             
-            # Перезапускаем Xray
-            exit_code, out, err = self._exec_command('systemctl restart xray')
+            # Перезапускаем Xray (если конфиг не развёрнут через локальную копию)
+            exit_code = 0
+            if not (self.config_sync and self.name):
+                exit_code, out, err = self._exec_command('systemctl restart xray')
             
             if exit_code == 0:
                 # Проверяем статус
@@ -331,9 +393,7 @@ fi
             logger.info(f"✅ UUID generated on server: {user_uuid}")
             
             # Читаем текущую конфигурацию
-            sftp = self.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'r') as f:
-                config = json.load(f)
+            config = self._load_config(max_age=0)
             
             # Добавляем пользователя
             new_client = {
@@ -345,13 +405,9 @@ fi
             config['inbounds'][0]['settings']['clients'].append(new_client)
             
             # Сохраняем обновлённую конфигурацию
-            with sftp.file('/usr/local/etc/xray/config.json', 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            sftp.close()
-            
-            # Перезапускаем Xray
-            self._exec_command('systemctl restart xray')
+            if not self._save_config(config, added_clients=[new_client]):
+                logger.error("❌ Не удалось развернуть конфигурацию")
+                return None
             
             # Получаем публичный ключ из конфигурации
             reality_settings = config['inbounds'][0]['streamSettings']['realitySettings']
@@ -392,24 +448,18 @@ fi
         """Удаление пользователя"""
         try:
             # Читаем текущую конфигурацию
-            sftp = self.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'r') as f:
-                config = json.load(f)
+            config = self._load_config(max_age=0)
             
             # Удаляем пользователя
             clients = config['inbounds'][0]['settings']['clients']
+            removed_emails = [c.get('email') for c in clients if c['id'] == user_uuid and c.get('email')]
             config['inbounds'][0]['settings']['clients'] = [
                 c for c in clients if c['id'] != user_uuid
             ]
             
             # Сохраняем обновлённую конфигурацию
-            with sftp.file('/usr/local/etc/xray/config.json', 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            sftp.close()
-            
-            # Перезапускаем Xray
-            self._exec_command('systemctl restart xray')
+            if not self._save_config(config, removed_emails=removed_emails):
+                return False
             
             logger.info(f"✅ Пользователь {user_uuid} удалён")
             return True
@@ -422,23 +472,16 @@ fi
         """Изменение SNI (маскировки)"""
         try:
             # Читаем текущую конфигурацию
-            sftp = self.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'r') as f:
-                config = json.load(f)
+            config = self._load_config(max_age=0)
             
             # Изменяем SNI
             reality_settings = config['inbounds'][0]['streamSettings']['realitySettings']
             reality_settings['dest'] = f"{new_sni}:443"
             reality_settings['serverNames'] = [new_sni]
             
-            # Сохраняем обновлённую конфигурацию
-            with sftp.file('/usr/local/etc/xray/config.json', 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            sftp.close()
-            
-            # Перезапускаем Xray
-            self._exec_command('systemctl restart xray')
+            # Сохраняем обновлённую конфигурацию (смена SNI требует перезагрузки Xray)
+            if not self._save_config(config):
+                return False
             
             logger.info(f"✅ SNI изменён на {new_sni}")
             return True
@@ -454,11 +497,8 @@ fi
             exit_code, out, err = self._exec_command('systemctl is-active xray')
             is_running = 'active' in out
             
-            # Читаем конфигурацию
-            sftp = self.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'r') as f:
-                config = json.load(f)
-            sftp.close()
+            # Читаем конфигурацию (локальная копия, хеш сверяется периодически)
+            config = self._load_config()
             
             # Получаем информацию о пользователях
             clients = config['inbounds'][0]['settings']['clients']
@@ -498,7 +538,11 @@ class V2RayManager:
     
     def __init__(self, db_path: str = 'knowledge.db'):
         self.db_path = db_path
+        self.ssh_pool = get_ssh_pool()
         self._init_db()
+        # Локальная версионированная копия config.json серверов
+        self.config_sync = XrayConfigSync(XrayConfigStore(db_path), self.ssh_pool)
+        self.traffic_stats = XrayTrafficStats(db_path)
     
     def _init_db(self):
         """Инициализация таблиц"""
@@ -619,7 +663,10 @@ class V2RayManager:
             conn.close()
             
             if row:
-                return V2RayServer(row[0], row[2], row[3], row[1])
+                server = V2RayServer(row[0], row[2], row[3], row[1])
+                server.name = name
+                server.config_sync = self.config_sync
+                return server
             else:
                 return None
                 
@@ -786,10 +833,11 @@ class V2RayManager:
             
             logger.info(f"✅ UUID generated on server: {user_uuid}")
             
-            # Читаем текущую конфигурацию
-            sftp = server.ssh_client.open_sftp()
-            with sftp.file('/usr/local/etc/xray/config.json', 'r') as f:
-                config = json.load(f)
+            # Читаем текущую конфигурацию (со сверкой хеша перед изменением)
+            config_path, config = self._read_config(server_name, server_info, max_age=0)
+            if not config:
+                logger.error(f"❌ Config not found on {server_name}")
+                return None
             
             # Добавляем пользователя
             sni = server_info.get('sni', 'rutube.ru')
@@ -801,17 +849,17 @@ class V2RayManager:
             
             config['inbounds'][0]['settings']['clients'].append(new_client)
             
-            # Сохраняем обновлённую конфигурацию
-            with sftp.file('/usr/local/etc/xray/config.json', 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            sftp.close()
-            
-            # Перезапускаем Xray
-            server._exec_command('systemctl restart xray')
+            # Разворачиваем обновлённую конфигурацию
+            deployed = self.config_sync.deploy(
+                server_name, server_info, config_path, config, added_clients=[new_client]
+            )
             
             server.disconnect()
             
+            if not deployed:
+                logger.error(f"❌ Failed to deploy Xray config on {server_name}")
+                return None
+            
             logger.info(f"✅ User added to Xray config")
             
             # Сохраняем в БД
@@ -873,8 +921,8 @@ class V2RayManager:
                     try:
                         # Пробуем получить из keys.json
                         logger.info("🔍 Trying to read /root/Xray-core/keys.json...")
-                        stdin, stdout, stderr = ssh.exec_command('cat /root/Xray-core/keys.json')
-                        keys_content = stdout.read().decode().strip()
+                        exit_code, keys_content, err = self.ssh_pool.exec(server, 'cat /root/Xray-core/keys.json')
+                        keys_content = keys_content.strip()
                         
                         if keys_content:
                             keys = json.loads(keys_content)
@@ -888,34 +936,22 @@ class V2RayManager:
                         else:
                             # Пробуем парсить из config.json
                             logger.info("🔍 Trying to read from config.json...")
-                            config_paths = [
-                                '/usr/local/etc/xray/config.json',
-                                '/root/Xray-core/config.json',
-                                '/etc/xray/config.json'
-                            ]
+                            config_path, config = self._read_config(server_name, server)
                             
-                            for config_path in config_paths:
-                                stdin, stdout, stderr = ssh.exec_command(f'cat {config_path}')
-                                config_content = stdout.read().decode().strip()
+                            if config and 'realitySettings' in json.dumps(config):
+                                reality_settings = config.get('inbounds', [{}])[0].get('streamSettings', {}).get('realitySettings', {})
                                 
-                                if config_content and 'realitySettings' in config_content:
-                                    config = json.loads(config_content)
-                                    reality_settings = config.get('inbounds', [{}])[0].get('streamSettings', {}).get('realitySettings', {})
-                                    
-                                    # Note: publicKey не хранится в config.json, только privateKey
-                                    # Нужно сгенерировать публичный ключ из приватного
-                                    private_key = reality_settings.get('privateKey', '')
-                                    short_ids = reality_settings.get('shortIds', [])
-                                    if short_ids:
-                                        short_id = short_ids[0] if short_ids[0] else ''
-                                    
-                                    logger.info(f"✅ Found private key and short_id in config")
-                                    break
+                                # Note: publicKey не хранится в config.json, только privateKey
+                                # Нужно сгенерировать публичный ключ из приватного
+                                private_key = reality_settings.get('privateKey', '')
+                                short_ids = reality_settings.get('shortIds', [])
+                                if short_ids:
+                                    short_id = short_ids[0] if short_ids[0] else ''
+                                
+                                logger.info(f"✅ Found private key and short_id in config")
                     
                     except Exception as e:
                         logger.error(f"❌ Error fetching keys from server: {e}")
-                    finally:
-                        ssh.close()
             
             if not public_key:
                 logger.warning(f"⚠️ Public key not found for {server_name}!")
@@ -996,37 +1032,15 @@ class V2RayManager:
                 logger.error(f"❌ Server {server_name} not found")
                 return []
             
-            ssh = self._connect_ssh(server)
-            if not ssh:
+            if not self._connect_ssh(server):
                 logger.error(f"❌ Failed to connect to {server_name}")
                 return []
             
-            # Ищем config.json в разных местах
-            config_paths = [
-                '/usr/local/etc/xray/config.json',
-                '/root/Xray-core/config.json',
-                '/etc/xray/config.json'
-            ]
-            
-            config_content = None
-            config_path_used = None
-            for path in config_paths:
-                logger.info(f"🔍 Checking {path}...")
-                stdin, stdout, stderr = ssh.exec_command(f'cat {path}')
-                content = stdout.read().decode()
-                if content and 'inbounds' in content:
-                    config_content = content
-                    config_path_used = path
-                    logger.info(f"✅ Found config at {path}")
-                    break
-            
-            if not config_content:
+            config_path_used, config = self._read_config(server_name, server)
+            if not config:
                 logger.error(f"❌ Config not found on {server_name}")
-                ssh.close()
                 return []
             
-            config = json.loads(config_content)
-            
             # Парсим пользователей из первого inbound
             users = []
             if 'inbounds' in config and len(config['inbounds']) > 0:
@@ -1039,7 +1053,6 @@ class V2RayManager:
                         'flow': client.get('flow', 'xtls-rprx-vision')
                     })
             
-            ssh.close()
             logger.info(f"✅ Retrieved {len(users)} users from {server_name}")
             return users
             
@@ -1070,83 +1083,71 @@ class V2RayManager:
     
     def delete_user(self, server_name: str, uuid: str) -> bool:
         """Удалить пользователя с сервера и из БД"""
+        return self.delete_users(server_name, [uuid]) is not None
+    
+    def delete_users(self, server_name: str, uuids: List[str]) -> Optional[int]:
+        """
+        Удалить несколько пользователей с сервера за одну перезапись config.json
+        и один перезапуск Xray, затем из БД
+        
+        Returns:
+            Число удаленных из конфига клиентов или None при ошибке
+        """
         try:
-            logger.info(f"🗑️ Deleting user {uuid} from {server_name}")
+            logger.info(f"🗑️ Deleting {len(uuids)} user(s) from {server_name}")
             
             # Удаляем из конфига Xray на сервере
             server_info = self.get_server_info(server_name)
             if not server_info:
                 logger.error(f"❌ Server {server_name} not found")
-                return False
+                return None
             
-            ssh = self._connect_ssh(server_info)
-            if not ssh:
+            if not self._connect_ssh(server_info):
                 logger.error(f"❌ Failed to connect to {server_name}")
-                return False
+                return None
             
-            try:
-                # Читаем конфигурацию
-                config_paths = [
-                    '/usr/local/etc/xray/config.json',
-                    '/root/Xray-core/config.json',
-                    '/etc/xray/config.json'
-                ]
-                
-                config_content = None
-                config_path_used = None
-                for path in config_paths:
-                    stdin, stdout, stderr = ssh.exec_command(f'cat {path}')
-                    content = stdout.read().decode()
-                    if content and 'inbounds' in content:
-                        config_content = content
-                        config_path_used = path
-                        break
-                
-                if not config_content:
-                    logger.error(f"❌ Config not found on {server_name}")
-                    ssh.close()
-                    return False
-                
-                config = json.loads(config_content)
-                
-                # Удаляем пользователя из конфига
-                clients = config['inbounds'][0]['settings']['clients']
-                original_count = len(clients)
-                config['inbounds'][0]['settings']['clients'] = [
-                    c for c in clients if c['id'] != uuid
-                ]
-                new_count = len(config['inbounds'][0]['settings']['clients'])
-                
-                if original_count == new_count:
-                    logger.warning(f"⚠️ User {uuid} not found in config")
-                else:
-                    logger.info(f"✅ User removed from config ({original_count} -> {new_count})")
-                
-                # Сохраняем обновлённую конфигурацию
-                sftp = ssh.open_sftp()
-                with sftp.file(config_path_used, 'w') as f:
-                    json.dump(config, f, indent=2)
-                sftp.close()
-                
-                # Перезапускаем Xray
-                ssh.exec_command('systemctl restart xray')
-                logger.info(f"🔄 Xray restarted")
+            # Читаем конфигурацию (со сверкой хеша перед изменением)
+            config_path_used, config = self._read_config(server_name, server_info, max_age=0)
+            if not config:
+                logger.error(f"❌ Config not found on {server_name}")
+                return None
+            
+            # Удаляем пользователей из конфига
+            to_remove = set(uuids)
+            clients = config['inbounds'][0]['settings']['clients']
+            removed_emails = [c.get('email') for c in clients if c['id'] in to_remove and c.get('email')]
+            original_count = len(clients)
+            config['inbounds'][0]['settings']['clients'] = [
+                c for c in clients if c['id'] not in to_remove
+            ]
+            removed = original_count - len(config['inbounds'][0]['settings']['clients'])
+            
+            if removed == 0:
+                logger.warning(f"⚠️ Users {', '.join(uuids)} not found in config")
+            else:
+                logger.info(f"✅ Users removed from config ({original_count} -> {original_count - removed})")
                 
-            finally:
-                ssh.close()
+                # Разворачиваем обновлённую конфигурацию
+                if not self.config_sync.deploy(server_name, server_info, config_path_used, config,
+                                               removed_emails=removed_emails):
+                    logger.error(f"❌ Failed to deploy Xray config on {server_name}")
+                    return None
             
             # Удаляем из БД
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM v2ray_users WHERE server_name = ? AND uuid = ?', (server_name, uuid))
+            cursor.executemany(
+                'DELETE FROM v2ray_users WHERE server_name = ? AND uuid = ?',
+                [(server_name, user_uuid) for user_uuid in uuids]
+            )
             conn.commit()
             conn.close()
             
-            logger.info(f"✅ User {uuid} deleted from server and DB")
-            return True
+            logger.info(f"✅ {len(uuids)} user(s) deleted from {server_name} and DB")
+            return removed
         except Exception as e:
-            logger.error(f"❌ delete_user error: {e}", exc_info=True)
-            return False
+            logger.error(f"❌ delete_users error: {e}", exc_info=True)
+            return None
     
     def delete_server(self, server_name: str) -> bool:
         """Удаляет сервер из БД вместе со всеми пользователями"""
@@ -1168,6 +1169,8 @@ class V2RayManager:
             conn.close()
             
             if deleted_servers > 0:
+                self.config_sync.store.forget(server_name)
+                self.traffic_stats.forget(server_name)
                 logger.info(f"✅ Сервер {server_name} и его пользователи удалены из БД")
                 return True
             else:
@@ -1185,15 +1188,9 @@ class V2RayManager:
             if not server:
                 return False
             
-            ssh = self._connect_ssh(server)
-            if not ssh:
-                return False
+            exit_code, out, err = self.ssh_pool.exec(server, 'systemctl is-active xray')
             
-            stdin, stdout, stderr = ssh.exec_command('systemctl is-active xray')
-            status = stdout.read().decode().strip()
-            ssh.close()
-            
-            return status == 'active'
+            return out.strip() == 'active'
         except Exception as e:
             logger.error(f"❌ check_xray_status error: {e}")
             return False
@@ -1205,13 +1202,8 @@ class V2RayManager:
             if not server:
                 return None
             
-            ssh = self._connect_ssh(server)
-            if not ssh:
-                return None
-            
-            stdin, stdout, stderr = ssh.exec_command('cat /root/Xray-core/keys.json')
-            keys_json = stdout.read().decode().strip()
-            ssh.close()
+            exit_code, keys_json, err = self.ssh_pool.exec(server, 'cat /root/Xray-core/keys.json')
+            keys_json = keys_json.strip()
             
             if keys_json:
                 return json.loads(keys_json)
@@ -1241,22 +1233,27 @@ class V2RayManager:
             return False
     
     def _connect_ssh(self, server: dict) -> Optional[paramiko.SSHClient]:
-        """Подключение по SSH к серверу"""
+        """
+        SSH-клиент к серверу из общего пула.
+        Клиент переиспользуется между операциями - закрывать его не нужно.
+        """
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(
-                hostname=server['host'],
-                port=server['port'],
-                username=server['username'],
-                password=server['password'],
-                timeout=10
-            )
-            return ssh
+            return self.ssh_pool.client_for(server)
         except Exception as e:
             logger.error(f"❌ SSH connection error: {e}")
             return None
     
+    def _read_config(self, server_name: str, server: dict,
+                     max_age: Optional[float] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        config.json Xray сервера из локальной копии (XrayConfigSync).
+        Хеш сверяется с сервером, если последняя сверка старше max_age.
+        
+        Returns:
+            (путь, конфигурация) или (None, None)
+        """
+        return self.config_sync.get(server_name, server, max_age=max_age)
+    
     def set_temp_access(self, server_name: str, uuid: str, expires_at) -> bool:
         """Установить временный доступ для пользователя"""
         try:
@@ -1352,24 +1349,30 @@ class V2RayManager:
             logger.error(f"❌ get_expired_users error: {e}")
             return []
     
+    def group_expired_users(self) -> Dict[str, List[str]]:
+        """Пользователи с истёкшим доступом, сгруппированные по серверу"""
+        grouped: Dict[str, List[str]] = {}
+        for user in self.get_expired_users():
+            grouped.setdefault(user['server_name'], []).append(user['uuid'])
+        return grouped
+    
+    def cleanup_server_expired(self, server_name: str, uuids: List[str]) -> int:
+        """Удалить истёкших пользователей одного сервера одной пачкой (-1 при ошибке)"""
+        logger.info(f"🗑️ Cleaning up {len(uuids)} expired user(s) on {server_name}")
+        if self.delete_users(server_name, uuids) is None:
+            logger.error(f"❌ Failed to delete expired users on {server_name}")
+            return -1
+        
+        for user_uuid in uuids:
+            self.remove_temp_access(server_name, user_uuid)
+        return len(uuids)
+    
     def cleanup_expired_users(self) -> int:
-        """Очистить пользователей с истёкшим доступом"""
+        """Очистить пользователей с истёкшим доступом (по одной перезаписи конфига на сервер)"""
         try:
-            expired = self.get_expired_users()
             deleted_count = 0
-            
-            for user in expired:
-                server_name = user['server_name']
-                uuid = user['uuid']
-                
-                logger.info(f"🗑️ Cleaning up expired user {uuid} on {server_name}")
-                
-                # Удаляем пользователя
-                if self.delete_user(server_name, uuid):
-                    deleted_count += 1
-                    logger.info(f"✅ Deleted expired user {uuid}")
-                else:
-                    logger.error(f"❌ Failed to delete expired user {uuid}")
+            for server_name, uuids in self.group_expired_users().items():
+                deleted_count += max(0, self.cleanup_server_expired(server_name, uuids))
             
             logger.info(f"✅ Cleanup completed: {deleted_count} expired users deleted")
             return deleted_count
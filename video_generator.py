@@ -52,16 +52,29 @@ class VideoGenerator:
     
     def generate(self, prompt: str, duration: int = 5, resolution: str = "1080p") -> Dict:
         """
-        Generate video via OpenAI Sora API
+        Generate video via OpenAI Sora API (blocking, polls until done)
         
         Args:
             prompt: Video description
             duration: Video duration in seconds (5 or 10)
             resolution: Video resolution (720p or 1080p)
-            
+        
         Returns:
             dict with 'video_url' or 'error'
         """
+        result = self.start(prompt, duration, resolution)
+        if 'task_id' in result:
+            return self._poll_completion(result['task_id'], duration, resolution)
+        return result
+    
+    def start(self, prompt: str, duration: int = 5, resolution: str = "1080p") -> Dict:
+        """
+        Submit a video generation request without waiting for it
+        
+        Returns:
+            dict with 'video_url' (finished synchronously), 'task_id' (poll with check())
+            or 'error'
+        """
         try:
             logger.info(f"🎬 Generating video with OpenAI Sora")
             logger.info(f"  📝 Prompt: {prompt[:100]}...")
@@ -103,14 +116,13 @@ class VideoGenerator:
                     'resolution': resolution
                 }
             elif hasattr(response, 'id'):
-                # Task ID (asynchronous - need to poll)
-                task_id = response.id
-                logger.info(f"✅ Task created: {task_id}, polling for completion...")
-                return self._poll_completion(task_id, duration, resolution)
+                # Task ID (asynchronous - caller polls with check())
+                logger.info(f"✅ Task created: {response.id}")
+                return {'task_id': response.id, 'duration': duration, 'resolution': resolution}
             else:
                 logger.error("❌ Unexpected response format")
                 return {'error': 'Unexpected API response format'}
-            
+        
         except openai.error.AuthenticationError:
             logger.error("❌ OpenAI authentication failed - check API key")
             return {'error': 'Authentication failed. Check OpenAI API key.'}
@@ -131,6 +143,30 @@ class VideoGenerator:
             logger.error(f"❌ Video generation error: {e}")
             return {'error': str(e)}
     
+    def check(self, task_id: str) -> Dict:
+        """
+        Single status check of a video task (no sleeping)
+        
+        Returns:
+            {'status': 'completed', 'video_url': ...} | {'status': 'failed', 'error': ...}
+            | {'status': 'processing'}
+        """
+        try:
+            response = openai.Video.retrieve(task_id)
+            status = response.status
+            logger.info(f"📊 Video task {task_id} status: {status}")
+            
+            if status == 'completed':
+                return {'status': 'completed', 'video_url': response.url}
+            if status == 'failed':
+                return {'status': 'failed', 'error': getattr(response, 'error', 'Generation failed')}
+            return {'status': 'processing'}
+        
+        except Exception as e:
+            # Transient status-check errors: keep polling
+            logger.warning(f"⚠️ Status check error: {e}")
+            return {'status': 'processing'}
+
     def _poll_completion(self, task_id: str, duration: int, resolution: str) -> Dict:
         """
         Poll for video generation completion
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Response Cache - серверный кеш ответов API аналитики для WebApp
+
+Ключ кеша: endpoint + параметры запроса (включая user_id) + версия данных.
+Версия данных хранится в таблице data_versions и увеличивается триггерами
+SQLite при любой записи в таблицы смен/расходов, поэтому бот и WebApp
+(разные процессы) видят одну и ту же версию без явной синхронизации.
+
+Ответы отдаются с ETag (If-None-Match → 304) и gzip-сжатием.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Response, request
+
+from modules.data_version import DataVersion
+
+logger = logging.getLogger(__name__)
+
+# Параметры, не влияющие на содержимое ответа. user_id сюда не входит:
+# view проверяют по нему права и отвечают 400/403, а ошибки не кешируются -
+# запрос без user_id (или чужой) не должен получить закешированный 200.
+IGNORED_PARAMS = ('_',)
+
+GZIP_MIN_SIZE = 512
+
+
+class ResponseCache:
+    """LRU-кеш готовых (сериализованных и сжатых) JSON-ответов"""
+
+    def __init__(self, data_version: DataVersion, max_entries: int = 256, ttl: int = 300):
+        self.data_version = data_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, endpoint: str, params: Dict[str, str], version: str) -> str:
+        """Ключ: endpoint + отсортированные параметры + версия данных + дата"""
+        items = sorted((k, v) for k, v in params.items() if k not in IGNORED_PARAMS)
+        # Периоды считаются от текущей даты, поэтому смена суток инвалидирует кеш
+        raw = json.dumps([endpoint, items, version, date.today().isoformat()])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.monotonic() - entry['created'] > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, status: int, body: bytes) -> Dict:
+        entry = {
+            'status': status,
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_SIZE else None,
+            'etag': '"' + hashlib.sha1(body).hexdigest() + '"',
+            'created': time.monotonic(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    # Слабые ETag (W/"...") сравниваются по значению
+    return any(tag == etag or tag == 'W/' + etag for tag in candidates)
+
+
+def build_response(entry: Dict) -> Response:
+    """Собрать HTTP-ответ из записи кеша с учетом If-None-Match и Accept-Encoding"""
+    headers = {
+        'ETag': entry['etag'],
+        'Cache-Control': 'private, no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+
+    if entry['status'] == 200 and _etag_matches(request.headers.get('If-None-Match'), entry['etag']):
+        return Response(status=304, headers=headers)
+
+    body = entry['body']
+    if entry['gzip'] is not None and 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+        body = entry['gzip']
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(body, status=entry['status'], mimetype='application/json', headers=headers)
+
+
+def cached_response(cache: ResponseCache) -> Callable:
+    """
+    Декоратор для Flask-view, возвращающего jsonify(...) или (jsonify(...), status).
+    Ошибочные ответы (status >= 400) не кешируются, как и все ответы,
+    пока нет версии данных (DataVersion.current() вернул None).
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = cache.data_version.current()
+            if version is None:
+                # Версия данных недоступна или неполная - кешировать нельзя
+                return view(*args, **kwargs)
+            key = cache.make_key(request.path, request.args.to_dict(), version)
+
+            entry = cache.get(key)
+            if entry is None:
+                result = view(*args, **kwargs)
+                response, status = _unpack(result)
+                body = response.get_data()
+                if status >= 400:
+                    return response, status
+                entry = cache.put(key, status, body)
+
+            return build_response(entry)
+        return wrapper
+    return decorator
+
+
+def _unpack(result) -> Tuple[Response, int]:
+    if isinstance(result, tuple):
+        response, status = result[0], result[1]
+        return response, int(status)
+    return result, result.status_code
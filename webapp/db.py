@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebApp DB - read-only подключения к SQLite для API аналитики
+
+Каждый поток воркера держит одно постоянное подключение в режиме
+только-чтение (mode=ro + query_only). БД переводится в WAL один раз
+при старте, поэтому чтения WebApp не блокируют запись бота и наоборот.
+
+Для каждого запроса задается дедлайн: запрос к SQLite, превысивший
+его, прерывается через progress handler (QueryTimeout).
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в инструкциях VM SQLite) проверять дедлайн
+PROGRESS_STEPS = 10000
+
+
+class QueryTimeout(Exception):
+    """Запрос к БД превысил таймаут запроса"""
+
+
+class ReadOnlyDB:
+    """Пул read-only подключений: одно подключение на поток воркера"""
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000, cache_size_kb: int = 16384):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self._local = threading.local()
+
+    def enable_wal(self) -> bool:
+        """
+        Перевести БД в WAL (настройка сохраняется в файле БД).
+        Вызывается один раз в мастер-процессе до форка воркеров.
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            conn.close()
+            logger.info(f"✅ SQLite journal_mode={mode}")
+            return mode.lower() == 'wal'
+        except Exception as e:
+            logger.error(f"❌ Не удалось включить WAL: {e}")
+            return False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro",
+            uri=True,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.set_progress_handler(self._check_deadline, PROGRESS_STEPS)
+        return conn
+
+    def _check_deadline(self) -> int:
+        deadline = getattr(self._local, 'deadline', None)
+        # Ненулевой результат прерывает текущий запрос SQLite
+        return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+    def get(self) -> sqlite3.Connection:
+        """Подключение текущего потока (создается лениво)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def set_deadline(self, timeout: Optional[float]):
+        """Установить дедлайн для запросов текущего потока (None - без ограничения)"""
+        self._local.deadline = time.monotonic() + timeout if timeout else None
+
+    @contextmanager
+    def connection(self):
+        """
+        Контекстный менеджер, совместимый с `with analytics._get_db() as conn`.
+        Подключение не закрывается - оно переиспользуется потоком.
+        """
+        conn = self.get()
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryTimeout('Превышено время выполнения запроса') from e
+            raise
+        finally:
+            # Завершить неявную read-транзакцию, чтобы не держать снимок WAL
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close(self):
+        """Закрыть подключение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
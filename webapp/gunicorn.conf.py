@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn для WebApp финансовой аналитики
+
+Все параметры переопределяются переменными окружения:
+    WEBAPP_PORT, WEBAPP_WORKERS, WEBAPP_THREADS, WEBAPP_TIMEOUT
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('WEBAPP_PORT', 5000)}"
+
+# Процессы x потоки: SQLite в WAL допускает параллельные чтения,
+# каждый поток держит собственное read-only подключение (webapp/db.py)
+workers = int(os.environ.get('WEBAPP_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEBAPP_THREADS', 4))
+
+# Жесткий таймаут воркера (зависший воркер перезапускается);
+# мягкий таймаут запросов к БД - WEBAPP_REQUEST_TIMEOUT в server.py
+timeout = int(os.environ.get('WEBAPP_TIMEOUT', 30))
+graceful_timeout = 10
+keepalive = 5
+
+# Перезапуск воркеров для защиты от утечек памяти
+max_requests = 2000
+max_requests_jitter = 200
+
+# Приложение (и включение WAL) загружается один раз в мастере до форка
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('WEBAPP_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Не наследовать подключения мастера: каждый воркер открывает свои"""
+    from webapp.server import ro_db
+    ro_db.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест WebApp API на чистом asyncio (без внешних зависимостей)
+
+Каждый клиент держит keep-alive соединение и последовательно шлет запросы;
+по итогам для каждого уровня конкурентности печатаются p50/p95/p99 и RPS.
+
+Пример:
+    python webapp/loadtest.py --url http://127.0.0.1:5000/api/analytics/overview?period=week \
+        --concurrency 1 10 50 --requests 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """Прочитать HTTP/1.1 ответ; вернуть (статус, keep_alive)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip().split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def _client(url: str, count: int, bust_cache: bool, timeout: float,
+                  latencies: List[float], errors: List[str]):
+    parts = urlsplit(url)
+    host = parts.hostname
+    port = parts.port or 80
+    base_path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+    reader = writer = None
+    for i in range(count):
+        path = base_path
+        if bust_cache:
+            path += ('&' if '?' in path else '?') + f'nocache={time.monotonic_ns()}'
+
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"Accept: application/json\r\n"
+            f"Connection: keep-alive\r\n\r\n"
+        ).encode('latin-1')
+
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await asyncio.wait_for(_read_response(reader), timeout)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(f"HTTP {status}")
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except Exception as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_level(url: str, concurrency: int, total: int, bust_cache: bool, timeout: float) -> dict:
+    """Прогнать total запросов через concurrency параллельных клиентов"""
+    latencies: List[float] = []
+    errors: List[str] = []
+    per_client = max(1, total // concurrency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _client(url, per_client, bust_cache, timeout, latencies, errors)
+        for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies) + len([e for e in errors if not e.startswith('HTTP')]),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': _percentile(latencies, 50) * 1000,
+        'p95': _percentile(latencies, 95) * 1000,
+        'p99': _percentile(latencies, 99) * 1000,
+        'mean': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест WebApp API')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/analytics/overview?period=week')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=200, help='Запросов на каждый уровень')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Таймаут одного запроса, сек')
+    parser.add_argument('--bust-cache', action='store_true',
+                        help='Добавлять уникальный параметр, чтобы обойти кеш ответов')
+    args = parser.parse_args()
+
+    print(f"🎯 {args.url}  ({args.requests} запросов на уровень"
+          f"{', без кеша' if args.bust_cache else ''})")
+    print(f"{'clients':>8} {'req':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+
+    failed = False
+    for level in args.concurrency:
+        result = asyncio.run(run_level(args.url, level, args.requests, args.bust_cache, args.timeout))
+        failed = failed or result['errors'] > 0
+        print(f"{result['concurrency']:>8} {result['requests']:>6} {result['errors']:>5} "
+              f"{result['rps']:>8.1f} {result['p50']:>9.1f} {result['p95']:>9.1f} {result['p99']:>9.1f}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
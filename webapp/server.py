@@ -16,6 +16,9 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from modules.finance_analytics import FinanceAnalytics
 from modules.admins.db import AdminDB
+from modules.revenue_forecast import RevenueForecaster
+from webapp.cache import DataVersion, ResponseCache, cached_response
+from webapp.db import ReadOnlyDB, QueryTimeout
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,32 @@ CORS(app)
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'knowledge.db')
 analytics = FinanceAnalytics(db_path=DB_PATH)
 admin_db = AdminDB(DB_PATH)
+forecaster = RevenueForecaster(DB_PATH)
+
+# Read-only подключения (одно на поток воркера), БД в режиме WAL
+ro_db = ReadOnlyDB(DB_PATH)
+ro_db.enable_wal()
+REQUEST_TIMEOUT = float(os.environ.get('WEBAPP_REQUEST_TIMEOUT', 10))
+
+# Кеш ответов API (инвалидируется по версии данных из триггеров SQLite).
+# Таблицу версий и триггеры ставит бот; WebApp только читает версию
+data_version = DataVersion(DB_PATH, read_only=True)
+response_cache = ResponseCache(
+    data_version,
+    max_entries=int(os.environ.get('WEBAPP_CACHE_SIZE', 256)),
+    ttl=int(os.environ.get('WEBAPP_CACHE_TTL', 300))
+)
+
+
+@app.before_request
+def _set_request_deadline():
+    """Ограничить время выполнения запросов к БД в рамках HTTP-запроса"""
+    ro_db.set_deadline(REQUEST_TIMEOUT)
+
+
+@app.teardown_request
+def _clear_request_deadline(exc=None):
+    ro_db.set_deadline(None)
 
 
 # ============================================
@@ -49,6 +78,7 @@ def admins():
 # ============================================
 
 @app.route('/api/analytics/overview')
+@cached_response(response_cache)
 def api_overview():
     """
     Обзор финансов за период
@@ -71,7 +101,7 @@ def api_overview():
 
     try:
         # Получить реальные данные из закрытых смен (обе таблицы)
-        with analytics._get_db() as conn:
+        with ro_db.connection() as conn:
             cursor = conn.cursor()
 
             # Проверить существование таблицы finmon_shifts
@@ -226,12 +256,17 @@ def api_overview():
             }
         })
 
+    except QueryTimeout as e:
+        logger.warning(f"⏱ {request.path}: {e}")
+        return jsonify({'error': str(e)}), 504
+
     except Exception as e:
         logger.error(f"Error in overview API: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/analytics/revenue')
+@cached_response(response_cache)
 def api_revenue():
     """
     Выручка за период
@@ -252,7 +287,7 @@ def api_revenue():
         start_date = end_date - timedelta(days=7)
 
     try:
-        with analytics._get_db() as conn:
+        with ro_db.connection() as conn:
             cursor = conn.cursor()
 
             # Проверить существование таблицы
@@ -310,12 +345,17 @@ def api_revenue():
             'by_club': by_club
         })
 
+    except QueryTimeout as e:
+        logger.warning(f"⏱ {request.path}: {e}")
+        return jsonify({'error': str(e)}), 504
+
     except Exception as e:
         logger.error(f"Error in revenue API: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/analytics/admins')
+@cached_response(response_cache)
 def api_admins():
     """
     Рейтинг администраторов
@@ -337,7 +377,7 @@ def api_admins():
 
     try:
         # Получить реальных админов из БД
-        with analytics._get_db() as conn:
+        with ro_db.connection() as conn:
             cursor = conn.cursor()
 
             # Проверить существование таблицы
@@ -414,12 +454,17 @@ def api_admins():
 
             return jsonify({'admins': admins_list})
 
+    except QueryTimeout as e:
+        logger.warning(f"⏱ {request.path}: {e}")
+        return jsonify({'error': str(e)}), 504
+
     except Exception as e:
         logger.error(f"Ошибка в api_admins: {e}")
         return jsonify({'error': str(e), 'admins': []}), 500
 
 
 @app.route('/api/analytics/salaries')
+@cached_response(response_cache)
 def api_salaries():
     """
     Зарплаты администраторов
@@ -466,6 +511,7 @@ def api_salaries():
 
 
 @app.route('/api/analytics/efficiency')
+@cached_response(response_cache)
 def api_efficiency():
     """
     Анализ эффективности по дням недели
@@ -522,6 +568,58 @@ def api_efficiency():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/analytics/forecast')
+@cached_response(response_cache)
+def api_forecast():
+    """
+    Прогноз выручки и остатков сейфа (из кеша прогнозов, пересчитывается ботом ночью)
+
+    Query params:
+    - days: 7|30 (default: 7)
+    - club: фильтр по клубу (опционально)
+    """
+    days = request.args.get('days', 7, type=int)
+    days = 30 if days > 7 else 7
+    club = request.args.get('club')
+
+    try:
+        forecast = forecaster.get_forecast(days=days, club=club)
+
+        clubs = []
+        for club_name, data in sorted(forecast.items()):
+            clubs.append({
+                'club': club_name,
+                'total': int(data['total']),
+                'total_low': int(data['total_low']),
+                'total_high': int(data['total_high']),
+                'cash_balance_end': int(data['cash_balance_end']) if data['cash_balance_end'] is not None else None,
+                'days': [
+                    {
+                        'date': day['date'],
+                        'revenue': int(day['revenue']),
+                        'revenue_low': int(day['revenue_low']),
+                        'revenue_high': int(day['revenue_high']),
+                        'cash_balance': int(day['cash_balance']) if day['cash_balance'] is not None else None,
+                        'is_holiday': day['is_holiday']
+                    }
+                    for day in data['days']
+                ]
+            })
+
+        generated_at = next(iter(forecast.values()))['generated_at'] if forecast else None
+
+        return jsonify({
+            'days': days,
+            'generated_at': generated_at,
+            'total': sum(c['total'] for c in clubs),
+            'clubs': clubs
+        })
+
+    except Exception as e:
+        logger.error(f"Error in forecast API: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 # ============================================
 # HEALTH CHECK
 # ============================================
@@ -531,7 +629,9 @@ def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'ok',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'data_version': data_version.current(),
+        'cache': response_cache.stats()
     })
 
 
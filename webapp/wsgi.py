@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WSGI entry point для production-запуска WebApp
+
+Запуск:
+    gunicorn -c webapp/gunicorn.conf.py webapp.wsgi:app
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webapp.server import app  # noqa: E402
+
+application = app
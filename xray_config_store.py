@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray Config Store - локальная авторитетная копия config.json серверов Xray
+
+Каждая версия конфигурации сервера хранится в SQLite (xray_config_versions)
+вместе с SHA-256 содержимого. Чтение обслуживается из локальной копии;
+расхождение с сервером определяется сравнением хеша (`sha256sum` на сервере -
+одна короткая команда вместо скачивания файла).
+
+Развёртывание:
+1. новый конфиг пишется во временный файл рядом с рабочим;
+2. проверяется `xray run -test`;
+3. атомарно переименовывается поверх рабочего (mv в той же директории);
+4. изменения пользователей применяются на лету через Xray API (adu/rmu),
+   если API включен в конфиге, - активные VPN-сессии не рвутся;
+   иначе `systemctl reload-or-restart xray`.
+
+Каждое развёртывание включает в конфиге статистику и API Xray
+(enable_stats_api), поэтому серверы, настроенные до появления сбора
+трафика, получают их при первой же правке конфига - с одним перезапуском.
+"""
+
+import hashlib
+import json
+import logging
+import shlex
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from xray_traffic_stats import enable_stats_api, stats_api_port
+
+logger = logging.getLogger(__name__)
+
+# Возможные расположения config.json Xray (в порядке проверки)
+XRAY_CONFIG_PATHS = (
+    '/usr/local/etc/xray/config.json',
+    '/root/Xray-core/config.json',
+    '/etc/xray/config.json',
+)
+
+# Как часто сверять хеш локальной копии с сервером при чтении
+DRIFT_CHECK_SECONDS = 600
+
+# Сколько версий конфигурации хранить на сервер
+KEEP_VERSIONS = 20
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def serialize_config(config: Dict) -> str:
+    """Каноничное представление конфига, в котором он пишется на сервер"""
+    return json.dumps(config, indent=2)
+
+
+class XrayConfigStore:
+    """Версии конфигураций в SQLite"""
+
+    def __init__(self, db_path: str = 'knowledge.db'):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xray_config_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                server_name TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                config_path TEXT NOT NULL,
+                content TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(server_name, version)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xray_config_state (
+                server_name TEXT PRIMARY KEY,
+                current_version INTEGER NOT NULL,
+                remote_hash TEXT,
+                drift_detected INTEGER DEFAULT 0,
+                checked_at REAL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def latest(self, server_name: str) -> Optional[Dict]:
+        """Текущая локальная версия: config, hash, path, version, checked_at"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT v.version, v.config_path, v.content, v.content_hash, v.source,
+                   s.remote_hash, s.drift_detected, s.checked_at
+            FROM xray_config_state s
+            JOIN xray_config_versions v
+              ON v.server_name = s.server_name AND v.version = s.current_version
+            WHERE s.server_name = ?
+        ''', (server_name,))
+        row = cursor.fetchone()
+        conn.close()
+
+        if not row:
+            return None
+        result = dict(row)
+        result['config'] = json.loads(result.pop('content'))
+        return result
+
+    def record(self, server_name: str, content: str, config_path: str, source: str) -> int:
+        """
+        Сохранить версию (если содержимое изменилось) и сделать её текущей.
+        Сервер считается синхронизированным с ней.
+        """
+        digest = content_hash(content)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT version, content_hash, config_path FROM xray_config_versions
+            WHERE server_name = ? ORDER BY version DESC LIMIT 1
+        ''', (server_name,))
+        last = cursor.fetchone()
+
+        if last and last[1] == digest and last[2] == config_path:
+            version = last[0]
+        else:
+            version = (last[0] if last else 0) + 1
+            cursor.execute('''
+                INSERT INTO xray_config_versions (server_name, version, config_path, content, content_hash, source)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (server_name, version, config_path, content, digest, source))
+            cursor.execute('''
+                DELETE FROM xray_config_versions
+                WHERE server_name = ? AND version <= ?
+            ''', (server_name, version - KEEP_VERSIONS))
+
+        cursor.execute('''
+            INSERT INTO xray_config_state (server_name, current_version, remote_hash, drift_detected, checked_at)
+            VALUES (?, ?, ?, 0, ?)
+            ON CONFLICT(server_name) DO UPDATE SET
+                current_version = excluded.current_version,
+                remote_hash = excluded.remote_hash,
+                drift_detected = 0,
+                checked_at = excluded.checked_at
+        ''', (server_name, version, digest, time.time()))
+
+        conn.commit()
+        conn.close()
+        return version
+
+    def mark_checked(self, server_name: str, remote_hash: Optional[str], drift: bool):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            UPDATE xray_config_state
+            SET remote_hash = ?, drift_detected = ?, checked_at = ?
+            WHERE server_name = ?
+        ''', (remote_hash, 1 if drift else 0, time.time(), server_name))
+        conn.commit()
+        conn.close()
+
+    def history(self, server_name: str, limit: int = 10) -> List[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT version, content_hash, source, created_at FROM xray_config_versions
+            WHERE server_name = ? ORDER BY version DESC LIMIT ?
+        ''', (server_name, limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    def forget(self, server_name: str):
+        """Удалить локальные версии сервера (при удалении сервера)"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM xray_config_versions WHERE server_name = ?', (server_name,))
+        conn.execute('DELETE FROM xray_config_state WHERE server_name = ?', (server_name,))
+        conn.commit()
+        conn.close()
+
+
+class XrayConfigSync:
+    """Синхронизация локальной копии с сервером через SSH-пул"""
+
+    def __init__(self, store: XrayConfigStore, ssh_pool, drift_check_seconds: float = DRIFT_CHECK_SECONDS):
+        self.store = store
+        self.ssh_pool = ssh_pool
+        self.drift_check_seconds = drift_check_seconds
+
+    # ===== ЧТЕНИЕ =====
+
+    def pull(self, server_name: str, server: Dict, path_hint: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """Скачать конфиг с сервера одной командой и записать как новую версию"""
+        paths = [path_hint] if path_hint else []
+        paths += [p for p in XRAY_CONFIG_PATHS if p != path_hint]
+        probe = ' '.join(shlex.quote(p) for p in paths)
+
+        # Первая строка вывода - найденный путь, дальше - содержимое
+        exit_code, out, err = self.ssh_pool.exec(
+            server,
+            f'for p in {probe}; do if grep -qs inbounds "$p"; then echo "$p"; cat "$p"; exit 0; fi; done; exit 1'
+        )
+        if exit_code != 0 or '\n' not in out:
+            return None, None
+
+        path, content = out.split('\n', 1)
+        path = path.strip()
+        config = json.loads(content)
+        version = self.store.record(server_name, content, path, 'pulled')
+        logger.info(f"📥 Xray config {server_name} v{version} загружен с сервера ({path})")
+        return path, config
+
+    def remote_hash(self, server: Dict, path: str) -> Optional[str]:
+        exit_code, out, err = self.ssh_pool.exec(server, f'sha256sum {shlex.quote(path)}')
+        if exit_code != 0 or not out.strip():
+            return None
+        return out.split()[0]
+
+    def check_drift(self, server_name: str, server: Dict) -> bool:
+        """
+        Сравнить хеш файла на сервере с локальной версией.
+        При расхождении (правка вне бота) подтягивает серверную версию.
+
+        Returns:
+            True, если обнаружено расхождение
+        """
+        local = self.store.latest(server_name)
+        if not local:
+            self.pull(server_name, server)
+            return False
+
+        remote = self.remote_hash(server, local['config_path'])
+        if remote == local['content_hash']:
+            self.store.mark_checked(server_name, remote, drift=False)
+            return False
+
+        logger.warning(f"⚠️ Xray config drift on {server_name}: "
+                       f"local {local['content_hash'][:12]} != remote {(remote or 'missing')[:12]}")
+        self.store.mark_checked(server_name, remote, drift=True)
+        self.pull(server_name, server, path_hint=local['config_path'] if remote else None)
+        return True
+
+    def get(self, server_name: str, server: Dict,
+            max_age: Optional[float] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Конфиг сервера из локальной копии. Если последняя сверка старше max_age
+        (по умолчанию drift_check_seconds) - сначала сверяется хеш с сервером.
+        max_age=0 - сверка всегда (перед изменением конфига).
+        """
+        max_age = self.drift_check_seconds if max_age is None else max_age
+        local = self.store.latest(server_name)
+        if local is None:
+            return self.pull(server_name, server)
+
+        if time.time() - (local['checked_at'] or 0) >= max_age:
+            if self.check_drift(server_name, server):
+                local = self.store.latest(server_name)
+                if local is None:
+                    return None, None
+
+        return local['config_path'], local['config']
+
+    # ===== РАЗВЁРТЫВАНИЕ =====
+
+    def deploy(self, server_name: str, server: Dict, path: str, config: Dict,
+               added_clients: Optional[List[Dict]] = None,
+               removed_emails: Optional[List[str]] = None) -> bool:
+        """
+        Атомарно развернуть конфиг и применить его
+
+        Args:
+            added_clients / removed_emails: изменения пользователей для
+                применения на лету через Xray API (без перезапуска)
+        """
+        # Работающий Xray без API не примет изменения на лету - только перезапуск
+        stats_added = enable_stats_api(config)
+        if stats_added:
+            logger.info(f"📊 Xray stats API включается на {server_name}")
+
+        content = serialize_config(config)
+        digest = content_hash(content)
+        tmp_path = f"{path}.tmp-{digest[:8]}"
+
+        client = self.ssh_pool.client_for(server)
+        sftp = client.open_sftp()
+        try:
+            with sftp.file(tmp_path, 'w') as f:
+                f.write(content)
+        finally:
+            sftp.close()
+
+        # Проверка конфига и атомарная замена одной командой
+        q_tmp, q_path = shlex.quote(tmp_path), shlex.quote(path)
+        exit_code, out, err = self.ssh_pool.exec(
+            server,
+            f'if command -v xray >/dev/null 2>&1; then xray run -test -config {q_tmp} >/dev/null 2>&1 '
+            f'|| {{ rm -f {q_tmp}; exit 3; }}; fi; mv -f {q_tmp} {q_path}'
+        )
+        if exit_code == 3:
+            logger.error(f"❌ Xray config for {server_name} failed validation, deploy aborted")
+            return False
+        if exit_code != 0:
+            logger.error(f"❌ Failed to install Xray config on {server_name}: {err.strip()}")
+            return False
+
+        version = self.store.record(server_name, content, path, 'deployed')
+
+        live = not stats_added and (added_clients or removed_emails) and self._apply_live(
+            server, config, added_clients or [], removed_emails or []
+        )
+        if live:
+            logger.info(f"✅ Xray config {server_name} v{version}: пользователи применены через API без перезапуска")
+            return True
+
+        exit_code, out, err = self.ssh_pool.exec(server, 'systemctl reload-or-restart xray')
+        if exit_code != 0:
+            logger.error(f"❌ Xray reload failed on {server_name}: {err.strip()}")
+            return False
+        logger.info(f"✅ Xray config {server_name} v{version} развёрнут")
+        return True
+
+    def ensure_stats_api(self, server_name: str, server: Dict) -> Optional[int]:
+        """
+        Порт API статистики Xray на сервере. Если в конфиге его нет
+        (сервер настроен до сбора трафика) - включить и развернуть конфиг,
+        Xray перезапускается один раз.
+
+        Returns:
+            Порт API или None, если конфиг не прочитан или не развёрнут
+        """
+        path, config = self.get(server_name, server)
+        if not config:
+            return None
+        port = stats_api_port(config)
+        if port:
+            return port
+
+        path, config = self.get(server_name, server, max_age=0)
+        if not config:
+            return None
+        if not stats_api_port(config) and not self.deploy(server_name, server, path, config):
+            return None
+        return stats_api_port(config)
+
+    def _apply_live(self, server: Dict, config: Dict, added: List[Dict], removed: List[str]) -> bool:
+        """Изменить пользователей через Xray API (HandlerService), если он включен в конфиге"""
+        api = config.get('api') or {}
+        if 'HandlerService' not in (api.get('services') or []):
+            return False
+
+        inbounds = config.get('inbounds') or []
+        api_port = next((ib.get('port') for ib in inbounds if ib.get('tag') == api.get('tag')), None)
+        user_inbound = next((ib for ib in inbounds if ib.get('protocol') == 'vless' and ib.get('tag')), None)
+        if not api_port or not user_inbound:
+            return False
+
+        api_server = f"--server=127.0.0.1:{api_port}"
+        tag = user_inbound['tag']
+
+        if removed:
+            emails = ' '.join(shlex.quote(e) for e in removed)
+            exit_code, out, err = self.ssh_pool.exec(server, f'xray api rmu {api_server} -tag={shlex.quote(tag)} {emails}')
+            if exit_code != 0:
+                logger.warning(f"⚠️ xray api rmu failed: {err.strip()}")
+                return False
+
+        if added:
+            payload = json.dumps({'inbounds': [{
+                'tag': tag,
+                'protocol': user_inbound['protocol'],
+                'port': user_inbound.get('port'),
+                'settings': {'clients': added, 'decryption': 'none'},
+            }]})
+            tmp = '/tmp/xray_adu.json'
+            exit_code, out, err = self.ssh_pool.exec(
+                server,
+                f'printf %s {shlex.quote(payload)} > {tmp} && xray api adu {api_server} {tmp}; '
+                f'rc=$?; rm -f {tmp}; exit $rc'
+            )
+            if exit_code != 0:
+                logger.warning(f"⚠️ xray api adu failed: {err.strip()}")
+                return False
+
+        return True
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray Traffic Stats - сбор и хранение трафика пользователей V2Ray
+
+Счетчики Xray (StatsService) читаются через `xray api statsquery` по
+пулу SSH, в БД пишутся приращения (дельты), а не сами счетчики.
+Ряды хранятся в одной компактной таблице с понижением детализации:
+- минутные корзины за последние MINUTE_RETENTION;
+- старше - сворачиваются в часовые, затем (после HOUR_RETENTION) в дневные.
+Каждая единица трафика лежит ровно в одной корзине, поэтому запросы
+за любой период - это просто SUM по диапазону, и даже за месяцы они
+читают единицы-десятки строк на пользователя.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+MINUTE_RETENTION = 2 * DAY
+HOUR_RETENTION = 60 * DAY
+
+# Дневные корзины выравниваются по полуночи МСК
+MSK_OFFSET = 3 * HOUR
+
+COLLECT_TIMEOUT_SECONDS = 20
+STATS_API_PORT = 10085
+
+_TEXT_STAT_RE = re.compile(r'name:\s*"([^"]+)"(?:\s*value:\s*(\d+))?')
+
+
+def bucket_start(ts: float, resolution: int) -> int:
+    """Начало корзины заданной детализации, в которую попадает ts"""
+    return int((int(ts) + MSK_OFFSET) // resolution * resolution - MSK_OFFSET)
+
+
+def parse_statsquery(output: str) -> Dict[Tuple[str, str], int]:
+    """
+    Разбор вывода `xray api statsquery -pattern user>>>`.
+
+    Поддерживает JSON (Xray 1.8+) и текстовый protobuf (старые версии).
+    Нулевые счетчики Xray опускает поле value - считаем их нулем.
+
+    Returns:
+        {(email, 'uplink'|'downlink'): значение счетчика}
+    """
+    pairs = []
+    try:
+        data = json.loads(output)
+        for stat in data.get('stat') or []:
+            pairs.append((stat.get('name', ''), stat.get('value', 0)))
+    except (ValueError, AttributeError):
+        pairs = _TEXT_STAT_RE.findall(output)
+
+    counters = {}
+    for name, value in pairs:
+        parts = name.split('>>>')
+        # user>>>{email}>>>traffic>>>{uplink|downlink}
+        if len(parts) != 4 or parts[0] != 'user' or parts[2] != 'traffic':
+            continue
+        if parts[3] not in ('uplink', 'downlink'):
+            continue
+        counters[(parts[1], parts[3])] = int(value or 0)
+    return counters
+
+
+def enable_stats_api(config: Dict, port: int = STATS_API_PORT) -> bool:
+    """
+    Включить в config.json статистику по пользователям и API Xray
+    (StatsService для счетчиков, HandlerService для живого добавления
+    пользователей без перезапуска). API слушает только 127.0.0.1.
+
+    Returns:
+        True, если конфиг изменен
+    """
+    changed = False
+
+    if 'stats' not in config:
+        config['stats'] = {}
+        changed = True
+
+    api = config.setdefault('api', {'tag': 'api', 'services': []})
+    api.setdefault('tag', 'api')
+    services = api.setdefault('services', [])
+    for service in ('HandlerService', 'StatsService'):
+        if service not in services:
+            services.append(service)
+            changed = True
+
+    levels = config.setdefault('policy', {}).setdefault('levels', {}).setdefault('0', {})
+    for key in ('statsUserUplink', 'statsUserDownlink'):
+        if not levels.get(key):
+            levels[key] = True
+            changed = True
+
+    inbounds = config.setdefault('inbounds', [])
+    if inbounds and inbounds[0].get('protocol') == 'vless' and not inbounds[0].get('tag'):
+        inbounds[0]['tag'] = 'vless-in'
+        changed = True
+    if not any(ib.get('tag') == api['tag'] for ib in inbounds):
+        # API-инбаунд добавляется в конец: первый инбаунд остается пользовательским
+        inbounds.append({
+            'tag': api['tag'],
+            'listen': '127.0.0.1',
+            'port': port,
+            'protocol': 'dokodemo-door',
+            'settings': {'address': '127.0.0.1'}
+        })
+        changed = True
+
+    rules = config.setdefault('routing', {}).setdefault('rules', [])
+    if not any(rule.get('outboundTag') == api['tag'] for rule in rules):
+        rules.insert(0, {'type': 'field', 'inboundTag': [api['tag']], 'outboundTag': api['tag']})
+        changed = True
+
+    return changed
+
+
+def stats_api_port(config: Optional[Dict]) -> Optional[int]:
+    """Порт API Xray, если в конфиге включен StatsService"""
+    if not config:
+        return None
+    api = config.get('api') or {}
+    if 'StatsService' not in (api.get('services') or []):
+        return None
+    return next((ib.get('port') for ib in config.get('inbounds', []) if ib.get('tag') == api.get('tag')), None)
+
+
+def format_bytes(value: int) -> str:
+    """Человекочитаемый объем трафика"""
+    size = float(value or 0)
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} ТБ"
+
+
+class XrayTrafficStats:
+    """Хранилище рядов трафика (минута → час → день)"""
+
+    def __init__(self, db_path: str = 'knowledge.db', clock=time.time):
+        self.db_path = db_path
+        self.clock = clock
+        self._init_db()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # resolution - длина корзины в секундах (60 / 3600 / 86400)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xray_traffic (
+                server_name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                resolution INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                uplink INTEGER NOT NULL DEFAULT 0,
+                downlink INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (server_name, email, resolution, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_xray_traffic_rollup
+            ON xray_traffic(resolution, bucket)
+        ''')
+
+        # Последние увиденные значения счетчиков - для вычисления дельт
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xray_traffic_counters (
+                server_name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                last_value INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (server_name, email, direction)
+            ) WITHOUT ROWID
+        ''')
+
+        # Результат последнего опроса сервера: без него пустые ряды
+        # неотличимы от нулевого трафика
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xray_traffic_sources (
+                server_name TEXT PRIMARY KEY,
+                ok INTEGER NOT NULL,
+                error TEXT,
+                checked_at REAL NOT NULL
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def ingest(self, server_name: str, counters: Dict[Tuple[str, str], int],
+               now: Optional[float] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        Записать снимок счетчиков сервера.
+
+        Дельта = текущее значение - предыдущее; если счетчик уменьшился
+        (Xray перезапускался), дельтой считается само значение. Первое
+        наблюдение только запоминает базу.
+
+        Returns:
+            {email: (uplink_delta, downlink_delta)} для ненулевых дельт
+        """
+        now = self.clock() if now is None else now
+        bucket = bucket_start(now, MINUTE)
+        deltas: Dict[str, List[int]] = {}
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT email, direction, last_value FROM xray_traffic_counters
+                WHERE server_name = ?
+            ''', (server_name,))
+            previous = {(email, direction): value for email, direction, value in cursor.fetchall()}
+
+            for (email, direction), value in counters.items():
+                last = previous.get((email, direction))
+                if last is None:
+                    delta = 0
+                elif value >= last:
+                    delta = value - last
+                else:
+                    delta = value
+                if delta:
+                    pair = deltas.setdefault(email, [0, 0])
+                    pair[0 if direction == 'uplink' else 1] += delta
+
+            cursor.executemany('''
+                INSERT INTO xray_traffic_counters (server_name, email, direction, last_value, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(server_name, email, direction)
+                DO UPDATE SET last_value = excluded.last_value, updated_at = excluded.updated_at
+            ''', [(server_name, email, direction, value, now) for (email, direction), value in counters.items()])
+
+            cursor.executemany('''
+                INSERT INTO xray_traffic (server_name, email, resolution, bucket, uplink, downlink)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(server_name, email, resolution, bucket)
+                DO UPDATE SET uplink = uplink + excluded.uplink, downlink = downlink + excluded.downlink
+            ''', [(server_name, email, MINUTE, bucket, up, down) for email, (up, down) in deltas.items()])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return {email: (up, down) for email, (up, down) in deltas.items()}
+
+    def downsample(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Свернуть минутные корзины старше MINUTE_RETENTION в часовые
+        и часовые старше HOUR_RETENTION в дневные.
+
+        Returns:
+            {'minute': свернуто строк, 'hour': свернуто строк}
+        """
+        now = self.clock() if now is None else now
+        result = {}
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for label, source, target, retention in (('minute', MINUTE, HOUR, MINUTE_RETENTION),
+                                                      ('hour', HOUR, DAY, HOUR_RETENTION)):
+                # Сворачиваем только целые корзины назначения, чтобы не разрывать час/день
+                cutoff = bucket_start(now - retention, target)
+                cursor.execute('''
+                    INSERT INTO xray_traffic (server_name, email, resolution, bucket, uplink, downlink)
+                    SELECT server_name, email, ?, (bucket + ?) / ? * ? - ?, SUM(uplink), SUM(downlink)
+                    FROM xray_traffic
+                    WHERE resolution = ? AND bucket < ?
+                    GROUP BY server_name, email, (bucket + ?) / ?
+                    ON CONFLICT(server_name, email, resolution, bucket)
+                    DO UPDATE SET uplink = uplink + excluded.uplink, downlink = downlink + excluded.downlink
+                ''', (target, MSK_OFFSET, target, target, MSK_OFFSET,
+                      source, cutoff, MSK_OFFSET, target))
+                cursor.execute('DELETE FROM xray_traffic WHERE resolution = ? AND bucket < ?', (source, cutoff))
+                result[label] = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        if any(result.values()):
+            logger.info(f"📉 Xray traffic downsampled: {result}")
+        return result
+
+    def usage(self, server_name: str, email: str, since: float) -> Dict[str, int]:
+        """Трафик пользователя с момента since: {'uplink', 'downlink', 'total'}"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COALESCE(SUM(uplink), 0), COALESCE(SUM(downlink), 0)
+            FROM xray_traffic
+            WHERE server_name = ? AND email = ? AND bucket >= ?
+        ''', (server_name, email, int(since)))
+        up, down = cursor.fetchone()
+        conn.close()
+        return {'uplink': up, 'downlink': down, 'total': up + down}
+
+    def usage_periods(self, server_name: str, email: str, now: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+        """Трафик пользователя за сутки, неделю и 30 дней"""
+        now = self.clock() if now is None else now
+        return {
+            '24h': self.usage(server_name, email, now - DAY),
+            '7d': self.usage(server_name, email, now - 7 * DAY),
+            '30d': self.usage(server_name, email, now - 30 * DAY),
+        }
+
+    def top_talkers(self, server_name: str, since: float, limit: int = 5) -> List[Dict]:
+        """Пользователи сервера с наибольшим трафиком с момента since"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT email, SUM(uplink) AS uplink, SUM(downlink) AS downlink,
+                   SUM(uplink + downlink) AS total
+            FROM xray_traffic
+            WHERE server_name = ? AND bucket >= ?
+            GROUP BY email
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (server_name, int(since), limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    def set_source_status(self, server_name: str, error: Optional[str] = None, now: Optional[float] = None):
+        """Запомнить результат опроса сервера (error=None - счетчики сняты)"""
+        now = self.clock() if now is None else now
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO xray_traffic_sources (server_name, ok, error, checked_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(server_name) DO UPDATE SET
+                ok = excluded.ok, error = excluded.error, checked_at = excluded.checked_at
+        ''', (server_name, 0 if error else 1, error, now))
+        conn.commit()
+        conn.close()
+
+    def source_status(self, server_name: str) -> Optional[Dict]:
+        """Результат последнего опроса сервера: {'ok', 'error', 'checked_at'} или None"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT ok, error, checked_at FROM xray_traffic_sources WHERE server_name = ?',
+                       (server_name,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def forget(self, server_name: str):
+        """Удалить ряды удаленного сервера"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM xray_traffic WHERE server_name = ?', (server_name,))
+        cursor.execute('DELETE FROM xray_traffic_counters WHERE server_name = ?', (server_name,))
+        cursor.execute('DELETE FROM xray_traffic_sources WHERE server_name = ?', (server_name,))
+        conn.commit()
+        conn.close()
+
+
+class XrayTrafficCollector:
+    """Опрос счетчиков Xray на всех серверах"""
+
+    def __init__(self, manager, stats: XrayTrafficStats, host_timeout: float = COLLECT_TIMEOUT_SECONDS):
+        self.manager = manager
+        self.stats = stats
+        self.host_timeout = host_timeout
+
+    def collect_server(self, server_name: str) -> Optional[int]:
+        """
+        Снять счетчики одного сервера (блокирующий вызов, выполняется в потоке).
+        Если API статистики в конфиге сервера нет - включает его (один
+        перезапуск Xray). Результат опроса записывается в xray_traffic_sources.
+
+        Returns:
+            Число пользователей с ненулевым трафиком или None,
+            если API статистики на сервере не включен/недоступен
+        """
+        server = self.manager.get_server_info(server_name)
+        if not server:
+            return None
+
+        port = self.manager.config_sync.ensure_stats_api(server_name, server)
+        if not port:
+            logger.warning(f"⚠️ Xray stats API не включен на {server_name}")
+            self.stats.set_source_status(server_name, 'API статистики Xray не включен')
+            return None
+
+        exit_code, out, err = self.manager.ssh_pool.exec(
+            server, f"xray api statsquery --server=127.0.0.1:{port} -pattern 'user>>>'", timeout=15
+        )
+        if exit_code != 0:
+            logger.warning(f"⚠️ xray statsquery на {server_name}: {err.strip()}")
+            self.stats.set_source_status(server_name, f"statsquery: {err.strip() or exit_code}")
+            return None
+
+        deltas = self.stats.ingest(server_name, parse_statsquery(out))
+        self.stats.set_source_status(server_name)
+        return len(deltas)
+
+    async def collect_all(self) -> Dict[str, Optional[int]]:
+        """Опросить все серверы параллельно и свернуть старые корзины"""
+        servers = self.manager.list_servers()
+        results = await asyncio.gather(
+            *[asyncio.wait_for(asyncio.to_thread(self.collect_server, srv['name']), timeout=self.host_timeout)
+              for srv in servers],
+            return_exceptions=True
+        )
+
+        summary = {}
+        for srv, result in zip(servers, results):
+            if isinstance(result, BaseException):
+                error = 'таймаут' if isinstance(result, asyncio.TimeoutError) else str(result)
+                logger.warning(f"⚠️ Xray traffic {srv['name']}: {error}")
+                await asyncio.to_thread(self.stats.set_source_status, srv['name'], error)
+                result = None
+            summary[srv['name']] = result
+
+        await asyncio.to_thread(self.stats.downsample)
+        return summary